@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the signals that keep the conversation state cache write-through
+        from . import conversation_state  # noqa: F401
+        # ... and drop deleted sessions from the session resolver cache
+        from . import session_resolver  # noqa: F401
+
+        post_migrate.connect(reserve_shard_id_ranges, sender=self)
+
+
+def reserve_shard_id_ranges(sender, using, **kwargs):
+    """Start the id sequences of a new shard at its range (see api/sharding.py)"""
+    from .sharding import reserve_id_ranges
+    reserve_id_ranges(using)
@@ -0,0 +1,388 @@
+"""
+Conversation Archive
+
+Moves conversations idle for more than IDLE_DAYS out of the primary database
+into compressed cold-storage files, so the hot tables (messages, feedback,
+voice transcripts) only hold recent data.
+
+Storage layout, under DIRECTORY:
+
+    <year>/<month>/sessions-<timestamp>-<token>.jsonl.gz
+
+Files are partitioned by the month of the session's last activity. Each line
+is one session: its row and every dependent row (messages and annotations,
+user context, stored summary, feedback and expert reviews, voice sessions,
+participants and transcripts) in Django's serialization format. Every line is
+compressed as its own gzip member, so the file as a whole is a normal
+.jsonl.gz and a single session can be read by seeking to its offset.
+
+The ArchivedSession table is the index: session id, client external_id,
+file, offset and activity range of every archived session. It lives on
+'default'; sessions are archived from and rehydrated into their own shard
+(api/sharding.py).
+
+Archived sessions are rehydrated (restored with their original primary keys)
+on demand: when a client id resolves to one (api/session_resolver.py), when a
+summary asks for one, and when a summary date range or the training data
+export covers one. Daily AnalyticsMetric rows are kept, so update the metrics
+for a period before its sessions are archived.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import secrets
+
+from django.apps import apps
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ArchivedSession, ConversationSession
+from .runtime_metrics import metrics
+from .sharding import fan_out, fan_out_ids, group_by_shard, shard_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'DIRECTORY': None,  # Default: <BASE_DIR>/archive
+    'IDLE_DAYS': 90,
+    'BATCH_SIZE': 100,  # Sessions per archive transaction
+}
+
+# Models archived with a session, in insertion order, with the lookup from each row to its session
+ARCHIVED_MODELS = [
+    ('api.ConversationSession', 'id'),
+    ('api.Message', 'session_id'),
+    ('api.MessageAnnotation', 'message__session_id'),
+    ('api.UserContext', 'session_id'),
+    ('api.SessionSummary', 'session_id'),
+    ('api.Feedback', 'session_id'),
+    ('api.ExpertReview', 'feedback__session_id'),
+    ('voice_service.VoiceSession', 'conversation_id'),
+    ('voice_service.VoiceSessionParticipant', 'session__conversation_id'),
+    ('voice_service.VoiceTranscript', 'session__conversation_id'),
+]
+
+# Fields whose values bound a session's activity
+_ACTIVITY_FIELDS = {'api.message': 'timestamp', 'api.feedback': 'created_at'}
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping full microsecond precision, so restored timestamps are unchanged"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        if isinstance(o, datetime.time):
+            return o.isoformat()
+        return super().default(o)
+
+
+def get_archive_settings():
+    """Get the archive configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'CONVERSATION_ARCHIVE', {}))
+    if not config['DIRECTORY']:
+        config['DIRECTORY'] = os.path.join(settings.BASE_DIR, 'archive')
+    return config
+
+
+def idle_session_ids(idle_days, limit=None):
+    """
+    Sessions without messages for more than idle_days, least recently active first
+
+    Returns:
+        list: Session ids
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=idle_days)
+
+    def idle_on_shard(alias):
+        queryset = ConversationSession.objects.using(alias) \
+                                              .annotate(last_activity=Coalesce(Max('messages__timestamp'), 'created_at')) \
+                                              .filter(last_activity__lt=cutoff) \
+                                              .order_by('last_activity', 'id') \
+                                              .values_list('last_activity', 'id')
+        return list(queryset[:limit] if limit else queryset)
+
+    idle = sorted(row for rows in fan_out(idle_on_shard) for row in rows)
+    return [session_id for _, session_id in (idle[:limit] if limit else idle)]
+
+
+def _archived_models():
+    for label, lookup in ARCHIVED_MODELS:
+        try:
+            yield apps.get_model(label), lookup
+        except LookupError:
+            # App not installed
+            continue
+
+
+def build_records(session_ids):
+    """
+    Serialize sessions and their dependent rows, with one query per archived model
+
+    Returns:
+        list: One record per existing session:
+            {'session_id', 'external_id', 'first_activity_at', 'last_activity_at',
+             'message_count', 'has_feedback', 'objects'}
+    """
+    records = {}
+    for model, lookup in _archived_models():
+        rows = [
+            row
+            for shard_rows in fan_out_ids(
+                lambda alias, ids: list(model._base_manager.using(alias)
+                                                           .filter(**{f'{lookup}__in': ids})
+                                                           .annotate(archive_session_id=F(lookup))
+                                                           .order_by('pk')),
+                session_ids,
+            )
+            for row in shard_rows
+        ]
+        label = model._meta.label_lower
+        for row in rows:
+            session_id = row.archive_session_id
+            if label == 'api.conversationsession':
+                records[session_id] = {
+                    'session_id': row.pk,
+                    'external_id': row.external_id,
+                    'first_activity_at': row.created_at,
+                    'last_activity_at': row.created_at,
+                    'message_count': 0,
+                    'has_feedback': False,
+                    'objects': [],
+                }
+            record = records.get(session_id)
+            if record is None:
+                continue
+            record['objects'].extend(serializers.serialize('python', [row]))
+            if label in _ACTIVITY_FIELDS:
+                record['last_activity_at'] = max(record['last_activity_at'], getattr(row, _ACTIVITY_FIELDS[label]))
+            if label == 'api.message':
+                record['message_count'] += 1
+            elif label == 'api.feedback':
+                record['has_feedback'] = True
+    return [records[session_id] for session_id in session_ids if session_id in records]
+
+
+def write_records(records, directory):
+    """
+    Append records to new partition files, one gzip member per record
+
+    Returns:
+        list: (record, relative path, offset, length) per record
+    """
+    token = f"{timezone.now().strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(4)}"
+    by_partition = {}
+    for record in records:
+        partition = record['last_activity_at'].strftime('%Y/%m')
+        by_partition.setdefault(partition, []).append(record)
+
+    written = []
+    for partition, partition_records in by_partition.items():
+        relative_path = f'{partition}/sessions-{token}.jsonl.gz'
+        path = os.path.join(directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset = 0
+        with open(path, 'wb') as f:
+            for record in partition_records:
+                line = json.dumps(record, cls=ArchiveJSONEncoder, separators=(',', ':')) + '\n'
+                member = gzip.compress(line.encode('utf-8'), mtime=0)
+                f.write(member)
+                written.append((record, relative_path, offset, len(member)))
+                offset += len(member)
+            f.flush()
+            os.fsync(f.fileno())
+    return written
+
+
+def archive_sessions(session_ids, directory=None, idle_before=None):
+    """
+    Move sessions to cold storage: write their records, index them, then delete
+    them from the primary database
+
+    Each shard's sessions are archived in one transaction that locks their
+    rows before reading them, so a message or feedback written meanwhile waits
+    for the delete (and then fails, leaving the client to rehydrate) instead
+    of being deleted without having been archived. The files are written
+    inside the transaction, so a failure leaves at most an unreferenced
+    record behind, never a lost session.
+
+    Args:
+        session_ids (list): Sessions to archive
+        directory (str): Archive directory (default: DIRECTORY)
+        idle_before (datetime): Skip sessions active since then, re-checked under the lock
+
+    Returns:
+        dict: {'sessions', 'messages', 'bytes'}
+    """
+    directory = directory or get_archive_settings()['DIRECTORY']
+    stats = {'sessions': 0, 'messages': 0, 'bytes': 0}
+    for alias, ids in group_by_shard(session_ids).items():
+        for key, value in _archive_shard_sessions(alias, ids, directory, idle_before).items():
+            stats[key] += value
+    if not stats['sessions']:
+        return stats
+
+    metrics.incr('archive.sessions_archived', stats['sessions'])
+    logger.info(f"Archived {stats['sessions']} sessions ({stats['messages']} messages, {stats['bytes']} bytes)")
+    return stats
+
+
+def _archive_shard_sessions(alias, session_ids, directory, idle_before):
+    """Archive sessions that all live on one shard (see archive_sessions)"""
+    with transaction.atomic(), transaction.atomic(using=alias):
+        # PostgreSQL row locks also block new rows referencing the sessions;
+        # SQLite transactions take the write lock up front (BEGIN IMMEDIATE)
+        locked = list(ConversationSession.objects.using(alias)
+                                                 .select_for_update()
+                                                 .filter(id__in=session_ids)
+                                                 .order_by('id')
+                                                 .values_list('id', flat=True))
+        if idle_before is not None and locked:
+            active = set(ConversationSession.objects.using(alias)
+                                                    .filter(id__in=locked)
+                                                    .annotate(last_activity=Coalesce(Max('messages__timestamp'),
+                                                                                     'created_at'))
+                                                    .filter(last_activity__gte=idle_before)
+                                                    .values_list('id', flat=True))
+            if active:
+                logger.info(f"Skipped archiving sessions {sorted(active)}: active again")
+                locked = [session_id for session_id in locked if session_id not in active]
+        records = build_records(locked)
+        if not records:
+            return {'sessions': 0, 'messages': 0, 'bytes': 0}
+        written = write_records(records, directory)
+
+        ArchivedSession.objects.bulk_create([
+            ArchivedSession(
+                session_id=record['session_id'],
+                external_id=record['external_id'],
+                path=path,
+                offset=offset,
+                length=length,
+                message_count=record['message_count'],
+                has_feedback=record['has_feedback'],
+                first_activity_at=record['first_activity_at'],
+                last_activity_at=record['last_activity_at'],
+            )
+            for record, path, offset, length in written
+        ])
+        ConversationSession.objects.using(alias).filter(id__in=[record['session_id'] for record in records]).delete()
+
+    return {
+        'sessions': len(records),
+        'messages': sum(record['message_count'] for record in records),
+        'bytes': sum(length for _, _, _, length in written),
+    }
+
+
+def archive_idle_sessions(idle_days=None, batch_size=None, limit=None, directory=None):
+    """
+    Archive every session idle for more than idle_days, in batches
+
+    Returns:
+        dict: Totals {'sessions', 'messages', 'bytes', 'batches'}
+    """
+    config = get_archive_settings()
+    idle_days = config['IDLE_DAYS'] if idle_days is None else idle_days
+    batch_size = batch_size or config['BATCH_SIZE']
+    session_ids = idle_session_ids(idle_days, limit)
+
+    totals = {'sessions': 0, 'messages': 0, 'bytes': 0, 'batches': 0}
+    for start in range(0, len(session_ids), batch_size):
+        # A session that became active since the scan is left alone
+        idle_before = timezone.now() - datetime.timedelta(days=idle_days)
+        stats = archive_sessions(session_ids[start:start + batch_size], directory, idle_before=idle_before)
+        for key, value in stats.items():
+            totals[key] += value
+        totals['batches'] += 1
+    return totals
+
+
+def read_record(entry, directory=None):
+    """Read the archived record an ArchivedSession points to"""
+    directory = directory or get_archive_settings()['DIRECTORY']
+    with open(os.path.join(directory, entry.path), 'rb') as f:
+        f.seek(entry.offset)
+        member = f.read(entry.length)
+    return json.loads(gzip.decompress(member))
+
+
+def rehydrate_sessions(session_ids, directory=None):
+    """
+    Restore archived sessions into the primary database with their original keys
+
+    Ids that are not archived are ignored.
+
+    Returns:
+        list: Ids of the restored sessions
+    """
+    if not session_ids:
+        return []
+    restored = []
+    with transaction.atomic():
+        entries = list(ArchivedSession.objects.select_for_update().filter(session_id__in=session_ids))
+        for entry in entries:
+            record = read_record(entry, directory)
+            alias = shard_for(entry.session_id)
+            with transaction.atomic(using=alias):
+                for obj in serializers.deserialize('python', record['objects'], using=alias):
+                    obj.save(using=alias, force_insert=True)
+            restored.append(entry.session_id)
+        ArchivedSession.objects.filter(id__in=[entry.id for entry in entries]).delete()
+
+    if restored:
+        from .conversation_state import get_conversation_state
+        state = get_conversation_state()
+        if state is not None:
+            for session_id in restored:
+                state.invalidate(session_id)
+        metrics.incr('archive.sessions_rehydrated', len(restored))
+        logger.info(f"Rehydrated archived sessions {restored}")
+    return restored
+
+
+def rehydrate_client_session(**lookup):
+    """
+    Restore the archived session matching an id or external_id lookup
+
+    Returns:
+        ConversationSession: The restored session, or None when nothing is archived under the lookup
+    """
+    if 'id' in lookup:
+        entry = ArchivedSession.objects.filter(session_id=lookup['id']).values_list('session_id', flat=True).first()
+    else:
+        entry = ArchivedSession.objects.filter(**lookup).values_list('session_id', flat=True).first()
+    if entry is None or not rehydrate_sessions([entry]):
+        return None
+    return ConversationSession.objects.using(shard_for(entry)).filter(id=entry).first()
+
+
+def rehydrate_active_between(start, end, with_feedback=False):
+    """
+    Restore the archived sessions whose activity overlaps [start, end)
+
+    Args:
+        start, end (datetime): Time range
+        with_feedback (bool): Only sessions that have feedback
+
+    Returns:
+        list: Ids of the restored sessions
+    """
+    return rehydrate_sessions(archived_active_between(start, end, with_feedback))
+
+
+def archived_active_between(start, end, with_feedback=False):
+    """Ids of the archived sessions whose activity overlaps [start, end), without restoring them"""
+    entries = ArchivedSession.objects.filter(last_activity_at__gte=start, first_activity_at__lt=end)
+    if with_feedback:
+        entries = entries.filter(has_feedback=True)
+    return list(entries.order_by('session_id').values_list('session_id', flat=True))
@@ -0,0 +1,168 @@
+"""
+Message Compression Benchmark
+
+Measures what CompressedTextField (api/compression.py) saves and costs on a
+corpus of chat messages:
+
+1. Storage: stored bytes and ratio for plain text, zstd without a dictionary
+   and zstd with a dictionary trained on a separate part of the corpus
+2. Write and read overhead: microseconds per message to encode and decode a
+   stored value, against plain UTF-8 encoding as the baseline
+
+The corpus is either the most recent stored messages or a synthetic one:
+assistant replies assembled from the acknowledgements, follow-up questions
+and safety disclaimers the assistant uses, around the patient messages of the
+NER gold corpus. The dictionary is trained in memory and never stored.
+"""
+
+import platform
+import random
+import time
+
+import zstandard
+from django.utils import timezone
+
+from api.benchmarks.ner_benchmark import load_corpus
+from api.compression import MessageCodec, get_compression_settings
+from api.runtime_metrics import _percentile
+
+ACKNOWLEDGEMENTS = [
+    "Thank you for sharing that with me. I understand that {symptom} can be very uncomfortable.",
+    "I'm sorry to hear you're dealing with {symptom}. Let's try to understand what is going on.",
+    "Thanks for letting me know about the {symptom}. I'd like to ask a few more questions.",
+    "I understand. {symptom_title} is something we should look at carefully.",
+]
+FOLLOW_UPS = [
+    "How long have you had the {symptom}, and has it been getting better or worse?",
+    "On a scale of 1 to 10, how severe would you say the {symptom} is right now?",
+    "Have you noticed anything that makes the {symptom} better or worse, such as food, rest or activity?",
+    "Are you currently taking any medication for this, and if so, has it helped?",
+    "Do you have any other symptoms, such as fever, dizziness, vomiting or shortness of breath?",
+    "Have you had anything like this before, or do you have any ongoing medical conditions?",
+]
+ADVICE = [
+    "In the meantime, try to rest, drink plenty of water and avoid strenuous activity.",
+    "Keeping a note of when the {symptom} starts and what you were doing can help your doctor.",
+    "Over-the-counter pain relief may help, but please follow the dosage on the packet.",
+    "Eating light meals and staying hydrated can help while your body recovers.",
+]
+DISCLAIMERS = [
+    "Please remember that I am an AI assistant and not a doctor. This information does not replace "
+    "a consultation with a qualified healthcare professional.",
+    "If your symptoms get worse, or you develop chest pain, difficulty breathing or confusion, please "
+    "seek emergency medical care immediately or call your local emergency number.",
+    "I would recommend booking an appointment with your doctor or visiting the nearest clinic so they "
+    "can examine you properly.",
+]
+FALLBACK_SYMPTOMS = ['headache', 'fever', 'cough', 'stomach pain', 'back pain', 'tiredness']
+
+
+def synthetic_corpus(count, seed=0):
+    """
+    Chat messages with the shape of real conversations: short patient messages
+    and long, repetitive assistant replies
+
+    Returns:
+        list: Message texts, alternating user and assistant
+    """
+    rng = random.Random(seed)
+    patients = load_corpus()['messages']
+    messages = []
+    while len(messages) < count:
+        patient = rng.choice(patients)
+        symptoms = patient['entities'].get('SYMPTOM') or FALLBACK_SYMPTOMS
+        symptom = rng.choice(symptoms)
+        fill = {'symptom': symptom, 'symptom_title': symptom[:1].upper() + symptom[1:]}
+        reply = [rng.choice(ACKNOWLEDGEMENTS)]
+        reply += rng.sample(FOLLOW_UPS, rng.randint(1, 3))
+        if rng.random() < 0.6:
+            reply.append(rng.choice(ADVICE))
+        reply += rng.sample(DISCLAIMERS, rng.randint(1, 2))
+        messages.append(patient['text'])
+        messages.append(' '.join(part.format(**fill) for part in reply))
+    return messages[:count]
+
+
+def stored_corpus(count):
+    """The most recent stored messages, oldest first"""
+    from api.models import Message
+    return list(reversed(Message.objects.order_by('-id').values_list('content', flat=True)[:count]))
+
+
+def _timed(function, values, iterations):
+    samples = []
+    for _ in range(iterations):
+        for value in values:
+            start = time.perf_counter()
+            function(value)
+            samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'mean_us': round(sum(samples) / len(samples) * 1e6, 3),
+        'p50_us': round(_percentile(samples, 50) * 1e6, 3),
+        'p99_us': round(_percentile(samples, 99) * 1e6, 3),
+    }
+
+
+def measure_strategy(messages, config, dictionary=None, iterations=5):
+    """
+    Storage and per-message cost of one codec configuration
+
+    Returns:
+        dict: Stored bytes, ratio and encode/decode timings
+    """
+    codec = MessageCodec(config)
+    codec.use_dictionary(dictionary)
+    stored = [codec.compress(text) for text in messages]
+    raw_bytes = sum(len(text.encode('utf-8')) for text in messages)
+    stored_bytes = sum(len(value) for value in stored)
+    assert [codec.decompress(value) for value in stored] == messages
+    return {
+        'raw_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+        'ratio': round(raw_bytes / stored_bytes, 3),
+        'compressed_messages': sum(1 for value in stored if value[:1] != b'\x00'),
+        'write': _timed(codec.compress, messages, iterations),
+        'read': _timed(codec.decompress, stored, iterations),
+    }
+
+
+def run_benchmark(messages, iterations=5, dictionary_size=None, level=None):
+    """
+    Compare plain storage, zstd and zstd with a trained dictionary
+
+    The first half of the corpus trains the dictionary; every strategy is
+    measured on the second half.
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    config = get_compression_settings()
+    if level is not None:
+        config['LEVEL'] = level
+    dictionary_size = dictionary_size or config['DICTIONARY_SIZE']
+    training, evaluation = messages[:len(messages) // 2], messages[len(messages) // 2:]
+
+    start = time.perf_counter()
+    dictionary = zstandard.train_dictionary(dictionary_size, [text.encode('utf-8') for text in training])
+    training_seconds = time.perf_counter() - start
+
+    results = {
+        'meta': {
+            'timestamp': timezone.now().isoformat(),
+            'messages': len(evaluation),
+            'training_messages': len(training),
+            'level': config['LEVEL'],
+            'min_size': config['MIN_SIZE'],
+            'dictionary_bytes': len(dictionary.as_bytes()),
+            'dictionary_training_seconds': round(training_seconds, 3),
+            'zstandard': zstandard.__version__,
+            'python': platform.python_version(),
+        },
+        'strategies': {
+            'plain': measure_strategy(evaluation, dict(config, ENABLED=False), iterations=iterations),
+            'zstd': measure_strategy(evaluation, config, iterations=iterations),
+            'zstd_dictionary': measure_strategy(evaluation, config, dictionary, iterations=iterations),
+        },
+    }
+    return results
@@ -0,0 +1,175 @@
+"""
+Concurrent Chat Write Benchmark
+
+Compares database profiles (eleraai_backend/database.py) under the write
+pattern of concurrent chat turns:
+
+1. Each profile gets a scratch database holding the ConversationSession and
+   Message tables
+2. WRITERS threads each replay TURNS chat turns on their own session, the
+   way a turn touches the database: save the user message, read the recent
+   history, save the assistant reply
+3. Per-turn latency, throughput and failed turns ("database is locked") are
+   reported per profile
+
+SQLite profiles use temporary files that are removed afterwards. The
+PostgreSQL profile runs only when a scratch database name is given; the two
+tables are created there and dropped afterwards.
+"""
+
+import os
+import platform
+import tempfile
+import threading
+import time
+
+from django.db import connections, transaction, OperationalError
+from django.utils import timezone
+
+from api.models import ConversationSession, Message
+from api.runtime_metrics import _percentile
+from eleraai_backend.database import sqlite_database, postgres_database
+
+HISTORY_WINDOW = 12
+USER_MESSAGE = "I have had a headache for three days and it is worse in the morning"
+ASSISTANT_MESSAGE = "Thank you for sharing that. Have you noticed anything that makes it better or worse?"
+
+
+def benchmark_profiles(directory, postgres_db=None):
+    """
+    The database settings compared by the benchmark
+
+    Args:
+        directory: Where the SQLite files are created
+        postgres_db (str): Scratch PostgreSQL database; None skips the profile
+
+    Returns:
+        dict: Profile name -> DATABASES entry
+    """
+    profiles = {
+        # The previous configuration: rollback journal, deferred transactions,
+        # the driver's 5 s lock timeout and a new connection per request
+        'sqlite_default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'default.sqlite3'),
+        },
+        'sqlite_wal': sqlite_database(os.path.join(directory, 'wal.sqlite3')),
+    }
+    if postgres_db:
+        profiles['postgres'] = dict(postgres_database(), NAME=postgres_db)
+    return profiles
+
+
+def _add_database(alias, config):
+    configured = connections.configure_settings({'default': connections.settings['default'], alias: config})
+    connections.settings[alias] = configured[alias]
+
+
+def _remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def _create_tables(alias):
+    with connections[alias].schema_editor() as editor:
+        editor.create_model(ConversationSession)
+        editor.create_model(Message)
+
+
+def _drop_tables(alias):
+    with connections[alias].schema_editor() as editor:
+        editor.delete_model(Message)
+        editor.delete_model(ConversationSession)
+
+
+def _replay_turns(alias, session_id, turns, latencies, failures, start_barrier):
+    try:
+        start_barrier.wait()
+        for _ in range(turns):
+            start = time.perf_counter()
+            try:
+                with transaction.atomic(using=alias):
+                    Message.objects.using(alias).create(session_id=session_id, role='user', content=USER_MESSAGE)
+                    list(Message.objects.using(alias).filter(session_id=session_id)
+                         .order_by('-timestamp')[:HISTORY_WINDOW])
+                Message.objects.using(alias).create(session_id=session_id, role='assistant', content=ASSISTANT_MESSAGE)
+            except OperationalError as e:
+                failures.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+    finally:
+        # Connections are per thread; close the one this writer opened
+        connections[alias].close()
+
+
+def measure_profile(alias, config, writers, turns):
+    """
+    Run the concurrent writers against one profile
+
+    Returns:
+        dict: Latency percentiles (ms), throughput and failures
+    """
+    _add_database(alias, config)
+    try:
+        _create_tables(alias)
+        sessions = [ConversationSession.objects.using(alias).create() for _ in range(writers)]
+        connections[alias].close()
+
+        latencies, failures = [], []
+        start_barrier = threading.Barrier(writers)
+        threads = [
+            threading.Thread(target=_replay_turns, args=(alias, session.id, turns, latencies, failures, start_barrier))
+            for session in sessions
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if not config['ENGINE'].endswith('sqlite3'):
+            _drop_tables(alias)
+    finally:
+        _remove_database(alias)
+
+    samples = sorted(latencies)
+    return {
+        'engine': config['ENGINE'].rsplit('.', 1)[-1],
+        'turns': len(samples),
+        'failed_turns': len(failures),
+        'errors': sorted(set(failures))[:5],
+        'turns_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3) if samples else None,
+        'p50_ms': round(_percentile(samples, 50) * 1000, 3) if samples else None,
+        'p95_ms': round(_percentile(samples, 95) * 1000, 3) if samples else None,
+        'p99_ms': round(_percentile(samples, 99) * 1000, 3) if samples else None,
+    }
+
+
+def run_benchmark(writers=16, turns=50, postgres_db=None):
+    """
+    Run the concurrent write benchmark
+
+    Args:
+        writers (int): Concurrent chat sessions
+        turns (int): Chat turns per session
+        postgres_db (str): Scratch PostgreSQL database to include; None skips it
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    results = {
+        'meta': {
+            'timestamp': timezone.now().isoformat(),
+            'writers': writers,
+            'turns_per_writer': turns,
+            'python': platform.python_version(),
+        },
+        'profiles': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='db-benchmark-') as directory:
+        for name, config in benchmark_profiles(directory, postgres_db).items():
+            results['profiles'][name] = measure_profile(f'benchmark_{name}', config, writers, turns)
+    return results
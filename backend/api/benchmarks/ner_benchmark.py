@@ -0,0 +1,300 @@
+"""
+Medical NER Benchmark
+
+Measures speed and quality of the extractors in medical_ner.py against a
+labeled corpus of English and Nigerian Pidgin patient messages:
+
+1. Throughput (messages/sec) and p50/p99 latency of every extract_* function,
+   extract_medical_entities and analyze_patient_emotion
+2. Peak memory allocated while processing the corpus
+3. Precision/recall/F1 per entity type, overall and per language
+
+Models can be stubbed so runs are fast, offline and deterministic. Results
+are plain dicts that serialize to JSON, so runs can be compared over time.
+"""
+
+import json
+import os
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.utils import timezone
+
+from api import medical_ner
+from api.emotion_cache import get_emotion_cache
+from api.runtime_metrics import _percentile
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'ner_gold_corpus.json')
+
+# Entity type -> extractor function name in medical_ner
+EXTRACTORS = {
+    'MEDICATION': 'extract_medications',
+    'SYMPTOM': 'extract_symptoms',
+    'SEVERITY': 'extract_severity',
+    'DURATION': 'extract_duration',
+    'CONDITION': 'extract_conditions',
+    'VITALS': 'extract_vitals',
+}
+
+# Keyword rules for the stub emotion classifier
+STUB_EMOTION_KEYWORDS = [
+    ('fear', ('worried', 'worry', 'fear', 'scared', 'afraid', 'panic')),
+    ('joy', ('thank', 'better', 'happy', 'relieved')),
+    ('anger', ('angry', 'annoyed', 'vex')),
+    ('sadness', ('excruciating', 'sad', 'hopeless', 'crying')),
+]
+
+# Emotion cache key version for stub results
+STUB_EMOTION_MODEL_VERSION = 'benchmark-stub@1'
+
+
+def load_corpus(path=DEFAULT_CORPUS_PATH):
+    """Load the labeled corpus"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def stub_emotion_classifier(inputs, **kwargs):
+    """Deterministic stand-in for the Hugging Face text-classification pipeline"""
+    def classify(text):
+        text_lower = text.lower()
+        for label, keywords in STUB_EMOTION_KEYWORDS:
+            if any(keyword in text_lower for keyword in keywords):
+                return {'label': label, 'score': 0.9}
+        return {'label': 'neutral', 'score': 0.3}
+
+    if isinstance(inputs, str):
+        return [classify(inputs)]
+    return [classify(text) for text in inputs]
+
+
+@contextmanager
+def stubbed_models():
+    """
+    Replace the Hugging Face models with stubs for the duration of the block
+
+    Stub results are cached under their own model version so they never
+    reach callers of the real classifier through the (possibly shared) emotion cache.
+    """
+    previous_pipeline = medical_ner._emotion_pipeline
+    previous_ner_ready = medical_ner._medical_ner_ready
+    previous_version = medical_ner.EMOTION_MODEL_VERSION
+    medical_ner._emotion_pipeline = stub_emotion_classifier
+    medical_ner._medical_ner_ready = True
+    medical_ner.EMOTION_MODEL_VERSION = STUB_EMOTION_MODEL_VERSION
+    try:
+        yield
+    finally:
+        medical_ner._emotion_pipeline = previous_pipeline
+        medical_ner._medical_ner_ready = previous_ner_ready
+        medical_ner.EMOTION_MODEL_VERSION = previous_version
+
+
+def _normalize_span(span):
+    return ' '.join(span.lower().split())
+
+
+def _score(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    f1 = (2 * precision * recall / (precision + recall)) if precision + recall else 0.0
+    return {
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(f1, 4),
+        'tp': tp,
+        'fp': fp,
+        'fn': fn,
+    }
+
+
+def evaluate_quality(messages):
+    """
+    Compute precision/recall per entity type, overall and per language
+
+    Returns:
+        dict: {'overall': {type: scores}, 'by_language': {language: {type: scores}}}
+    """
+    counts = {}  # (language, entity_type) -> [tp, fp, fn]
+    for message in messages:
+        gold_entities = message.get('entities', {})
+        for entity_type, function_name in EXTRACTORS.items():
+            predicted = {_normalize_span(s) for s in getattr(medical_ner, function_name)(message['text'])}
+            gold = {_normalize_span(s) for s in gold_entities.get(entity_type, [])}
+            for key in ((message['language'], entity_type), ('*', entity_type)):
+                tally = counts.setdefault(key, [0, 0, 0])
+                tally[0] += len(predicted & gold)
+                tally[1] += len(predicted - gold)
+                tally[2] += len(gold - predicted)
+
+    quality = {'overall': {}, 'by_language': {}}
+    for (language, entity_type), (tp, fp, fn) in sorted(counts.items()):
+        if language == '*':
+            quality['overall'][entity_type] = _score(tp, fp, fn)
+        else:
+            quality['by_language'].setdefault(language, {})[entity_type] = _score(tp, fp, fn)
+
+    # Micro-average across entity types
+    totals = [sum(values) for values in zip(*(counts[('*', t)] for t in EXTRACTORS))]
+    quality['overall']['ALL'] = _score(*totals)
+    return quality
+
+
+def evaluate_emotion(messages, stubbed=False):
+    """
+    Accuracy of analyze_patient_emotion on messages with an emotion label
+
+    The stub classifier only matches keywords, so its accuracy says nothing
+    about the model and is reported as 'n/a'.
+    """
+    labeled = [m for m in messages if m.get('emotion')]
+    if stubbed:
+        return {'labeled': len(labeled), 'correct': None, 'accuracy': 'n/a'}
+    correct = sum(
+        1 for m in labeled
+        if medical_ner.analyze_patient_emotion(m['text'])['emotion'] == m['emotion']
+    )
+    return {
+        'labeled': len(labeled),
+        'correct': correct,
+        'accuracy': round(correct / len(labeled), 4) if labeled else None,
+    }
+
+
+def _time_function(func, texts, iterations, before_iteration=None):
+    """Time every call of func over the texts; returns per-call latencies in seconds"""
+    samples = []
+    for _ in range(iterations):
+        if before_iteration:
+            before_iteration()
+        for text in texts:
+            start = time.perf_counter()
+            func(text)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _summarize(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'calls': len(samples),
+        'messages_per_sec': round(len(samples) / total, 1) if total else None,
+        'mean_ms': round(total / len(samples) * 1000, 4),
+        'p50_ms': round(_percentile(samples, 50) * 1000, 4),
+        'p99_ms': round(_percentile(samples, 99) * 1000, 4),
+        'max_ms': round(samples[-1] * 1000, 4),
+    }
+
+
+def _clear_emotion_cache():
+    cache = get_emotion_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def measure_performance(messages, iterations=20):
+    """Latency/throughput of each function and peak memory over the corpus"""
+    texts = [m['text'] for m in messages]
+    functions = [(name, getattr(medical_ner, name)) for name in EXTRACTORS.values()]
+    functions.append(('extract_medical_entities', medical_ner.extract_medical_entities))
+
+    latency = {}
+    for name, func in functions:
+        # One untimed pass warms up the regex cache
+        _time_function(func, texts, 1)
+        latency[name] = _summarize(_time_function(func, texts, iterations))
+
+    # Emotion: uncached (cache cleared each pass) and served from the cache
+    latency['analyze_patient_emotion'] = _summarize(_time_function(
+        medical_ner.analyze_patient_emotion, texts, iterations, before_iteration=_clear_emotion_cache
+    ))
+    latency['analyze_patient_emotion[cached]'] = _summarize(_time_function(
+        medical_ner.analyze_patient_emotion, texts, iterations
+    ))
+
+    # Memory is measured separately because tracing slows everything down
+    peak_memory_kb = {}
+    for name, func in functions + [('analyze_patient_emotion', medical_ner.analyze_patient_emotion)]:
+        _clear_emotion_cache()
+        tracemalloc.start()
+        for text in texts:
+            func(text)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_memory_kb[name] = round(peak / 1024, 1)
+
+    return latency, peak_memory_kb
+
+
+def run_benchmark(corpus, iterations=20, emotion_mode='stub'):
+    """
+    Run the full benchmark
+
+    Args:
+        corpus (dict): Loaded gold corpus
+        iterations (int): Timed passes over the corpus per function
+        emotion_mode (str): 'stub' for deterministic stand-in models, 'model' for the real ones
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    messages = corpus['messages']
+
+    def run():
+        latency, peak_memory_kb = measure_performance(messages, iterations)
+        return {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'corpus_version': corpus.get('version'),
+                'corpus_size': len(messages),
+                'languages': sorted({m['language'] for m in messages}),
+                'iterations': iterations,
+                'emotion_mode': emotion_mode,
+                'python': platform.python_version(),
+            },
+            'latency': latency,
+            'peak_memory_kb': peak_memory_kb,
+            'quality': evaluate_quality(messages),
+            'emotion': evaluate_emotion(messages, stubbed=emotion_mode == 'stub'),
+        }
+
+    if emotion_mode == 'stub':
+        with stubbed_models():
+            return run()
+    return run()
+
+
+def compare_results(current, baseline):
+    """
+    Compare two benchmark results
+
+    Returns:
+        dict: Relative latency changes (%) and absolute quality changes per metric
+    """
+    comparison = {'latency_p50_change_pct': {}, 'throughput_change_pct': {}, 'quality_change': {}}
+
+    for name, stats in current.get('latency', {}).items():
+        previous = baseline.get('latency', {}).get(name)
+        if not previous:
+            continue
+        if previous.get('p50_ms'):
+            comparison['latency_p50_change_pct'][name] = round(
+                (stats['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100, 1
+            )
+        if previous.get('messages_per_sec') and stats.get('messages_per_sec'):
+            comparison['throughput_change_pct'][name] = round(
+                (stats['messages_per_sec'] - previous['messages_per_sec']) / previous['messages_per_sec'] * 100, 1
+            )
+
+    for entity_type, scores in current.get('quality', {}).get('overall', {}).items():
+        previous = baseline.get('quality', {}).get('overall', {}).get(entity_type)
+        if previous:
+            comparison['quality_change'][entity_type] = {
+                metric: round(scores[metric] - previous[metric], 4)
+                for metric in ('precision', 'recall', 'f1')
+            }
+
+    return comparison
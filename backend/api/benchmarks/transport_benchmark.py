@@ -0,0 +1,199 @@
+"""
+Chat Transport Benchmark
+
+Compares the per-turn overhead of POST /api/chat/ with the WebSocket chat
+channel (api/chat_socket.py):
+
+1. The LLM is replaced by an in-process model that answers instantly, so the
+   measured time is our own work: request handling, session resolution,
+   history, prompt assembly, routing and saving the turn
+2. The same conversation is replayed over both transports in separate sessions
+3. Per-turn latency (and time to first token on the socket) is summarized as
+   mean/p50/p95/p99
+
+The Hugging Face models are stubbed and the deferred task queue is disabled
+for the run. The benchmark sessions are deleted afterwards.
+"""
+
+import asyncio
+import json
+import platform
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.test import Client, override_settings
+from django.utils import timezone
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from api import llm_client
+from api.benchmarks.ner_benchmark import stubbed_models
+from api.chat_socket import ChatSocket, get_socket_settings
+from api.models import ConversationSession
+from api.runtime_metrics import _percentile
+
+DEFAULT_CONVERSATION = [
+    "Hello",
+    "I have had a headache for three days",
+    "It is worse in the morning",
+    "I took paracetamol but it did not help",
+    "Sometimes I feel dizzy too",
+    "No fever",
+    "Thank you",
+    "What should I do next?",
+]
+
+INSTANT_REPLY = "Thank you for sharing that. How long has this been going on, and is it getting better or worse?"
+
+
+class InstantChatModel:
+    """Chat model stand-in that answers immediately, in word-sized chunks when streamed"""
+
+    def __init__(self, model):
+        self.model = model
+
+    async def ainvoke(self, messages, config=None):
+        return AIMessage(content=INSTANT_REPLY, response_metadata={'model_name': self.model})
+
+    async def astream(self, messages, config=None):
+        for i, word in enumerate(INSTANT_REPLY.split()):
+            yield AIMessageChunk(content=word if i == 0 else f' {word}')
+
+
+def instant_model_factory(model, config, backend_config):
+    """LLM_BACKEND factory for InstantChatModel"""
+    return InstantChatModel(model)
+
+
+def _summarize(samples):
+    samples = sorted(samples)
+    return {
+        'turns': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'p50_ms': round(_percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(_percentile(samples, 99) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+
+def measure_rest(session_id, conversation):
+    """Per-turn latency of POST /api/chat/ through the full Django request stack"""
+    client = Client()
+    samples = []
+    for message in conversation:
+        start = time.perf_counter()
+        response = client.post('/api/chat/', {'message': message, 'session_id': session_id},
+                               content_type='application/json')
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"REST turn failed with {response.status_code}: {response.content[:200]}")
+    return samples
+
+
+async def measure_websocket(session_id, conversation):
+    """Per-turn latency and time to first token of the WebSocket channel, driven in-process"""
+    inbound = asyncio.Queue()
+    outbound = asyncio.Queue()
+    scope = {
+        'type': 'websocket',
+        'path': get_socket_settings()['PATH'],
+        'query_string': urlencode({'session_id': session_id}).encode('utf-8'),
+    }
+    socket = asyncio.ensure_future(ChatSocket(scope, inbound.get, outbound.put).run())
+
+    async def next_frame():
+        event = await asyncio.wait_for(outbound.get(), timeout=30)
+        if event['type'] == 'websocket.close':
+            raise RuntimeError(f"Chat socket closed with code {event.get('code')}")
+        return json.loads(event['text']) if event['type'] == 'websocket.send' else event
+
+    await inbound.put({'type': 'websocket.connect'})
+    await next_frame()  # accept
+    await next_frame()  # ready
+
+    samples = []
+    first_token = []
+    try:
+        for i, message in enumerate(conversation):
+            start = time.perf_counter()
+            streamed = False
+            frame = {'type': 'message', 'message': message, 'id': i}
+            await inbound.put({'type': 'websocket.receive', 'text': json.dumps(frame)})
+            while True:
+                frame = await next_frame()
+                if frame['type'] == 'token' and not streamed:
+                    first_token.append(time.perf_counter() - start)
+                    streamed = True
+                elif frame['type'] == 'done':
+                    samples.append(time.perf_counter() - start)
+                    break
+                elif frame['type'] == 'error':
+                    raise RuntimeError(f"WebSocket turn failed: {frame['error']}")
+    finally:
+        await inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        await socket
+    return samples, first_token
+
+
+def run_benchmark(conversation=None, repeats=5, session_base=990000):
+    """
+    Run the transport benchmark
+
+    Args:
+        conversation (list): User messages replayed on each transport
+        repeats (int): Conversations per transport; each uses a new session
+        session_base (int): First numeric session id used by the benchmark
+
+    Returns:
+        dict: JSON-serializable results
+    """
+    conversation = conversation or DEFAULT_CONVERSATION
+    session_ids = {
+        'rest': [session_base + i for i in range(repeats)],
+        'websocket': [session_base + repeats + i for i in range(repeats)],
+    }
+    rest, socket, socket_first_token = [], [], []
+
+    overrides = {
+        # The test client's requests come from 'testserver'
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        'LLM_BACKEND': {'BACKEND': 'api.benchmarks.transport_benchmark.instant_model_factory'},
+        'TASK_QUEUE': {'ENABLED': False},
+        'SEMANTIC_CACHE': {'ENABLED': False},
+    }
+    previous_clients = dict(llm_client._llm_clients)
+    llm_client._llm_clients.clear()
+    try:
+        with override_settings(**overrides), stubbed_models():
+            # One untimed turn per transport warms up imports and caches
+            measure_rest(session_base - 1, conversation[:1])
+            asyncio.run(measure_websocket(session_base - 2, conversation[:1]))
+
+            for session_id in session_ids['rest']:
+                rest.extend(measure_rest(session_id, conversation))
+            for session_id in session_ids['websocket']:
+                samples, first_token = asyncio.run(measure_websocket(session_id, conversation))
+                socket.extend(samples)
+                socket_first_token.extend(first_token)
+    finally:
+        llm_client._llm_clients.clear()
+        llm_client._llm_clients.update(previous_clients)
+        all_ids = session_ids['rest'] + session_ids['websocket'] + [session_base - 1, session_base - 2]
+        ConversationSession.objects.filter(id__in=all_ids).delete()
+
+    results = {
+        'meta': {
+            'timestamp': timezone.now().isoformat(),
+            'turns_per_conversation': len(conversation),
+            'repeats': repeats,
+            'python': platform.python_version(),
+        },
+        'rest': _summarize(rest),
+        'websocket': _summarize(socket),
+        'websocket_first_token': _summarize(socket_first_token),
+    }
+    results['websocket_saving_pct'] = round(
+        (1 - results['websocket']['p50_ms'] / results['rest']['p50_ms']) * 100, 1
+    ) if results['rest']['p50_ms'] else None
+    return results
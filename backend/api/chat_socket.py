@@ -0,0 +1,318 @@
+"""
+WebSocket Chat Channel
+
+Persistent alternative to POST /api/chat/, served under ASGI at
+ws://<host>/ws/chat/?session_id=<id>. The ConversationSession and UserContext
+are resolved once when the socket connects and kept in connection state, so a
+turn skips session resolution and (with the conversation state cache) history
+loading.
+
+Client -> server (JSON text frames):
+    {"type": "message", "message": "...", "id": "<optional client turn id>"}
+    {"type": "ping"}  /  {"type": "pong"}
+
+Server -> client:
+    {"type": "ready", "session_id": ...}
+    {"type": "token", "id": ..., "text": "..."}  - reply text as it streams
+    {"type": "done", "id": ..., "reply": "...", "message_id": ...}  - plus the
+        REST response fields ('urgent', 'cached', ...) for turns answered
+        without streaming
+    {"type": "error", "id": ..., "error": "...", "status": <HTTP-like code>}
+    {"type": "ping"}  - heartbeat; any client frame counts as an answer
+
+Backpressure: turns of a connection run one at a time and at most
+MAX_QUEUED_TURNS wait behind the running one; further turns are rejected with
+status 429. Tokens are coalesced into frames of at most FLUSH_INTERVAL_MS, and
+a client that does not accept a frame within SEND_TIMEOUT_SECONDS is
+disconnected.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async, ThreadSensitiveContext
+from django.db import close_old_connections, connections
+from langchain_core.messages import AIMessage
+
+from .llm_client import get_llm_client, LLMDeadlineExceeded
+from .model_router import record_routed_call
+from .prompts import record_prompt_usage
+from .runtime_metrics import metrics
+from .views import load_chat_session, prepare_chat_turn, finish_chat_turn
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'PATH': '/ws/chat/',
+    'HEARTBEAT_SECONDS': 20,
+    'IDLE_TIMEOUT_SECONDS': 60,  # Closed when no client frame arrives for this long
+    'MAX_QUEUED_TURNS': 2,
+    'MAX_MESSAGE_LENGTH': 4000,
+    'FLUSH_INTERVAL_MS': 50,  # Token frames are coalesced over this interval
+    'SEND_TIMEOUT_SECONDS': 10,
+    'CONTEXT_REFRESH_TURNS': 5,  # Reload the UserContext updated by the task workers every N turns
+}
+
+# Close codes
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_INTERNAL_ERROR = 1011
+
+
+def get_socket_settings():
+    """Get the WebSocket chat configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'CHAT_SOCKET', {}))
+    return config
+
+
+def database_sync_to_async(func):
+    """Run ORM work on the sync thread, releasing stale connections like a request would"""
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=True)
+
+
+def _load_connection_state(session_id):
+    return load_chat_session(session_id)
+
+
+class SocketClosed(Exception):
+    """The client went away or stopped reading"""
+
+
+class ChatSocket:
+    """
+    One WebSocket chat connection
+    """
+
+    def __init__(self, scope, receive, send, config=None):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.config = config or get_socket_settings()
+        self.session = None
+        self.user_context = None
+        # Turns waiting behind the one being answered
+        self.turns = asyncio.Queue(maxsize=max(1, self.config['MAX_QUEUED_TURNS']))
+        self.turn_count = 0
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def run(self):
+        """Handle the connection from the handshake to the disconnect"""
+        # Give the connection its own sync thread (and database connection) instead of
+        # sharing the process-wide one with every other socket
+        async with ThreadSensitiveContext():
+            try:
+                await self._run()
+            finally:
+                await sync_to_async(connections.close_all, thread_sensitive=True)()
+
+    async def _run(self):
+        event = await self.receive()
+        if event['type'] != 'websocket.connect':
+            return
+
+        query = parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        session_id = (query.get('session_id') or ['default'])[0]
+        try:
+            self.session, self.user_context = await database_sync_to_async(_load_connection_state)(session_id)
+        except Exception as e:
+            logger.error(f"Error resolving session for chat socket: {str(e)}", exc_info=True)
+            await self.send({'type': 'websocket.close', 'code': CLOSE_INTERNAL_ERROR})
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        metrics.incr('chat_socket.connections')
+        await self.send_json({'type': 'ready', 'session_id': self.session.id})
+
+        workers = [asyncio.ensure_future(self.process_turns()), asyncio.ensure_future(self.heartbeat())]
+        try:
+            await self.receive_frames()
+        except SocketClosed:
+            pass
+        finally:
+            self.closed = True
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            metrics.incr('chat_socket.disconnects')
+
+    async def receive_frames(self):
+        """Read client frames until the socket closes, queueing chat turns"""
+        while True:
+            event = await self.receive()
+            if event['type'] == 'websocket.disconnect':
+                return
+            if event['type'] != 'websocket.receive':
+                continue
+            self.last_seen = time.monotonic()
+
+            try:
+                frame = json.loads(event.get('text') or event.get('bytes') or b'')
+            except (ValueError, TypeError):
+                await self.send_json({'type': 'error', 'error': 'Frames must be JSON', 'status': 400})
+                continue
+            if not isinstance(frame, dict):
+                await self.send_json({'type': 'error', 'error': 'Frames must be JSON objects', 'status': 400})
+                continue
+
+            frame_type = frame.get('type', 'message')
+            if frame_type == 'ping':
+                await self.send_json({'type': 'pong'})
+            elif frame_type == 'pong':
+                continue
+            elif frame_type == 'message':
+                await self.queue_turn(frame)
+            else:
+                await self.send_json({'type': 'error', 'error': f"Unknown frame type '{frame_type}'", 'status': 400})
+
+    async def queue_turn(self, frame):
+        message = frame.get('message')
+        turn_id = frame.get('id')
+        if not message or not isinstance(message, str):
+            await self.send_json({'type': 'error', 'id': turn_id, 'error': 'No message provided', 'status': 400})
+            return
+        if len(message) > self.config['MAX_MESSAGE_LENGTH']:
+            await self.send_json({'type': 'error', 'id': turn_id, 'error': 'Message too long', 'status': 413})
+            return
+        try:
+            self.turns.put_nowait((turn_id, message, time.perf_counter()))
+        except asyncio.QueueFull:
+            metrics.incr('chat_socket.turns_rejected')
+            await self.send_json({
+                'type': 'error', 'id': turn_id, 'status': 429,
+                'error': 'Too many turns in flight; wait for the current reply',
+            })
+
+    async def process_turns(self):
+        """Run queued turns one at a time, in order"""
+        while True:
+            turn_id, message, started_at = await self.turns.get()
+            try:
+                await self.handle_turn(turn_id, message, started_at)
+            except SocketClosed:
+                return
+            except LLMDeadlineExceeded as e:
+                logger.error(f"LLM deadline exceeded in chat socket: {str(e)}")
+                await self.send_json({'type': 'error', 'id': turn_id, 'error': str(e), 'status': 504})
+            except Exception as e:
+                logger.error(f"Error in chat socket turn: {str(e)}", exc_info=True)
+                await self.send_json({'type': 'error', 'id': turn_id, 'error': str(e), 'status': 500})
+            finally:
+                self.turns.task_done()
+
+    async def handle_turn(self, turn_id, message, started_at):
+        """Answer one chat turn, streaming the LLM reply"""
+        metrics.incr('chat_socket.turns')
+        self.turn_count += 1
+        if self.turn_count % self.config['CONTEXT_REFRESH_TURNS'] == 0:
+            await database_sync_to_async(self.user_context.refresh_from_db)()
+
+        turn = await database_sync_to_async(prepare_chat_turn)(self.session, self.user_context, message, started_at)
+        if 'reply_data' in turn:
+            await self.send_json({'type': 'done', 'id': turn_id, **turn['reply_data']})
+            metrics.observe('chat_socket.turn', time.perf_counter() - started_at)
+            return
+
+        route = turn['route']
+        llm_start = time.perf_counter()
+        parts = []
+        buffer = []
+        metadata = {}
+        last_flush = time.monotonic()
+        flush_interval = self.config['FLUSH_INTERVAL_MS'] / 1000
+
+        with metrics.timer('chat.llm'):
+            async for chunk in get_llm_client(route['endpoint']).astream(turn['messages']):
+                if not metadata:
+                    # The first chunk names the model and path that answered
+                    metadata = dict(chunk.response_metadata)
+                if not chunk.content:
+                    continue
+                if not parts:
+                    metrics.observe('chat_socket.first_token', time.perf_counter() - started_at)
+                parts.append(chunk.content)
+                buffer.append(chunk.content)
+                if time.monotonic() - last_flush >= flush_interval:
+                    await self.send_json({'type': 'token', 'id': turn_id, 'text': ''.join(buffer)})
+                    buffer = []
+                    last_flush = time.monotonic()
+        if buffer:
+            await self.send_json({'type': 'token', 'id': turn_id, 'text': ''.join(buffer)})
+
+        reply = ''.join(parts)
+        response = AIMessage(content=reply, response_metadata=metadata)
+        record_routed_call(route, response, time.perf_counter() - llm_start)
+        record_prompt_usage('chat', response)
+
+        assistant_message = await database_sync_to_async(finish_chat_turn)(self.session, message, reply, started_at)
+        await self.send_json({'type': 'done', 'id': turn_id, 'reply': reply, 'message_id': assistant_message.id})
+        metrics.observe('chat_socket.turn', time.perf_counter() - started_at)
+
+    async def heartbeat(self):
+        """Ping the client and close the socket when it stops answering"""
+        while True:
+            await asyncio.sleep(self.config['HEARTBEAT_SECONDS'])
+            if time.monotonic() - self.last_seen > self.config['IDLE_TIMEOUT_SECONDS']:
+                metrics.incr('chat_socket.idle_timeouts')
+                await self.close(CLOSE_GOING_AWAY)
+                return
+            await self.send_json({'type': 'ping'})
+
+    async def send_json(self, data):
+        """Send a frame, disconnecting clients that stop reading"""
+        if self.closed:
+            raise SocketClosed()
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(
+                    self.send({'type': 'websocket.send', 'text': json.dumps(data)}),
+                    timeout=self.config['SEND_TIMEOUT_SECONDS'],
+                )
+            except asyncio.TimeoutError:
+                metrics.incr('chat_socket.slow_consumers')
+                logger.warning(f"Closing chat socket for session {self.session.id}: client is not reading")
+                self.closed = True
+                raise SocketClosed()
+            except (OSError, RuntimeError) as e:
+                # Sending after the client disconnected
+                self.closed = True
+                raise SocketClosed() from e
+
+    async def close(self, code=CLOSE_NORMAL):
+        if not self.closed:
+            self.closed = True
+            await self.send({'type': 'websocket.close', 'code': code})
+
+
+def websocket_router(http_application):
+    """
+    Wrap the Django ASGI application so WebSocket connections to the chat path
+    reach ChatSocket and everything else reaches Django
+    """
+    config = get_socket_settings()
+    chat_path = config['PATH'].rstrip('/')
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'websocket':
+            if scope['path'].rstrip('/') == chat_path:
+                await ChatSocket(scope, receive, send, config).run()
+            else:
+                await receive()
+                await send({'type': 'websocket.close', 'code': CLOSE_POLICY_VIOLATION})
+            return
+        await http_application(scope, receive, send)
+
+    return application
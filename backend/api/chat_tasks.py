@@ -0,0 +1,197 @@
+"""
+Post-turn chat side effects, run by the deferred task queue after the reply
+has been sent (see task_queue.py), and summaries of sessions that went idle
+"""
+
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .clinical_summary import get_current_summaries, get_summary_settings, summarize_session
+from .medical_ner import extract_medical_entities, analyze_patient_emotion, SYMPTOM_TERMS
+from .models import Message, MessageAnnotation, AnalyticsMetric, UserContext
+from .sharding import shard_for
+from .task_queue import deferred_task, enqueue_many
+
+logger = logging.getLogger(__name__)
+
+
+@deferred_task('annotate_message')
+def annotate_message(message_id):
+    """Store medical entities and emotion for a saved message"""
+    alias = shard_for(message_id)
+    message = Message.objects.using(alias).filter(id=message_id).only('id', 'content').first()
+    if message is None:
+        logger.info(f"Message {message_id} no longer exists, skipping annotation")
+        return
+    entities = extract_medical_entities(message.content)
+    emotion = analyze_patient_emotion(message.content)
+    MessageAnnotation.objects.using(alias).update_or_create(
+        message=message,
+        defaults={
+            'entities': entities,
+            'emotion': emotion['emotion'],
+            'emotion_confidence': emotion['confidence'],
+        }
+    )
+
+
+@deferred_task('record_chat_turn')
+def record_chat_turn(response_time_ms, date=None):
+    """Add a chat turn to today's turn count and running average response time"""
+    date = date or timezone.now().date().isoformat()
+    with transaction.atomic():
+        AnalyticsMetric.objects.get_or_create(metric_type='chat_turns', date=date, defaults={'value': 0})
+        AnalyticsMetric.objects.get_or_create(metric_type='response_time', date=date, defaults={'value': 0})
+        metrics = {
+            metric.metric_type: metric
+            for metric in AnalyticsMetric.objects.select_for_update()
+                                                 .filter(metric_type__in=['chat_turns', 'response_time'], date=date)
+        }
+        turns = metrics['chat_turns']
+        response_time = metrics['response_time']
+        response_time.value = (response_time.value * turns.value + response_time_ms) / (turns.value + 1)
+        turns.value += 1
+        turns.save(update_fields=['value'])
+        response_time.save(update_fields=['value'])
+
+
+# Severity words from extract_severity mapped to the 1-5 scale used by the context editor
+SEVERITY_SCORES = {
+    'slight': 1, 'mild': 2, 'manageable': 2, 'moderate': 3, 'significant': 4,
+    'severe': 4, 'extreme': 5, 'excruciating': 5, 'unbearable': 5, 'intolerable': 5,
+}
+DEFAULT_SEVERITY = 3
+
+# SYMPTOM_TERMS entries that qualify a symptom rather than name one
+SYMPTOM_QUALIFIERS = frozenset({'chronic', 'acute', 'persistent', 'intermittent', 'constant', 'occasional'})
+
+
+def severity_score(severities):
+    """Map extracted severity phrases to a 1-5 score, or None if none are recognised"""
+    for phrase in severities:
+        for word in phrase.split():
+            if word in SEVERITY_SCORES:
+                return SEVERITY_SCORES[word]
+    return None
+
+
+def context_symptoms(spans):
+    """
+    Reduce extracted SYMPTOM spans to symptom names
+
+    extract_symptoms also returns severity and duration phrases ("severe headache",
+    "for 3 days") and generic words next to specific ones ("pain" with "chest pain").
+    """
+    names = [span for span in spans if span in SYMPTOM_TERMS and span not in SYMPTOM_QUALIFIERS]
+    return [name for name in names if not any(name != other and name in other.split() for other in names)]
+
+
+def merge_entities(context, entities):
+    """
+    Merge extracted medical entities into a UserContext with set semantics
+
+    Existing entries (including ones entered by the user) are never overwritten.
+
+    Returns:
+        list: Names of the fields that changed
+    """
+    changed = set()
+
+    symptom_names = context_symptoms(entities.get('SYMPTOM', []))
+
+    # Severity and duration are only attributable when the message mentions a single symptom
+    single_symptom = len(symptom_names) == 1
+    severity = severity_score(entities.get('SEVERITY', [])) if single_symptom else None
+
+    symptoms = dict(context.symptoms or {})
+    known_symptoms = {name.lower() for name in symptoms}
+    for symptom in symptom_names:
+        if symptom.lower() not in known_symptoms:
+            symptoms[symptom] = {
+                'name': symptom,
+                'severity': severity or DEFAULT_SEVERITY,
+                'severity_reported': severity is not None,
+                'source': 'chat',
+            }
+            known_symptoms.add(symptom.lower())
+            changed.add('symptoms')
+
+    durations = dict(context.symptom_durations or {})
+    if single_symptom and entities.get('DURATION'):
+        symptom = symptom_names[0]
+        if not any(name.lower() == symptom.lower() and value for name, value in durations.items()):
+            durations[symptom] = entities['DURATION'][0]
+            changed.add('symptom_durations')
+
+    treatments = list(context.treatments_tried or [])
+    known_treatments = {str(t.get('name', '')).lower() for t in treatments if isinstance(t, dict)}
+    for medication in entities.get('MEDICATION', []):
+        if medication.lower() not in known_treatments:
+            treatments.append({'name': medication, 'type': 'modern', 'effective': None, 'source': 'chat'})
+            known_treatments.add(medication.lower())
+            changed.add('treatments_tried')
+
+    history = list(context.medical_history or [])
+    known_conditions = {str(h.get('condition', '')).lower() for h in history if isinstance(h, dict)}
+    for condition in entities.get('CONDITION', []):
+        if condition.lower() not in known_conditions:
+            history.append({'condition': condition, 'duration': '', 'source': 'chat'})
+            known_conditions.add(condition.lower())
+            changed.add('medical_history')
+
+    context.symptoms = symptoms
+    context.symptom_durations = durations
+    context.treatments_tried = treatments
+    context.medical_history = history
+    return sorted(changed)
+
+
+@deferred_task('update_user_context')
+def update_user_context(message_id):
+    """Merge the medical entities of a user message into its session's UserContext"""
+    alias = shard_for(message_id)
+    message = Message.objects.using(alias).filter(id=message_id).only('id', 'session_id', 'content').first()
+    if message is None:
+        return
+    annotation = MessageAnnotation.objects.using(alias).filter(message_id=message_id).only('entities').first()
+    entities = annotation.entities if annotation is not None else extract_medical_entities(message.content)
+    if not entities:
+        return
+
+    with transaction.atomic(using=alias):
+        context, _ = UserContext.objects.using(alias).get_or_create(session_id=message.session_id)
+        context = UserContext.objects.using(alias).select_for_update().get(pk=context.pk)
+        changed = merge_entities(context, entities)
+        if changed:
+            # Only the clinical fields: language detection writes to the same row from the request thread
+            context.save(update_fields=changed + ['updated_at'])
+            logger.info(f"Updated {', '.join(changed)} in context of session {message.session_id}")
+
+
+@deferred_task('summarize_idle_session')
+def summarize_idle_session(session_id, after_message_id):
+    """
+    Precompute the clinical summary of a session that has gone idle
+
+    Scheduled IDLE_MINUTES after each chat turn. Only the check of the newest
+    user turn stays responsible: when the session has had messages since (e.g.
+    an urgent-reply elaboration), that check is pushed back until it is idle.
+    """
+    messages = Message.objects.using(shard_for(session_id)).filter(session_id=session_id)
+    latest = messages.order_by('-id').values_list('id', 'timestamp').first()
+    if latest is None or get_current_summaries([session_id]):
+        return
+
+    idle_seconds = get_summary_settings()['IDLE_MINUTES'] * 60
+    remaining = idle_seconds - (timezone.now() - latest[1]).total_seconds()
+    if remaining > 0:
+        if messages.filter(role='user', id__gt=after_message_id).exists():
+            return
+        enqueue_many([('summarize_idle_session',
+                       {'session_id': session_id, 'after_message_id': after_message_id}, remaining)])
+        return
+
+    summarize_session(session_id)
+    logger.info(f"Precomputed summary of idle session {session_id} up to message {latest[0]}")
@@ -0,0 +1,441 @@
+"""
+Clinical Summaries
+
+Builds the doctor-facing summary of a conversation session, for one session
+(ChatSummaryAPIView) or a whole clinic queue at once:
+
+1. Messages of all requested sessions are loaded with one query, and user
+   messages without a stored annotation are annotated in one batch (entities
+   per message, emotions in batched forward passes) and saved for reuse
+2. Summary LLM calls run concurrently, bounded by CONCURRENCY, so the wall
+   time of a queue is close to that of its slowest call
+3. Results are yielded as each call completes, in completion order
+
+Summaries are stored with the newest message they cover (SessionSummary).
+A stored summary is current until the session gets a newer message, and is
+then returned without any model work. With PRECOMPUTE_ON_IDLE, every chat
+turn schedules a deferred 'summarize_idle_session' task IDLE_MINUTES later,
+so sessions are usually summarized before a doctor asks.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .archive import archived_active_between, rehydrate_sessions
+from .llm_client import get_llm_client, LLMDeadlineExceeded
+from .medical_ner import extract_medical_entities, analyze_patient_emotion, analyze_patient_emotions
+from .models import ConversationSession, Message, MessageAnnotation, SessionSummary
+from .prompts import build_summary_prompt, record_prompt_usage
+from .runtime_metrics import metrics
+from .sharding import fan_out, fan_out_ids, group_by_shard, shard_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'CONCURRENCY': 8,  # Summary LLM calls in flight at once
+    'MAX_SESSIONS': 200,  # Per bulk request
+    'PRECOMPUTE_ON_IDLE': True,
+    'IDLE_MINUTES': 15,  # A session without new messages for this long gets summarized
+}
+
+_DONE = object()
+
+
+def get_summary_settings():
+    """Get the clinical summary configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'CLINICAL_SUMMARY', {}))
+    return config
+
+
+class TooManySessions(ValueError):
+    """A bulk request for more sessions than MAX_SESSIONS"""
+
+    def __init__(self, count, max_sessions):
+        super().__init__(f"At most {max_sessions} sessions per request ({count} requested)")
+        self.count = count
+        self.max_sessions = max_sessions
+
+
+class SessionsNotFound(LookupError):
+    """Requested sessions that exist neither live nor in the archive"""
+
+    def __init__(self, session_ids):
+        super().__init__(f"Sessions not found: {session_ids}")
+        self.session_ids = session_ids
+
+
+def sessions_active_between(date_from, date_to, max_sessions=None):
+    """
+    Ids of sessions with messages between two dates (inclusive), oldest first
+
+    Archived sessions active in the range are restored first. With max_sessions,
+    the live and archived candidates are counted before anything is restored.
+
+    Raises:
+        TooManySessions: When more than max_sessions sessions may be in the range
+    """
+    start = timezone.make_aware(datetime.combine(date_from, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    session_ids = _live_sessions_between(start, end)
+    archived_ids = archived_active_between(start, end)
+    count = len(session_ids) + len(archived_ids)
+    if max_sessions is not None and count > max_sessions:
+        raise TooManySessions(count, max_sessions)
+    if not archived_ids:
+        return session_ids
+    rehydrate_sessions(archived_ids)
+    return _live_sessions_between(start, end)
+
+
+def restore_requested_sessions(session_ids, max_sessions=None):
+    """
+    Validate the session ids of a bulk request and restore the archived ones
+
+    Ids are deduplicated in order, and counted against max_sessions before
+    anything is restored.
+
+    Returns:
+        list: The session ids
+
+    Raises:
+        TooManySessions: When more than max_sessions sessions are requested
+        SessionsNotFound: When sessions exist neither live nor in the archive
+        ValueError: When an id belongs to no shard
+    """
+    session_ids = list(dict.fromkeys(session_ids))
+    if max_sessions is not None and len(session_ids) > max_sessions:
+        raise TooManySessions(len(session_ids), max_sessions)
+    by_shard = group_by_shard(session_ids)
+    found = set().union(*fan_out(
+        lambda alias: ConversationSession.objects.using(alias).filter(id__in=by_shard[alias])
+                                                              .values_list('id', flat=True),
+        shards=by_shard,
+    ))
+    missing = [session_id for session_id in session_ids if session_id not in found]
+    if missing:
+        restored = set(rehydrate_sessions(missing))
+        missing = [session_id for session_id in missing if session_id not in restored]
+    if missing:
+        raise SessionsNotFound(missing)
+    return session_ids
+
+
+def _live_sessions_between(start, end):
+    per_shard = fan_out(lambda alias: list(
+        ConversationSession.objects.using(alias)
+                                   .filter(messages__timestamp__gte=start, messages__timestamp__lt=end)
+                                   .order_by('id').values_list('id', flat=True).distinct()
+    ))
+    return [session_id for session_ids in per_shard for session_id in session_ids]
+
+
+def annotate_missing(messages):
+    """
+    Annotate user messages that have no stored annotation, in one batch
+
+    Annotations are saved, so later summaries and the backfill skip them.
+
+    Returns:
+        dict: message id -> {'entities', 'emotion', 'confidence'}
+    """
+    missing = [msg for msg in messages if msg.role == 'user' and getattr(msg, 'annotation', None) is None]
+    if not missing:
+        return {}
+    start = time.perf_counter()
+    texts = [msg.content for msg in missing]
+    entities = [extract_medical_entities(text) for text in texts]
+    emotions = analyze_patient_emotions(texts)
+    by_shard = {}
+    for msg, found, emotion in zip(missing, entities, emotions):
+        by_shard.setdefault(msg._state.db, []).append(
+            MessageAnnotation(message_id=msg.id, entities=found, emotion=emotion['emotion'],
+                              emotion_confidence=emotion['confidence'])
+        )
+    for alias, annotations in by_shard.items():
+        MessageAnnotation.objects.using(alias).bulk_create(annotations, ignore_conflicts=True)
+    metrics.observe('summary.annotate_batch', time.perf_counter() - start)
+    return {
+        msg.id: {'entities': found, 'emotion': emotion['emotion'], 'confidence': emotion['confidence']}
+        for msg, found, emotion in zip(missing, entities, emotions)
+    }
+
+
+def build_summary_inputs(messages, annotations=None):
+    """
+    Aggregate a session's transcript, entities and emotions for the summary prompt
+
+    Args:
+        messages (list): The session's messages, oldest first (with 'annotation' selected)
+        annotations (dict): Fresh annotations by message id for messages without a stored one
+
+    Returns:
+        dict: {'conversation_text', 'entities', 'entity_summary', 'emotion_summary',
+               'dominant_emotion', 'emotion_breakdown'}
+    """
+    annotations = annotations or {}
+
+    # Construct conversation text for summary
+    conversation_text = ""
+
+    # Aggregate all medical entities across the conversation
+    all_entities = {}
+
+    # Track patient emotions across the conversation
+    patient_emotions = []
+
+    for msg in messages:
+        conversation_text += f"{msg.role.capitalize()}: {msg.content}\n\n"
+
+        if msg.role != 'user':
+            continue
+
+        # Reuse stored annotations instead of re-running the models
+        annotation = getattr(msg, 'annotation', None)
+        if annotation is not None:
+            entities = annotation.entities
+            emotion_result = {"emotion": annotation.emotion, "confidence": annotation.emotion_confidence}
+        elif msg.id in annotations:
+            entities = annotations[msg.id]['entities']
+            emotion_result = annotations[msg.id]
+        else:
+            entities = extract_medical_entities(msg.content)
+            emotion_result = analyze_patient_emotion(msg.content)
+
+        for entity_type, words in entities.items():
+            all_entities.setdefault(entity_type, set()).update(words)
+        if emotion_result["emotion"] != "unknown":
+            patient_emotions.append(emotion_result)
+
+    # Create a formatted string of all detected entities
+    entity_summary = ""
+    if all_entities:
+        entity_summary = "Extracted medical entities:\n"
+
+        # Format medications
+        if "MEDICATION" in all_entities:
+            entity_summary += f"- Medications: {', '.join(all_entities['MEDICATION'])}\n"
+
+        # Format symptoms with attributes
+        if "SYMPTOM" in all_entities:
+            entity_summary += f"- Symptoms: {', '.join(all_entities['SYMPTOM'])}\n"
+
+            # Add severity if available
+            if "SEVERITY" in all_entities:
+                entity_summary += f"- Severity indicators: {', '.join(all_entities['SEVERITY'])}\n"
+
+            # Add duration if available
+            if "DURATION" in all_entities:
+                entity_summary += f"- Duration information: {', '.join(all_entities['DURATION'])}\n"
+
+        # Format conditions
+        if "CONDITION" in all_entities:
+            entity_summary += f"- Medical conditions: {', '.join(all_entities['CONDITION'])}\n"
+
+        # Format vital signs
+        if "VITALS" in all_entities:
+            entity_summary += f"- Vital signs: {', '.join(all_entities['VITALS'])}\n"
+
+    # Create a summary of patient emotions
+    emotion_summary = ""
+    dominant_emotion = "unknown"
+    emotion_percentages = {}
+    if patient_emotions:
+        emotion_counts = {}
+        for emotion_data in patient_emotions:
+            emotion_counts[emotion_data["emotion"]] = emotion_counts.get(emotion_data["emotion"], 0) + 1
+
+        # Get the dominant emotion
+        dominant_emotion = max(emotion_counts.items(), key=lambda x: x[1])[0]
+        emotion_summary = f"Patient emotional state: Patient predominantly expressed {dominant_emotion}. "
+
+        # Add emotional state details
+        emotion_percentages = {emotion: (count / len(patient_emotions)) * 100
+                               for emotion, count in emotion_counts.items()}
+        emotion_list = [f"{emotion} ({percentage:.0f}%)" for emotion, percentage in emotion_percentages.items()]
+        emotion_summary += f"Emotions detected during conversation: {', '.join(emotion_list)}."
+
+    return {
+        'conversation_text': conversation_text,
+        'entities': all_entities,
+        'entity_summary': entity_summary,
+        'emotion_summary': emotion_summary,
+        'dominant_emotion': dominant_emotion,
+        'emotion_breakdown': emotion_percentages,
+    }
+
+
+def summary_result(session_id, inputs, summary):
+    """The summary response body shared by the single and bulk endpoints"""
+    return {
+        'summary': summary,
+        'session_id': session_id,
+        'covers_message_id': inputs['last_message_id'],
+        'extracted_entities': {k: list(v) for k, v in inputs['entities'].items()},
+        'emotional_analysis': {
+            'dominant_emotion': inputs['dominant_emotion'],
+            'emotion_breakdown': inputs['emotion_breakdown'],
+        }
+    }
+
+
+def load_summary_inputs(session_ids):
+    """
+    Load and annotate the messages of many sessions with one query and one annotation batch
+
+    Returns:
+        dict: session id -> summary inputs, or None for sessions without messages
+    """
+    per_shard = fan_out_ids(lambda alias, ids: list(
+        Message.objects.using(alias).filter(session_id__in=ids).select_related('annotation')
+                       .order_by('session_id', 'timestamp', 'id')
+    ), session_ids)
+    messages = [msg for shard_messages in per_shard for msg in shard_messages]
+    annotations = annotate_missing(messages)
+
+    by_session = {session_id: [] for session_id in session_ids}
+    for msg in messages:
+        by_session[msg.session_id].append(msg)
+    inputs_by_session = {}
+    for session_id, session_messages in by_session.items():
+        inputs = None
+        if session_messages:
+            inputs = build_summary_inputs(session_messages, annotations)
+            inputs['last_message_id'] = max(msg.id for msg in session_messages)
+        inputs_by_session[session_id] = inputs
+    return inputs_by_session
+
+
+def get_current_summaries(session_ids):
+    """
+    Stored summaries that still cover the newest message of their session
+
+    Returns:
+        dict: session id -> stored summary body (marked 'precomputed')
+    """
+    def current_on_shard(alias, ids):
+        latest = dict(
+            Message.objects.using(alias).filter(session_id__in=ids).values_list('session_id')
+                           .annotate(last=Max('id')).order_by()
+        )
+        return {
+            stored.session_id: dict(stored.data, precomputed=True)
+            for stored in SessionSummary.objects.using(alias).filter(session_id__in=ids)
+            if latest.get(stored.session_id) == stored.last_message_id
+        }
+
+    current = {}
+    for shard_current in fan_out_ids(current_on_shard, session_ids):
+        current.update(shard_current)
+    return current
+
+
+def store_summary(session_id, data):
+    """Save a generated summary with the newest message it covers"""
+    SessionSummary.objects.using(shard_for(session_id)).update_or_create(
+        session_id=session_id,
+        defaults={'last_message_id': data['covers_message_id'], 'data': data},
+    )
+
+
+def summarize_session(session_id):
+    """
+    Generate and store the summary of one session from synchronous code
+
+    Returns:
+        dict: The summary body, or None when the session has no messages
+    """
+    inputs = load_summary_inputs([session_id])[session_id]
+    if inputs is None:
+        return None
+    prompt = build_summary_prompt(inputs['conversation_text'], inputs['entity_summary'], inputs['emotion_summary'])
+    start = time.perf_counter()
+    try:
+        response = get_llm_client('summary').invoke(prompt['messages'])
+    finally:
+        metrics.observe('summary.llm', time.perf_counter() - start)
+    record_prompt_usage('summary', response)
+    data = summary_result(session_id, inputs, response.content)
+    store_summary(session_id, data)
+    return data
+
+
+async def _summarize_concurrently(inputs_by_session, concurrency, emit):
+    """Run the summary calls with at most `concurrency` in flight, emitting each result when it completes"""
+    llm = get_llm_client('summary')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarize(session_id, inputs):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                prompt = build_summary_prompt(inputs['conversation_text'], inputs['entity_summary'],
+                                              inputs['emotion_summary'])
+                response = await llm.ainvoke(prompt['messages'])
+            except LLMDeadlineExceeded as e:
+                return {'session_id': session_id, 'error': str(e), 'status': 504}
+            except Exception as e:
+                logger.error(f"Error summarizing session {session_id}: {str(e)}")
+                return {'session_id': session_id, 'error': str(e), 'status': 500}
+            finally:
+                metrics.observe('summary.llm', time.perf_counter() - start)
+            record_prompt_usage('summary', response)
+            return summary_result(session_id, inputs, response.content)
+
+    tasks = [asyncio.ensure_future(summarize(session_id, inputs)) for session_id, inputs in inputs_by_session.items()]
+    for task in asyncio.as_completed(tasks):
+        emit(await task)
+
+
+def iter_summaries(session_ids, concurrency=None):
+    """
+    Summarize many sessions, yielding each result as soon as it is ready
+
+    Current stored summaries are yielded first. Database work happens in the
+    calling thread; the LLM calls run on an event loop in a helper thread.
+
+    Yields:
+        dict: A summary result, or {'session_id', 'error', 'status'} for a failed session
+    """
+    concurrency = concurrency or get_summary_settings()['CONCURRENCY']
+    current = get_current_summaries(session_ids)
+    for data in current.values():
+        metrics.incr('summary.precomputed_hit')
+        yield data
+
+    inputs_by_session = load_summary_inputs([session_id for session_id in session_ids if session_id not in current])
+
+    ready = {session_id: inputs for session_id, inputs in inputs_by_session.items() if inputs is not None}
+    for session_id, inputs in inputs_by_session.items():
+        if inputs is None:
+            yield {'session_id': session_id, 'error': 'No messages found in session.', 'status': 400}
+    if not ready:
+        return
+
+    results = queue.Queue()
+
+    def run():
+        try:
+            asyncio.run(_summarize_concurrently(ready, concurrency, results.put))
+        except Exception as e:
+            logger.error(f"Error in bulk summary run: {str(e)}", exc_info=True)
+        finally:
+            results.put(_DONE)
+
+    threading.Thread(target=run, name='bulk-summary', daemon=True).start()
+    while True:
+        result = results.get()
+        if result is _DONE:
+            return
+        if 'error' not in result:
+            store_summary(result['session_id'], result)
+            result = dict(result, precomputed=False)
+        yield result
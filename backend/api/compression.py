@@ -0,0 +1,226 @@
+"""
+Message Compression
+
+Codec behind CompressedTextField (api/fields.py), used for Message.content.
+Assistant replies are long and repetitive (the same disclaimers, follow-up
+questions and phrasing), so they compress well with zstd, and much better
+with a dictionary trained on earlier messages.
+
+Stored values start with a one-byte format marker:
+
+- RAW: UTF-8 text, for short content or when compression is disabled
+- ZSTD: a zstd frame; the frame header names the dictionary it was
+  compressed with (0 for none)
+
+Dictionaries are stored in the CompressionDictionary table and never change
+or get deleted, so every stored value stays readable. New values use the most
+recently trained dictionary (`manage.py train_compression_dictionary`); each
+process re-checks for a newer one every DICTIONARY_REFRESH_SECONDS.
+"""
+
+import logging
+import threading
+import time
+
+import zstandard
+
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,  # Compress new values; stored values are always readable
+    'LEVEL': 3,
+    'MIN_SIZE': 200,  # Bytes of UTF-8 below which content is stored as is
+    'DICTIONARY_SIZE': 32 * 1024,
+    'DICTIONARY_REFRESH_SECONDS': 300,
+}
+
+RAW = b'\x00'
+ZSTD = b'\x01'
+
+
+def get_compression_settings():
+    """Get the message compression configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'MESSAGE_COMPRESSION', {}))
+    return config
+
+
+class MessageCodec:
+    """
+    Compresses and decompresses stored text with the current dictionary
+
+    zstd compressors are not thread-safe, so each thread keeps its own.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_compression_settings()
+        self._lock = threading.Lock()
+        self._dictionaries = {}  # zstd dict id -> ZstdCompressionDict
+        self._current_id = None
+        self._checked_at = None
+        self._local = threading.local()
+
+    def _load_dictionary(self, dict_id):
+        from .models import CompressionDictionary
+        row = CompressionDictionary.objects.filter(dict_id=dict_id).values_list('data', flat=True).first()
+        if row is None:
+            raise ValueError(f"Compression dictionary {dict_id} not found")
+        return zstandard.ZstdCompressionDict(bytes(row))
+
+    def dictionary(self, dict_id):
+        """The dictionary with a zstd dict id, loaded once per process"""
+        with self._lock:
+            dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            dictionary = self._load_dictionary(dict_id)
+            with self._lock:
+                self._dictionaries[dict_id] = dictionary
+        return dictionary
+
+    def current_dictionary_id(self):
+        """The newest dictionary's zstd id (None when none is trained), re-checked periodically"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.config['DICTIONARY_REFRESH_SECONDS']:
+            from .models import CompressionDictionary
+            self._current_id = CompressionDictionary.objects.order_by('-created_at', '-id') \
+                                                            .values_list('dict_id', flat=True).first()
+            self._checked_at = now
+        return self._current_id
+
+    def use_dictionary(self, dictionary):
+        """Compress new values with a dictionary (None for none), without checking the database again"""
+        if dictionary is not None:
+            with self._lock:
+                self._dictionaries[dictionary.dict_id()] = dictionary
+        self._current_id = dictionary.dict_id() if dictionary is not None else None
+        self._checked_at = float('inf')
+
+    def _compressor(self, dict_id):
+        compressors = self._local.__dict__.setdefault('compressors', {})
+        compressor = compressors.get(dict_id)
+        if compressor is None:
+            if dict_id is None:
+                compressor = zstandard.ZstdCompressor(level=self.config['LEVEL'])
+            else:
+                compressor = zstandard.ZstdCompressor(level=self.config['LEVEL'], dict_data=self.dictionary(dict_id))
+            compressors[dict_id] = compressor
+        return compressor
+
+    def _decompressor(self, dict_id):
+        decompressors = self._local.__dict__.setdefault('decompressors', {})
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id:
+                decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary(dict_id))
+            else:
+                decompressor = zstandard.ZstdDecompressor()
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    def compress(self, text, dict_id=...):
+        """
+        Encode text for storage
+
+        Args:
+            text (str): Content
+            dict_id: Dictionary to use; by default the current one (None for no dictionary)
+
+        Returns:
+            bytes: Stored value
+        """
+        data = text.encode('utf-8')
+        if not self.config['ENABLED'] or len(data) < self.config['MIN_SIZE']:
+            return RAW + data
+        if dict_id is ...:
+            dict_id = self.current_dictionary_id()
+        compressed = self._compressor(dict_id).compress(data)
+        if len(compressed) >= len(data):
+            return RAW + data
+        metrics.incr('compression.bytes_in', len(data))
+        metrics.incr('compression.bytes_out', len(compressed) + 1)
+        return ZSTD + compressed
+
+    def decompress(self, value):
+        """
+        Decode a stored value
+
+        Returns:
+            str: Content
+        """
+        value = bytes(value)
+        marker, data = value[:1], value[1:]
+        if marker == RAW:
+            return data.decode('utf-8')
+        if marker == ZSTD:
+            dict_id = zstandard.get_frame_parameters(data).dict_id
+            return self._decompressor(dict_id).decompress(data).decode('utf-8')
+        raise ValueError(f"Unknown compressed text format {marker!r}")
+
+
+_codec = None
+
+
+def get_codec():
+    """Get or initialize the process-wide message codec"""
+    global _codec
+    if _codec is None:
+        _codec = MessageCodec()
+    return _codec
+
+
+def reset_codec():
+    """Drop the process-wide codec, e.g. after the settings change"""
+    global _codec
+    _codec = None
+
+
+def train_dictionary(samples, size=None):
+    """
+    Train and store a dictionary from sample texts
+
+    Args:
+        samples (list): Texts, e.g. recent assistant messages
+        size (int): Dictionary size in bytes (default DICTIONARY_SIZE)
+
+    Returns:
+        CompressionDictionary: The stored dictionary, used for new values from now on
+    """
+    from .models import CompressionDictionary
+    size = size or get_compression_settings()['DICTIONARY_SIZE']
+    dictionary = zstandard.train_dictionary(size, [text.encode('utf-8') for text in samples])
+    stored = CompressionDictionary.objects.create(
+        dict_id=dictionary.dict_id(),
+        data=dictionary.as_bytes(),
+        sample_count=len(samples),
+    )
+    if _codec is not None:
+        # This process switches right away; others within DICTIONARY_REFRESH_SECONDS
+        _codec._checked_at = None
+    logger.info(f"Trained compression dictionary {stored.dict_id} ({len(stored.data)} bytes) from {len(samples)} samples")
+    return stored
+
+
+def recompress_messages(batch_size=500):
+    """
+    Rewrite stored message content with the current settings and dictionary
+
+    Returns:
+        int: Messages rewritten
+    """
+    from .models import Message
+    from .sharding import get_shards
+    rewritten = 0
+    for alias in get_shards():
+        last_id = 0
+        while True:
+            batch = list(Message.objects.using(alias).filter(id__gt=last_id).order_by('id')
+                                                     .only('id', 'content')[:batch_size])
+            if not batch:
+                break
+            Message.objects.using(alias).bulk_update(batch, ['content'])
+            rewritten += len(batch)
+            last_id = batch[-1].id
+    return rewritten
@@ -0,0 +1,301 @@
+"""
+Conversation State Cache
+
+Per-session cache of what a chat turn needs from the database: the recent
+message window with per-message token counts. A normal turn reads it from the
+cache, so it makes no history queries. Client session ids are resolved by
+api/session_resolver.py.
+
+The cache is write-through: messages created through the ORM are appended
+by a post_save signal, while edits and deletes invalidate the session's
+state. Bulk operations (QuerySet.update/delete, bulk_create) bypass signals
+and must call invalidate() themselves.
+
+By default the state lives in local memory, which is only coherent when all
+requests of a session reach the same process (runserver, a single worker or
+sticky sessions). Set SHARED_CACHE_ALIAS to keep the state in a Django cache
+backend shared by all workers instead. A shared window is never modified in
+place, since two workers appending at once would lose a message: windows are
+stored under a per-session version counter. An append takes the next version
+with an atomic incr() and stores the previous version's window plus the new
+message under it; if that window is missing (another worker has not stored
+it yet, or it was invalidated) nothing is stored and the next read rebuilds
+the window from the database. Invalidation just moves to the next version.
+
+Appends run when the message's transaction commits, so a rolled-back message
+never reaches the cache and a window rebuilt by another request always holds
+it.
+"""
+
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ConversationSession, Message
+from .prompts import count_tokens
+from .runtime_metrics import metrics
+from .sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'MAX_SESSIONS': 1000,
+    'MAX_MESSAGES': 100,  # Most recent messages kept per session
+    'TTL_SECONDS': 30 * 60,
+    'SHARED_CACHE_ALIAS': None,  # e.g. 'default' for multi-process deployments
+}
+
+WINDOW_LOCK_STRIPES = 64
+
+
+class _LocalStore:
+    """Thread-safe LRU dictionary with TTL expiry"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ConversationStateCache:
+    """
+    Write-through cache of recent message windows
+    """
+
+    def __init__(self, max_sessions=1000, max_messages=100, ttl_seconds=1800, shared_cache_alias=None):
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self.shared_cache_alias = shared_cache_alias
+        self._local = _LocalStore(max_sessions, ttl_seconds)
+        # Serialize window loads and appends of a session so a message saved during a load is not lost;
+        # sessions are spread over a fixed set of locks so unrelated sessions rarely wait for each other
+        self._window_locks = [threading.Lock() for _ in range(WINDOW_LOCK_STRIPES)]
+
+    # Storage tier
+
+    def _backend(self):
+        if not self.shared_cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.shared_cache_alias]
+
+    def _get(self, key):
+        backend = self._backend()
+        if backend is None:
+            return self._local.get(key)
+        try:
+            return backend.get(f'conversation:{key}')
+        except Exception as e:
+            logger.warning(f"Error reading shared conversation state: {str(e)}")
+            return None
+
+    def _set(self, key, value):
+        backend = self._backend()
+        if backend is None:
+            self._local.set(key, value)
+            return
+        try:
+            backend.set(f'conversation:{key}', value, timeout=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Error writing shared conversation state: {str(e)}")
+
+    def _window_lock(self, session_pk):
+        return self._window_locks[hash(session_pk) % WINDOW_LOCK_STRIPES]
+
+    def _version_key(self, session_pk):
+        return f'conversation:version:{session_pk}'
+
+    def _window_key(self, session_pk, version=None):
+        """Cache key of a session's message window (at its current version when shared)"""
+        backend = self._backend()
+        if backend is None:
+            return f'messages:{session_pk}'
+        if version is None:
+            key = self._version_key(session_pk)
+            try:
+                version = backend.get(key)
+                if version is None:
+                    # Start the counter here so the session's first append can extend this window
+                    backend.add(key, secrets.randbelow(2 ** 62), timeout=self.ttl_seconds * 2)
+                    version = backend.get(key)
+            except Exception as e:
+                logger.warning(f"Error reading shared conversation state: {str(e)}")
+        return f'messages:{session_pk}:{version}'
+
+    def _next_version(self, backend, session_pk):
+        """Atomically move a session's shared window to its next version; returns it, or None on errors"""
+        key = self._version_key(session_pk)
+        try:
+            # Counters start at a random value so they never reuse the versions of an expired one
+            backend.add(key, secrets.randbelow(2 ** 62), timeout=self.ttl_seconds * 2)
+            return backend.incr(key)
+        except ValueError:
+            # Expired between add() and incr(); windows of the old counter are never read again
+            return None
+        except Exception as e:
+            logger.warning(f"Error writing shared conversation state: {str(e)}")
+            return None
+
+    # Message windows
+
+    def get_history(self, session):
+        """
+        Get the recent messages of a session, oldest first
+
+        Messages carry a `token_count` attribute. Only the first turn after a miss
+        reads the database.
+        """
+        key = self._window_key(session.pk)
+        rows = self._get(key)
+        if rows is not None:
+            metrics.incr('conversation_state.history_hit')
+        else:
+            with self._window_lock(session.pk):
+                rows = self._get(key)
+                if rows is None:
+                    metrics.incr('conversation_state.history_miss')
+                    recent = Message.objects.using(shard_for(session.pk)) \
+                                            .filter(session_id=session.pk).order_by('-timestamp', '-id') \
+                                            .values_list('id', 'role', 'content', 'timestamp')[:self.max_messages]
+                    rows = [(pk, role, content, timestamp, count_tokens(content))
+                            for pk, role, content, timestamp in reversed(list(recent))]
+                    self._set(key, rows)
+        return [_to_message(session.pk, row) for row in rows]
+
+    def append(self, message):
+        """
+        Add a newly saved and committed message to its session's window, if the window is cached
+
+        A shared window is stored again under the session's next version.
+        """
+        row = (message.pk, message.role, message.content, message.timestamp, count_tokens(message.content))
+        backend = self._backend()
+        with self._window_lock(message.session_id):
+            if backend is None:
+                key = self._window_key(message.session_id)
+                rows = self._get(key)
+            else:
+                version = self._next_version(backend, message.session_id)
+                if version is None:
+                    return
+                key = self._window_key(message.session_id, version)
+                rows = self._get(self._window_key(message.session_id, version - 1))
+            if rows is None:
+                return
+            if not any(existing[0] == message.pk for existing in rows):
+                # Copy on write so concurrent readers never see a half-updated list
+                rows = sorted(list(rows) + [row], key=lambda r: (r[3], r[0]))[-self.max_messages:]
+            self._set(key, rows)
+        metrics.incr('conversation_state.append')
+
+    def invalidate(self, session_pk, using=None):
+        """Drop the cached message window of a session, again when the current transaction commits"""
+        def drop():
+            backend = self._backend()
+            if backend is None:
+                self._local.delete(self._window_key(session_pk))
+            else:
+                self._next_version(backend, session_pk)
+        drop()
+        using = using or shard_for(session_pk)
+        if connections[using].in_atomic_block:
+            # A read before the commit may rebuild the window without the write
+            transaction.on_commit(drop, using=using)
+        metrics.incr('conversation_state.invalidate')
+
+    def stats(self):
+        """Get the number of locally cached entries"""
+        return {
+            'backend': self.shared_cache_alias or 'local',
+            'local_entries': len(self._local),
+        }
+
+
+def _to_message(session_pk, row):
+    pk, role, content, timestamp, token_count = row
+    message = Message(id=pk, session_id=session_pk, role=role, content=content, timestamp=timestamp)
+    message.token_count = token_count
+    return message
+
+
+_conversation_state = None
+_conversation_state_lock = threading.Lock()
+
+
+def get_conversation_state():
+    """Get or initialize the process-wide conversation state cache (None when disabled)"""
+    global _conversation_state
+    if _conversation_state is None:
+        config = dict(DEFAULT_SETTINGS)
+        from django.conf import settings
+        config.update(getattr(settings, 'CONVERSATION_STATE', {}))
+        if not config['ENABLED']:
+            return None
+        with _conversation_state_lock:
+            if _conversation_state is None:
+                _conversation_state = ConversationStateCache(
+                    max_sessions=config['MAX_SESSIONS'],
+                    max_messages=config['MAX_MESSAGES'],
+                    ttl_seconds=config['TTL_SECONDS'],
+                    shared_cache_alias=config['SHARED_CACHE_ALIAS'],
+                )
+    return _conversation_state
+
+
+@receiver(post_save, sender=Message)
+def _message_saved(sender, instance, created, **kwargs):
+    state = get_conversation_state()
+    if state is None:
+        return
+    if created:
+        transaction.on_commit(lambda: state.append(instance), using=instance._state.db)
+    else:
+        state.invalidate(instance.session_id, using=instance._state.db)
+
+
+@receiver(post_delete, sender=Message)
+def _message_deleted(sender, instance, **kwargs):
+    state = get_conversation_state()
+    if state is not None:
+        state.invalidate(instance.session_id)
+
+
+@receiver(post_delete, sender=ConversationSession)
+def _session_deleted(sender, instance, **kwargs):
+    state = get_conversation_state()
+    if state is not None:
+        state.invalidate(instance.pk)
@@ -11,7 +11,7 @@ It includes functions to:
 import os
 import json
 import datetime
-from django.db.models import Avg, Count, Q, FloatField, Case, When, F, ExpressionWrapper
+from django.db.models import Avg, Count, Q, FloatField, Case, When, F, ExpressionWrapper, Prefetch
 from django.utils import timezone
 from django.db.models.functions import TruncDate, TruncWeek, TruncMonth
 import pandas as pd
@@ -19,6 +19,98 @@ import numpy as np
 from collections import Counter
 
 from .models import Feedback, ExpertReview, UserContext, AnalyticsMetric, ConversationSession, Message
+from .archive import rehydrate_active_between
+from .sharding import fan_out
+from .replicas import read_db, replica_reads
+
+
+def created_between(from_date, to_date, field='created_at'):
+    """
+    Filter for rows created on the days from_date..to_date (inclusive)
+
+    A half-open datetime range rather than created_at__date lookups, which wrap
+    the column in a date cast and so cannot use its index.
+
+    Returns:
+        dict: Keyword arguments for QuerySet.filter()
+    """
+    if isinstance(from_date, str):
+        from_date = datetime.date.fromisoformat(from_date)
+    if isinstance(to_date, str):
+        to_date = datetime.date.fromisoformat(to_date)
+    start = timezone.make_aware(datetime.datetime.combine(from_date, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(to_date + datetime.timedelta(days=1), datetime.time.min))
+    return {f'{field}__gte': start, f'{field}__lt': end}
+
+
+def upsert_daily_metrics(values):
+    """
+    Save daily metric values in one statement, replacing existing values
+
+    Args:
+        values (list): (metric_type, date, value) or (metric_type, date, value, text_value) tuples
+
+    Returns:
+        list: The saved AnalyticsMetric instances
+    """
+    metrics = [
+        AnalyticsMetric(metric_type=item[0], date=item[1], value=item[2],
+                        text_value=item[3] if len(item) > 3 else None)
+        for item in values
+    ]
+    if not metrics:
+        return []
+    return AnalyticsMetric.objects.bulk_create(
+        metrics,
+        update_conflicts=True,
+        unique_fields=['metric_type', 'date'],
+        update_fields=['value', 'text_value'],
+    )
+
+
+# Per-group stats that are counts rather than averages
+SUMMED_STATS = {'count', 'cultural_appropriate'}
+
+
+def merge_weighted(parts, field, weight='count'):
+    """Average of a field over per-shard results, weighted by their counts"""
+    if len(parts) == 1:
+        return parts[0][field]
+    total = sum(part[weight] for part in parts)
+    if not total:
+        return 0
+    return sum((part[field] or 0) * part[weight] for part in parts) / total
+
+
+def merge_grouped_stats(groups):
+    """
+    Merge per-shard {key: stats} results (time series periods, languages)
+
+    Counts (SUMMED_STATS) are summed, everything else is an average weighted
+    by count.
+
+    Args:
+        groups (list): Dicts of key -> {'count': ..., 'avg_rating': ..., ...}
+
+    Returns:
+        dict: Merged stats, ordered by key
+    """
+    groups = [group for group in groups if group]
+    if len(groups) <= 1:
+        return groups[0] if groups else {}
+    by_key = {}
+    for group in groups:
+        for key, stats in group.items():
+            by_key.setdefault(key, []).append(stats)
+    merged = {}
+    for key in sorted(by_key):
+        parts = by_key[key]
+        merged[key] = {
+            name: sum(part[name] for part in parts) if name in SUMMED_STATS else merge_weighted(parts, name)
+            for name in parts[0]
+        }
+    return merged
+
 
 class DataPipeline:
     """
@@ -56,36 +148,65 @@ class DataPipeline:
             'by_language': {},
         }
         
+        # Each shard computes its part (on its replica), merged weighted by feedback count
+        with replica_reads():
+            parts = [part for part in fan_out(lambda alias: self._extract_shard_metrics(alias, from_date, to_date))
+                     if part['total_feedback']]
+        if not parts:
+            return metrics
+        total = sum(part['total_feedback'] for part in parts)
+        metrics['total_feedback'] = total
+        metrics['avg_rating'] = merge_weighted(parts, 'avg_rating', 'total_feedback')
+        metrics['cultural_score'] = merge_weighted(parts, 'cultural_score', 'total_feedback')
+        
+        # Extract common issues from comments using simple keyword extraction
+        common_issues = self._extract_common_issues(comment for part in parts for comment in part['comments'])
+        metrics['common_issues'] = common_issues[:5]  # Top 5 issues
+        
+        metrics['time_series'] = {
+            period: merge_grouped_stats([part['time_series'][period] for part in parts])
+            for period in ('daily', 'weekly', 'monthly')
+        }
+        metrics['by_language'] = merge_grouped_stats([part['by_language'] for part in parts])
+        return metrics
+    
+    def _extract_shard_metrics(self, alias, from_date, to_date):
+        """
+        Metrics of the feedback on one shard
+
+        Returns:
+            dict: As extract_metrics(), with the raw comments instead of common issues
+        """
+        metrics = {'total_feedback': 0, 'comments': [], 'time_series': {}, 'by_language': {}}
+        alias = read_db(alias)
+        
         # Get feedback data in date range
-        feedback_data = Feedback.objects.filter(
-            created_at__date__gte=from_date,
-            created_at__date__lte=to_date
-        )
+        feedback_data = Feedback.objects.using(alias).filter(**created_between(from_date, to_date))
         
-        if not feedback_data.exists():
-            return metrics
-            
         # Calculate basic metrics
-        metrics['total_feedback'] = feedback_data.count()
-        avg_rating = feedback_data.aggregate(avg=Avg('rating'))
-        metrics['avg_rating'] = avg_rating['avg'] or 0
+        totals = feedback_data.aggregate(
+            count=Count('id'),
+            avg=Avg('rating'),
+            cultural_count=Count('id', filter=Q(culturally_appropriate=True)),
+        )
+        if not totals['count']:
+            return metrics
+        metrics['total_feedback'] = totals['count']
+        metrics['avg_rating'] = totals['avg'] or 0
         
         # Cultural appropriateness score
-        cultural_count = feedback_data.filter(culturally_appropriate=True).count()
-        if metrics['total_feedback'] > 0:
-            metrics['cultural_score'] = (cultural_count / metrics['total_feedback']) * 100
+        metrics['cultural_score'] = (totals['cultural_count'] / metrics['total_feedback']) * 100
             
-        # Extract common issues from comments using simple keyword extraction
-        comments = feedback_data.exclude(comment='').values_list('comment', flat=True)
-        common_issues = self._extract_common_issues(comments)
-        metrics['common_issues'] = common_issues[:5]  # Top 5 issues
+        metrics['comments'] = list(feedback_data.exclude(comment='').values_list('comment', flat=True))
         
         # Generate time series data
         metrics['time_series'] = self._generate_time_series(feedback_data)
         
         # Group by language if UserContext is available
-        user_contexts = UserContext.objects.filter(session__in=feedback_data.values_list('session', flat=True))
-        if user_contexts.exists():
+        user_contexts = list(UserContext.objects.using(alias)
+                                                .filter(session__in=feedback_data.values_list('session', flat=True))
+                                                .only('session_id', 'language'))
+        if user_contexts:
             metrics['by_language'] = self._group_by_language(feedback_data, user_contexts)
             
         return metrics
@@ -258,11 +379,53 @@ class DataPipeline:
         if not to_date:
             to_date = timezone.now().date()
             
-        # Filter feedback based on criteria
-        feedback_query = Feedback.objects.filter(
-            created_at__date__gte=from_date,
-            created_at__date__lte=to_date
-        )
+        # Archived conversations with feedback in the period are restored first
+        period = created_between(from_date, to_date)
+        restored = rehydrate_active_between(period['created_at__gte'], period['created_at__lt'], with_feedback=True)
+
+        # Each shard's samples are collected in parallel, from its replica unless
+        # sessions were just restored to the primary
+        with replica_reads(enabled=not restored):
+            training_samples = [
+                sample
+                for samples in fan_out(lambda alias: self._training_samples(alias, period, min_rating))
+                for sample in samples
+            ]
+            
+        # Export to file if requested
+        if export and training_samples:
+            timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
+            filename = f'training_data_{timestamp}.json'
+            filepath = os.path.join(self.data_dir, filename)
+            
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(training_samples, f, indent=2)
+                
+        # Return statistics
+        return {
+            'total_samples': len(training_samples),
+            'with_expert_reviews': sum(1 for sample in training_samples if sample['expert_reviews']),
+            'with_user_context': sum(1 for sample in training_samples if sample['user_context']),
+            'by_rating': Counter(sample['feedback']['rating'] for sample in training_samples),
+            'export_path': filepath if export and training_samples else None,
+        }
+    
+    def _training_samples(self, alias, period, min_rating):
+        """
+        Training samples from the feedback on one shard
+
+        Returns:
+            list: Samples (see prepare_training_data)
+        """
+        alias = read_db(alias)
+        # Filter feedback based on criteria; conversations, contexts and reviews are
+        # loaded with a fixed number of queries rather than per feedback
+        feedback_query = Feedback.objects.using(alias).filter(**period) \
+                                         .select_related('session__medical_context') \
+                                         .prefetch_related(
+                                             Prefetch('session__messages', queryset=Message.objects.using(alias).order_by('timestamp')),
+                                             'expert_reviews',
+                                         )
         
         if min_rating is not None:
             feedback_query = feedback_query.filter(rating__gte=min_rating)
@@ -272,9 +435,9 @@ class DataPipeline:
         
         for feedback in feedback_query:
             # Get the conversation
-            messages = Message.objects.filter(session=feedback.session).order_by('timestamp')
+            messages = feedback.session.messages.all()
             
-            if not messages.exists():
+            if not messages:
                 continue
                 
             # Extract the conversation history
@@ -290,7 +453,7 @@ class DataPipeline:
             # Get user context if available
             context_data = {}
             try:
-                user_context = UserContext.objects.get(session=feedback.session)
+                user_context = feedback.session.medical_context
                 context_data = {
                     'symptoms': user_context.symptoms,
                     'symptom_durations': user_context.symptom_durations,
@@ -304,7 +467,7 @@ class DataPipeline:
                 
             # Get expert reviews if available
             expert_reviews = []
-            for review in ExpertReview.objects.filter(feedback=feedback):
+            for review in feedback.expert_reviews.all():
                 expert_reviews.append({
                     'reviewer_name': review.reviewer_name,
                     'medical_accuracy': review.medical_accuracy,
@@ -328,23 +491,7 @@ class DataPipeline:
             
             training_samples.append(sample)
             
-        # Export to file if requested
-        if export and training_samples:
-            timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-            filename = f'training_data_{timestamp}.json'
-            filepath = os.path.join(self.data_dir, filename)
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(training_samples, f, indent=2)
-                
-        # Return statistics
-        return {
-            'total_samples': len(training_samples),
-            'with_expert_reviews': sum(1 for sample in training_samples if sample['expert_reviews']),
-            'with_user_context': sum(1 for sample in training_samples if sample['user_context']),
-            'by_rating': Counter(sample['feedback']['rating'] for sample in training_samples),
-            'export_path': filepath if export and training_samples else None,
-        }
+        return training_samples
     
     def update_analytics_metrics(self, from_date=None, to_date=None):
         """
@@ -371,70 +518,34 @@ class DataPipeline:
         # Extract metrics
         metrics = self.extract_metrics(from_date, to_date)
         
-        # Update or create analytics metrics
-        updated_count = 0
-        created_count = 0
+        # Collect the daily values, then save them with a single upsert
+        values = []
         
         # Process time series data
         if 'time_series' in metrics and 'daily' in metrics['time_series']:
             for date_str, daily_data in metrics['time_series']['daily'].items():
                 date = datetime.date.fromisoformat(date_str)
-                
-                # Average rating
-                metric, created = AnalyticsMetric.objects.update_or_create(
-                    metric_type='avg_rating',
-                    date=date,
-                    defaults={'value': daily_data['avg_rating']}
-                )
-                
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
-                    
-                # Cultural score
+                values.append(('avg_rating', date, daily_data['avg_rating']))
                 if 'cultural_score' in daily_data:
-                    metric, created = AnalyticsMetric.objects.update_or_create(
-                        metric_type='cultural_score',
-                        date=date,
-                        defaults={'value': daily_data['cultural_score']}
-                    )
-                    
-                    if created:
-                        created_count += 1
-                    else:
-                        updated_count += 1
-                        
-                # Feedback count
-                metric, created = AnalyticsMetric.objects.update_or_create(
-                    metric_type='feedback_count',
-                    date=date,
-                    defaults={'value': daily_data['count']}
-                )
-                
-                if created:
-                    created_count += 1
-                else:
-                    updated_count += 1
+                    values.append(('cultural_score', date, daily_data['cultural_score']))
+                values.append(('feedback_count', date, daily_data['count']))
                     
         # Common issues - store as a single metric with the latest date
         if metrics['common_issues']:
             # Convert to format for storage
             issues_text = '; '.join(f"{issue}: {count}" for issue, count in metrics['common_issues'])
-            
-            metric, created = AnalyticsMetric.objects.update_or_create(
-                metric_type='common_issue',
-                date=to_date,
-                defaults={
-                    'value': len(metrics['common_issues']),
-                    'text_value': issues_text
-                }
+            values.append(('common_issue', to_date, len(metrics['common_issues']), issues_text))
+        
+        existing = set()
+        if values:
+            existing = set(
+                AnalyticsMetric.objects.filter(date__in={item[1] for item in values},
+                                               metric_type__in={item[0] for item in values})
+                                       .values_list('metric_type', 'date')
             )
-            
-            if created:
-                created_count += 1
-            else:
-                updated_count += 1
+        upsert_daily_metrics(values)
+        updated_count = sum(1 for item in values if (item[0], item[1]) in existing)
+        created_count = len(values) - updated_count
                 
         return {
             'metrics_created': created_count,
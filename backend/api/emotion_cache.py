@@ -0,0 +1,231 @@
+"""
+Emotion Result Cache
+
+Bounded LRU/TTL cache placed in front of the emotion classifier. Patients
+often repeat near-identical short messages ("I still have headache"), so
+results are keyed by the normalized text and the model version and reused
+instead of running another forward pass.
+
+An optional second tier stores entries in a Django cache backend so that
+results are shared across worker processes.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 4096,
+    'MAX_BYTES': 2 * 1024 * 1024,  # 2 MB of keys and results
+    'TTL_SECONDS': 60 * 60,
+    'MAX_TEXT_LENGTH': 280,  # Only short messages are worth caching
+    'SHARED_CACHE_ALIAS': None,  # e.g. 'default' to share across workers
+}
+
+# Fixed per-entry overhead (OrderedDict node, tuple, floats) used in size accounting
+ENTRY_OVERHEAD_BYTES = 120
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s']+", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Fold case, punctuation and whitespace so trivially different messages share a key"""
+    text = _PUNCTUATION_RE.sub(' ', text.lower())
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class EmotionCache:
+    """
+    Thread-safe LRU cache with TTL expiry and a byte budget
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=2 * 1024 * 1024, ttl_seconds=3600,
+                 max_text_length=280, shared_cache_alias=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_text_length = max_text_length
+        self.shared_cache_alias = shared_cache_alias
+
+        self._entries = OrderedDict()  # key -> (result, size, expires_at)
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, text, model_version):
+        """Build the cache key for a message, or None if it should not be cached"""
+        normalized = normalize_text(text)
+        if not normalized or len(normalized) > self.max_text_length:
+            return None
+        return f"{model_version}:{normalized}"
+
+    def get(self, text, model_version):
+        """Return a cached result for the message or None"""
+        key = self.make_key(text, model_version)
+        if key is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, size, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.incr('emotion_cache.hit')
+                    return dict(result)
+                self._remove(key)
+
+        result = self._shared_get(key)
+        if result is not None:
+            self._store(key, result)
+            with self._lock:
+                self.shared_hits += 1
+            metrics.incr('emotion_cache.shared_hit')
+            return dict(result)
+
+        with self._lock:
+            self.misses += 1
+        metrics.incr('emotion_cache.miss')
+        return None
+
+    def set(self, text, model_version, result):
+        """Store the classifier result for a message"""
+        key = self.make_key(text, model_version)
+        if key is None:
+            return
+        self._store(key, result)
+        self._shared_set(key, result)
+
+    def clear(self):
+        """Drop all local entries and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Get hit-rate and size statistics"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._size_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': ((self.hits + self.shared_hits) / lookups) if lookups else 0.0,
+            }
+
+    def _store(self, key, result):
+        size = _entry_size(key, result)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (dict(result), size, time.monotonic() + self.ttl_seconds)
+            self._size_bytes += size
+
+            # Evict least recently used entries until both budgets are met
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self._size_bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+                metrics.incr('emotion_cache.eviction')
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size_bytes -= size
+
+    def _shared_backend(self):
+        if not self.shared_cache_alias:
+            return None
+        try:
+            from django.core.cache import caches
+            return caches[self.shared_cache_alias]
+        except Exception as e:
+            logger.warning(f"Shared emotion cache '{self.shared_cache_alias}' unavailable: {str(e)}")
+            return None
+
+    def _shared_key(self, key):
+        # Hash the key so it is safe for memcached-style backends
+        return 'emotion:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _shared_get(self, key):
+        backend = self._shared_backend()
+        if backend is None:
+            return None
+        try:
+            return backend.get(self._shared_key(key))
+        except Exception as e:
+            logger.warning(f"Error reading shared emotion cache: {str(e)}")
+            return None
+
+    def _shared_set(self, key, result):
+        backend = self._shared_backend()
+        if backend is None:
+            return
+        try:
+            backend.set(self._shared_key(key), dict(result), timeout=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Error writing shared emotion cache: {str(e)}")
+
+
+def _entry_size(key, result):
+    """Approximate memory footprint of a cache entry in bytes"""
+    return len(key.encode('utf-8')) + len(json.dumps(result)) + ENTRY_OVERHEAD_BYTES
+
+
+_emotion_cache = None
+_emotion_cache_lock = threading.Lock()
+
+
+def get_cache_settings():
+    """Get emotion cache settings merged over the defaults"""
+    config = dict(DEFAULT_SETTINGS)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'EMOTION_CACHE', {}))
+    except Exception:
+        # Django not configured (e.g. standalone scripts); use defaults
+        pass
+    return config
+
+
+def get_emotion_cache():
+    """Get or initialize the process-wide emotion cache (None when disabled)"""
+    global _emotion_cache
+    if _emotion_cache is None:
+        with _emotion_cache_lock:
+            if _emotion_cache is None:
+                config = get_cache_settings()
+                if not config['ENABLED']:
+                    return None
+                _emotion_cache = EmotionCache(
+                    max_entries=config['MAX_ENTRIES'],
+                    max_bytes=config['MAX_BYTES'],
+                    ttl_seconds=config['TTL_SECONDS'],
+                    max_text_length=config['MAX_TEXT_LENGTH'],
+                    shared_cache_alias=config['SHARED_CACHE_ALIAS'],
+                )
+    return _emotion_cache
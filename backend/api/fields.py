@@ -0,0 +1,35 @@
+"""
+Model fields
+"""
+
+from django.db import models
+
+from .compression import get_codec
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text stored zstd-compressed in a binary column (see api/compression.py)
+
+    Reads and writes plain str like a TextField. Values are compressed on save
+    and decompressed when rows are loaded; querysets that do not need the text
+    can defer() it to skip the transfer and decompression. Stored bytes depend
+    on the dictionary in use, so only isnull lookups are meaningful.
+    """
+    description = "Compressed text"
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(get_codec().compress(value))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            # str: a row written before the column was compressed
+            return value
+        return get_codec().decompress(value)
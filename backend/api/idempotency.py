@@ -0,0 +1,220 @@
+"""
+Idempotent Chat Requests
+
+Mobile clients retry POST /api/chat/ when a request times out. A request sent
+with an Idempotency-Key header (or an `idempotency_key` field) is executed at
+most once per session:
+
+1. A completed key returns the stored reply without calling the LLM again
+   (deduplicated)
+2. A duplicate that arrives while the first request is still running in this
+   process waits on the same future instead of issuing a second LLM call
+   (coalesced), unless it carries a different message (422, as for a
+   stored reply)
+3. A duplicate of a request still running in another worker process gets a
+   409 with Retry-After, since there is no future to wait on there
+
+Only successful responses are stored, so a retry after an error runs again.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .models import ChatIdempotencyRecord
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'TTL_SECONDS': 24 * 60 * 60,  # How long a completed reply is replayed
+    'WAIT_TIMEOUT_SECONDS': 90,  # How long a coalesced duplicate waits for the original
+    'PENDING_TIMEOUT_SECONDS': 120,  # After this a pending record is assumed abandoned
+    'PRUNE_INTERVAL_SECONDS': 60 * 60,
+}
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyError(Exception):
+    """A request that cannot be executed under its idempotency key"""
+
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def get_idempotency_key(request):
+    """Read the client's idempotency key from the header or request body"""
+    key = request.headers.get(IDEMPOTENCY_HEADER) or request.data.get('idempotency_key')
+    if not key:
+        return None
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"Idempotency key must be 1-{MAX_KEY_LENGTH} characters", 400)
+    return key
+
+
+def _sha256(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class IdempotentExecutor:
+    """
+    Runs a handler at most once per idempotency key
+    """
+
+    def __init__(self, ttl_seconds=24 * 60 * 60, wait_timeout=90, pending_timeout=120, prune_interval=60 * 60):
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self.pending_timeout = pending_timeout
+        self.prune_interval = prune_interval
+        self._in_flight = {}  # scoped key -> (request hash, Future of (status_code, data, replayed))
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def execute(self, session_id, key, message, handler):
+        """
+        Run handler() for a keyed request, or replay/join an earlier run
+
+        Args:
+            session_id: Client session id the key is scoped to
+            key (str): Client idempotency key
+            message (str): Chat message, used to reject a key reused for a different request
+            handler (callable): Returns (status_code, data) for a fresh request
+
+        Returns:
+            tuple: (status_code, data, replayed)
+        """
+        metrics.incr('chat.idempotency.requests')
+        scoped_key = _sha256(f"{session_id}:{key}")
+        request_hash = _sha256(message)
+
+        with self._lock:
+            in_flight = self._in_flight.get(scoped_key)
+            owner = in_flight is None
+            if owner:
+                future = Future()
+                self._in_flight[scoped_key] = (request_hash, future)
+            else:
+                in_flight_hash, future = in_flight
+
+        if not owner:
+            if in_flight_hash != request_hash:
+                metrics.incr('chat.idempotency.conflict')
+                raise IdempotencyError("Idempotency key was already used for a different message", 422)
+            metrics.incr('chat.idempotency.coalesced')
+            logger.info(f"Coalescing duplicate chat request {scoped_key[:12]} with the in-flight original")
+            try:
+                status_code, data, _ = future.result(timeout=self.wait_timeout)
+            except FutureTimeoutError:
+                raise IdempotencyError("The original request is still being processed", 409, retry_after=5)
+            return status_code, data, True
+
+        try:
+            result = self._execute_once(scoped_key, request_hash, handler)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(scoped_key, None)
+
+    def _execute_once(self, scoped_key, request_hash, handler):
+        """Replay a stored reply or claim the key in the database and run the handler"""
+        self.prune_expired()
+        now = timezone.now()
+        record = ChatIdempotencyRecord.objects.filter(key=scoped_key).first()
+
+        if record is not None and record.created_at < now - timedelta(seconds=self.ttl_seconds):
+            record.delete()
+            record = None
+
+        if record is not None:
+            if record.request_hash != request_hash:
+                metrics.incr('chat.idempotency.conflict')
+                raise IdempotencyError("Idempotency key was already used for a different message", 422)
+            if record.status == 'completed':
+                metrics.incr('chat.idempotency.deduplicated')
+                logger.info(f"Replaying stored reply for idempotency key {scoped_key[:12]}")
+                return record.response_status, record.response_data, True
+            if record.updated_at > now - timedelta(seconds=self.pending_timeout):
+                # Running in another worker process; nothing to wait on here
+                metrics.incr('chat.idempotency.in_progress')
+                raise IdempotencyError("The original request is still being processed", 409, retry_after=5)
+            # Abandoned by a worker that died mid-request: take it over, unless another worker just did
+            taken_over = ChatIdempotencyRecord.objects.filter(
+                pk=record.pk, status='pending', updated_at=record.updated_at,
+            ).update(updated_at=now)
+            if not taken_over:
+                metrics.incr('chat.idempotency.in_progress')
+                raise IdempotencyError("The original request is still being processed", 409, retry_after=5)
+            record.updated_at = now
+        else:
+            try:
+                record = ChatIdempotencyRecord.objects.create(key=scoped_key, request_hash=request_hash)
+            except IntegrityError:
+                # Another process claimed the key between the lookup and the insert
+                metrics.incr('chat.idempotency.in_progress')
+                raise IdempotencyError("The original request is still being processed", 409, retry_after=5)
+
+        try:
+            status_code, data = handler()
+        except Exception:
+            record.delete()
+            raise
+
+        if 200 <= status_code < 300:
+            record.status = 'completed'
+            record.response_status = status_code
+            record.response_data = data
+            record.save(update_fields=['status', 'response_status', 'response_data', 'updated_at'])
+        else:
+            # Let the client retry failed requests
+            record.delete()
+        return status_code, data, False
+
+    def prune_expired(self):
+        """Delete expired records, at most once per prune interval"""
+        if time.monotonic() - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = time.monotonic()
+        cutoff = timezone.now() - timedelta(seconds=self.ttl_seconds)
+        deleted, _ = ChatIdempotencyRecord.objects.filter(created_at__lt=cutoff).delete()
+        if deleted:
+            logger.info(f"Pruned {deleted} expired chat idempotency records")
+
+
+_idempotent_executor = None
+_idempotent_executor_lock = threading.Lock()
+
+
+def get_idempotent_executor():
+    """Get or initialize the process-wide idempotent executor (None when disabled)"""
+    global _idempotent_executor
+    if _idempotent_executor is None:
+        config = dict(DEFAULT_SETTINGS)
+        from django.conf import settings
+        config.update(getattr(settings, 'CHAT_IDEMPOTENCY', {}))
+        if not config['ENABLED']:
+            return None
+        with _idempotent_executor_lock:
+            if _idempotent_executor is None:
+                _idempotent_executor = IdempotentExecutor(
+                    ttl_seconds=config['TTL_SECONDS'],
+                    wait_timeout=config['WAIT_TIMEOUT_SECONDS'],
+                    pending_timeout=config['PENDING_TIMEOUT_SECONDS'],
+                    prune_interval=config['PRUNE_INTERVAL_SECONDS'],
+                )
+    return _idempotent_executor
@@ -0,0 +1,238 @@
+"""
+Language Identification
+
+Fast word-boundary language identifier for patient messages. It combines a
+token trie of marker words and phrases with a small character trigram scorer
+and returns one of en / en-pidgin / yo / ig / ha with a confidence.
+
+Detection runs once per session: the result is stored on
+UserContext.language and reused on later turns until a message is detected
+with higher confidence.
+"""
+
+import math
+import re
+from collections import Counter
+
+SUPPORTED_LANGUAGES = ('en', 'en-pidgin', 'yo', 'ig', 'ha')
+
+LANGUAGE_NAMES = {
+    'en': 'English',
+    'en-pidgin': 'Nigerian Pidgin',
+    'yo': 'Yoruba',
+    'ig': 'Igbo',
+    'ha': 'Hausa',
+}
+
+# Once a session's language is known with this confidence it is no longer re-detected
+SESSION_LOCK_CONFIDENCE = 0.8
+
+# Marker words and phrases with their weight. Words shared with English
+# (e.g. "go", "fit") are left out so ordinary English is not misread.
+LANGUAGE_MARKERS = {
+    'en-pidgin': {
+        'dey': 2.0, 'abeg': 3.0, 'wahala': 3.0, 'wetin': 3.0, 'weytin': 3.0, 'belle': 2.5,
+        'bele': 2.5, 'comot': 3.0, 'sabi': 3.0, 'oya': 2.0, 'na': 1.0, 'una': 1.5, 'shey': 2.0,
+        'abi': 1.5, 'chop': 1.0, 'palava': 3.0, 'waka': 2.0, 'aswear': 3.0, 'jare': 2.0,
+        'pikin': 3.0, 'wan': 1.0, 'don': 0.5, 'sharp sharp': 2.0, 'small small': 2.0,
+        'small-small': 2.0, 'no vex': 3.0, 'how far': 1.5, 'e don tey': 3.0, 'e go beta': 3.0,
+        'na true': 2.0, 'pain me': 2.0, 'i dey': 2.5, 'you dey': 2.5, 'e dey': 2.5,
+        'no be small': 3.0, 'as e be so': 3.0, 'e be like say': 3.0, 'i no sabi': 3.0,
+        'e no easy': 3.0, 'na wa': 3.0, 'no shaking': 2.0, 'body dey hot': 3.0,
+        'dey purge': 3.0, 'make i': 2.0, 'no fit': 2.0, 'e reach': 1.5, 'mad o': 2.0,
+    },
+    'yo': {
+        'bawo': 3.0, 'jowo': 3.0, 'ẹ jọ': 3.0, 'mo': 1.0, 'ni': 0.5, 'mi': 0.5, 'ara': 1.0,
+        'ń': 2.0, 'dun': 1.5, 'orí': 2.5, 'ori': 1.0, 'inu': 1.5, 'ikun': 2.5, 'ibà': 3.0,
+        'iba': 1.5, 'kaaro': 3.0, 'kaasan': 3.0, 'kaale': 3.0, 'ẹ': 1.5, 'ọ': 1.0, 'ṣe': 2.0,
+        'se': 0.5, 'oogun': 3.0, 'dokita': 2.0, 'o ṣeun': 3.0, 'e se': 2.0, 'ko': 0.5,
+        'ara mi': 3.0, 'ori mi': 3.0, 'inu mi': 3.0, 'n dun mi': 3.0, 'ń dun mi': 3.0,
+    },
+    'ig': {
+        'kedu': 3.0, 'biko': 2.0, 'daalu': 3.0, 'ahụ': 3.0, 'ahu': 1.0, 'isi': 1.0,
+        'afọ': 3.0, 'afo': 1.0, 'nne': 1.5, 'nna': 1.5, 'ọ': 1.0, 'ụ': 1.5, 'ị': 1.5,
+        'na-': 1.0, 'm': 0.3, 'ọrịa': 3.0, 'oria': 2.0, 'ọgwụ': 3.0, 'ogwu': 2.5,
+        'dọkịta': 3.0, 'mgbu': 3.0, 'na-egbu': 3.0, 'isi m': 3.0, 'ahụ m': 3.0, 'afọ m': 3.0,
+        'ka chi': 2.0, 'ọ na-egbu m': 3.0,
+    },
+    'ha': {
+        'sannu': 3.0, 'ina': 1.0, 'kwana': 2.0, 'yaya': 2.0, 'na gode': 3.0, 'don allah': 3.0,
+        'ciwon': 3.0, 'ciwo': 3.0, 'kai': 1.0, 'kaina': 3.0, 'zazzabi': 3.0, 'zazzaɓi': 3.0,
+        'ciki': 1.5, 'cikina': 3.0, 'magani': 2.5, 'likita': 3.0, 'ba': 0.5, 'da': 0.3,
+        'ɗ': 2.0, 'ƙ': 2.0, 'ɓ': 2.0, 'jiki': 2.0, 'jikina': 3.0, 'yana': 1.5, 'ina jin': 3.0,
+    },
+    'en': {
+        'the': 1.0, 'and': 1.0, 'have': 1.0, 'has': 0.5, 'is': 0.5, 'my': 0.5, 'i': 0.3,
+        'been': 1.0, 'feel': 0.5, 'feeling': 1.0, 'since': 1.0, 'what': 0.5, 'should': 1.0,
+        'would': 1.0, 'with': 0.5, 'this': 0.5, 'that': 0.5, 'because': 1.0, 'doctor': 0.3,
+        "i'm": 1.0, "it's": 1.0, 'very': 0.5, 'really': 0.5, 'headache': 0.3, 'pain': 0.2,
+    },
+}
+
+# Seed text for the character trigram profiles; kept small so profiles build at import
+NGRAM_SEED_TEXT = {
+    'en': (
+        "i have been feeling sick since yesterday and my head hurts. what should i do about "
+        "this pain in my stomach? the fever is getting worse and i am very tired"
+    ),
+    'en-pidgin': (
+        "abeg my belle dey pain me well well. wetin i go do? the fever dey worry me since "
+        "yesterday, body dey hot and i dey feel weak. na wa o, e no easy"
+    ),
+    'yo': (
+        "ẹ kaaro dokita, ori mi n dun mi gan an. inu mi n dun, ara mi ko ya. mo ni iba lati "
+        "ana, jowo kini mo le ṣe? oogun wo ni mo le lo"
+    ),
+    'ig': (
+        "kedu dọkịta, isi m na-egbu m mgbu. afọ m na-egbu m, ahụ m adịghị mma. enwere m ọrịa "
+        "kemgbe ụnyahụ, biko kedu ọgwụ m ga-aṅụ"
+    ),
+    'ha': (
+        "sannu likita, ina jin ciwon kai sosai. cikina yana ciwo, jikina ba lafiya. ina da "
+        "zazzabi tun jiya, don allah wane magani zan sha"
+    ),
+}
+
+# Relative weight of the n-gram score against the marker score
+NGRAM_WEIGHT = 0.5
+
+# Prior in favour of English, the default language of the assistant
+ENGLISH_PRIOR = 1.0
+
+_TOKEN_RE = re.compile(r"[\w'\-]+", re.UNICODE)
+_TRIE_END = '$'
+
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _build_trie():
+    """Build a token trie mapping word sequences to (language, weight) entries"""
+    trie = {}
+    for language, markers in LANGUAGE_MARKERS.items():
+        for phrase, weight in markers.items():
+            node = trie
+            for token in phrase.split():
+                node = node.setdefault(token, {})
+            node.setdefault(_TRIE_END, []).append((language, weight))
+    return trie
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _build_ngram_profiles():
+    """Build add-one smoothed log-probability tables from the seed text"""
+    profiles = {}
+    for language, seed in NGRAM_SEED_TEXT.items():
+        counts = Counter(_trigrams(' '.join(_tokenize(seed))))
+        total = sum(counts.values())
+        vocab_size = len(counts) + 1
+        profiles[language] = (
+            {gram: math.log((count + 1) / (total + vocab_size)) for gram, count in counts.items()},
+            math.log(1 / (total + vocab_size)),
+        )
+    return profiles
+
+
+_MARKER_TRIE = _build_trie()
+_NGRAM_PROFILES = _build_ngram_profiles()
+
+
+def _marker_scores(tokens):
+    """Sum marker weights of every (longest) phrase found in the token stream"""
+    scores = dict.fromkeys(SUPPORTED_LANGUAGES, 0.0)
+    i = 0
+    while i < len(tokens):
+        node = _MARKER_TRIE
+        matched = None
+        matched_end = i
+        j = i
+        while j < len(tokens) and tokens[j] in node:
+            node = node[tokens[j]]
+            j += 1
+            if _TRIE_END in node:
+                matched = node[_TRIE_END]
+                matched_end = j
+        if matched:
+            for language, weight in matched:
+                scores[language] += weight
+            i = matched_end
+        else:
+            i += 1
+    return scores
+
+
+def _ngram_scores(tokens):
+    """Average per-trigram log-likelihood, rescaled so the best language scores highest"""
+    grams = _trigrams(' '.join(tokens))
+    if not grams:
+        return dict.fromkeys(SUPPORTED_LANGUAGES, 0.0)
+    raw = {}
+    for language, (table, unseen) in _NGRAM_PROFILES.items():
+        raw[language] = sum(table.get(gram, unseen) for gram in grams) / len(grams)
+    floor = min(raw.values())
+    return {language: value - floor for language, value in raw.items()}
+
+
+def detect_language(text):
+    """
+    Identify the language of a message
+
+    Args:
+        text (str): Message text
+
+    Returns:
+        tuple: (language code, confidence between 0 and 1)
+    """
+    tokens = _tokenize(text)
+    if not tokens:
+        return 'en', 0.0
+
+    markers = _marker_scores(tokens)
+    ngrams = _ngram_scores(tokens)
+    scores = {
+        language: markers[language] + NGRAM_WEIGHT * ngrams[language]
+        for language in SUPPORTED_LANGUAGES
+    }
+    scores['en'] += ENGLISH_PRIOR
+
+    # Pidgin is written with mostly English words; English n-grams shouldn't outvote its markers
+    if markers['en-pidgin'] >= 2.0:
+        scores['en-pidgin'] += NGRAM_WEIGHT * ngrams['en']
+
+    # Softmax over the scores gives a confidence; short messages are capped lower
+    peak = max(scores.values())
+    exp_scores = {language: math.exp(score - peak) for language, score in scores.items()}
+    total = sum(exp_scores.values())
+    language = max(exp_scores, key=exp_scores.get)
+    confidence = exp_scores[language] / total
+    confidence *= min(1.0, 0.4 + 0.15 * len(tokens))
+
+    return language, round(confidence, 3)
+
+
+def resolve_session_language(user_context, text):
+    """
+    Get the language for a conversation turn, detecting it only when the session hasn't settled
+
+    Args:
+        user_context (UserContext): Context of the conversation session
+        text (str): The new user message
+
+    Returns:
+        str: Language code for this turn
+    """
+    if user_context.language_confidence >= SESSION_LOCK_CONFIDENCE:
+        return user_context.language
+
+    language, confidence = detect_language(text)
+    if confidence > user_context.language_confidence:
+        user_context.language = language
+        user_context.language_confidence = confidence
+        user_context.save(update_fields=['language', 'language_confidence', 'updated_at'])
+
+    return user_context.language
@@ -0,0 +1,365 @@
+"""
+LLM Invocation Layer
+
+Wraps chat-model calls with a per-endpoint latency deadline and request
+hedging for tail latency:
+
+1. The primary model is called first
+2. If it has not answered after the hedge delay (the observed p95 latency of
+   the primary for that endpoint, or a static default until enough samples
+   exist), or if it fails, a hedged request is sent to the fallback model
+3. The first successful response wins and the other request is cancelled
+4. If nothing succeeds before the deadline, LLMDeadlineExceeded is raised
+
+Streamed calls (astream) hedge and enforce the deadline on the first token.
+
+Every call records which path won and the latency of each path in the runtime
+metrics registry under llm.<endpoint>.*. A request cancelled because the other
+path won (or the deadline passed) records the time it had run as a censored
+latency sample: a lower bound, but without it the slow requests that lose to
+the hedge would be missing from the p95 that sets the hedge delay, pulling it
+down until every call is hedged.
+
+Models are created by the backend selected in settings.LLM_BACKEND:
+
+- 'openai': ChatOpenAI against the OpenAI API (or BASE_URL, for any
+  OpenAI-compatible server)
+- 'local_stub': ChatOpenAI against the local stub server started with
+  `python manage.py run_llm_stub` (see api/llm_stub.py)
+- a dotted path to a factory `(model, config, backend_config)` returning an
+  object with `async ainvoke(messages, config=None)` that returns an AIMessage
+
+A client builds each model once per event loop and reuses it, with its HTTP
+connection pool, for every later call (the async HTTP clients inside a model
+are bound to the loop they were first used on). Synchronous callers all run on
+one background event loop for the same reason.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from django.utils.module_loading import import_string
+from langchain_community.chat_models import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint defaults; override any key through settings.LLM_ENDPOINTS
+DEFAULT_ENDPOINTS = {
+    'chat': {
+        'MODEL': 'gpt-4o',
+        'HEDGE_MODEL': 'gpt-4o-mini',
+        'TEMPERATURE': 0.7,
+        'MODEL_KWARGS': {},
+        'DEADLINE_SECONDS': 25.0,
+        'HEDGE_AFTER_SECONDS': 6.0,  # Used until MIN_SAMPLES primary latencies are known
+    },
+    # Turns without clinical content (see model_router.py)
+    'chat_simple': {
+        'MODEL': 'gpt-4o-mini',
+        'HEDGE_MODEL': 'gpt-4o-mini',
+        'TEMPERATURE': 0.7,
+        'MODEL_KWARGS': {},
+        'DEADLINE_SECONDS': 15.0,
+        'HEDGE_AFTER_SECONDS': 3.0,
+    },
+    'urgent_elaboration': {
+        'MODEL': 'gpt-4o',
+        'HEDGE_MODEL': 'gpt-4o-mini',
+        'TEMPERATURE': 0.7,
+        'MODEL_KWARGS': {},
+        'DEADLINE_SECONDS': 30.0,
+        'HEDGE_AFTER_SECONDS': 8.0,
+    },
+    'summary': {
+        'MODEL': 'gpt-4o',
+        'HEDGE_MODEL': 'gpt-4o-mini',
+        'TEMPERATURE': 0.4,
+        'MODEL_KWARGS': {'top_p': 0.85},
+        'DEADLINE_SECONDS': 45.0,
+        'HEDGE_AFTER_SECONDS': 12.0,
+    },
+}
+
+# Shared by every endpoint unless overridden
+COMMON_DEFAULTS = {
+    'HEDGE_ENABLED': True,
+    'HEDGE_PERCENTILE': 95,
+    'MIN_SAMPLES': 20,  # Primary latencies needed before the percentile replaces HEDGE_AFTER_SECONDS
+    'MIN_HEDGE_AFTER_SECONDS': 1.0,
+    'MAX_RETRIES': 0,  # The hedge replaces client-side retries
+}
+
+
+DEFAULT_BACKEND_SETTINGS = {
+    'BACKEND': 'openai',
+    'BASE_URL': None,  # Defaults to the OpenAI API (or the stub's address for 'local_stub')
+    'API_KEY': None,  # Defaults to the OPENAI_API_KEY environment variable
+}
+
+LOCAL_STUB_DEFAULTS = {
+    'BASE_URL': 'http://127.0.0.1:8089/v1',
+    'API_KEY': 'stub',
+}
+
+
+class LLMDeadlineExceeded(Exception):
+    """No model answered before the endpoint's deadline"""
+
+
+class TokenUsageRecorder(BaseCallbackHandler):
+    """Captures the provider's token usage, which ChatOpenAI keeps out of the response message"""
+
+    def __init__(self):
+        self.token_usage = {}
+
+    def on_llm_end(self, response, **kwargs):
+        self.token_usage = (response.llm_output or {}).get('token_usage') or {}
+
+
+def get_endpoint_config(endpoint):
+    """Get the merged configuration of an LLM endpoint"""
+    from django.conf import settings
+    overrides = getattr(settings, 'LLM_ENDPOINTS', {})
+    config = dict(COMMON_DEFAULTS)
+    config.update(DEFAULT_ENDPOINTS.get(endpoint, DEFAULT_ENDPOINTS['chat']))
+    config.update(overrides.get(endpoint, {}))
+    return config
+
+
+def get_backend_settings():
+    """Get the LLM backend configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_BACKEND_SETTINGS)
+    config.update(getattr(settings, 'LLM_BACKEND', {}))
+    return config
+
+
+def build_openai_model(model, config, backend_config):
+    """ChatOpenAI for the OpenAI API or any OpenAI-compatible server"""
+    extra = {}
+    if backend_config.get('BASE_URL'):
+        extra['openai_api_base'] = backend_config['BASE_URL']
+    if backend_config.get('API_KEY'):
+        extra['openai_api_key'] = backend_config['API_KEY']
+    return ChatOpenAI(
+        model_name=model,
+        temperature=config['TEMPERATURE'],
+        model_kwargs=dict(config['MODEL_KWARGS']),
+        request_timeout=config['DEADLINE_SECONDS'],
+        max_retries=config['MAX_RETRIES'],
+        **extra,
+    )
+
+
+def build_local_stub_model(model, config, backend_config):
+    """ChatOpenAI pointed at the local stub server"""
+    stub_config = dict(LOCAL_STUB_DEFAULTS)
+    stub_config.update({key: value for key, value in backend_config.items() if value})
+    return build_openai_model(model, config, stub_config)
+
+
+LLM_BACKENDS = {
+    'openai': build_openai_model,
+    'local_stub': build_local_stub_model,
+}
+
+
+def get_backend_factory(backend_config=None):
+    """Resolve the model factory of the configured backend"""
+    backend_config = backend_config or get_backend_settings()
+    backend = backend_config['BACKEND']
+    factory = LLM_BACKENDS.get(backend) or import_string(backend)
+    return lambda model, config: factory(model, config, backend_config)
+
+
+def build_chat_model(model, config):
+    """Create the chat model used for a single attempt with the configured backend"""
+    return get_backend_factory()(model, config)
+
+
+class HedgedLLMClient:
+    """
+    Deadline-bound, hedged chat-model client for one endpoint
+    """
+
+    def __init__(self, endpoint, config=None, model_factory=build_chat_model):
+        self.endpoint = endpoint
+        self.config = config or get_endpoint_config(endpoint)
+        self.model_factory = model_factory
+        self._models = weakref.WeakKeyDictionary()  # event loop -> {model name: chat model}
+        self._models_lock = threading.Lock()
+
+    def metric(self, name):
+        return f"llm.{self.endpoint}.{name}"
+
+    def hedge_delay(self):
+        """Seconds to wait for the primary before sending the hedged request"""
+        config = self.config
+        delay = config['HEDGE_AFTER_SECONDS']
+        if metrics.sample_count(self.metric('primary')) >= config['MIN_SAMPLES']:
+            delay = metrics.percentile(self.metric('primary'), config['HEDGE_PERCENTILE'])
+        return min(max(delay, config['MIN_HEDGE_AFTER_SECONDS']), config['DEADLINE_SECONDS'])
+
+    def invoke(self, messages):
+        """Call the model from synchronous code and return its response message"""
+        return asyncio.run_coroutine_threadsafe(self.ainvoke(messages), get_background_loop()).result()
+
+    async def ainvoke(self, messages):
+        """Call the model, hedging after the hedge delay, and return the first response"""
+        return await self._race(self._attempt, messages, 'total')
+
+    async def astream(self, messages):
+        """
+        Stream the response as AIMessageChunks
+
+        Hedging and the deadline apply to the first token: the path that produces
+        it first keeps streaming and the other is cancelled. The first chunk's
+        response_metadata carries the model name and winning path.
+        """
+        iterator, chunk = await self._race(self._first_chunk, messages, 'first_token')
+        try:
+            yield chunk
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await iterator.aclose()
+
+    async def _race(self, attempt, messages, total_metric):
+        """Run attempt(path, model, messages), hedging when slow, and return the first success"""
+        config = self.config
+        start = time.perf_counter()
+        deadline = config['DEADLINE_SECONDS']
+        hedge_after = self.hedge_delay()
+        hedge_model = config.get('HEDGE_MODEL') or config['MODEL']
+
+        paths = {asyncio.ensure_future(attempt('primary', config['MODEL'], messages)): 'primary'}
+        pending = set(paths)
+        hedged = not config['HEDGE_ENABLED']
+        last_error = None
+        metrics.incr(self.metric('calls'))
+
+        try:
+            while True:
+                elapsed = time.perf_counter() - start
+                remaining = deadline - elapsed
+                if remaining <= 0:
+                    break
+                timeout = remaining if hedged else max(0.0, min(remaining, hedge_after - elapsed))
+
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        path = paths[task]
+                        metrics.incr(self.metric(f'won.{path}'))
+                        metrics.observe(self.metric(total_metric), time.perf_counter() - start)
+                        return task.result()
+                    last_error = task.exception()
+                    metrics.incr(self.metric(f'{paths[task]}.error'))
+                    logger.warning(f"LLM {paths[task]} request for {self.endpoint} failed: {str(last_error)}")
+
+                if not hedged and (not pending or time.perf_counter() - start >= hedge_after):
+                    reason = 'error' if not pending else 'slow'
+                    metrics.incr(self.metric(f'hedged.{reason}'))
+                    logger.info(f"Hedging {self.endpoint} request to {hedge_model} ({reason} primary)")
+                    hedge = asyncio.ensure_future(attempt('hedge', hedge_model, messages))
+                    paths[hedge] = 'hedge'
+                    pending.add(hedge)
+                    hedged = True
+                elif not pending:
+                    metrics.observe(self.metric(total_metric), time.perf_counter() - start)
+                    raise last_error
+        finally:
+            # Cancel the losing (or timed out) requests
+            for task in pending:
+                task.cancel()
+                metrics.incr(self.metric(f'{paths[task]}.cancelled'))
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        metrics.incr(self.metric('deadline_exceeded'))
+        metrics.observe(self.metric(total_metric), time.perf_counter() - start)
+        raise LLMDeadlineExceeded(f"No response from the {self.endpoint} model within {deadline:.0f}s")
+
+    async def _get_model(self, model):
+        """The chat model for `model` on the running event loop, built on first use"""
+        loop = asyncio.get_running_loop()
+        with self._models_lock:
+            llm = self._models.setdefault(loop, {}).get(model)
+        if llm is None:
+            # Building a client takes ~100ms of blocking work (HTTP/TLS setup); keep it off the event loop
+            llm = await asyncio.to_thread(self.model_factory, model, self.config)
+            with self._models_lock:
+                llm = self._models[loop].setdefault(model, llm)
+        return llm
+
+    def _observe_censored(self, name, start):
+        """Record the latency of a cancelled request: it would have taken at least this long"""
+        metrics.observe(self.metric(name), time.perf_counter() - start)
+        metrics.incr(self.metric(f'{name}.censored'))
+
+    async def _attempt(self, path, model, messages):
+        """A single model request; its latency is recorded when it completes or is cancelled"""
+        start = time.perf_counter()
+        try:
+            llm = await self._get_model(model)
+            usage = TokenUsageRecorder()
+            response = await llm.ainvoke(messages, config={'callbacks': [usage]})
+        except asyncio.CancelledError:
+            self._observe_censored(path, start)
+            raise
+        metrics.observe(self.metric(path), time.perf_counter() - start)
+
+        # Record which model and path answered for routing and cost accounting
+        response.response_metadata.setdefault('model_name', model)
+        response.response_metadata.setdefault('token_usage', usage.token_usage)
+        response.response_metadata['llm_path'] = path
+        return response
+
+    async def _first_chunk(self, path, model, messages):
+        """Open a streamed request and wait for its first chunk; returns (iterator, chunk)"""
+        start = time.perf_counter()
+        llm = await self._get_model(model)
+        iterator = llm.astream(messages).__aiter__()
+        try:
+            chunk = await iterator.__anext__()
+        except BaseException as e:
+            # Failed, or cancelled because the other path won
+            if isinstance(e, asyncio.CancelledError):
+                self._observe_censored(f'{path}.first_token', start)
+            await iterator.aclose()
+            raise
+        metrics.observe(self.metric(f'{path}.first_token'), time.perf_counter() - start)
+
+        chunk.response_metadata.setdefault('model_name', model)
+        chunk.response_metadata['llm_path'] = path
+        return iterator, chunk
+
+
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+_background_loop = None
+
+
+def get_background_loop():
+    """Get or start the event loop thread that runs the calls of synchronous callers"""
+    global _background_loop
+    with _llm_clients_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-client-loop', daemon=True).start()
+            _background_loop = loop
+        return _background_loop
+
+
+def get_llm_client(endpoint):
+    """Get or initialize the hedged client for an endpoint"""
+    with _llm_clients_lock:
+        if endpoint not in _llm_clients:
+            _llm_clients[endpoint] = HedgedLLMClient(endpoint, model_factory=get_backend_factory())
+        return _llm_clients[endpoint]
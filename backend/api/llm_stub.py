@@ -0,0 +1,285 @@
+"""
+Local LLM Stub Server
+
+OpenAI-compatible stand-in for load tests and offline development. It serves
+POST /v1/chat/completions (plain and streamed) with simulated provider
+behaviour:
+
+- Time to first token drawn from a latency distribution (fixed, uniform or
+  lognormal)
+- Completion tokens generated at a fixed tokens-per-second rate, so plain
+  responses take as long as a streamed one would
+- Injected errors (HTTP 429/500/503) and timeouts at configurable rates
+
+GET /stats reports the simulated latencies it served. Comparing them with the
+llm.* timings at /api/metrics/runtime/ separates our own overhead from the
+provider's latency.
+
+Run it with `python manage.py run_llm_stub` and point the backend at it with
+LLM_BACKEND = {'BACKEND': 'local_stub'} (see api/llm_client.py).
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'HOST': '127.0.0.1',
+    'PORT': 8089,
+    'LATENCY': 'lognormal',  # 'fixed', 'uniform' or 'lognormal' time to first token
+    'LATENCY_MS': 800,  # Fixed value, or the median of the lognormal distribution
+    'LATENCY_MIN_MS': 200,  # Bounds of the uniform distribution
+    'LATENCY_MAX_MS': 2000,
+    'LATENCY_SIGMA': 0.5,  # Spread of the lognormal distribution
+    'TOKENS_PER_SECOND': 60,  # Completion token rate (0 for instant completions)
+    'REPLY_TOKENS': 40,  # Approximate completion length
+    'REPLY': None,  # Fixed reply text; by default the last user message is echoed
+    'ERROR_RATE': 0.0,  # Fraction of requests answered with one of ERROR_STATUSES
+    'ERROR_STATUSES': [429, 500, 503],
+    'TIMEOUT_RATE': 0.0,  # Fraction of requests that hang for TIMEOUT_SECONDS
+    'TIMEOUT_SECONDS': 60,
+    'SEED': None,
+}
+
+MAX_RECORDED_SAMPLES = 10000
+
+
+def approximate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class StubBehaviour:
+    """
+    Draws the latency, errors and reply of each simulated completion
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._random = random.Random(config['SEED'])
+        self._lock = threading.Lock()
+        self._samples = []
+        self._counts = {'requests': 0, 'errors': 0, 'timeouts': 0, 'streamed': 0}
+
+    def first_token_delay(self):
+        """Seconds before the first token, drawn from the configured distribution"""
+        config = self.config
+        with self._lock:
+            if config['LATENCY'] == 'fixed':
+                delay_ms = config['LATENCY_MS']
+            elif config['LATENCY'] == 'uniform':
+                delay_ms = self._random.uniform(config['LATENCY_MIN_MS'], config['LATENCY_MAX_MS'])
+            elif config['LATENCY'] == 'lognormal':
+                delay_ms = config['LATENCY_MS'] * self._random.lognormvariate(0, config['LATENCY_SIGMA'])
+            else:
+                raise ValueError(f"Unknown latency distribution '{config['LATENCY']}'")
+        return max(delay_ms, 0) / 1000
+
+    def token_interval(self):
+        """Seconds between completion tokens"""
+        rate = self.config['TOKENS_PER_SECOND']
+        return 1 / rate if rate else 0.0
+
+    def draw_failure(self):
+        """'timeout', an HTTP status to fail with, or None for a normal response"""
+        config = self.config
+        with self._lock:
+            roll = self._random.random()
+            if roll < config['TIMEOUT_RATE']:
+                return 'timeout'
+            if roll < config['TIMEOUT_RATE'] + config['ERROR_RATE']:
+                return self._random.choice(config['ERROR_STATUSES'])
+        return None
+
+    def reply_tokens(self, messages):
+        """The completion, split into stream chunks of about one token each"""
+        reply = self.config['REPLY']
+        if not reply:
+            last_user = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+            reply = f"Stub reply to: {last_user[:200]}"
+        words = reply.split()
+        while len(words) < self.config['REPLY_TOKENS']:
+            words.append('lorem')
+        return [word if i == 0 else f' {word}' for i, word in enumerate(words[:max(self.config['REPLY_TOKENS'], 1)])]
+
+    def record(self, outcome, served_seconds, streamed=False):
+        with self._lock:
+            self._counts['requests'] += 1
+            if outcome == 'timeout':
+                self._counts['timeouts'] += 1
+            elif outcome != 'ok':
+                self._counts['errors'] += 1
+            if streamed:
+                self._counts['streamed'] += 1
+            if outcome == 'ok':
+                self._samples.append(served_seconds)
+                if len(self._samples) > MAX_RECORDED_SAMPLES:
+                    del self._samples[:len(self._samples) - MAX_RECORDED_SAMPLES]
+
+    def stats(self):
+        """Request counts and percentiles (ms) of the simulated latency of successful responses"""
+        with self._lock:
+            samples = sorted(self._samples)
+            counts = dict(self._counts)
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))] * 1000
+
+        counts['latency_ms'] = {
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'p99': percentile(99),
+            'mean': (sum(samples) / len(samples) * 1000) if samples else 0.0,
+        }
+        return counts
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """OpenAI chat completions endpoint backed by the server's StubBehaviour"""
+
+    server_version = 'EleraLLMStub/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(f"LLM stub {self.address_string()} {format % args}")
+
+    def do_GET(self):
+        behaviour = self.server.behaviour
+        if self.path.rstrip('/') == '/stats':
+            self.send_json(200, behaviour.stats())
+        elif self.path.rstrip('/') == '/v1/models':
+            self.send_json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self.send_error_json(404, f"Unknown path {self.path}")
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            self.send_error_json(400, "Request body must be JSON")
+            return
+        self.complete(body)
+
+    def complete(self, body):
+        behaviour = self.server.behaviour
+        start = time.perf_counter()
+        streamed = bool(body.get('stream'))
+
+        failure = behaviour.draw_failure()
+        if failure == 'timeout':
+            time.sleep(behaviour.config['TIMEOUT_SECONDS'])
+            behaviour.record('timeout', time.perf_counter() - start, streamed)
+            self.close_connection = True
+            return
+
+        time.sleep(behaviour.first_token_delay())
+        if failure is not None:
+            behaviour.record('error', time.perf_counter() - start, streamed)
+            self.send_error_json(failure, "Injected stub error",
+                                 headers={'Retry-After': '1'} if failure == 429 else None)
+            return
+
+        messages = body.get('messages') or []
+        tokens = behaviour.reply_tokens(messages)
+        usage = {
+            'prompt_tokens': sum(approximate_tokens(m.get('content') or '') for m in messages),
+            'completion_tokens': len(tokens),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        model = body.get('model') or 'stub'
+
+        if streamed:
+            self.stream_completion(completion_id, model, tokens, usage, body)
+        else:
+            time.sleep(behaviour.token_interval() * len(tokens))
+            self.send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': usage,
+            })
+        behaviour.record('ok', time.perf_counter() - start, streamed)
+
+    def stream_completion(self, completion_id, model, tokens, usage, body):
+        """Send the completion as server-sent events at the configured token rate"""
+        interval = self.server.behaviour.token_interval()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None, **extra):
+            event = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                **extra,
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        chunk({'role': 'assistant', 'content': ''})
+        for token in tokens:
+            chunk({'content': token})
+            if interval:
+                time.sleep(interval)
+        if (body.get('stream_options') or {}).get('include_usage'):
+            chunk({}, 'stop', usage=usage)
+        else:
+            chunk({}, 'stop')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_json(self, status_code, data, headers=None):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status_code, message, headers=None):
+        error_type = 'rate_limit_error' if status_code == 429 else 'server_error' if status_code >= 500 else 'invalid_request_error'
+        self.send_json(status_code, {'error': {'message': message, 'type': error_type, 'code': status_code}}, headers)
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the shared stub behaviour"""
+
+    daemon_threads = True
+
+    def __init__(self, config):
+        self.behaviour = StubBehaviour(config)
+        super().__init__((config['HOST'], config['PORT']), StubRequestHandler)
+
+
+def get_stub_settings(**overrides):
+    """Get the stub configuration: defaults, then settings.LLM_STUB, then overrides"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'LLM_STUB', {}))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
@@ -0,0 +1,191 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.medical_ner import extract_medical_entities, analyze_patient_emotions
+from api.models import Message, MessageAnnotation
+from api.sharding import get_shards, group_by_shard
+
+DEFAULT_CHECKPOINT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+    'data', 'annotate_messages.checkpoint.json'
+)
+
+
+def annotate_batch(texts, with_emotion=True):
+    """
+    Annotate a batch of message texts
+
+    Runs in a worker (thread or process), so it must not touch the database.
+
+    Returns:
+        list: (entities, emotion_result) tuples in input order
+    """
+    entities = [extract_medical_entities(text) for text in texts]
+    if with_emotion:
+        emotions = analyze_patient_emotions(texts)
+    else:
+        emotions = [{"emotion": "unknown", "confidence": 0.0} for _ in texts]
+    return list(zip(entities, emotions))
+
+
+class Command(BaseCommand):
+    help = "Backfill medical entity and emotion annotations for stored messages (resumable)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', default='user', choices=['user', 'assistant', 'all'],
+                            help='Which messages to annotate (default: user)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched per database round trip')
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help='Messages per model batch handed to a worker')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker pool size')
+        parser.add_argument('--executor', default='process', choices=['process', 'thread'],
+                            help='Worker pool type; processes avoid the GIL for regex-heavy NER')
+        parser.add_argument('--skip-emotion', action='store_true',
+                            help='Only extract entities')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-annotate messages that already have an annotation')
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                            help='File recording the last processed message id')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore any existing checkpoint and start from the beginning')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after this many messages')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size, --chunk-size and --workers must be positive')
+
+        checkpoint_path = options['checkpoint']
+        checkpoint = {} if options['restart'] else self.load_checkpoint(checkpoint_path)
+        last_id = checkpoint.get('last_id', 0)
+        if last_id:
+            self.stdout.write(f"Resuming after message id {last_id}")
+
+        # Shards are processed in order; their id ranges ascend, so one last_id checkpoints all of them
+        querysets = []
+        for alias in get_shards():
+            queryset = Message.objects.using(alias).filter(id__gt=last_id).order_by('id')
+            if options['role'] != 'all':
+                queryset = queryset.filter(role=options['role'])
+            if not options['force']:
+                queryset = queryset.filter(annotation__isnull=True)
+            querysets.append(queryset)
+
+        total = sum(queryset.count() for queryset in querysets)
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        if total == 0:
+            self.stdout.write("Nothing to annotate.")
+            return
+        self.stdout.write(f"Annotating {total} messages with {options['workers']} {options['executor']} workers")
+
+        executor_class = ProcessPoolExecutor if options['executor'] == 'process' else ThreadPoolExecutor
+        with_emotion = not options['skip_emotion']
+        batch_size = options['batch_size']
+
+        processed = 0
+        started = time.perf_counter()
+        rows = itertools.chain.from_iterable(
+            queryset.values_list('id', 'content').iterator(chunk_size=options['chunk_size'])
+            for queryset in querysets
+        )
+
+        with executor_class(max_workers=options['workers']) as executor:
+            for chunk in self.chunks(rows, options['chunk_size'], total):
+                ids = [row[0] for row in chunk]
+                texts = [row[1] for row in chunk]
+                batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+                # map() preserves input order, so results line up with ids
+                results = []
+                for batch_result in executor.map(annotate_batch, batches, [with_emotion] * len(batches)):
+                    results.extend(batch_result)
+
+                self.write_annotations(ids, results)
+
+                processed += len(ids)
+                self.save_checkpoint(checkpoint_path, ids[-1], checkpoint.get('processed', 0) + processed)
+                self.report_progress(processed, total, started)
+                close_old_connections()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Annotated {processed} messages in {elapsed:.1f}s ({processed / elapsed:.1f} msg/s)"
+        ))
+
+    def chunks(self, rows, chunk_size, limit):
+        """Group streamed rows into lists of at most chunk_size, stopping at limit"""
+        chunk = []
+        seen = 0
+        for row in rows:
+            if seen >= limit:
+                break
+            chunk.append(row)
+            seen += 1
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_annotations(self, ids, results):
+        """Upsert annotations for a processed chunk in one statement per batch and shard"""
+        now = timezone.now()
+        results = dict(zip(ids, results))
+        for alias, shard_ids in group_by_shard(ids).items():
+            annotations = [
+                MessageAnnotation(
+                    message_id=message_id,
+                    entities=results[message_id][0],
+                    emotion=results[message_id][1]['emotion'],
+                    emotion_confidence=results[message_id][1]['confidence'],
+                    annotated_at=now,
+                )
+                for message_id in shard_ids
+            ]
+            MessageAnnotation.objects.using(alias).bulk_create(
+                annotations,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['message'],
+                update_fields=['entities', 'emotion', 'emotion_confidence', 'annotated_at'],
+            )
+
+    def report_progress(self, processed, total, started):
+        elapsed = time.perf_counter() - started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = total - processed
+        eta = remaining / rate if rate > 0 else 0.0
+        self.stdout.write(
+            f"{processed}/{total} ({processed / total:.0%}) - {rate:.1f} msg/s - ETA {eta:.0f}s"
+        )
+
+    def load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read checkpoint {path}: {e}. Use --restart to ignore it.")
+
+    def save_checkpoint(self, path, last_id, processed):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so an interruption never leaves a corrupt checkpoint
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'last_id': last_id,
+                'processed': processed,
+                'updated_at': timezone.now().isoformat(),
+            }, f)
+        os.replace(temp_path, path)
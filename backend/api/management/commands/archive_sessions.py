@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import archive_idle_sessions, idle_session_ids, rehydrate_sessions, get_archive_settings
+
+
+class Command(BaseCommand):
+    help = "Move idle conversations to compressed cold storage, or restore archived ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=None,
+                            help='Archive sessions without messages for this many days '
+                                 '(default: CONVERSATION_ARCHIVE IDLE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Sessions per archive transaction (default: CONVERSATION_ARCHIVE BATCH_SIZE)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Archive at most this many sessions, least recently active first')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many sessions would be archived')
+        parser.add_argument('--rehydrate', type=int, nargs='+', metavar='SESSION_ID',
+                            help='Restore these archived sessions instead of archiving')
+
+    def handle(self, *args, **options):
+        if options['rehydrate']:
+            restored = rehydrate_sessions(options['rehydrate'])
+            not_archived = sorted(set(options['rehydrate']) - set(restored))
+            if not_archived:
+                self.stderr.write(f"Not archived: {not_archived}")
+            self.stdout.write(self.style.SUCCESS(f"Restored {len(restored)} sessions"))
+            return
+
+        config = get_archive_settings()
+        idle_days = config['IDLE_DAYS'] if options['idle_days'] is None else options['idle_days']
+        if idle_days < 0:
+            raise CommandError('--idle-days must not be negative')
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if options['dry_run']:
+            count = len(idle_session_ids(idle_days, options['limit']))
+            self.stdout.write(f"{count} sessions idle for more than {idle_days} days would be archived")
+            return
+
+        totals = archive_idle_sessions(idle_days, options['batch_size'], options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {totals['sessions']} sessions ({totals['messages']} messages, "
+            f"{totals['bytes'] / 1024:.1f} KiB compressed) in {totals['batches']} batches to {config['DIRECTORY']}"
+        ))
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks.transport_benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare the per-turn overhead of the REST chat endpoint and the WebSocket chat channel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeats', type=int, default=5,
+                            help='Conversations replayed per transport')
+        parser.add_argument('--session-base', type=int, default=990000,
+                            help='First numeric session id used (sessions are deleted afterwards)')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['repeats'] < 1:
+            raise CommandError('--repeats must be at least 1')
+
+        results = run_benchmark(repeats=options['repeats'], session_base=options['session_base'])
+
+        meta = results['meta']
+        self.stdout.write(
+            f"{meta['repeats']} conversations of {meta['turns_per_conversation']} turns per transport "
+            f"(instant in-process LLM)\n"
+        )
+        self.stdout.write(f"{'transport':<24}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name in ('rest', 'websocket', 'websocket_first_token'):
+            stats = results[name]
+            self.stdout.write(
+                f"{name:<24}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+            )
+        if results['websocket_saving_pct'] is not None:
+            self.stdout.write(f"\nWebSocket p50 saving vs REST: {results['websocket_saving_pct']:+.1f}%")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks.compression_benchmark import run_benchmark, synthetic_corpus, stored_corpus
+
+
+class Command(BaseCommand):
+    help = "Benchmark message compression: storage ratio and read/write overhead"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=4000,
+                            help='Corpus size (half trains the dictionary, half is measured)')
+        parser.add_argument('--corpus', default='synthetic', choices=['synthetic', 'stored'],
+                            help='Synthetic chat messages (default) or the most recent stored messages')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='Timed passes over the corpus')
+        parser.add_argument('--level', type=int, default=None,
+                            help='zstd level (default: MESSAGE_COMPRESSION LEVEL)')
+        parser.add_argument('--dictionary-size', type=int, default=None,
+                            help='Dictionary size in bytes (default: MESSAGE_COMPRESSION DICTIONARY_SIZE)')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['messages'] < 20 or options['iterations'] < 1:
+            raise CommandError('--messages must be at least 20 and --iterations at least 1')
+
+        if options['corpus'] == 'stored':
+            messages = stored_corpus(options['messages'])
+            if len(messages) < 20:
+                raise CommandError(f"Only {len(messages)} stored messages")
+        else:
+            messages = synthetic_corpus(options['messages'])
+
+        results = run_benchmark(
+            messages,
+            iterations=options['iterations'],
+            dictionary_size=options['dictionary_size'],
+            level=options['level'],
+        )
+
+        meta = results['meta']
+        self.stdout.write(
+            f"{meta['messages']} messages, zstd level {meta['level']}, "
+            f"{meta['dictionary_bytes']} byte dictionary from {meta['training_messages']} messages "
+            f"({meta['dictionary_training_seconds']}s)\n"
+        )
+        self.stdout.write(f"{'strategy':<18}{'stored KiB':>12}{'ratio':>8}{'write us':>10}{'read us':>10}")
+        for name, stats in results['strategies'].items():
+            self.stdout.write(
+                f"{name:<18}{stats['stored_bytes'] / 1024:>12.1f}{stats['ratio']:>8.2f}"
+                f"{stats['write']['mean_us']:>10.2f}{stats['read']['mean_us']:>10.2f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks.database_benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare database profiles under concurrent chat writes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16,
+                            help='Concurrent chat sessions')
+        parser.add_argument('--turns', type=int, default=50,
+                            help='Chat turns per session')
+        parser.add_argument('--postgres-db',
+                            help='Scratch PostgreSQL database (POSTGRES_* settings) to include; '
+                                 'its tables are created and dropped')
+        parser.add_argument('--output', help='Write results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 1 or options['turns'] < 1:
+            raise CommandError('--writers and --turns must be at least 1')
+
+        results = run_benchmark(
+            writers=options['writers'],
+            turns=options['turns'],
+            postgres_db=options['postgres_db'],
+        )
+
+        meta = results['meta']
+        self.stdout.write(f"{meta['writers']} concurrent writers x {meta['turns_per_writer']} chat turns\n")
+        self.stdout.write(f"{'profile':<16}{'turns/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}")
+        for name, stats in results['profiles'].items():
+            if not stats['turns']:
+                self.stdout.write(f"{name:<16}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{stats['failed_turns']:>8}")
+                continue
+            self.stdout.write(
+                f"{name:<16}{stats['turns_per_second']:>10.1f}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['failed_turns']:>8}"
+            )
+        for name, stats in results['profiles'].items():
+            for error in stats['errors']:
+                self.stdout.write(self.style.WARNING(f"{name}: {error}"))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
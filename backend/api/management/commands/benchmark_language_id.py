@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.language_id import detect_language, resolve_session_language
+from api.models import UserContext
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "I have nausea since Monday and I feel weak",
+    "abeg my belle dey pain me since yesterday",
+    "I have had a headache for 3 days and the pain is getting worse, what should I do?",
+    "wetin I go take for this fever wey dey worry me",
+    "Ori mi n dun mi gan, mo ni iba",
+    "Kedu, isi m na-egbu m mgbu",
+    "Sannu likita, ina jin ciwon kai",
+    "thank you doctor",
+    "The pain is in my lower back and it gets worse when I bend down to pick something up. "
+    "I tried paracetamol but it only helps for a few hours.",
+]
+
+# The substring check ChatAPIView used before the language identifier
+LEGACY_PIDGIN_INDICATORS = ["dey", "abeg", "belle", "na", "wetin", "wahala", "chop"]
+
+
+def legacy_has_pidgin(message):
+    return any(indicator in message.lower() for indicator in LEGACY_PIDGIN_INDICATORS)
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark per-message language identification cost"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000,
+                            help='Passes over the sample messages')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        messages = SAMPLE_MESSAGES
+
+        # Detection quality at a glance
+        for message in messages:
+            language, confidence = detect_language(message)
+            legacy = 'en-pidgin' if legacy_has_pidgin(message) else 'en'
+            self.stdout.write(f"{language:>10} ({confidence:.2f})  legacy={legacy:<10} {message[:50]}")
+
+        # An unsaved, settled context: later turns of a session skip detection entirely
+        settled_context = UserContext(language='en-pidgin', language_confidence=1.0)
+
+        benchmarks = [
+            ('legacy substring check', legacy_has_pidgin),
+            ('detect_language (first turn)', detect_language),
+            ('session reuse (later turns)', lambda m: resolve_session_language(settled_context, m)),
+        ]
+
+        self.stdout.write("")
+        for name, func in benchmarks:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for message in messages:
+                    func(message)
+            elapsed = time.perf_counter() - start
+            per_message_us = elapsed / (iterations * len(messages)) * 1e6
+            self.stdout.write(f"{name:<32} {per_message_us:8.2f} us/message")
@@ -0,0 +1,80 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks.ner_benchmark import (
+    DEFAULT_CORPUS_PATH, load_corpus, run_benchmark, compare_results
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark medical NER and emotion analysis speed and quality on the gold corpus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH,
+                            help='Path to the labeled corpus JSON')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Timed passes over the corpus per function')
+        parser.add_argument('--emotion', default='stub', choices=['stub', 'model'],
+                            help="Use stubbed models (default) or load the real Hugging Face models")
+        parser.add_argument('--output', help='Write results to this JSON file')
+        parser.add_argument('--compare', help='Baseline results JSON to compare against')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        results = run_benchmark(
+            load_corpus(options['corpus']),
+            iterations=options['iterations'],
+            emotion_mode=options['emotion'],
+        )
+
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                results['comparison'] = compare_results(results, json.load(f))
+
+        self.print_report(results)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def print_report(self, results):
+        meta = results['meta']
+        self.stdout.write(
+            f"Corpus: {meta['corpus_size']} messages ({', '.join(meta['languages'])}), "
+            f"{meta['iterations']} iterations, emotion={meta['emotion_mode']}\n"
+        )
+
+        self.stdout.write(f"{'function':<34}{'msg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>10}")
+        for name, stats in results['latency'].items():
+            peak = results['peak_memory_kb'].get(name, '')
+            self.stdout.write(
+                f"{name:<34}{stats['messages_per_sec']:>10}{stats['p50_ms']:>10.3f}"
+                f"{stats['p99_ms']:>10.3f}{peak:>10}"
+            )
+
+        self.stdout.write(f"\n{'entity':<12}{'precision':>10}{'recall':>10}{'f1':>10}")
+        for entity_type, scores in results['quality']['overall'].items():
+            self.stdout.write(
+                f"{entity_type:<12}{scores['precision']:>10.3f}{scores['recall']:>10.3f}{scores['f1']:>10.3f}"
+            )
+        for language, by_type in results['quality']['by_language'].items():
+            recalls = ', '.join(f"{t}={s['recall']:.2f}" for t, s in by_type.items())
+            self.stdout.write(f"recall [{language}]: {recalls}")
+
+        emotion = results['emotion']
+        if emotion['accuracy'] == 'n/a':
+            self.stdout.write("\nemotion accuracy: n/a (stubbed model)")
+        elif emotion['accuracy'] is not None:
+            self.stdout.write(f"\nemotion accuracy: {emotion['accuracy']:.3f} ({emotion['correct']}/{emotion['labeled']})")
+
+        comparison = results.get('comparison')
+        if comparison:
+            self.stdout.write("\nChange vs baseline (p50 latency %, F1):")
+            for name, change in comparison['latency_p50_change_pct'].items():
+                self.stdout.write(f"  {name:<34}{change:+.1f}%")
+            for entity_type, change in comparison['quality_change'].items():
+                self.stdout.write(f"  {entity_type:<34}{change['f1']:+.4f}")
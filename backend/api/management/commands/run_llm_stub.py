@@ -0,0 +1,59 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.llm_stub import StubServer, get_stub_settings
+
+
+class Command(BaseCommand):
+    help = "Run the local OpenAI-compatible LLM stub server for load tests and offline development"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help='Address to bind')
+        parser.add_argument('--port', type=int, help='Port to bind')
+        parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'],
+                            help='Distribution of the time to first token')
+        parser.add_argument('--latency-ms', type=float,
+                            help='Fixed time to first token, or the lognormal median')
+        parser.add_argument('--latency-min-ms', type=float, help='Lower bound of the uniform distribution')
+        parser.add_argument('--latency-max-ms', type=float, help='Upper bound of the uniform distribution')
+        parser.add_argument('--latency-sigma', type=float, help='Spread of the lognormal distribution')
+        parser.add_argument('--tokens-per-second', type=float,
+                            help='Completion token rate (0 for instant completions)')
+        parser.add_argument('--reply-tokens', type=int, help='Approximate completion length')
+        parser.add_argument('--reply', help='Fixed reply text (default: echo the last user message)')
+        parser.add_argument('--error-rate', type=float, help='Fraction of requests answered with an HTTP error')
+        parser.add_argument('--error-statuses', type=int, nargs='+', help='HTTP statuses used for injected errors')
+        parser.add_argument('--timeout-rate', type=float, help='Fraction of requests that hang')
+        parser.add_argument('--timeout-seconds', type=float, help='How long hanging requests hang')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        keys = ['host', 'port', 'latency', 'latency_ms', 'latency_min_ms', 'latency_max_ms', 'latency_sigma',
+                'tokens_per_second', 'reply_tokens', 'reply', 'error_rate', 'error_statuses',
+                'timeout_rate', 'timeout_seconds', 'seed']
+        config = get_stub_settings(**{key.upper(): options[key] for key in keys})
+        if not 0 <= config['ERROR_RATE'] + config['TIMEOUT_RATE'] <= 1:
+            raise CommandError('--error-rate plus --timeout-rate must be between 0 and 1')
+
+        try:
+            server = StubServer(config)
+        except OSError as e:
+            raise CommandError(f"Could not bind {config['HOST']}:{config['PORT']}: {e}")
+
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: threading.Thread(target=server.shutdown).start())
+
+        self.stdout.write(
+            f"LLM stub listening on http://{config['HOST']}:{config['PORT']}/v1 "
+            f"(latency={config['LATENCY']}, {config['TOKENS_PER_SECOND']} tokens/s, "
+            f"error rate {config['ERROR_RATE']:.0%}, timeout rate {config['TIMEOUT_RATE']:.0%}); "
+            f"stats at /stats. Ctrl+C to stop"
+        )
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS(f"LLM stub stopped: {server.behaviour.stats()}"))
@@ -0,0 +1,74 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.task_queue import TaskWorker, queue_stats, requeue_dead_tasks
+
+
+class Command(BaseCommand):
+    help = "Run deferred task workers (chat annotation, context extraction, analytics)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2,
+                            help='Worker threads in this process')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once the queue has no due tasks')
+        parser.add_argument('--stats-interval', type=float, default=60.0,
+                            help='Seconds between queue depth reports (0 to disable)')
+        parser.add_argument('--requeue-dead', nargs='?', const='', default=None, metavar='TASK_NAME',
+                            help='Move dead-letter tasks (optionally only TASK_NAME) back to the queue and exit')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print queue depth and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.print_stats()
+            return
+
+        if options['requeue_dead'] is not None:
+            count = requeue_dead_tasks(options['requeue_dead'] or None)
+            self.stdout.write(self.style.SUCCESS(f"Requeued {count} dead-letter tasks"))
+            return
+
+        if options['threads'] < 1:
+            raise CommandError('--threads must be at least 1')
+
+        stop_event = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: stop_event.set())
+
+        processed = []
+
+        def work():
+            try:
+                worker = TaskWorker()
+                processed.append(worker.run_forever(stop_event, burst=options['burst']))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, name=f'task-worker-{i}', daemon=True)
+                   for i in range(options['threads'])]
+        self.stdout.write(f"Starting {len(threads)} task workers (Ctrl+C to stop)")
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+            if options['stats_interval'] and time.monotonic() - last_report >= options['stats_interval']:
+                self.print_stats()
+                last_report = time.monotonic()
+
+        self.stdout.write(self.style.SUCCESS(f"Workers stopped after processing {sum(processed)} tasks"))
+
+    def print_stats(self):
+        stats = queue_stats()
+        depth = ', '.join(f"{status}={count}" for status, count in stats['depth'].items())
+        self.stdout.write(f"Queue depth: {depth}; oldest due task waiting {stats['oldest_pending_seconds']:.1f}s")
+        for name, count in sorted(stats['by_task'].items()):
+            self.stdout.write(f"  {name}: {count} pending")
@@ -0,0 +1,72 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.clinical_summary import (
+    iter_summaries, restore_requested_sessions, sessions_active_between, get_summary_settings, SessionsNotFound,
+)
+
+
+class Command(BaseCommand):
+    help = "Generate clinical summaries for many sessions concurrently (e.g. a doctor's daily queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session-ids', type=int, nargs='+',
+                            help='Sessions to summarize')
+        parser.add_argument('--date', help='Summarize sessions with messages on this date (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='With --date, the last date of a range (inclusive)')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Summary LLM calls in flight at once (default: CLINICAL_SUMMARY CONCURRENCY)')
+        parser.add_argument('--output', help='Append results to this JSON Lines file as they complete')
+
+    def handle(self, *args, **options):
+        config = get_summary_settings()
+        if options['session_ids']:
+            # Validated and restored from the archive like the bulk summary endpoint's session_ids
+            try:
+                session_ids = restore_requested_sessions(options['session_ids'], max_sessions=config['MAX_SESSIONS'])
+            except (SessionsNotFound, ValueError) as e:
+                raise CommandError(str(e))
+        elif options['date']:
+            date_from = parse_date(options['date'])
+            date_to = parse_date(options['date_to']) if options['date_to'] else date_from
+            if date_from is None or date_to is None or date_to < date_from:
+                raise CommandError('--date/--date-to must be YYYY-MM-DD dates, --date first')
+            session_ids = sessions_active_between(date_from, date_to)
+        else:
+            raise CommandError('Provide --session-ids or --date')
+
+        if not session_ids:
+            self.stdout.write('No sessions to summarize')
+            return
+
+        concurrency = options['concurrency'] or config['CONCURRENCY']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        self.stdout.write(f"Summarizing {len(session_ids)} sessions with concurrency {concurrency}")
+        output = open(options['output'], 'a', encoding='utf-8') if options['output'] else None
+        started_at = time.perf_counter()
+        failed = 0
+        try:
+            for result in iter_summaries(session_ids, concurrency):
+                elapsed = time.perf_counter() - started_at
+                if 'error' in result:
+                    failed += 1
+                    self.stderr.write(f"[{elapsed:6.1f}s] session {result['session_id']}: {result['error']}")
+                else:
+                    first_line = result['summary'].strip().splitlines()[0] if result['summary'].strip() else ''
+                    self.stdout.write(f"[{elapsed:6.1f}s] session {result['session_id']}: {first_line[:80]}")
+                if output:
+                    output.write(json.dumps(result) + '\n')
+                    output.flush()
+        finally:
+            if output:
+                output.close()
+
+        wall_time = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f"Summarized {len(session_ids) - failed}/{len(session_ids)} sessions in {wall_time:.1f}s"
+        ))
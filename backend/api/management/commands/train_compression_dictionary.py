@@ -0,0 +1,50 @@
+import zstandard
+from django.core.management.base import BaseCommand, CommandError
+
+from api.compression import train_dictionary, recompress_messages, get_compression_settings
+from api.models import Message
+from api.sharding import fan_out
+
+
+class Command(BaseCommand):
+    help = "Train a zstd dictionary for message content from recent messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=5000,
+                            help='Most recent messages to train on')
+        parser.add_argument('--role', default='assistant', choices=['assistant', 'user', 'all'],
+                            help='Train on messages of this role')
+        parser.add_argument('--size', type=int, default=None,
+                            help='Dictionary size in bytes (default: MESSAGE_COMPRESSION DICTIONARY_SIZE)')
+        parser.add_argument('--recompress', action='store_true',
+                            help='Rewrite every stored message with the new dictionary')
+
+    def handle(self, *args, **options):
+        if options['samples'] < 1:
+            raise CommandError('--samples must be at least 1')
+
+        def recent_on_shard(alias):
+            queryset = Message.objects.using(alias).order_by('-id')
+            if options['role'] != 'all':
+                queryset = queryset.filter(role=options['role'])
+            return list(queryset.values_list('timestamp', 'content')[:options['samples']])
+
+        # The most recent messages across shards
+        recent = sorted((row for rows in fan_out(recent_on_shard) for row in rows), key=lambda row: row[0], reverse=True)
+        min_size = get_compression_settings()['MIN_SIZE']
+        samples = [text for _, text in recent[:options['samples']] if len(text.encode('utf-8')) >= min_size]
+        if len(samples) < 10:
+            raise CommandError(f"Only {len(samples)} messages of at least {min_size} bytes; "
+                               f"zstd needs more samples to train a dictionary")
+
+        try:
+            dictionary = train_dictionary(samples, options['size'])
+        except zstandard.ZstdError as e:
+            raise CommandError(f"Dictionary training failed: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained dictionary {dictionary.dict_id} ({len(dictionary.data)} bytes) from {len(samples)} messages"
+        ))
+
+        if options['recompress']:
+            count = recompress_messages()
+            self.stdout.write(self.style.SUCCESS(f"Recompressed {count} messages"))
@@ -1,37 +1,160 @@
 from transformers import pipeline, AutoTokenizer, AutoModelForTokenClassification
 import logging
 import re
+import threading
+
+import numpy as np
+
+from .emotion_cache import get_emotion_cache
 
 logger = logging.getLogger(__name__)
 
+# Symptom vocabulary, shared with the red-flag triage matcher
+SYMPTOM_PATTERNS = [
+    # General symptoms
+    r'\b(headache|migraine|pain|ache|fever|cough|nausea|vomiting|dizziness|fatigue|tired)\b',
+    # Specific pains
+    r'\b(chest pain|back pain|throat pain|stomach pain|abdominal pain|joint pain)\b',
+    # Respiratory
+    r'\b(shortness of breath|difficulty breathing|wheezing|phlegm|congestion)\b',
+    r'\b(runny nose|stuffy nose|sore throat|hoarse voice|dry cough|wet cough)\b',
+    # Digestive
+    r'\b(diarrhea|constipation|indigestion|heartburn|bloating|gas)\b',
+    r'\b(stomach ache|abdominal cramping|bloody stool|black stool|nausea|vomiting)\b',
+    # Neurological
+    r'\b(numbness|tingling|weakness|confusion|memory loss|seizure)\b',
+    r'\b(dizziness|fainting|lightheaded|vertigo|headache|migraine|concussion)\b',
+    # Cardiovascular
+    r'\b(palpitations|irregular heartbeat|fast heart rate|slow heart rate)\b',
+    r'\b(chest tightness|shortness of breath|cyanosis|edema|swelling)\b',
+    # Skin
+    r'\b(rash|swelling|bleeding|bruising|itching|lump|bump)\b',
+    r'\b(hives|welts|blisters|redness|scaling|peeling)\b',
+    # Sensory
+    r'\b(blurry vision|double vision|hearing loss|ringing in ears)\b',
+    r'\b(eye pain|ear pain|loss of taste|loss of smell)\b',
+    # Sleep
+    r'\b(insomnia|trouble sleeping|sleep apnea|snoring)\b',
+    r'\b(nightmares|night sweats|restless leg|teeth grinding)\b',
+    # Mental Health
+    r'\b(anxiety|depression|panic attack|stress|mood swings)\b',
+    r'\b(irritability|difficulty concentrating|racing thoughts)\b',
+    # Severity patterns
+    r'\b(mild|moderate|severe|extreme|excruciating) (pain|discomfort|fever|headache|cough)\b',
+    r'\b(slight|significant|unbearable|manageable) (pain|discomfort|symptom)\b',
+    # Duration patterns
+    r'\b(for|since|over the last|past) \d+ (hours?|days?|weeks?|months?|years?)\b',
+    r'\b(chronic|acute|persistent|intermittent|constant|occasional)\b',
+    r'\bstarted \d+ (hours?|days?|weeks?|months?) ago\b'
+]
+
+# Medical condition vocabulary, shared with the red-flag triage matcher
+CONDITION_PATTERNS = [
+    # Common chronic conditions
+    r'\b(diabetes|hypertension|high blood pressure|asthma|copd|cancer)\b',
+    r'\b(arthritis|depression|anxiety|insomnia|allergies|migraine)\b',
+    r'\b(heart disease|heart attack|stroke|seizure|epilepsy)\b',
+    # Chronic conditions
+    r'\b(chronic pain|chronic fatigue|fibromyalgia|lupus|ms|multiple sclerosis)\b',
+    r'\b(osteoporosis|parkinson|alzheimer|dementia|hypothyroidism|hyperthyroidism)\b',
+    # Infections
+    r'\b(infection|pneumonia|bronchitis|sinusitis|flu|influenza|cold)\b',
+    r'\b(uti|urinary tract infection|strep throat|viral infection|bacterial infection)\b',
+    r'\b(covid|coronavirus|covid-19|mono|mononucleosis|lyme disease)\b',
+    # Digestive conditions
+    r'\b(gerd|acid reflux|ibs|irritable bowel|crohn|ulcerative colitis|celiac)\b',
+    r'\b(gallstones|diverticulitis|pancreatitis|hepatitis|cirrhosis|gastritis)\b',
+    # Skin conditions
+    r'\b(eczema|psoriasis|rosacea|acne|dermatitis|shingles|hives)\b',
+    # Respiratory conditions
+    r'\b(asthma|copd|emphysema|bronchitis|sleep apnea|pulmonary fibrosis)\b',
+    # Cardiovascular conditions
+    r'\b(hypertension|high blood pressure|afib|atrial fibrillation|coronary artery disease|arrhythmia)\b',
+    r'\b(tachycardia|bradycardia|heart failure|congestive heart failure|aneurysm)\b',
+    # Endocrine
+    r'\b(thyroid|hypothyroidism|hyperthyroidism|diabetes|type 1|type 2|cushings|addisons)\b',
+    # Mental health
+    r'\b(depression|anxiety|bipolar|schizophrenia|ocd|ptsd|adhd|add)\b',
+    # Other
+    r'\b(anemia|kidney disease|liver disease|osteoporosis)\b',
+    r'\b(glaucoma|cataracts|macular degeneration|retinopathy)\b'
+]
+
+
+def _pattern_terms(patterns):
+    """Collect the plain keyword alternatives from a list of \\b(a|b|c)\\b patterns"""
+    terms = set()
+    for pattern in patterns:
+        match = re.fullmatch(r'\\b\(([a-z0-9 \-|]+)\)\\b', pattern)
+        if match:
+            terms.update(match.group(1).split('|'))
+    return frozenset(terms)
+
+SYMPTOM_TERMS = _pattern_terms(SYMPTOM_PATTERNS)
+CONDITION_TERMS = _pattern_terms(CONDITION_PATTERNS)
+
+CLINICAL_BERT_MODEL_NAME = "emilyalsentzer/Bio_ClinicalBERT"
+
+_medical_ner_ready = False
+_feature_extractor = None
+_medical_ner_lock = threading.Lock()
+
 # Initialize the medical NER pipeline
 # Note: This will download the model on first use
 def get_medical_ner_pipeline():
-    try:
-        # We'll use a Hugging Face pipeline for NER with Bio_ClinicalBERT as the base model
-        # Since Bio_ClinicalBERT itself isn't specifically an NER model,
-        # we're implementing a hybrid approach with regex patterns as fallback
-        model_name = "emilyalsentzer/Bio_ClinicalBERT"
-        logger.info(f"Using {model_name} for embedding medical text")
-        
-        # Return a pipeline that extracts entities
-        # For the actual NER, we'll mostly rely on our regex-based approach
-        # But we'll load the model to have its embeddings available for future improvements
-        
+    global _medical_ner_ready, _feature_extractor
+    if _medical_ner_ready:
+        # Already initialized in this process
+        return True
+    # Threads arriving during the load wait for it instead of seeing no model
+    with _medical_ner_lock:
+        if _medical_ner_ready:
+            return True
         try:
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            # Just load the base model - we'll use it for embeddings, not direct NER
-            _ = pipeline("feature-extraction", model=model_name, tokenizer=tokenizer)
-            logger.info(f"Successfully loaded {model_name} model")
-        except Exception as inner_e:
-            logger.warning(f"Could not load full feature pipeline: {str(inner_e)}. Using regex fallback only.")
+            # We'll use a Hugging Face pipeline for NER with Bio_ClinicalBERT as the base model
+            # Since Bio_ClinicalBERT itself isn't specifically an NER model,
+            # we're implementing a hybrid approach with regex patterns as fallback
+            model_name = CLINICAL_BERT_MODEL_NAME
+            logger.info(f"Using {model_name} for embedding medical text")
+            
+            # Return a pipeline that extracts entities
+            # For the actual NER, we'll mostly rely on our regex-based approach
+            # But we'll load the model to have its embeddings available for future improvements
+            
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                # Just load the base model - we'll use it for embeddings, not direct NER
+                _feature_extractor = pipeline("feature-extraction", model=model_name, tokenizer=tokenizer)
+                logger.info(f"Successfully loaded {model_name} model")
+            except Exception as inner_e:
+                logger.warning(f"Could not load full feature pipeline: {str(inner_e)}. Using regex fallback only.")
+        except Exception as e:
+            logger.error(f"Error loading medical NER model: {str(e)}")
         
-        # Always return True to indicate we're ready to extract with regex methods
+        # Ready once the load has been attempted; the regex methods work either way
+        _medical_ner_ready = True
         return True
+
+# Get the ClinicalBERT feature extractor (None if the model could not be loaded)
+def get_feature_extractor():
+    get_medical_ner_pipeline()
+    return _feature_extractor
+
+# Embed text as a mean-pooled, L2-normalized ClinicalBERT vector
+def embed_text(text):
+    try:
+        extractor = get_feature_extractor()
+        if extractor is None:
+            return None
+        
+        # Output shape is [1][tokens][hidden]; average over tokens
+        token_vectors = np.asarray(extractor(text, truncation=True)[0], dtype=np.float32)
+        vector = token_vectors.mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
     except Exception as e:
-        logger.error(f"Error loading medical NER model: {str(e)}")
-        # Return True anyway to use regex fallback
-        return True
+        logger.error(f"Error embedding text: {str(e)}")
+        return None
 
 # Extract medical entities from patient text
 def extract_medical_entities(text):
@@ -186,45 +309,109 @@ def extract_vitals(text):
         logger.error(f"Error extracting vitals: {str(e)}")
         return []
 
+# Emotion classifier; the model name doubles as the cache version key
+EMOTION_MODEL_NAME = "bhadresh-savani/distilbert-base-uncased-emotion"
+EMOTION_MODEL_VERSION = f"{EMOTION_MODEL_NAME}@1"
+
+_emotion_pipeline = None
+_emotion_lock = threading.Lock()
+
 # Initialize the emotion analysis pipeline
 def get_emotion_pipeline():
-    try:
-        # Pre-trained emotion detection model
-        return pipeline("text-classification", model="bhadresh-savani/distilbert-base-uncased-emotion")
-    except Exception as e:
-        logger.error(f"Error loading emotion model: {str(e)}")
-        # Return a fallback function
-        return lambda text: [{"label": "unknown", "score": 1.0}]
+    global _emotion_pipeline
+    if _emotion_pipeline is not None:
+        return _emotion_pipeline
+    with _emotion_lock:
+        if _emotion_pipeline is not None:
+            return _emotion_pipeline
+        try:
+            # Pre-trained emotion detection model, loaded once per process
+            _emotion_pipeline = pipeline("text-classification", model=EMOTION_MODEL_NAME)
+            return _emotion_pipeline
+        except Exception as e:
+            logger.error(f"Error loading emotion model: {str(e)}")
+            # Return a fallback function
+            return lambda text: [{"label": "unknown", "score": 1.0}]
+
+# Add minimum length threshold to avoid misclassifications on short messages
+EMOTION_MIN_TEXT_LENGTH = 5  # Skip emotion detection for very short messages
+EMOTION_MIN_CONFIDENCE = 0.5  # Minimum confidence threshold for emotion detection
+
+def _emotion_result(emotion):
+    """Convert a classifier prediction into the emotion analysis format"""
+    # Only return a valid emotion if confidence is above threshold
+    if emotion["score"] < EMOTION_MIN_CONFIDENCE:
+        return {"emotion": "unknown", "confidence": emotion["score"]}
+    return {
+        "emotion": emotion["label"],
+        "confidence": emotion["score"]
+    }
 
 # Analyze patient emotion
 def analyze_patient_emotion(text):
     try:
-        # Add minimum length threshold to avoid misclassifications on short messages
-        MIN_TEXT_LENGTH = 5  # Skip emotion detection for very short messages
-        MIN_CONFIDENCE = 0.5  # Minimum confidence threshold for emotion detection
-        
-        if len(text.strip()) < MIN_TEXT_LENGTH:
+        if len(text.strip()) < EMOTION_MIN_TEXT_LENGTH:
             # Skip emotion analysis for greetings and very short messages
             return {"emotion": "unknown", "confidence": 0.0}
+        
+        # Patients repeat short messages a lot; reuse earlier results when possible
+        cache = get_emotion_cache()
+        if cache is not None:
+            cached = cache.get(text, EMOTION_MODEL_VERSION)
+            if cached is not None:
+                return cached
             
         emotion_classifier = get_emotion_pipeline()
         result = emotion_classifier(text)
         
         # Return the primary emotion and its confidence score
-        emotion = result[0]
+        analysis = _emotion_result(result[0])
         
-        # Only return a valid emotion if confidence is above threshold
-        if emotion["score"] < MIN_CONFIDENCE:
-            return {"emotion": "unknown", "confidence": emotion["score"]}
+        # Don't cache the placeholder result produced when the model failed to load
+        if cache is not None and emotion_classifier is _emotion_pipeline:
+            cache.set(text, EMOTION_MODEL_VERSION, analysis)
             
-        return {
-            "emotion": emotion["label"],
-            "confidence": emotion["score"]
-        }
+        return analysis
     except Exception as e:
         logger.error(f"Error analyzing patient emotion: {str(e)}")
         return {"emotion": "unknown", "confidence": 0.0}
 
+# Analyze emotions for many texts with batched forward passes
+def analyze_patient_emotions(texts, batch_size=32):
+    results = [{"emotion": "unknown", "confidence": 0.0} for _ in texts]
+    try:
+        cache = get_emotion_cache()
+        pending = []
+        for index, text in enumerate(texts):
+            if len(text.strip()) < EMOTION_MIN_TEXT_LENGTH:
+                continue
+            cached = cache.get(text, EMOTION_MODEL_VERSION) if cache is not None else None
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append(index)
+        
+        if not pending:
+            return results
+        
+        emotion_classifier = get_emotion_pipeline()
+        if emotion_classifier is not _emotion_pipeline:
+            # Model unavailable; leave the pending texts as unknown
+            return results
+        
+        predictions = emotion_classifier([texts[i] for i in pending], batch_size=batch_size, truncation=True)
+        for index, prediction in zip(pending, predictions):
+            # Pipelines return a dict per input for lists, or a list of dicts with top_k
+            emotion = prediction[0] if isinstance(prediction, list) else prediction
+            results[index] = _emotion_result(emotion)
+            if cache is not None:
+                cache.set(texts[index], EMOTION_MODEL_VERSION, results[index])
+        
+        return results
+    except Exception as e:
+        logger.error(f"Error analyzing patient emotions in batch: {str(e)}")
+        return results
+
 # Extract medications using regex patterns
 def extract_medications(text):
     try:
@@ -273,48 +460,10 @@ def extract_medications(text):
 # Extract symptoms using keyword matching
 def extract_symptoms(text):
     try:
-        symptoms_list = [
-            # General symptoms
-            r'\b(headache|migraine|pain|ache|fever|cough|nausea|vomiting|dizziness|fatigue|tired)\b',
-            # Specific pains
-            r'\b(chest pain|back pain|throat pain|stomach pain|abdominal pain|joint pain)\b',
-            # Respiratory
-            r'\b(shortness of breath|difficulty breathing|wheezing|phlegm|congestion)\b',
-            r'\b(runny nose|stuffy nose|sore throat|hoarse voice|dry cough|wet cough)\b',
-            # Digestive
-            r'\b(diarrhea|constipation|indigestion|heartburn|bloating|gas)\b',
-            r'\b(stomach ache|abdominal cramping|bloody stool|black stool|nausea|vomiting)\b',
-            # Neurological
-            r'\b(numbness|tingling|weakness|confusion|memory loss|seizure)\b',
-            r'\b(dizziness|fainting|lightheaded|vertigo|headache|migraine|concussion)\b',
-            # Cardiovascular
-            r'\b(palpitations|irregular heartbeat|fast heart rate|slow heart rate)\b',
-            r'\b(chest tightness|shortness of breath|cyanosis|edema|swelling)\b',
-            # Skin
-            r'\b(rash|swelling|bleeding|bruising|itching|lump|bump)\b',
-            r'\b(hives|welts|blisters|redness|scaling|peeling)\b',
-            # Sensory
-            r'\b(blurry vision|double vision|hearing loss|ringing in ears)\b',
-            r'\b(eye pain|ear pain|loss of taste|loss of smell)\b',
-            # Sleep
-            r'\b(insomnia|trouble sleeping|sleep apnea|snoring)\b',
-            r'\b(nightmares|night sweats|restless leg|teeth grinding)\b',
-            # Mental Health
-            r'\b(anxiety|depression|panic attack|stress|mood swings)\b',
-            r'\b(irritability|difficulty concentrating|racing thoughts)\b',
-            # Severity patterns
-            r'\b(mild|moderate|severe|extreme|excruciating) (pain|discomfort|fever|headache|cough)\b',
-            r'\b(slight|significant|unbearable|manageable) (pain|discomfort|symptom)\b',
-            # Duration patterns
-            r'\b(for|since|over the last|past) \d+ (hours?|days?|weeks?|months?|years?)\b',
-            r'\b(chronic|acute|persistent|intermittent|constant|occasional)\b',
-            r'\bstarted \d+ (hours?|days?|weeks?|months?) ago\b'
-        ]
-        
         symptoms = []
         text_lower = text.lower()
         
-        for pattern in symptoms_list:
+        for pattern in SYMPTOM_PATTERNS:
             matches = re.finditer(pattern, text_lower)
             for match in matches:
                 symptom = match.group(0)
@@ -329,41 +478,10 @@ def extract_symptoms(text):
 # Extract medical conditions
 def extract_conditions(text):
     try:
-        conditions_list = [
-            # Common chronic conditions
-            r'\b(diabetes|hypertension|high blood pressure|asthma|copd|cancer)\b',
-            r'\b(arthritis|depression|anxiety|insomnia|allergies|migraine)\b',
-            r'\b(heart disease|heart attack|stroke|seizure|epilepsy)\b',
-            # Chronic conditions
-            r'\b(chronic pain|chronic fatigue|fibromyalgia|lupus|ms|multiple sclerosis)\b',
-            r'\b(osteoporosis|parkinson|alzheimer|dementia|hypothyroidism|hyperthyroidism)\b',
-            # Infections
-            r'\b(infection|pneumonia|bronchitis|sinusitis|flu|influenza|cold)\b',
-            r'\b(uti|urinary tract infection|strep throat|viral infection|bacterial infection)\b',
-            r'\b(covid|coronavirus|covid-19|mono|mononucleosis|lyme disease)\b',
-            # Digestive conditions
-            r'\b(gerd|acid reflux|ibs|irritable bowel|crohn|ulcerative colitis|celiac)\b',
-            r'\b(gallstones|diverticulitis|pancreatitis|hepatitis|cirrhosis|gastritis)\b',
-            # Skin conditions
-            r'\b(eczema|psoriasis|rosacea|acne|dermatitis|shingles|hives)\b',
-            # Respiratory conditions
-            r'\b(asthma|copd|emphysema|bronchitis|sleep apnea|pulmonary fibrosis)\b',
-            # Cardiovascular conditions
-            r'\b(hypertension|high blood pressure|afib|atrial fibrillation|coronary artery disease|arrhythmia)\b',
-            r'\b(tachycardia|bradycardia|heart failure|congestive heart failure|aneurysm)\b',
-            # Endocrine
-            r'\b(thyroid|hypothyroidism|hyperthyroidism|diabetes|type 1|type 2|cushings|addisons)\b',
-            # Mental health
-            r'\b(depression|anxiety|bipolar|schizophrenia|ocd|ptsd|adhd|add)\b',
-            # Other
-            r'\b(anemia|kidney disease|liver disease|osteoporosis)\b',
-            r'\b(glaucoma|cataracts|macular degeneration|retinopathy)\b'
-        ]
-        
         conditions = []
         text_lower = text.lower()
         
-        for pattern in conditions_list:
+        for pattern in CONDITION_PATTERNS:
             matches = re.finditer(pattern, text_lower)
             for match in matches:
                 condition = match.group(0)
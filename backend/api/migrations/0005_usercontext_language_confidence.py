@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+def mark_explicit_languages(apps, schema_editor):
+    # Non-default languages could only have been set by the client, so treat them as explicit
+    UserContext = apps.get_model('api', 'UserContext')
+    UserContext.objects.exclude(language='en').update(language_confidence=1.0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_analyticsmetric_expertreview_usercontext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercontext',
+            name='language_confidence',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(mark_explicit_languages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_usercontext_language_confidence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageAnnotation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entities', models.JSONField(blank=True, default=dict)),
+                ('emotion', models.CharField(default='unknown', max_length=20)),
+                ('emotion_confidence', models.FloatField(default=0.0)),
+                ('annotated_at', models.DateTimeField(auto_now=True)),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='annotation', to='api.message')),
+            ],
+        ),
+    ]
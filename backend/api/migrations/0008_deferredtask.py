@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_chatidempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analyticsmetric',
+            name='metric_type',
+            field=models.CharField(choices=[('avg_rating', 'Average Rating'), ('cultural_score', 'Cultural Appropriateness Score'), ('response_time', 'Average Response Time'), ('feedback_count', 'Feedback Count'), ('common_issue', 'Common Issue'), ('chat_turns', 'Chat Turns')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DeferredTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('dead', 'Dead letter')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='api_deferre_status_e520f5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def drop_duplicate_metrics(apps, schema_editor):
+    # Keep the newest row of each (metric_type, date) before it becomes unique
+    AnalyticsMetric = apps.get_model('api', 'AnalyticsMetric')
+    keep = AnalyticsMetric.objects.values('metric_type', 'date').annotate(newest=models.Max('id')).values('newest')
+    AnalyticsMetric.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_conversationsession_external_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analyticsmetric',
+            index=models.Index(fields=['date', 'metric_type'], name='api_analyti_date_b71cfd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatidempotencyrecord',
+            index=models.Index(fields=['created_at'], name='api_chatide_created_87b2e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expertreview',
+            index=models.Index(fields=['created_at'], name='api_expertr_created_d36d27_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['created_at'], name='api_feedbac_created_2f98c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp'], name='api_message_session_5d9d51_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['created_at'], name='api_task_created_9da793_idx'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='api.conversationsession'),
+        ),
+        migrations.RunPython(drop_duplicate_metrics, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='analyticsmetric',
+            constraint=models.UniqueConstraint(fields=('metric_type', 'date'), name='unique_analytics_metric_per_day'),
+        ),
+    ]
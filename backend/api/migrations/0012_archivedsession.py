@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.BigIntegerField(unique=True)),
+                ('external_id', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('has_feedback', models.BooleanField(default=False)),
+                ('first_activity_at', models.DateTimeField()),
+                ('last_activity_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_activity_at'], name='api_archive_last_ac_4aa505_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+import api.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def _copy_content(apps, schema_editor, source, target):
+    Message = apps.get_model('api', 'Message')
+    using = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        batch = list(Message.objects.using(using).filter(id__gt=last_id).order_by('id').only('id', source)[:BATCH_SIZE])
+        if not batch:
+            break
+        for message in batch:
+            setattr(message, target, getattr(message, source))
+        Message.objects.using(using).bulk_update(batch, [target])
+        last_id = batch[-1].id
+
+
+def compress_content(apps, schema_editor):
+    _copy_content(apps, schema_editor, 'content', 'compressed_content')
+
+
+def decompress_content(apps, schema_editor):
+    _copy_content(apps, schema_editor, 'compressed_content', 'content')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_archivedsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dict_id', models.PositiveBigIntegerField(unique=True)),
+                ('data', models.BinaryField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # Text and binary columns do not convert in place on every database, so
+        # the content is copied into a new column that then takes its name
+        migrations.AddField(
+            model_name='message',
+            name='compressed_content',
+            field=api.fields.CompressedTextField(null=True),
+        ),
+        # Nullable while either column may be empty, so the migration can be reversed
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_content, decompress_content, hints={'model_name': 'message'}),
+        migrations.RemoveField(
+            model_name='message',
+            name='content',
+        ),
+        migrations.RenameField(
+            model_name='message',
+            old_name='compressed_content',
+            new_name='content',
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='content',
+            field=api.fields.CompressedTextField(),
+        ),
+    ]
@@ -0,0 +1,134 @@
+"""
+Latency-Aware Model Router
+
+Classifies each chat turn cheaply (message length, regex medical entities and
+the session language) and routes it to an LLM endpoint:
+
+- 'clinical' turns stay on the full model (LLM endpoint 'chat', gpt-4o)
+- 'simple' turns without clinical content - greetings, thanks, short
+  clarifications - go to the faster, cheaper model (endpoint 'chat_simple')
+
+Models, deadlines and hedging of each endpoint are configured in
+LLM_ENDPOINTS; the routing rules in LLM_ROUTING. Every decision is logged and
+counted, and the latency, tokens and estimated cost of each route are recorded
+in the runtime metrics registry under router.<route>.* for tuning.
+"""
+
+import logging
+
+from .medical_ner import extract_medical_entities
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'ROUTES': {
+        'clinical': 'chat',
+        'simple': 'chat_simple',
+    },
+    'SIMPLE_MAX_WORDS': 12,
+    # Languages the small model handles well enough; others stay on the full model
+    'SIMPLE_LANGUAGES': ['en', 'en-pidgin'],
+    # Any of these entity types makes a turn clinical
+    'CLINICAL_ENTITY_TYPES': ['MEDICATION', 'SYMPTOM', 'SEVERITY', 'DURATION', 'CONDITION', 'VITALS'],
+    # Short replies to a question from the assistant ("yes", "since monday") carry clinical context
+    'CLINICAL_IF_ANSWERING_QUESTION': True,
+    # USD per 1M tokens, used for cost estimates only
+    'MODEL_COSTS': {
+        'gpt-4o': {'input': 2.50, 'cached_input': 1.25, 'output': 10.00},
+        'gpt-4o-mini': {'input': 0.15, 'cached_input': 0.075, 'output': 0.60},
+    },
+}
+
+
+def get_routing_settings():
+    """Get the routing configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'LLM_ROUTING', {}))
+    return config
+
+
+def classify_turn(message, language='en', previous_reply=None, config=None):
+    """
+    Decide which route a chat turn should take
+
+    Args:
+        message (str): The user's message
+        language (str): Session language from the language identifier
+        previous_reply (str): The assistant's previous message, if any
+        config (dict): Routing settings (defaults to LLM_ROUTING)
+
+    Returns:
+        dict: {'route', 'endpoint', 'reason', 'features'} - the rule that decided and the features used
+    """
+    config = config or get_routing_settings()
+    routes = config['ROUTES']
+
+    word_count = len(message.split())
+    entities = extract_medical_entities(message) or {}
+    clinical_types = sorted(set(entities) & set(config['CLINICAL_ENTITY_TYPES']))
+    answering_question = bool(previous_reply and previous_reply.rstrip().endswith('?'))
+    features = {
+        'words': word_count,
+        'entity_types': clinical_types,
+        'language': language,
+        'answering_question': answering_question,
+    }
+
+    if not config['ENABLED']:
+        reason = 'disabled'
+    elif clinical_types:
+        reason = 'entities'
+    elif word_count > config['SIMPLE_MAX_WORDS']:
+        reason = 'length'
+    elif language not in config['SIMPLE_LANGUAGES']:
+        reason = 'language'
+    elif answering_question and config['CLINICAL_IF_ANSWERING_QUESTION']:
+        reason = 'answering_question'
+    else:
+        return _decision('simple', routes, 'no_clinical_content', features)
+    return _decision('clinical', routes, reason, features)
+
+
+def _decision(route, routes, reason, features):
+    return {'route': route, 'endpoint': routes[route], 'reason': reason, 'features': features}
+
+
+def estimate_cost(model, token_usage, config=None):
+    """Estimated USD cost of a call from its token usage, or None for unknown models"""
+    config = config or get_routing_settings()
+    prices = config['MODEL_COSTS'].get(model)
+    if not prices or not token_usage:
+        return None
+    prompt_tokens = token_usage.get('prompt_tokens', 0)
+    cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+    completion_tokens = token_usage.get('completion_tokens', 0)
+    cost = ((prompt_tokens - cached_tokens) * prices['input']
+            + cached_tokens * prices.get('cached_input', prices['input'])
+            + completion_tokens * prices['output'])
+    return cost / 1_000_000
+
+
+def record_routed_call(decision, response, latency):
+    """Log and count a routed LLM call with its latency, tokens and estimated cost"""
+    metadata = getattr(response, 'response_metadata', None) or {}
+    model = metadata.get('model_name', 'unknown')
+    token_usage = metadata.get('token_usage') or {}
+    cost = estimate_cost(model, token_usage)
+
+    prefix = f"router.{decision['route']}"
+    metrics.incr(f"{prefix}.calls")
+    metrics.incr(f"{prefix}.reason.{decision['reason']}")
+    metrics.observe(f"{prefix}.latency", latency)
+    metrics.incr(f"{prefix}.tokens", token_usage.get('total_tokens', 0))
+    if cost is not None:
+        metrics.incr(f"{prefix}.cost_usd", cost)
+
+    cost_text = f"${cost:.6f}" if cost is not None else "n/a"
+    logger.info(
+        f"Routed turn: route={decision['route']} reason={decision['reason']} model={model} "
+        f"latency={latency * 1000:.0f}ms tokens={token_usage.get('total_tokens', 0)} cost={cost_text} "
+        f"features={decision['features']}"
+    )
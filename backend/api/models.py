@@ -1,4 +1,6 @@
 from django.db import models
+from django.utils import timezone
+from .fields import CompressedTextField
 
 # Create your models here.
 
@@ -9,6 +11,11 @@ class Task(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -16,6 +23,8 @@ class ConversationSession(models.Model):
     """
     Represents a chat session between a user and the AI assistant.
     """
+    # Session id sent by the client (e.g. 'session-xxxx'); numeric ids are primary keys instead
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -35,16 +44,146 @@ class Message(models.Model):
     session = models.ForeignKey(
         ConversationSession,
         on_delete=models.CASCADE,
-        related_name="messages"
+        related_name="messages",
+        db_index=False  # Covered by the (session, timestamp) index
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
-    content = models.TextField()
+    content = CompressedTextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'timestamp']),
+        ]
+
     def __str__(self):
         snippet = self.content[:20].replace("\n", " ")
         return f"[{self.session.id}] {self.role}: {snippet}"
 
+class MessageAnnotation(models.Model):
+    """
+    Medical entities and emotion extracted from a Message
+    """
+    message = models.OneToOneField(
+        Message,
+        on_delete=models.CASCADE,
+        related_name='annotation'
+    )
+    entities = models.JSONField(default=dict, blank=True)
+    emotion = models.CharField(max_length=20, default='unknown')
+    emotion_confidence = models.FloatField(default=0.0)
+    annotated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Annotation for message {self.message_id} ({self.emotion})"
+
+class SessionSummary(models.Model):
+    """
+    Clinical summary precomputed for a ConversationSession, current while no
+    message newer than last_message_id exists
+    """
+    session = models.OneToOneField(
+        ConversationSession,
+        on_delete=models.CASCADE,
+        related_name='stored_summary'
+    )
+    last_message_id = models.BigIntegerField()  # Newest message the summary covers
+    data = models.JSONField(default=dict)  # The summary endpoint's response body
+    generated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of session {self.session_id} up to message {self.last_message_id}"
+
+class CompressionDictionary(models.Model):
+    """
+    zstd dictionary for compressed message content (see api/compression.py)
+
+    Never edited or deleted: stored values name the dictionary they need.
+    """
+    dict_id = models.PositiveBigIntegerField(unique=True)  # Id zstd writes into each frame header
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Compression dictionary {self.dict_id} ({self.sample_count} samples)"
+
+class ArchivedSession(models.Model):
+    """
+    Where a ConversationSession moved to cold storage lives (see api/archive.py)
+    """
+    session_id = models.BigIntegerField(unique=True)  # Primary key of the archived session
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    path = models.CharField(max_length=255)  # Archive file, relative to the archive directory
+    offset = models.BigIntegerField()  # Byte offset of the session's record in the file
+    length = models.PositiveIntegerField()  # Compressed size of the record
+    message_count = models.PositiveIntegerField(default=0)
+    has_feedback = models.BooleanField(default=False)
+    first_activity_at = models.DateTimeField()
+    last_activity_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_activity_at']),
+        ]
+
+    def __str__(self):
+        return f"Archived session {self.session_id} ({self.path})"
+
+class ChatIdempotencyRecord(models.Model):
+    """
+    Stored outcome of a chat POST sent with an idempotency key, so client retries
+    get the original reply instead of another LLM call
+    """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("completed", "Completed"),
+    ]
+    key = models.CharField(max_length=64, unique=True)  # SHA-256 of session id + client key
+    request_hash = models.CharField(max_length=64)  # SHA-256 of the message
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_data = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),  # Pruning of expired records
+        ]
+
+    def __str__(self):
+        return f"Idempotency record {self.key[:12]} ({self.status})"
+
+class DeferredTask(models.Model):
+    """
+    Queued post-response work (annotation, context extraction, analytics) run by manage.py run_workers
+    """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("dead", "Dead letter"),
+    ]
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)  # Not run before this (retry backoff)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status}, attempt {self.attempts})"
+
 class Feedback(models.Model):
     """Model to store user feedback on AI responses"""
     session = models.ForeignKey(
@@ -58,6 +197,11 @@ class Feedback(models.Model):
     culturally_appropriate = models.BooleanField(default=True)
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"Feedback: {self.rating}/5 - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
@@ -77,6 +221,7 @@ class UserContext(models.Model):
     medical_history = models.JSONField(default=list, blank=True)
     cultural_preferences = models.JSONField(default=dict, blank=True)
     language = models.CharField(max_length=20, default='en')
+    language_confidence = models.FloatField(default=0.0)  # 1.0 when chosen by the user
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -98,6 +243,11 @@ class ExpertReview(models.Model):
     suggested_correction = models.TextField(blank=True)
     additional_notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"Expert Review by {self.reviewer_name} - {self.created_at.strftime('%Y-%m-%d')}"
@@ -112,6 +262,7 @@ class AnalyticsMetric(models.Model):
         ('response_time', 'Average Response Time'),
         ('feedback_count', 'Feedback Count'),
         ('common_issue', 'Common Issue'),
+        ('chat_turns', 'Chat Turns'),
     ]
     
     metric_type = models.CharField(max_length=20, choices=METRIC_TYPES)
@@ -119,6 +270,15 @@ class AnalyticsMetric(models.Model):
     text_value = models.TextField(blank=True, null=True)  # For storing text-based metrics
     date = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # One value per metric and day; metrics are written with upserts on these fields
+            models.UniqueConstraint(fields=['metric_type', 'date'], name='unique_analytics_metric_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'metric_type']),
+        ]
     
     def __str__(self):
         return f"{self.get_metric_type_display()}: {self.value} ({self.date})"
@@ -0,0 +1,232 @@
+"""
+List Pagination
+
+Keyset (cursor) pagination, field projection and streamed rendering for the
+list endpoints (expert reviews, analytics metrics, voice sessions and their
+participants), so a request costs the same however large the table grows:
+
+- Rows are ordered by a unique key, e.g. (created_at, id), and the next page
+  starts after the last row of this one: WHERE (created_at, id) < (...),
+  which the key's index answers directly instead of skipping an OFFSET
+- ?fields=id,created_at returns only those serializer fields and loads only
+  their columns (QuerySet.only())
+- The page is rendered row by row into a streamed JSON array, so the whole
+  document is never built in memory
+
+The body is the same JSON array as before; the cursor of the next page is
+in the Link (rel="next") and X-Next-Cursor headers, and absent on the last
+page. ?limit= sets the page size (default DEFAULT_LIMIT, at most MAX_LIMIT).
+Lists spread over the session shards fetch one page from each shard and
+merge them (api/sharding.py).
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .sharding import fan_out
+
+DEFAULT_SETTINGS = {
+    'DEFAULT_LIMIT': 50,
+    'MAX_LIMIT': 500,
+    'STREAM_CHUNK_ROWS': 100,  # Rows rendered per chunk of the streamed response
+}
+
+
+class PaginationError(ValueError):
+    """An invalid limit, cursor or fields parameter"""
+
+
+def get_pagination_settings():
+    """Get the list pagination configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'LIST_PAGINATION', {}))
+    return config
+
+
+def _ordering_fields(model, ordering):
+    """(field, descending) for each ordering term"""
+    return [
+        (model._meta.pk if term.lstrip('-') == 'pk' else model._meta.get_field(term.lstrip('-')), term.startswith('-'))
+        for term in ordering
+    ]
+
+
+def encode_cursor(row, ordering):
+    """The cursor of the page after `row`: its ordering key, base64-encoded JSON"""
+    values = [field.value_to_string(row) for field, _ in _ordering_fields(type(row), ordering)]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, model, ordering):
+    """
+    The ordering key a cursor points after
+
+    Raises:
+        PaginationError: When the cursor was not made for this ordering
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        fields = _ordering_fields(model, ordering)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise PaginationError('Invalid cursor')
+        return [field.to_python(value) for (field, _), value in zip(fields, values)]
+    except (UnicodeEncodeError, binascii.Error, ValueError, ValidationError):
+        raise PaginationError('Invalid cursor')
+
+
+def after_cursor(model, ordering, values):
+    """
+    Filter for the rows after a key in an ordering
+
+    For ('-created_at', '-id'): created_at < c OR (created_at = c AND id < i)
+
+    Returns:
+        Q: Filter for QuerySet.filter()
+    """
+    condition = Q()
+    equal = Q()
+    for (field, descending), value in zip(_ordering_fields(model, ordering), values):
+        condition |= equal & Q(**{f"{field.name}__{'lt' if descending else 'gt'}": value})
+        equal &= Q(**{field.name: value})
+    return condition
+
+
+def parse_limit(request):
+    """The requested page size, capped at MAX_LIMIT"""
+    config = get_pagination_settings()
+    limit = request.query_params.get('limit')
+    if limit in (None, ''):
+        return config['DEFAULT_LIMIT']
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be positive')
+    return min(limit, config['MAX_LIMIT'])
+
+
+def parse_fields(request, serializer):
+    """
+    The serializer fields requested with ?fields=, in the serializer's order
+
+    Returns:
+        list: Field names, or None for every field
+    """
+    requested = request.query_params.get('fields')
+    if not requested:
+        return None
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names - set(serializer.fields)
+    if unknown:
+        raise PaginationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in serializer.fields if name in names]
+
+
+def projected_columns(model, serializer, fields, ordering):
+    """
+    The model fields QuerySet.only() needs to render some serializer fields
+
+    Returns:
+        set: Model field names, or None when a field does not map to a column
+    """
+    columns = {model._meta.pk.name}
+    columns.update(field.name for field, _ in _ordering_fields(model, ordering))
+    for name in fields:
+        source = serializer.fields[name].source
+        if source.startswith('get_') and source.endswith('_display'):
+            source = source[len('get_'):-len('_display')]
+        try:
+            field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete:
+            return None
+        columns.add(field.name)
+    return columns
+
+
+def sort_rows(rows, ordering):
+    """Sort rows (from several shards) by an ordering, ascending or descending per term"""
+    for term in reversed(ordering):
+        name = term.lstrip('-')
+        rows.sort(key=lambda row: getattr(row, name), reverse=term.startswith('-'))
+    return rows
+
+
+def stream_json(rows, serializer, fields=None):
+    """
+    Render rows as a JSON array, a chunk of rows at a time
+
+    The serializer's fields are built once and reused for every row.
+    """
+    if fields is not None:
+        for name in [name for name in serializer.fields if name not in fields]:
+            serializer.fields.pop(name)
+    chunk_rows = get_pagination_settings()['STREAM_CHUNK_ROWS']
+    yield '['
+    for start in range(0, len(rows), chunk_rows):
+        chunk = ','.join(
+            json.dumps(serializer.to_representation(row), cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+            for row in rows[start:start + chunk_rows]
+        )
+        yield f',{chunk}' if start else chunk
+    yield ']'
+
+
+def paginate(request, queryset, serializer_class, ordering, shards=None):
+    """
+    A page of a list endpoint, streamed
+
+    Args:
+        request: The DRF request (?limit=, ?cursor=, ?fields=)
+        queryset: The rows to list, filtered but not ordered
+        serializer_class: Renders each row; ?fields= picks among its fields
+        ordering (tuple): Unique sort key, e.g. ('-created_at', '-id')
+        shards (list): Fetch the page from each of these databases and merge
+
+    Returns:
+        StreamingHttpResponse: The page, or a 400 Response for invalid parameters
+    """
+    model = queryset.model
+    serializer = serializer_class()
+    try:
+        limit = parse_limit(request)
+        fields = parse_fields(request, serializer)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            queryset = queryset.filter(after_cursor(model, ordering, decode_cursor(cursor, model, ordering)))
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = queryset.order_by(*ordering)
+    if fields is not None:
+        columns = projected_columns(model, serializer, fields, ordering)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+
+    # One row past the page tells whether there is a next one
+    if shards is None:
+        rows = list(queryset[:limit + 1])
+    else:
+        rows = sort_rows([row for part in fan_out(lambda alias: list(queryset.using(alias)[:limit + 1]), shards)
+                          for row in part], ordering)[:limit + 1]
+    rows, more = rows[:limit], len(rows) > limit
+
+    response = StreamingHttpResponse(stream_json(rows, serializer, fields), content_type='application/json')
+    if more:
+        next_cursor = encode_cursor(rows[-1], ordering)
+        params = request.query_params.copy()
+        params['cursor'] = next_cursor
+        response['Link'] = f'<{request.build_absolute_uri(request.path)}?{params.urlencode()}>; rel="next"'
+        response['X-Next-Cursor'] = next_cursor
+    return response
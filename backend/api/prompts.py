@@ -0,0 +1,323 @@
+"""
+Prompt Assembly
+
+Precompiled prompt templates for the chat and summary endpoints. Prompts are
+assembled so that the start of every request is byte-identical across users
+and turns, which lets the provider's prompt-prefix cache reuse it:
+
+1. Base system prompt (shared by every request)
+2. Language guidance (stable for a session)
+3. Conversation history (append-only within a session)
+4. Compact patient context block (from UserContext, changes between turns)
+5. Current message
+
+Variable parts never modify the base prompt. When a context block is
+available, long histories are trimmed to a recent window, since the
+clinical facts of older turns are carried by the context block. Tokens are counted per section,
+and cached-prefix hits are read from the provider's usage fields, both into
+the runtime metrics registry under prompt.*.
+"""
+
+import logging
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.prompts import PromptTemplate
+
+from .language_id import LANGUAGE_NAMES
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model('gpt-4o')
+except Exception:
+    # tiktoken is optional; fall back to the ~4 characters per token rule of thumb
+    _encoding = None
+
+DEFAULT_SETTINGS = {
+    'HISTORY_WINDOW': 12,  # Messages kept when a context block is available
+    'HISTORY_TRIM_STEP': 6,  # Trim in steps so the history prefix stays stable for several turns
+}
+
+BASE_SYSTEM_PROMPT = """You are EleraAI, a healthcare assistant specializing in providing medical information for users in African regions.
+
+When responding to health concerns:
+1. Provide accurate, clear and compassionate healthcare advice
+2. Ask follow-up questions to better understand the user's condition (always include at least one relevant follow-up question)
+3. Inquire about both modern and traditional remedies they might have tried
+4. Be sensitive to cultural contexts around health and acknowledge local healing practices
+5. Clearly state when a condition requires professional medical attention
+6. Use a conversational, warm tone without excessive formatting
+
+For symptom assessment, follow this general structure:
+- Acknowledge the user's concern
+- Offer preliminary information about possible causes
+- Ask about symptom details (duration, severity, triggers)
+- Inquire about related symptoms
+- Ask if they've tried any treatments (including traditional remedies)
+- Provide helpful advice while being clear about your limitations
+
+Remember to:
+- Format your responses in a natural, readable way
+- Use short paragraphs with appropriate spacing between ideas
+- Don't use markdown formatting like asterisks or numbered points
+- Maintain a conversation flow rather than a clinical assessment"""
+
+PIDGIN_GUIDANCE = """The user is speaking Nigerian Pidgin. Respond in a mix of standard English and Nigerian Pidgin.
+Use natural Pidgin phrases without making the text too formal or structured.
+Common medical terms in Pidgin include:
+- "Belle pain" for stomach pain
+- "Dey purge" for diarrhea
+- "Fever dey worry me" for having a fever
+- "Body dey hot" for fever or high temperature
+- "I dey feel weak" for fatigue
+
+Speak in a warm, friendly tone as if you're talking to a friend.
+Ask about local treatments like herbs or traditional medicine they might have used."""
+
+LOCAL_LANGUAGE_GUIDANCE = PromptTemplate.from_template(
+    """The user appears to be writing in {language_name}. Respond in simple, clear English,
+using common {language_name} greetings and phrases where they feel natural."""
+)
+
+URGENT_ELABORATION_INSTRUCTION = (
+    "You have already told the user to seek emergency care (previous message). "
+    "Follow up briefly: explain why these symptoms are concerning, what to do while "
+    "waiting for help, and what information to give the emergency team. "
+    "Do not repeat the previous message and do not suggest waiting at home."
+)
+
+SUMMARY_SYSTEM_PROMPT = """You are a medical documentation assistant. Based on the following conversation between a patient and a virtual healthcare assistant, generate a clinical summary for a doctor.
+
+Your summary must include:
+1. **Patient's main symptoms** (with severity and duration if mentioned)
+2. **Relevant medical conditions or history**
+3. **Any medications, treatments, or vital signs referenced**
+4. **Patient's emotional state during the conversation**
+5. **Any lifestyle or contextual clues (e.g. sleep, stress, work)**
+6. **Questions or concerns raised by the patient**
+7. **Suggested next steps or further assessments if applicable**
+
+Format your output clearly. Aim for 5–8 sentences that a doctor could quickly read before consultation."""
+
+SUMMARY_INPUT_TEMPLATE = PromptTemplate.from_template(
+    """Conversation:
+{conversation}
+
+---
+
+Detected Medical Entities:
+{entity_summary}
+
+Patient Emotional Overview:
+{emotion_summary}"""
+)
+
+
+def count_tokens(text):
+    """Count (or estimate without tiktoken) the tokens in a text"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def get_language_guidance(language):
+    """Get the language guidance block for a session language, or None for English"""
+    if language == 'en-pidgin':
+        return PIDGIN_GUIDANCE
+    if language in ('yo', 'ig', 'ha'):
+        return LOCAL_LANGUAGE_GUIDANCE.format(language_name=LANGUAGE_NAMES[language])
+    return None
+
+
+def get_prompt_settings():
+    """Get the prompt assembly configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'CHAT_PROMPT', {}))
+    return config
+
+
+def build_context_block(user_context):
+    """
+    Summarize a UserContext as a compact block of clinical facts
+
+    Returns:
+        str: The context block, or None when nothing is known yet
+    """
+    if user_context is None:
+        return None
+
+    lines = []
+    durations = {name.lower(): value for name, value in (user_context.symptom_durations or {}).items() if value}
+    symptoms = []
+    for name, details in (user_context.symptoms or {}).items():
+        facts = []
+        # Entries added from chat carry a placeholder severity unless the patient gave one
+        if isinstance(details, dict) and details.get('severity') and details.get('severity_reported', True):
+            facts.append(f"severity {details['severity']}/5")
+        if durations.get(name.lower()):
+            facts.append(durations[name.lower()])
+        symptoms.append(f"{name} ({', '.join(facts)})" if facts else name)
+    if symptoms:
+        lines.append(f"- Symptoms: {'; '.join(symptoms)}")
+
+    treatments = []
+    for treatment in user_context.treatments_tried or []:
+        if not isinstance(treatment, dict) or not treatment.get('name'):
+            continue
+        outcome = {True: 'helped', False: 'did not help'}.get(treatment.get('effective'))
+        treatments.append(f"{treatment['name']} ({outcome})" if outcome else treatment['name'])
+    if treatments:
+        lines.append(f"- Treatments tried: {'; '.join(treatments)}")
+
+    conditions = [
+        f"{item['condition']} ({item['duration']})" if item.get('duration') else item['condition']
+        for item in user_context.medical_history or []
+        if isinstance(item, dict) and item.get('condition')
+    ]
+    if conditions:
+        lines.append(f"- Medical history: {'; '.join(conditions)}")
+
+    if not lines:
+        return None
+    return "Known patient context from this conversation (use it, do not ask again):\n" + "\n".join(lines)
+
+
+def trim_history(history, window, step):
+    """
+    Keep the most recent messages, dropping older ones in steps of `step`
+
+    Dropping in steps (rather than one message per turn) keeps the start of the
+    history identical for several turns, so the provider's prefix cache still hits.
+    """
+    if window is None or len(history) <= window:
+        return history
+    drop = ((len(history) - window) // step + 1) * step
+    return history[drop:]
+
+
+def _record_sections(name, tokens):
+    """Add the token count of each prompt section to the runtime metrics"""
+    metrics.incr(f'prompt.{name}.builds')
+    for section, count in tokens.items():
+        metrics.incr(f'prompt.{name}.tokens.{section}', count)
+    return tokens
+
+
+def build_chat_prompt(history, message, language='en', user_context=None):
+    """
+    Assemble the chat messages with the stable base prompt first
+
+    Args:
+        history (list): Earlier Message objects of the session, oldest first
+        message (str): The current user message
+        language (str): Session language from the language identifier
+        user_context (UserContext): Known clinical facts; enables history trimming
+
+    Returns:
+        dict: {'messages': LangChain messages, 'tokens': token count per section,
+               'trimmed': number of history messages left out}
+    """
+    messages = [SystemMessage(content=BASE_SYSTEM_PROMPT)]
+    context_block = build_context_block(user_context)
+
+    trimmed = 0
+    if context_block:
+        config = get_prompt_settings()
+        kept = trim_history(history, config['HISTORY_WINDOW'], config['HISTORY_TRIM_STEP'])
+        trimmed = len(history) - len(kept)
+        history = kept
+        if trimmed:
+            metrics.incr('prompt.chat.trimmed_messages', trimmed)
+
+    guidance = get_language_guidance(language)
+    if guidance:
+        messages.append(SystemMessage(content=guidance))
+
+    history_tokens = 0
+    for msg in history:
+        if msg.role == 'user':
+            messages.append(HumanMessage(content=msg.content))
+        else:
+            messages.append(AIMessage(content=msg.content))
+        # Messages from the conversation state cache carry their token count
+        token_count = getattr(msg, 'token_count', None)
+        history_tokens += token_count if token_count is not None else count_tokens(msg.content)
+
+    if context_block:
+        messages.append(SystemMessage(content=context_block))
+
+    messages.append(HumanMessage(content=message))
+
+    tokens = _record_sections('chat', {
+        'base': count_tokens(BASE_SYSTEM_PROMPT),
+        'language': count_tokens(guidance),
+        'history': history_tokens,
+        'context': count_tokens(context_block),
+        'message': count_tokens(message),
+    })
+    return {'messages': messages, 'tokens': tokens, 'trimmed': trimmed}
+
+
+def build_urgent_elaboration_prompt(chat_messages, urgent_reply):
+    """Extend a chat prompt with the templated urgent reply and the follow-up instruction"""
+    return chat_messages + [
+        AIMessage(content=urgent_reply),
+        SystemMessage(content=URGENT_ELABORATION_INSTRUCTION),
+    ]
+
+
+def build_summary_prompt(conversation, entity_summary, emotion_summary):
+    """Assemble the clinical summary prompt: fixed instructions first, session data after"""
+    session_data = SUMMARY_INPUT_TEMPLATE.format(
+        conversation=conversation,
+        entity_summary=entity_summary,
+        emotion_summary=emotion_summary,
+    )
+    tokens = _record_sections('summary', {
+        'base': count_tokens(SUMMARY_SYSTEM_PROMPT),
+        'session': count_tokens(session_data),
+    })
+    return {
+        'messages': [SystemMessage(content=SUMMARY_SYSTEM_PROMPT), HumanMessage(content=session_data)],
+        'tokens': tokens,
+    }
+
+
+def record_prompt_usage(name, response):
+    """Record prompt and cached-prefix token counts from a provider response"""
+    token_usage = (getattr(response, 'response_metadata', None) or {}).get('token_usage') or {}
+    prompt_tokens = token_usage.get('prompt_tokens')
+    if not prompt_tokens:
+        return
+    cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    metrics.incr(f'prompt.{name}.responses')
+    metrics.incr(f'prompt.{name}.prompt_tokens', prompt_tokens)
+    metrics.incr(f'prompt.{name}.cached_tokens', cached_tokens)
+    if cached_tokens:
+        metrics.incr(f'prompt.{name}.cache_hits')
+
+
+def prompt_cache_stats():
+    """
+    Cached-prefix hit rates per prompt
+
+    Returns:
+        dict: {name: {'responses', 'hit_rate', 'cached_token_ratio'}}
+    """
+    stats = {}
+    for name in ('chat', 'summary'):
+        responses = metrics.get(f'prompt.{name}.responses')
+        if not responses:
+            continue
+        prompt_tokens = metrics.get(f'prompt.{name}.prompt_tokens')
+        stats[name] = {
+            'responses': responses,
+            'hit_rate': metrics.get(f'prompt.{name}.cache_hits') / responses,
+            'cached_token_ratio': metrics.get(f'prompt.{name}.cached_tokens') / prompt_tokens if prompt_tokens else 0.0,
+        }
+    return stats
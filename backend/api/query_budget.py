@@ -0,0 +1,82 @@
+"""
+Query Budgets
+
+Test support for keeping the API's database access flat:
+
+- assertQueryBudget fails when a block runs more queries than its budget, so
+  an N+1 regression (a query per row) fails the endpoint's test
+- On SQLite, every captured statement is run through EXPLAIN QUERY PLAN and
+  full scans of the project's tables fail the test, so a hot query that
+  stops using its index is caught as well
+
+Used by api/tests.py and voice_service/tests.py.
+"""
+
+import re
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+PROJECT_APPS = ('api', 'voice_service')
+
+# Statements EXPLAIN QUERY PLAN cannot describe or that never read a table
+_SKIPPED_STATEMENTS = re.compile(r'^\s*(SAVEPOINT|RELEASE|ROLLBACK|BEGIN|COMMIT|INSERT)\b', re.IGNORECASE)
+_FULL_SCAN = re.compile(r'^SCAN (\w+)(?! USING (COVERING )?INDEX)(?! USING INTEGER PRIMARY KEY)')
+
+
+def project_tables():
+    """Database tables of the project's models"""
+    return {model._meta.db_table for app in PROJECT_APPS for model in apps.get_app_config(app).get_models()}
+
+
+def full_table_scans(queries, using='default', allowed=()):
+    """
+    Statements that scan a whole project table (SQLite only)
+
+    Args:
+        queries (list): Captured queries ({'sql': ...})
+        allowed: Tables whose full scans are expected
+
+    Returns:
+        list: (table, sql) for each full scan; always empty on other databases
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return []
+    tables = project_tables() - set(allowed)
+    scans = []
+    with connection.cursor() as cursor:
+        for query in queries:
+            sql = query['sql']
+            if _SKIPPED_STATEMENTS.match(sql):
+                continue
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            for row in cursor.fetchall():
+                match = _FULL_SCAN.match(row[-1])
+                if match and match.group(1) in tables:
+                    scans.append((match.group(1), sql))
+    return scans
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting query budgets and index use
+    """
+
+    # Tables whose full scans are expected (e.g. lists of every row)
+    ALLOWED_SCANS = ()
+
+    @contextmanager
+    def assertQueryBudget(self, budget, label='', using='default'):
+        """Fail when the block runs more than `budget` queries or scans a project table"""
+        with CaptureQueriesContext(connections[using]) as captured:
+            yield captured
+        queries = captured.captured_queries
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{label} ran {len(queries)} queries (budget {budget}):\n" + '\n'.join(q['sql'] for q in queries),
+        )
+        scans = full_table_scans(queries, using, self.ALLOWED_SCANS)
+        self.assertEqual(scans, [], f"{label} scans whole tables instead of using an index")
@@ -0,0 +1,222 @@
+"""
+Read Replicas
+
+The heavy read-only workloads (analytics metrics, the dashboard, the training
+data export) read from a replica of each database, so their scans do not
+compete with chat writes on the primary. settings.DATABASE_REPLICATION
+['REPLICAS'] maps each primary alias ('default', 'shard1', ...) to its
+replica (see eleraai_backend/database.py).
+
+Reads only go to a replica inside replica_reads(), and then only when:
+
+- The client is not pinned to the primary: after an unsafe request (a chat
+  message, feedback, ...) ReplicaPinningMiddleware pins the client to the
+  primary for PIN_SECONDS with a cookie, so it reads its own writes
+- The replica answers and is at most MAX_LAG_SECONDS behind its primary
+  (checked at most every LAG_CHECK_SECONDS); otherwise reads fall back to
+  the primary. PostgreSQL reports its replay lag; for other databases (a
+  SQLite replica file) the lag is the gap between the newest rows of the hot
+  tables (LAG_PROBES) on the primary and on the replica, so a copy that was
+  never synced is never read
+
+Queries that name their database (the shard fan-out's .using(alias)) read
+from read_db(alias); other reads are routed by api.routers.ReplicaRouter.
+Writes always go to the primary.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DatabaseError, connections
+
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'REPLICAS': {},  # Primary alias -> replica alias
+    'MAX_LAG_SECONDS': 10,
+    'LAG_CHECK_SECONDS': 5,
+    'PIN_SECONDS': 15,
+}
+
+PIN_COOKIE = 'db_pinned'
+
+# Seconds the replica is behind; 0 when it has replayed everything it received
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Hot tables whose newest row tells how far a replica without lag reporting is behind: (model, timestamp field)
+LAG_PROBES = [
+    ('api.Message', 'timestamp'),
+    ('api.Feedback', 'created_at'),
+]
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_pinned = ContextVar('replica_pinned', default=False)
+
+_lag_checks = {}  # replica alias -> (monotonic time, healthy)
+_lag_lock = threading.Lock()
+
+
+def get_replication_settings():
+    """Get the read replica configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'DATABASE_REPLICATION', {}))
+    return config
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Let the reads in a block (and the shard fan-outs it starts) use replicas
+
+    Args:
+        enabled (bool): False to keep the block on the primary, e.g. right
+            after writing what it reads
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Keep every read in a block on the primary, even inside replica_reads()"""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def primary_of(alias):
+    """The primary a database alias replicates, or the alias itself"""
+    for primary, replica in get_replication_settings()['REPLICAS'].items():
+        if replica == alias:
+            return primary
+    return alias
+
+
+def _newest_rows(alias):
+    """The newest timestamp of each LAG_PROBES table on a database (None for an empty table)"""
+    from django.apps import apps
+    from django.db.models import Max
+    return [
+        apps.get_model(label)._base_manager.using(alias).aggregate(newest=Max(field))['newest']
+        for label, field in LAG_PROBES
+    ]
+
+
+def replica_lag(alias):
+    """
+    Seconds a replica is behind its primary
+
+    PostgreSQL reports its replay lag. For other databases it is estimated
+    from the newest rows of the LAG_PROBES tables: how much newer the
+    primary's are (an overestimate after a quiet spell, never an
+    underestimate), or infinity when the replica has none of a table's rows.
+
+    Returns:
+        float: Lag, or None when the replica cannot be queried
+    """
+    connection = connections[alias]
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRES_LAG_SQL)
+                return float(cursor.fetchone()[0])
+        replica_newest = _newest_rows(alias)
+        primary_newest = _newest_rows(primary_of(alias))
+    except DatabaseError as e:
+        logger.warning(f"Replica {alias} lag check failed, reading from the primary: {str(e)}")
+        return None
+    lag = 0.0
+    for primary, replica in zip(primary_newest, replica_newest):
+        if primary is None:
+            continue
+        if replica is None:
+            return float('inf')
+        lag = max(lag, (primary - replica).total_seconds())
+    return lag
+
+
+def replica_healthy(alias):
+    """Whether a replica is reachable and within MAX_LAG_SECONDS, re-checked every LAG_CHECK_SECONDS"""
+    config = get_replication_settings()
+    now = time.monotonic()
+    with _lag_lock:
+        checked = _lag_checks.get(alias)
+    if checked is not None and now - checked[0] < config['LAG_CHECK_SECONDS']:
+        return checked[1]
+    lag = replica_lag(alias)
+    healthy = lag is not None and lag <= config['MAX_LAG_SECONDS']
+    if lag == float('inf'):
+        logger.warning(f"Replica {alias} has none of its primary's recent rows (never synced?); reading from the primary")
+    elif lag is not None and not healthy:
+        logger.warning(f"Replica {alias} is {lag:.1f}s behind; reading from the primary")
+    with _lag_lock:
+        _lag_checks[alias] = (now, healthy)
+    return healthy
+
+
+def reset_replica_health():
+    """Forget the lag checks, e.g. after the settings change"""
+    with _lag_lock:
+        _lag_checks.clear()
+
+
+def read_db(alias='default'):
+    """
+    The database to read a primary's data from
+
+    Returns:
+        str: The primary's replica inside replica_reads() when it may be used,
+            otherwise the primary
+    """
+    if not _replica_reads.get() or _pinned.get():
+        return alias
+    replica = get_replication_settings()['REPLICAS'].get(alias)
+    if replica is None:
+        return alias
+    if not replica_healthy(replica):
+        metrics.incr('replicas.fallback_reads')
+        return alias
+    metrics.incr('replicas.replica_reads')
+    return replica
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes for clients: after an unsafe request, the client's reads
+    stay on the primary for PIN_SECONDS
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_replication_settings()
+        if not config['REPLICAS']:
+            return self.get_response(request)
+
+        token = _pinned.set(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        if request.method not in self.SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=config['PIN_SECONDS'], httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,88 @@
+"""
+Database routers
+"""
+
+from .replicas import primary_of, read_db
+from .sharding import SHARDED_MODELS, get_shards, is_sharded, shard_for
+
+# Field holding the id of a row that shares the shard, per sharded model
+_SHARD_KEYS = {
+    'api.conversationsession': 'pk',
+    'api.message': 'session_id',
+    'api.messageannotation': 'message_id',
+    'api.usercontext': 'session_id',
+    'api.sessionsummary': 'session_id',
+    'api.feedback': 'session_id',
+    'api.expertreview': 'feedback_id',
+    'voice_service.voicesession': 'conversation_id',
+    'voice_service.voicesessionparticipant': 'session_id',
+    'voice_service.voicetranscript': 'session_id',
+}
+
+
+class ReplicaRouter:
+    """
+    Routes reads inside replica_reads() to a replica of 'default' (see
+    api/replicas.py)
+
+    Queries with an instance hint are left to SessionShardRouter: they follow
+    the instance, which is on a replica when it was read from one.
+    """
+
+    def db_for_read(self, model, **hints):
+        if hints.get('instance') is not None:
+            return None
+        alias = read_db('default')
+        return alias if alias != 'default' else None
+
+    def db_for_write(self, model, **hints):
+        # Saving a row read from a replica writes to its primary
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and primary_of(instance._state.db) != instance._state.db:
+            return primary_of(instance._state.db)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from a replica relate to rows of its primary
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+
+class SessionShardRouter:
+    """
+    Routes conversation data to its session's shard (see api/sharding.py)
+
+    Only queries with an instance hint can be routed here: related managers
+    (session.messages...), saving an instance, and relations between
+    instances. Other queries on sharded models go to 'default' unless they
+    name their shard with .using().
+    """
+
+    def _shard_of(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None or not is_sharded(model):
+            return None
+        if instance._state.db:
+            return instance._state.db
+        if not is_sharded(type(instance)):
+            return None
+        key = getattr(instance, _SHARD_KEYS[type(instance)._meta.label_lower])
+        return shard_for(key) if key is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self._shard_of(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard_of(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in get_shards():
+            return None
+        # Shards only hold the sharded tables
+        return model_name is not None and f'{app_label}.{model_name}' in SHARDED_MODELS
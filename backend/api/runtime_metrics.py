@@ -0,0 +1,120 @@
+"""
+In-process runtime metrics
+
+Lightweight, thread-safe counters and latency recorders used by the chat
+hot path (caches, triage, LLM calls). Values live in the memory of the
+current worker process and are exposed through the runtime metrics endpoint.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Number of latency samples kept per metric for percentile estimates
+MAX_LATENCY_SAMPLES = 2048
+
+
+class RuntimeMetrics:
+    """
+    Collects counters and latency samples for the current process
+    """
+
+    def __init__(self, max_samples=MAX_LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._counters = defaultdict(int)
+        self._latencies = defaultdict(lambda: deque(maxlen=self._max_samples))
+        self._latency_counts = defaultdict(int)
+
+    def incr(self, name, amount=1):
+        """Increment a named counter"""
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name):
+        """Get the current value of a counter"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, name, seconds):
+        """Record a latency sample (in seconds) for a named operation"""
+        with self._lock:
+            self._latencies[name].append(seconds)
+            self._latency_counts[name] += 1
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager recording the wall time of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def sample_count(self, name):
+        """Get the number of latency samples currently held for a metric"""
+        with self._lock:
+            return len(self._latencies.get(name, ()))
+
+    def percentile(self, name, pct):
+        """Get a latency percentile (0-100) in seconds, or None without samples"""
+        with self._lock:
+            samples = sorted(self._latencies.get(name, ()))
+        return _percentile(samples, pct)
+
+    def snapshot(self, prefix=None):
+        """
+        Get a serializable view of all metrics
+
+        Args:
+            prefix (str): Only include metrics whose name starts with this prefix
+
+        Returns:
+            dict: Counters and latency summaries (milliseconds)
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = {name: sorted(samples) for name, samples in self._latencies.items()}
+            latency_counts = dict(self._latency_counts)
+
+        if prefix:
+            counters = {k: v for k, v in counters.items() if k.startswith(prefix)}
+            latencies = {k: v for k, v in latencies.items() if k.startswith(prefix)}
+
+        latency_summary = {}
+        for name, samples in latencies.items():
+            if not samples:
+                continue
+            latency_summary[name] = {
+                'count': latency_counts.get(name, len(samples)),
+                'mean_ms': (sum(samples) / len(samples)) * 1000,
+                'p50_ms': _percentile(samples, 50) * 1000,
+                'p95_ms': _percentile(samples, 95) * 1000,
+                'p99_ms': _percentile(samples, 99) * 1000,
+                'max_ms': samples[-1] * 1000,
+            }
+
+        return {
+            'counters': counters,
+            'latencies': latency_summary,
+        }
+
+    def reset(self):
+        """Clear all counters and samples"""
+        with self._lock:
+            self._counters.clear()
+            self._latencies.clear()
+            self._latency_counts.clear()
+
+
+def _percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    index = int(round((pct / 100.0) * (len(sorted_samples) - 1)))
+    return sorted_samples[max(0, min(index, len(sorted_samples) - 1))]
+
+
+# Process-wide metrics registry
+metrics = RuntimeMetrics()
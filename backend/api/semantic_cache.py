@@ -0,0 +1,358 @@
+"""
+Semantic Response Cache
+
+Opt-in cache of well-rated replies to first messages. Many conversations
+open with near-identical messages ("I have malaria symptoms", "my belle dey
+pain me"); instead of paying for another LLM call, the normalized first
+message is embedded locally with ClinicalBERT and compared against the first
+turns of earlier conversations that received a feedback rating of at least
+MIN_RATING. A hit above the similarity threshold returns the stored reply.
+The reply is the session's first assistant message as stored in the
+database, never the response text a client sent with its feedback.
+
+Entries are partitioned per language and evicted by TTL and LRU.
+
+The cache is loaded from the database (embedding up to WARM_MAX_ENTRIES
+rated replies) in a background thread started by the first lookup; until the
+load has finished, lookups are misses. A failed load is retried by a lookup
+after WARM_RETRY_SECONDS. New feedback is embedded on a background thread of
+the process whose cache it fills, so the feedback request does not wait for
+ClinicalBERT.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .emotion_cache import normalize_text
+from .medical_ner import embed_text
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': False,
+    'SIMILARITY_THRESHOLD': 0.95,  # Cosine similarity required for a hit
+    'MIN_RATING': 4,
+    'MAX_ENTRIES_PER_LANGUAGE': 2000,
+    'TTL_SECONDS': 7 * 24 * 60 * 60,
+    'MAX_MESSAGE_LENGTH': 300,  # Long first messages are too specific to reuse
+    'WARM_MAX_ENTRIES': 10000,  # Rated replies embedded when the cache is loaded
+    'WARM_RETRY_SECONDS': 60,
+}
+
+
+class SemanticCachePartition:
+    """
+    Flat (brute-force) cosine index for a single language
+    """
+
+    def __init__(self, dimensions, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.entries = []  # dicts aligned with rows of self.vectors
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, vector):
+        """Return (entry, similarity) of the nearest live entry, or (None, 0.0)"""
+        self.expire()
+        if not self.entries:
+            return None, 0.0
+        similarities = self.vectors @ vector
+        best = int(np.argmax(similarities))
+        return self.entries[best], float(similarities[best])
+
+    def add(self, vector, entry):
+        """Add or replace an entry keyed by its normalized text"""
+        for index, existing in enumerate(self.entries):
+            if existing['key'] == entry['key']:
+                self.vectors[index] = vector
+                self.entries[index] = entry
+                return
+        if len(self.entries) >= self.max_entries:
+            self.evict_lru()
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+        self.entries.append(entry)
+
+    def expire(self):
+        """Drop entries older than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        keep = [i for i, entry in enumerate(self.entries) if entry['added_at'] >= cutoff]
+        if len(keep) != len(self.entries):
+            metrics.incr('semantic_cache.expired', len(self.entries) - len(keep))
+            self._keep(keep)
+
+    def evict_lru(self):
+        """Drop the least recently used entry"""
+        oldest = min(range(len(self.entries)), key=lambda i: self.entries[i]['last_used'])
+        self._keep([i for i in range(len(self.entries)) if i != oldest])
+        metrics.incr('semantic_cache.evicted')
+
+    def _keep(self, indices):
+        self.vectors = self.vectors[indices] if indices else self.vectors[:0]
+        self.entries = [self.entries[i] for i in indices]
+
+
+class SemanticCache:
+    """
+    Per-language semantic cache of first-turn replies
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_entries_per_language=2000,
+                 ttl_seconds=7 * 24 * 60 * 60, max_message_length=300, min_rating=4,
+                 embed=embed_text, warm_max_entries=10000, warm_retry_seconds=60):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_language = max_entries_per_language
+        self.ttl_seconds = ttl_seconds
+        self.max_message_length = max_message_length
+        self.min_rating = min_rating
+        self.embed = embed
+        self.warm_max_entries = warm_max_entries
+        self.warm_retry_seconds = warm_retry_seconds
+        self.partitions = {}
+        self._lock = threading.Lock()
+        self._warm_state = 'cold'  # 'cold', 'warming' or 'warm'
+        self._warm_failed_at = None
+        self._feedback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semantic-cache-feedback')
+
+    def lookup(self, message, language):
+        """
+        Find a cached reply for a first message
+
+        Returns:
+            dict: {'reply', 'similarity', 'feedback_id'} on a hit, otherwise None
+        """
+        start = time.perf_counter()
+        key = normalize_text(message)
+        if not key or len(key) > self.max_message_length:
+            metrics.incr('semantic_cache.skipped')
+            return None
+
+        if not self.warm_in_background():
+            metrics.incr('semantic_cache.miss')
+            metrics.incr('semantic_cache.not_warm')
+            return None
+        with self._lock:
+            partition = self.partitions.get(language)
+            if partition is None or not len(partition):
+                metrics.incr('semantic_cache.miss')
+                return None
+
+        vector = self.embed(key)
+        if vector is None:
+            metrics.incr('semantic_cache.miss')
+            return None
+
+        with self._lock:
+            entry, similarity = partition.search(vector)
+            if entry is None or similarity < self.similarity_threshold:
+                metrics.incr('semantic_cache.miss')
+                metrics.observe('semantic_cache.lookup', time.perf_counter() - start)
+                return None
+            entry['last_used'] = time.time()
+            entry['hits'] += 1
+
+        lookup_time = time.perf_counter() - start
+        metrics.incr('semantic_cache.hit')
+        metrics.observe('semantic_cache.lookup', lookup_time)
+
+        # Estimate the time saved from the median observed LLM latency
+        llm_latency = metrics.percentile('chat.llm', 50)
+        if llm_latency:
+            metrics.incr('semantic_cache.latency_saved_ms', max(0, int((llm_latency - lookup_time) * 1000)))
+
+        return {
+            'reply': entry['reply'],
+            'similarity': similarity,
+            'feedback_id': entry['feedback_id'],
+        }
+
+    def add(self, message, reply, language, feedback_id=None):
+        """Store a reply for a first message"""
+        key = normalize_text(message)
+        if not key or not reply or len(key) > self.max_message_length:
+            return False
+
+        vector = self.embed(key)
+        if vector is None:
+            return False
+
+        now = time.time()
+        with self._lock:
+            partition = self.partitions.get(language)
+            if partition is None:
+                partition = SemanticCachePartition(len(vector), self.max_entries_per_language, self.ttl_seconds)
+                self.partitions[language] = partition
+            partition.add(vector.astype(np.float32), {
+                'key': key,
+                'reply': reply,
+                'feedback_id': feedback_id,
+                'added_at': now,
+                'last_used': now,
+                'hits': 0,
+            })
+        metrics.incr('semantic_cache.added')
+        return True
+
+    def add_from_feedback(self, feedback):
+        """Add a session's first turn if the Feedback record rates it well; the reply is read from the session"""
+        if feedback.rating < self.min_rating or not feedback.user_query:
+            return False
+
+        from .models import UserContext
+        messages = feedback.session.messages.order_by('timestamp', 'id')
+        first_message = messages.filter(role='user').first()
+        if first_message is None or normalize_text(first_message.content) != normalize_text(feedback.user_query):
+            return False
+        reply = messages.filter(role='assistant', timestamp__gte=first_message.timestamp).first()
+        if reply is None:
+            return False
+
+        language = UserContext.objects.using(feedback._state.db).filter(session=feedback.session) \
+                                      .values_list('language', flat=True).first() or 'en'
+        return self.add(first_message.content, reply.content, language, feedback.id)
+
+    def add_from_feedback_in_background(self, feedback_id, using='default'):
+        """Queue add_from_feedback for a saved Feedback record on this cache's worker thread"""
+        self._feedback_executor.submit(self._add_feedback_and_release, feedback_id, using)
+
+    def _add_feedback_and_release(self, feedback_id, using):
+        from django.db import connections
+        from .models import Feedback
+        try:
+            feedback = Feedback.objects.using(using).select_related('session').filter(id=feedback_id).first()
+            if feedback is not None:
+                self.add_from_feedback(feedback)
+        except Exception as e:
+            logger.error(f"Error adding feedback {feedback_id} to the semantic cache: {str(e)}", exc_info=True)
+        finally:
+            # Connections are per thread; close the ones this thread opened
+            connections.close_all()
+
+    def warm_in_background(self):
+        """
+        Start loading the cache in a background thread unless it is loaded or loading
+
+        Returns:
+            bool: Whether the cache is loaded
+        """
+        with self._lock:
+            if self._warm_state != 'cold':
+                return self._warm_state == 'warm'
+            if self._warm_failed_at is not None and time.monotonic() - self._warm_failed_at < self.warm_retry_seconds:
+                return False
+            self._warm_state = 'warming'
+        threading.Thread(target=self._warm_and_release, name='semantic-cache-warm', daemon=True).start()
+        return False
+
+    def _warm_and_release(self):
+        from django.db import connections
+        try:
+            self.warm()
+        finally:
+            # Connections are per thread; close the ones this thread opened
+            connections.close_all()
+
+    def warm(self):
+        """
+        Load well-rated first turns from the database
+
+        Marks the cache loaded only when every shard was read; on an error the
+        load is retried by a later lookup.
+        """
+        with self._lock:
+            self._warm_state = 'warming'
+        try:
+            loaded = self._load_rated_replies()
+        except Exception as e:
+            logger.error(f"Error warming the semantic cache: {str(e)}", exc_info=True)
+            with self._lock:
+                self._warm_state = 'cold'
+                self._warm_failed_at = time.monotonic()
+            return 0
+        with self._lock:
+            self._warm_state = 'warm'
+            self._warm_failed_at = None
+        logger.info(f"Semantic cache warmed with {loaded} first-turn replies")
+        return loaded
+
+    def _load_rated_replies(self):
+        """Embed and add the rated first turns of the last TTL_SECONDS, newest first; returns how many were added"""
+        from django.db.models import OuterRef, Subquery
+        from .models import Feedback, Message, UserContext
+        from .sharding import fan_out
+
+        first_user_message = Message.objects.filter(session=OuterRef('session'), role='user') \
+                                            .order_by('timestamp', 'id').values('content')[:1]
+        first_reply = Message.objects.filter(session=OuterRef('session'), role='assistant') \
+                                     .order_by('timestamp', 'id').values('content')[:1]
+        session_language = UserContext.objects.filter(session=OuterRef('session')).values('language')[:1]
+        cutoff = timezone.now() - timedelta(seconds=self.ttl_seconds)
+
+        def candidates_on_shard(alias):
+            return list(Feedback.objects.using(alias)
+                                        .filter(rating__gte=self.min_rating, created_at__gte=cutoff)
+                                        .exclude(user_query='')
+                                        .annotate(first_message=Subquery(first_user_message),
+                                                  first_reply=Subquery(first_reply),
+                                                  language=Subquery(session_language))
+                                        .values('id', 'user_query', 'first_message', 'first_reply',
+                                                'language', 'created_at'))
+
+        # Newest first across all shards
+        candidates = sorted((row for rows in fan_out(candidates_on_shard) for row in rows),
+                            key=lambda row: row['created_at'], reverse=True)
+
+        loaded = 0
+        for row in candidates:
+            if not row['first_reply'] or normalize_text(row['first_message'] or '') != normalize_text(row['user_query']):
+                continue
+            if self.add(row['first_message'], row['first_reply'], row['language'] or 'en', row['id']):
+                loaded += 1
+            if loaded >= self.warm_max_entries:
+                break
+        return loaded
+
+    def stats(self):
+        """Get per-language sizes"""
+        with self._lock:
+            return {
+                'partitions': {language: len(p) for language, p in self.partitions.items()},
+                'similarity_threshold': self.similarity_threshold,
+                'warm': self._warm_state == 'warm',
+            }
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Get or initialize the process-wide semantic cache (None when disabled)"""
+    global _semantic_cache
+    if _semantic_cache is None:
+        config = dict(DEFAULT_SETTINGS)
+        from django.conf import settings
+        config.update(getattr(settings, 'SEMANTIC_CACHE', {}))
+        if not config['ENABLED']:
+            return None
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(
+                    similarity_threshold=config['SIMILARITY_THRESHOLD'],
+                    max_entries_per_language=config['MAX_ENTRIES_PER_LANGUAGE'],
+                    ttl_seconds=config['TTL_SECONDS'],
+                    max_message_length=config['MAX_MESSAGE_LENGTH'],
+                    min_rating=config['MIN_RATING'],
+                    warm_max_entries=config['WARM_MAX_ENTRIES'],
+                    warm_retry_seconds=config['WARM_RETRY_SECONDS'],
+                )
+    return _semantic_cache
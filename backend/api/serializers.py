@@ -1,5 +1,26 @@
 from rest_framework import serializers
 from .models import Task, ConversationSession, Message, Feedback, UserContext, ExpertReview, AnalyticsMetric
+from .sharding import shard_for
+
+
+class ShardedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField for sharded models: looks the row up on the shard its id names"""
+
+    def to_internal_value(self, data):
+        try:
+            self.queryset = self.queryset.using(shard_for(data))
+        except (TypeError, ValueError):
+            pass  # Not an id of a configured shard; reported as usual below
+        return super().to_internal_value(data)
+
+
+class ShardedCreateMixin:
+    """ModelSerializer mixin creating rows on the shard of the related row in `shard_field`"""
+    shard_field = None
+
+    def create(self, validated_data):
+        alias = validated_data[self.shard_field]._state.db
+        return self.Meta.model.objects.using(alias).create(**validated_data)
 
 class TaskSerializer(serializers.ModelSerializer):
     class Meta:
@@ -27,9 +48,12 @@ class UserContextSerializer(serializers.ModelSerializer):
         model = UserContext
         fields = ['id', 'session', 'symptoms', 'symptom_durations', 
                  'treatments_tried', 'medical_history', 'cultural_preferences', 
-                 'language', 'created_at', 'updated_at']
+                 'language', 'language_confidence', 'created_at', 'updated_at']
+
+class ExpertReviewSerializer(ShardedCreateMixin, serializers.ModelSerializer):
+    feedback = ShardedPrimaryKeyRelatedField(queryset=Feedback.objects.all())
+    shard_field = 'feedback'
 
-class ExpertReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = ExpertReview
         fields = ['id', 'feedback', 'reviewer_name', 'medical_accuracy', 
@@ -0,0 +1,229 @@
+"""
+Session Resolver
+
+Maps the session ids sent by clients to ConversationSession rows, for the
+chat API, the WebSocket channel and the voice service:
+
+- Numeric ids are primary keys (kept for existing clients)
+- Any other id (e.g. the frontend's 'session-xxxx') is the session's unique,
+  indexed external_id, so every client gets its own session
+
+A miss costs one lookup on the session's shard (see api/sharding.py), plus
+the insert for a new session or the restore of an archived one (see
+api/archive.py); resolved ids are kept in a bounded in-process LRU cache, so
+later requests resolve without a query. The mapping never changes once
+created, so the cache only has to forget deleted sessions. Deletes in this
+process are forgotten by a post_delete signal; a session archived by another
+process (the archive_sessions command) stays cached here, so writes go
+through with_session(), or with_resolved_session() for writes made later in
+the request, which re-resolve (and so rehydrate) the session when a write
+fails because its row is gone.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from django.db import IntegrityError
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .archive import rehydrate_client_session
+from .models import ConversationSession
+from .runtime_metrics import metrics
+from .sharding import get_shards, shard_for, shard_for_external_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'MAX_ENTRIES': 10000,
+    'DEFAULT_EXTERNAL_ID': 'default',  # Used when a client sends no session id
+}
+
+MAX_EXTERNAL_ID_LENGTH = 100
+
+# Fields cached per session; enough to rebuild a usable ConversationSession instance
+_CACHED_FIELDS = ['id', 'external_id', 'created_at', 'updated_at']
+
+
+class InvalidSessionId(ValueError):
+    """A client session id that cannot be used"""
+
+
+class SessionResolver:
+    """
+    Resolves client session ids with a bounded LRU cache of id -> session row
+    """
+
+    def __init__(self, max_entries=10000, default_external_id='default'):
+        self.max_entries = max_entries
+        self.default_external_id = default_external_id
+        self._entries = OrderedDict()  # normalized client id -> cached field values
+        self._keys_by_pk = {}
+        self._lock = threading.Lock()
+
+    def normalize(self, client_id):
+        """The lookup key for a client id: ('pk', int) or ('external_id', str)"""
+        if client_id is None or str(client_id).strip() == '':
+            return ('external_id', self.default_external_id)
+        if isinstance(client_id, int) and not isinstance(client_id, bool):
+            return ('pk', client_id)
+        client_id = str(client_id).strip()
+        if client_id.isdigit():
+            return ('pk', int(client_id))
+        if len(client_id) > MAX_EXTERNAL_ID_LENGTH:
+            raise InvalidSessionId(f"Session ids must be at most {MAX_EXTERNAL_ID_LENGTH} characters")
+        return ('external_id', client_id)
+
+    def resolve(self, client_id, create=True):
+        """
+        Get the ConversationSession for a client session id
+
+        Args:
+            client_id: Session id sent by the client
+            create (bool): Create the session when it does not exist yet
+
+        Returns:
+            ConversationSession: Or None when it does not exist and create is False
+        """
+        key = self.normalize(client_id)
+        with self._lock:
+            values = self._entries.get(key)
+            if values is not None:
+                self._entries.move_to_end(key)
+        if values is not None:
+            metrics.incr('sessions.resolve_hit')
+            return ConversationSession.from_db(shard_for(values[0]), _CACHED_FIELDS, values)
+
+        metrics.incr('sessions.resolve_miss')
+        field, value = key
+        if field == 'pk':
+            try:
+                shards = [shard_for(value)]
+            except ValueError as e:
+                raise InvalidSessionId(str(e))
+            lookup = {'id': value}
+        else:
+            # The hashed shard first, then sessions created before it was added
+            home = shard_for_external_id(value)
+            shards = [home] + [alias for alias in get_shards() if alias != home]
+            lookup = {'external_id': value}
+        session = None
+        for alias in shards:
+            session = ConversationSession.objects.using(alias).filter(**lookup).first()
+            if session is not None:
+                break
+        if session is None:
+            session = rehydrate_client_session(**lookup)
+        if session is None:
+            if not create:
+                return None
+            session, created = ConversationSession.objects.using(shards[0]).get_or_create(**lookup)
+            if created:
+                logger.info(f"Created conversation session {session.id} on {shards[0]} for client id {value}")
+        self._remember(key, session)
+        return session
+
+    def _remember(self, key, session):
+        with self._lock:
+            self._entries[key] = tuple(getattr(session, field) for field in _CACHED_FIELDS)
+            self._entries.move_to_end(key)
+            self._keys_by_pk.setdefault(session.pk, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                keys = self._keys_by_pk.get(evicted[0])
+                if keys is not None:
+                    keys.discard(evicted_key)
+                    if not keys:
+                        del self._keys_by_pk[evicted[0]]
+
+    def forget(self, session_pk):
+        """Drop the cached ids of a deleted session"""
+        with self._lock:
+            for key in self._keys_by_pk.pop(session_pk, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_pk.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_session_resolver = None
+_session_resolver_lock = threading.Lock()
+
+
+def get_session_resolver():
+    """Get or initialize the process-wide session resolver"""
+    global _session_resolver
+    if _session_resolver is None:
+        with _session_resolver_lock:
+            if _session_resolver is None:
+                from django.conf import settings
+                config = dict(DEFAULT_SETTINGS)
+                config.update(getattr(settings, 'SESSION_RESOLVER', {}))
+                _session_resolver = SessionResolver(
+                    max_entries=config['MAX_ENTRIES'],
+                    default_external_id=config['DEFAULT_EXTERNAL_ID'],
+                )
+    return _session_resolver
+
+
+def resolve_session(client_id, create=True):
+    """Shortcut for get_session_resolver().resolve()"""
+    return get_session_resolver().resolve(client_id, create=create)
+
+
+def with_session(client_id, function, create=True):
+    """
+    Call function(session) with the ConversationSession for a client session id
+
+    When it fails with an IntegrityError because the cached session has been
+    deleted meanwhile (archived by another process), the cached entry is
+    dropped and function is called once more with the re-resolved session.
+
+    Returns:
+        The result of function
+    """
+    resolver = get_session_resolver()
+    return _retry_if_deleted(resolver.resolve(client_id, create=create), function,
+                             lambda: resolver.resolve(client_id, create=create))
+
+
+def with_resolved_session(session, function):
+    """
+    Call function(session) for a write to a session resolved earlier in the request
+
+    with_session() only guards its own function, and a chat turn writes its
+    messages after waiting for the model (a WebSocket for as long as it stays
+    open), long enough for the session to be archived meanwhile. Such writes
+    are retried the same way, on the session restored by its primary key.
+    function must write atomically, so a failed attempt leaves nothing behind
+    to be written twice.
+
+    Returns:
+        The result of function
+    """
+    resolver = get_session_resolver()
+    return _retry_if_deleted(session, function, lambda: resolver.resolve(session.pk))
+
+
+def _retry_if_deleted(session, function, resolve_again):
+    try:
+        return function(session)
+    except IntegrityError:
+        if session is None or ConversationSession.objects.using(shard_for(session.pk)).filter(pk=session.pk).exists():
+            raise
+        logger.info(f"Session {session.pk} was deleted by another process; resolving it again")
+        metrics.incr('sessions.resolve_stale')
+        get_session_resolver().forget(session.pk)
+        return function(resolve_again())
+
+
+@receiver(post_delete, sender=ConversationSession)
+def _session_deleted(sender, instance, **kwargs):
+    if _session_resolver is not None:
+        _session_resolver.forget(instance.pk)
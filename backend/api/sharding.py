@@ -0,0 +1,187 @@
+"""
+Session Sharding
+
+Conversation data is spread over the databases in settings.SESSION_SHARDS by
+session: a session and every row that belongs to it (messages, annotations,
+user context, stored summary, feedback and expert reviews, voice sessions,
+participants and transcripts) live on the same shard, so the chat and voice
+paths only ever touch one database. Everything else (tasks, analytics,
+idempotency records, the archive index, ...) stays on 'default', which is
+also shard 0.
+
+Which shard a row lives on is encoded in its primary key: on shard i, the
+id sequences of the sharded tables start at i << SHARD_ID_BITS, so
+shard_for() maps any session, message, feedback or voice id to its database
+without a lookup. Rows created before sharding have small ids and live on
+'default'. New sessions with a client external_id go to the shard chosen by
+a hash of the id; external ids are looked up on that shard first, then on
+the others (sessions created before a shard was added).
+
+Routing:
+
+- api/routers.py routes queries that carry an instance hint (related
+  managers, saving an instance) to the instance's shard
+- Queries by session, message or feedback id use .using(shard_for(id))
+- Queries across sessions (analytics, exports, scans) run on every shard
+  in parallel with fan_out() and merge the results
+
+With a single shard every helper returns 'default' and fan_out() runs in
+the calling thread, so nothing changes.
+"""
+
+import contextvars
+import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SHARD_ID_BITS = 48
+
+# Models stored on the shard of their session
+SHARDED_MODELS = {
+    'api.conversationsession',
+    'api.message',
+    'api.messageannotation',
+    'api.usercontext',
+    'api.sessionsummary',
+    'api.feedback',
+    'api.expertreview',
+    'voice_service.voicesession',
+    'voice_service.voicesessionparticipant',
+    'voice_service.voicetranscript',
+}
+
+
+def get_shards():
+    """Database aliases of the shards, 'default' first"""
+    from django.conf import settings
+    return list(getattr(settings, 'SESSION_SHARDS', None) or ['default'])
+
+
+def is_sharded(model):
+    """Whether a model's rows live on their session's shard"""
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def shard_for(pk):
+    """
+    The shard holding a row of a sharded model
+
+    Args:
+        pk: Primary key of a session, message, feedback, ... (any sharded model)
+
+    Returns:
+        str: Database alias
+    """
+    shards = get_shards()
+    index = int(pk) >> SHARD_ID_BITS
+    if index >= len(shards):
+        raise ValueError(f"Id {pk} belongs to shard {index}, but only {len(shards)} are configured")
+    return shards[index]
+
+
+def shard_for_external_id(external_id):
+    """The shard new sessions with this client external_id are created on"""
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+    return shards[zlib.crc32(str(external_id).encode('utf-8')) % len(shards)]
+
+
+def group_by_shard(pks):
+    """
+    Split ids of a sharded model by shard, keeping their order
+
+    Returns:
+        dict: Database alias -> list of ids
+    """
+    groups = {}
+    for pk in pks:
+        groups.setdefault(shard_for(pk), []).append(pk)
+    return groups
+
+
+def _run_on_shard(function, alias, context):
+    try:
+        return context.run(function, alias)
+    finally:
+        # Connections are per thread; close the ones this worker opened
+        connections.close_all()
+
+
+def fan_out(function, shards=None):
+    """
+    Run function(alias) on every shard in parallel
+
+    Inside a transaction the shards are queried one after the other in the
+    calling thread instead, so the results include its uncommitted writes.
+
+    Args:
+        function: Called with each database alias; runs in a worker thread
+            when there is more than one shard
+        shards (list): Aliases (default: every shard)
+
+    Returns:
+        list: Results in shard order
+    """
+    shards = get_shards() if shards is None else list(shards)
+    if len(shards) <= 1 or any(connections[alias].in_atomic_block for alias in shards):
+        return [function(alias) for alias in shards]
+    # Workers see the caller's context variables (e.g. replica_reads() in api/replicas.py)
+    contexts = [contextvars.copy_context() for _ in shards]
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='shard') as executor:
+        return list(executor.map(lambda alias, context: _run_on_shard(function, alias, context), shards, contexts))
+
+
+def fan_out_ids(function, pks):
+    """
+    Run function(alias, ids) for the ids on each shard, in parallel
+
+    Returns:
+        list: Results, one per shard holding any of the ids
+    """
+    groups = group_by_shard(pks)
+    return fan_out(lambda alias: function(alias, groups[alias]), shards=groups)
+
+
+def reserve_id_ranges(using):
+    """
+    Start the id sequences of the sharded tables on a shard at its range
+
+    Idempotent; run after migrations (api/apps.py). Sequences already past the
+    start of the range are left alone.
+    """
+    from django.apps import apps
+    shards = get_shards()
+    if using not in shards or shards.index(using) == 0:
+        return
+    start = shards.index(using) << SHARD_ID_BITS
+    connection = connections[using]
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for label in sorted(SHARDED_MODELS):
+            try:
+                table = apps.get_model(label)._meta.db_table
+            except LookupError:
+                continue
+            if table not in tables:
+                continue
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start])
+                elif row[0] < start:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start, table])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))",
+                    [table, start],
+                )
+            else:
+                raise NotImplementedError(f"Id ranges are not supported on {connection.vendor}")
+    logger.info(f"Reserved id range {start} for the sharded tables on {using}")
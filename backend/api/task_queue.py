@@ -0,0 +1,235 @@
+"""
+Deferred Task Queue
+
+Database-backed queue for non-critical work that can run after the chat reply
+has been sent (annotation, context extraction, analytics increments):
+
+1. Handlers are registered by name with @deferred_task
+2. Views enqueue work with enqueue()/enqueue_many() - a single INSERT
+3. `manage.py run_workers` claims due tasks and runs them
+
+A failing task is retried with exponential backoff and moved to the dead
+letter status after max_attempts. Tasks left running by a crashed worker are
+released after the lease expires. Successful tasks are deleted.
+"""
+
+import importlib
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .models import DeferredTask
+from .runtime_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ENABLED': True,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF_SECONDS': 10,  # Doubled after every failed attempt
+    'LEASE_SECONDS': 300,  # Running tasks older than this are assumed abandoned
+    'POLL_INTERVAL_SECONDS': 1.0,
+    'BATCH_SIZE': 20,
+    'TASK_MODULES': ['api.chat_tasks'],  # Imported by workers to register handlers
+}
+
+_registry = {}
+
+
+def get_queue_settings():
+    """Get the task queue configuration merged over the defaults"""
+    from django.conf import settings
+    config = dict(DEFAULT_SETTINGS)
+    config.update(getattr(settings, 'TASK_QUEUE', {}))
+    return config
+
+
+def deferred_task(name):
+    """Register a function as the handler of a named deferred task"""
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def load_task_modules():
+    """Import the modules that register task handlers"""
+    for module in get_queue_settings()['TASK_MODULES']:
+        importlib.import_module(module)
+    return dict(_registry)
+
+
+def enqueue(name, **payload):
+    """Queue a single task; returns the DeferredTask or None when the queue is disabled"""
+    tasks = enqueue_many([(name, payload)])
+    return tasks[0] if tasks else None
+
+
+def enqueue_many(tasks):
+    """
+    Queue several tasks with one INSERT
+
+    Args:
+        tasks (list): (name, payload dict) or (name, payload dict, delay seconds) tuples
+
+    Returns:
+        list: Created DeferredTask objects (empty when the queue is disabled)
+    """
+    config = get_queue_settings()
+    if not config['ENABLED'] or not tasks:
+        return []
+    now = timezone.now()
+    created = DeferredTask.objects.bulk_create([
+        DeferredTask(name=task[0], payload=task[1], max_attempts=config['MAX_ATTEMPTS'],
+                     available_at=now + timedelta(seconds=task[2]) if len(task) > 2 else now)
+        for task in tasks
+    ])
+    for task in tasks:
+        metrics.incr(f'tasks.enqueued.{task[0]}')
+    return created
+
+
+def queue_stats():
+    """
+    Queue depth per status and the age of the oldest due task
+
+    Returns:
+        dict: {'depth': {status: count}, 'by_task': {name: pending count}, 'oldest_pending_seconds'}
+    """
+    depth = dict(DeferredTask.objects.values_list('status').annotate(count=Count('id')).order_by())
+    by_task = dict(
+        DeferredTask.objects.filter(status='pending').values_list('name').annotate(count=Count('id')).order_by()
+    )
+    oldest = DeferredTask.objects.filter(status='pending', available_at__lte=timezone.now()) \
+                                 .aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in DeferredTask.STATUS_CHOICES},
+        'by_task': by_task,
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+def requeue_dead_tasks(name=None):
+    """Move dead-letter tasks back to the queue with a fresh attempt budget"""
+    queryset = DeferredTask.objects.filter(status='dead')
+    if name:
+        queryset = queryset.filter(name=name)
+    return queryset.update(status='pending', attempts=0, available_at=timezone.now(), last_error='')
+
+
+class TaskWorker:
+    """
+    Claims and runs due tasks
+    """
+
+    def __init__(self, worker_id=None, config=None):
+        self.config = config or get_queue_settings()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.handlers = load_task_modules()
+
+    def release_expired_leases(self):
+        """
+        Return tasks abandoned by crashed workers to the queue
+
+        A task that has used up its attempts is dead-lettered instead, so a task
+        that crashes its worker every time is not retried forever.
+        """
+        cutoff = timezone.now() - timedelta(seconds=self.config['LEASE_SECONDS'])
+        expired = DeferredTask.objects.filter(status='running', locked_at__lt=cutoff)
+
+        exhausted = list(expired.filter(attempts__gte=F('max_attempts')).values_list('id', 'name'))
+        if exhausted:
+            dead = expired.filter(id__in=[task_id for task_id, _ in exhausted]).update(
+                status='dead', locked_by='', locked_at=None,
+                last_error='Lease expired on the last attempt; the worker may have crashed',
+            )
+            for _, name in exhausted:
+                metrics.incr(f'tasks.dead.{name}')
+            logger.error(f"Moved {dead} deferred tasks with expired leases on their last attempt to dead letter")
+
+        released = expired.filter(attempts__lt=F('max_attempts')) \
+                          .update(status='pending', locked_by='', locked_at=None)
+        if released:
+            logger.warning(f"Released {released} deferred tasks with expired leases")
+        return released
+
+    def claim(self):
+        """Claim up to BATCH_SIZE due tasks; safe with several workers on any database"""
+        now = timezone.now()
+        candidate_ids = list(
+            DeferredTask.objects.filter(status='pending', available_at__lte=now)
+                                .order_by('available_at', 'id')
+                                .values_list('id', flat=True)[:self.config['BATCH_SIZE']]
+        )
+        claimed = []
+        for task_id in candidate_ids:
+            # Conditional update: only one worker can move a task out of pending
+            updated = DeferredTask.objects.filter(id=task_id, status='pending').update(
+                status='running', locked_by=self.worker_id, locked_at=now, attempts=F('attempts') + 1
+            )
+            if updated:
+                claimed.append(task_id)
+        return list(DeferredTask.objects.filter(id__in=claimed).order_by('available_at', 'id'))
+
+    def run_task(self, task):
+        """Run one claimed task and record success, retry or dead letter"""
+        handler = self.handlers.get(task.name)
+        metrics.observe(f'tasks.wait.{task.name}', (timezone.now() - task.created_at).total_seconds())
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for deferred task '{task.name}'")
+            handler(**task.payload)
+        except Exception as e:
+            self.fail_task(task, e)
+            return False
+        metrics.observe(f'tasks.run.{task.name}', time.perf_counter() - start)
+        metrics.incr(f'tasks.succeeded.{task.name}')
+        task.delete()
+        return True
+
+    def fail_task(self, task, error):
+        """Schedule a retry with exponential backoff, or dead-letter the task"""
+        task.last_error = f"{error}\n{traceback.format_exc()}"[-4000:]
+        task.locked_by = ''
+        task.locked_at = None
+        if task.attempts >= task.max_attempts:
+            task.status = 'dead'
+            metrics.incr(f'tasks.dead.{task.name}')
+            logger.error(f"Deferred task {task} moved to dead letter: {str(error)}")
+        else:
+            delay = self.config['RETRY_BACKOFF_SECONDS'] * (2 ** (task.attempts - 1))
+            task.status = 'pending'
+            task.available_at = timezone.now() + timedelta(seconds=delay)
+            metrics.incr(f'tasks.retried.{task.name}')
+            logger.warning(f"Deferred task {task} failed, retrying in {delay}s: {str(error)}")
+        task.save(update_fields=['status', 'available_at', 'last_error', 'locked_by', 'locked_at'])
+
+    def run_once(self):
+        """Run one batch of due tasks; returns the number of tasks processed"""
+        close_old_connections()
+        self.release_expired_leases()
+        tasks = self.claim()
+        for task in tasks:
+            self.run_task(task)
+        return len(tasks)
+
+    def run_forever(self, stop_event=None, burst=False):
+        """Poll the queue until stopped, or until it is empty in burst mode"""
+        processed = 0
+        while not (stop_event and stop_event.is_set()):
+            count = self.run_once()
+            processed += count
+            if not count:
+                if burst:
+                    break
+                time.sleep(self.config['POLL_INTERVAL_SECONDS'])
+        return processed
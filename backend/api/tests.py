@@ -1,3 +1,1669 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from eleraai_backend.database import SQLITE_PRAGMAS, sqlite_database
+from langchain_core.messages import AIMessage, HumanMessage
+
+from . import compression, llm_client, medical_ner, replicas, session_resolver
+from .archive import archive_idle_sessions, archive_sessions, rehydrate_active_between
+from .benchmarks.compression_benchmark import synthetic_corpus
+from .benchmarks.ner_benchmark import load_corpus, evaluate_quality, run_benchmark, stubbed_models
+from .chat_tasks import merge_entities, summarize_idle_session, update_user_context
+from .clinical_summary import summarize_session
+from .compression import reset_codec, train_dictionary
+from .conversation_state import ConversationStateCache
+from .data_pipeline import DataPipeline, created_between, merge_grouped_stats
+from .emotion_cache import EmotionCache
+from .idempotency import IdempotencyError, IdempotentExecutor
+from .language_id import SESSION_LOCK_CONFIDENCE, detect_language, resolve_session_language
+from .llm_client import COMMON_DEFAULTS, HedgedLLMClient, LLMDeadlineExceeded, get_backend_factory
+from .llm_stub import StubBehaviour, StubServer, get_stub_settings
+from .model_router import DEFAULT_SETTINGS as ROUTING_DEFAULTS, classify_turn, estimate_cost
+from .models import (
+    Task, ConversationSession, Message, UserContext, Feedback, ExpertReview, AnalyticsMetric, ArchivedSession,
+    ChatIdempotencyRecord, DeferredTask, SessionSummary,
+)
+from .prompts import (
+    BASE_SYSTEM_PROMPT, PIDGIN_GUIDANCE, build_chat_prompt, build_context_block, count_tokens, trim_history,
+)
+from .query_budget import QueryBudgetMixin
+from .runtime_metrics import metrics
+from .semantic_cache import SemanticCache
+from .session_resolver import InvalidSessionId, SessionResolver, get_session_resolver, resolve_session
+from .triage import check_red_flags
+from .task_queue import DEFAULT_SETTINGS as QUEUE_DEFAULTS, TaskWorker, deferred_task, enqueue
+from .sharding import SHARD_ID_BITS, get_shards, group_by_shard, shard_for, shard_for_external_id
+
+
+class EmotionCacheTests(SimpleTestCase):
+    """Emotion results are reused for normalized repeats within the entry, byte and TTL budgets"""
+
+    RESULT = {'emotion': 'fear', 'confidence': 0.9}
+
+    def test_keys_are_normalized_and_versioned(self):
+        cache = EmotionCache(max_text_length=30)
+        self.assertEqual(cache.make_key("I still have HEADACHE!!", 'v1'), cache.make_key("i still  have headache", 'v1'))
+        self.assertNotEqual(cache.make_key("headache", 'v1'), cache.make_key("headache", 'v2'))
+        self.assertIsNone(cache.make_key("?!", 'v1'))
+        self.assertIsNone(cache.make_key("this message is longer than thirty characters", 'v1'))
+
+        cache.set("I still have HEADACHE!!", 'v1', self.RESULT)
+        self.assertEqual(cache.get("i still have headache", 'v1'), self.RESULT)
+        self.assertIsNone(cache.get("i still have headache", 'v2'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmotionCache(max_entries=2)
+        cache.set('first', 'v1', self.RESULT)
+        cache.set('second', 'v1', self.RESULT)
+        cache.get('first', 'v1')
+        cache.set('third', 'v1', self.RESULT)
+        self.assertIsNone(cache.get('second', 'v1'))
+        self.assertIsNotNone(cache.get('first', 'v1'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = EmotionCache(ttl_seconds=60)
+        with mock.patch('api.emotion_cache.time.monotonic', return_value=1000.0):
+            cache.set('headache', 'v1', self.RESULT)
+        with mock.patch('api.emotion_cache.time.monotonic', return_value=1059.0):
+            self.assertIsNotNone(cache.get('headache', 'v1'))
+        with mock.patch('api.emotion_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('headache', 'v1'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_byte_budget(self):
+        entry_size = len('v1:fever') + len(json.dumps(self.RESULT)) + 120
+        cache = EmotionCache(max_bytes=entry_size * 2)
+        for text in ('fever', 'cough', 'chills'):
+            cache.set(text, 'v1', self.RESULT)
+        self.assertLessEqual(cache.stats()['size_bytes'], entry_size * 2)
+        self.assertIsNone(cache.get('fever', 'v1'))
+        self.assertIsNotNone(cache.get('chills', 'v1'))
+
+        # An entry larger than the whole budget is not stored
+        cache.set('malaria', 'v1', {'emotion': 'fear', 'detail': 'x' * entry_size * 2})
+        self.assertIsNone(cache.get('malaria', 'v1'))
+
+
+class LanguageIdentificationTests(SimpleTestCase):
+    """Messages are identified per language; short or ambiguous ones stay unsettled"""
+
+    MESSAGES = [
+        ("I have been feeling sick since yesterday and my head hurts", 'en'),
+        ("Abeg my belle dey pain me well well", 'en-pidgin'),
+        ("I dey feel weak, body dey hot since yesterday", 'en-pidgin'),
+        ("Ẹ kaaro dokita, ori mi n dun mi", 'yo'),
+        ("Kedu, isi m na-egbu m mgbu", 'ig'),
+        ("Sannu likita, ina jin ciwon kai", 'ha'),
+    ]
+
+    def test_detection(self):
+        for text, expected in self.MESSAGES:
+            with self.subTest(text=text):
+                language, confidence = detect_language(text)
+                self.assertEqual(language, expected)
+                self.assertGreaterEqual(confidence, SESSION_LOCK_CONFIDENCE)
+
+    def test_short_and_empty_messages_have_low_confidence(self):
+        self.assertEqual(detect_language(''), ('en', 0.0))
+        self.assertEqual(detect_language('???'), ('en', 0.0))
+        for text in ('ok', 'malaria', 'na'):
+            with self.subTest(text=text):
+                self.assertLess(detect_language(text)[1], SESSION_LOCK_CONFIDENCE)
+
+    def test_session_language_settles_on_a_confident_message(self):
+        user_context = mock.Mock(language='en', language_confidence=0.0)
+        self.assertEqual(resolve_session_language(user_context, 'ok'), 'en')
+        self.assertLess(user_context.language_confidence, SESSION_LOCK_CONFIDENCE)
+
+        self.assertEqual(resolve_session_language(user_context, 'Abeg my belle dey pain me well well'), 'en-pidgin')
+        self.assertGreaterEqual(user_context.language_confidence, SESSION_LOCK_CONFIDENCE)
+        self.assertEqual(user_context.save.call_count, 2)
+
+        # Settled: later messages are not re-detected
+        self.assertEqual(resolve_session_language(user_context, 'I have been feeling sick since yesterday'), 'en-pidgin')
+        self.assertEqual(user_context.save.call_count, 2)
+
+
+class NERBenchmarkTests(SimpleTestCase):
+    """Guard medical_ner recall against the gold corpus"""
+
+    # Current recall minus a small margin; raise these when the extractors improve
+    MIN_RECALL = {
+        'CONDITION': 0.70,
+        'DURATION': 0.85,
+        'MEDICATION': 0.90,
+        'SEVERITY': 0.45,
+        'SYMPTOM': 0.65,
+        'VITALS': 0.60,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.corpus = load_corpus()
+
+    def test_recall_does_not_regress(self):
+        with stubbed_models():
+            quality = evaluate_quality(self.corpus['messages'])
+        for entity_type, min_recall in self.MIN_RECALL.items():
+            with self.subTest(entity_type=entity_type):
+                self.assertGreaterEqual(quality['overall'][entity_type]['recall'], min_recall)
+
+    def test_benchmark_results_are_json_serializable(self):
+        results = run_benchmark(self.corpus, iterations=1)
+        decoded = json.loads(json.dumps(results))
+        self.assertEqual(decoded['meta']['corpus_size'], len(self.corpus['messages']))
+        self.assertIn('extract_medical_entities', decoded['latency'])
+        self.assertIn('analyze_patient_emotion', decoded['peak_memory_kb'])
+        self.assertEqual(decoded['emotion']['accuracy'], 'n/a')
+
+    def test_stub_results_stay_out_of_the_emotion_cache(self):
+        cache = EmotionCache()
+        text = 'I am worried about this headache'
+        with mock.patch('api.medical_ner.get_emotion_cache', return_value=cache), stubbed_models():
+            medical_ner.analyze_patient_emotion(text)
+        self.assertIsNone(cache.get(text, medical_ner.EMOTION_MODEL_VERSION))
+
+
+class MedicalNERLoadingTests(SimpleTestCase):
+    """Threads that ask for ClinicalBERT while it loads wait for it instead of skipping it"""
+
+    def setUp(self):
+        for name in ('_medical_ner_ready', '_feature_extractor'):
+            patcher = mock.patch.object(medical_ner, name, getattr(medical_ner, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        medical_ner._medical_ner_ready = False
+        medical_ner._feature_extractor = None
+
+    def test_concurrent_callers_get_the_loaded_model(self):
+        extractor = object()
+
+        def slow_pipeline(*args, **kwargs):
+            time.sleep(0.1)
+            return extractor
+
+        results = []
+        with mock.patch.object(medical_ner, 'AutoTokenizer'), \
+                mock.patch.object(medical_ner, 'pipeline', side_effect=slow_pipeline) as load:
+            threads = [threading.Thread(target=lambda: results.append(medical_ner.get_feature_extractor()))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, [extractor] * 4)
+        load.assert_called_once()
+
+
+class RedFlagTriageTests(SimpleTestCase):
+    """Red flags are raised for current complaints, not negated or historical mentions"""
+
+    FLAGGED = [
+        ("I have chest pain", ['cardiac']),
+        ("Chest pain and I can't breathe", ['cardiac', 'breathing']),
+        ("No fever, but I have chest pain", ['cardiac']),
+        ("I had a seizure this morning", ['neurological']),
+        ("My father is having a stroke", ['neurological']),
+        ("My chest dey pain me", ['cardiac']),
+        ("I no fit breathe", ['breathing']),
+        ("I don't want to die", ['self_harm']),
+        ("Chest pain that started 2 hours ago", ['cardiac']),
+        ("Chest pain since 30 minutes ago", ['cardiac']),
+        ("My son had a seizure 5 minutes ago", ['neurological']),
+        ("My father had a stroke today", ['neurological']),
+        ("I have no energy and chest pain", ['cardiac']),
+        ("Not sleeping well, chest pain", ['cardiac']),
+    ]
+
+    NOT_FLAGGED = [
+        "No chest pain",
+        "I don't have shortness of breath",
+        "Patient denies seizure",
+        "Without chest pain or fainting",
+        "My father had a stroke last year",
+        "Had a seizure as a child",
+        "There is a family history of stroke",
+        "I have no fever or chest pain",
+        "I don't have any chest pain",
+        "Had a stroke 3 years ago",
+        "Chest pain when I was a teenager",
+    ]
+
+    def test_current_complaints_are_flagged(self):
+        for text, categories in self.FLAGGED:
+            with self.subTest(text=text):
+                result = check_red_flags(text)
+                self.assertIsNotNone(result)
+                self.assertEqual(result['categories'], categories)
+
+    def test_negated_and_historical_mentions_are_not_flagged(self):
+        for text in self.NOT_FLAGGED:
+            with self.subTest(text=text):
+                self.assertIsNone(check_red_flags(text))
+
+
+class ChatPollTests(TestCase):
+    """Polling for messages reads a session without creating it"""
+    databases = '__all__'
+
+    def test_unknown_session_is_not_created(self):
+        response = self.client.get('/api/chat/', {'session_id': 'session-unknown', 'after_id': 0})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(ConversationSession.objects.filter(external_id='session-unknown').exists())
+
+
+class IdempotentExecutorTests(TestCase):
+    """Keyed chat requests run once: stored replies are replayed, in-flight ones joined"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.executor = IdempotentExecutor()
+        self.calls = []
+
+    def handler(self, reply='Rest and drink water'):
+        def run():
+            self.calls.append(reply)
+            return 200, {'reply': reply}
+        return run
+
+    def test_completed_reply_is_replayed(self):
+        self.assertEqual(self.executor.execute('s1', 'k1', 'headache', self.handler()),
+                         (200, {'reply': 'Rest and drink water'}, False))
+        self.assertEqual(self.executor.execute('s1', 'k1', 'headache', self.handler('again')),
+                         (200, {'reply': 'Rest and drink water'}, True))
+        self.assertEqual(self.calls, ['Rest and drink water'])
+
+    def test_key_reused_for_another_message_is_rejected(self):
+        self.executor.execute('s1', 'k1', 'headache', self.handler())
+        with self.assertRaises(IdempotencyError) as raised:
+            self.executor.execute('s1', 'k1', 'fever', self.handler())
+        self.assertEqual(raised.exception.status_code, 422)
+        # Keys are scoped to their session
+        self.assertFalse(self.executor.execute('s2', 'k1', 'fever', self.handler())[2])
+
+    def test_concurrent_duplicates_join_the_original(self):
+        results = {}
+        threads = [threading.Thread(target=lambda: duplicate('same', 'headache')),
+                   threading.Thread(target=lambda: duplicate('different', 'fever'))]
+
+        def duplicate(name, message):
+            try:
+                results[name] = self.executor.execute('s1', 'k1', message, self.handler('duplicate'))
+            except IdempotencyError as e:
+                results[name] = e.status_code
+
+        def original():
+            # Duplicates arrive while the original is running; they never touch the database
+            coalesced = metrics.get('chat.idempotency.coalesced')
+            for thread in threads:
+                thread.start()
+            threads[1].join()
+            deadline = time.monotonic() + 5
+            while metrics.get('chat.idempotency.coalesced') == coalesced and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.calls.append('original')
+            return 200, {'reply': 'original'}
+
+        self.assertEqual(self.executor.execute('s1', 'k1', 'headache', original), (200, {'reply': 'original'}, False))
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertEqual(results, {'same': (200, {'reply': 'original'}, True), 'different': 422})
+        self.assertEqual(self.calls, ['original'])
+
+    def test_abandoned_record_is_taken_over_once(self):
+        record = ChatIdempotencyRecord.objects.create(key='x' * 64, request_hash='y' * 64)
+        stale = timezone.now() - timedelta(seconds=self.executor.pending_timeout + 1)
+        ChatIdempotencyRecord.objects.filter(pk=record.pk).update(updated_at=stale)
+        record.refresh_from_db()
+        lookup = ChatIdempotencyRecord.objects.filter
+
+        def lookup_then_taken_over(*args, **kwargs):
+            if 'key' in kwargs:
+                # Another worker takes the record over right after this one read it
+                lookup(pk=record.pk).update(updated_at=timezone.now())
+                return mock.Mock(first=lambda: record)
+            return lookup(*args, **kwargs)
+
+        with mock.patch.object(ChatIdempotencyRecord.objects, 'filter', side_effect=lookup_then_taken_over):
+            with self.assertRaises(IdempotencyError) as raised:
+                self.executor._execute_once(record.key, record.request_hash, self.handler())
+        self.assertEqual(raised.exception.status_code, 409)
+        self.assertEqual(self.calls, [])
+
+        ChatIdempotencyRecord.objects.filter(pk=record.pk).update(updated_at=stale)
+        self.assertEqual(self.executor._execute_once(record.key, record.request_hash, self.handler()),
+                         (200, {'reply': 'Rest and drink water'}, False))
+
+
+def bag_of_words_embedding(text, dimensions=64):
+    """Stand-in for ClinicalBERT: a normalized bag-of-words vector"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in text.split():
+        vector[zlib.crc32(word.encode('utf-8')) % dimensions] += 1
+    return vector / np.linalg.norm(vector)
+
+
+class SemanticCacheTests(SimpleTestCase):
+    """First-turn replies are reused for near-identical messages in the same language"""
+
+    def make_cache(self, **kwargs):
+        cache = SemanticCache(embed=bag_of_words_embedding, similarity_threshold=0.9, **kwargs)
+        with mock.patch.object(cache, '_load_rated_replies', return_value=0):
+            cache.warm()
+        return cache
+
+    def test_hit_above_threshold_only(self):
+        cache = self.make_cache()
+        cache.add('I have malaria symptoms', 'Please get a malaria test.', 'en', feedback_id=7)
+        hit = cache.lookup('i have MALARIA symptoms!', 'en')
+        self.assertEqual((hit['reply'], hit['feedback_id']), ('Please get a malaria test.', 7))
+        self.assertGreater(hit['similarity'], 0.99)
+        self.assertIsNone(cache.lookup('I have a broken leg', 'en'))
+        self.assertIsNone(cache.lookup('I have malaria symptoms', 'en-pidgin'))
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.make_cache(ttl_seconds=60)
+        cache.add('I have malaria symptoms', 'Please get a malaria test.', 'en')
+        cache.partitions['en'].entries[0]['added_at'] -= 61
+        self.assertIsNone(cache.lookup('I have malaria symptoms', 'en'))
+        self.assertEqual(len(cache.partitions['en']), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = self.make_cache(max_entries_per_language=2)
+        cache.add('I have malaria symptoms', 'malaria', 'en')
+        cache.add('my head dey pain me', 'headache', 'en')
+        cache.partitions['en'].entries[1]['last_used'] -= 10
+        cache.partitions['en'].entries[0]['last_used'] -= 5
+        self.assertIsNotNone(cache.lookup('I have malaria symptoms', 'en'))
+        cache.add('I have a bad cough', 'cough', 'en')
+        self.assertEqual([entry['reply'] for entry in cache.partitions['en'].entries], ['malaria', 'cough'])
+
+    def test_lookups_miss_until_warm_and_failed_warms_are_retried(self):
+        embed = mock.Mock(side_effect=bag_of_words_embedding)
+        cache = SemanticCache(embed=embed, warm_retry_seconds=0)
+        with mock.patch('api.semantic_cache.threading.Thread') as thread:
+            self.assertIsNone(cache.lookup('I have malaria symptoms', 'en'))
+            self.assertIsNone(cache.lookup('I have malaria symptoms', 'en'))
+        thread.assert_called_once()
+        embed.assert_not_called()
+
+        with mock.patch.object(cache, '_load_rated_replies', side_effect=RuntimeError('database is down')):
+            cache.warm()
+        self.assertFalse(cache.stats()['warm'])
+        with mock.patch('api.semantic_cache.threading.Thread') as thread:
+            cache.lookup('I have malaria symptoms', 'en')
+        thread.assert_called_once()
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {}})
+class SemanticCacheFeedbackTests(TestCase):
+    """Rated first turns are cached with the reply stored in the session, not the client's response text"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.cache = SemanticCache(embed=bag_of_words_embedding, similarity_threshold=0.9)
+        self.session = ConversationSession.objects.create(external_id='session-rated')
+        Message.objects.create(session=self.session, role='user', content='I have malaria symptoms')
+        Message.objects.create(session=self.session, role='assistant', content='Please get a malaria test.')
+        self.feedback = Feedback.objects.create(session=self.session, rating=5, user_query='I have malaria symptoms',
+                                                response_text='Buy these pills from my shop')
+
+    def test_feedback_caches_the_stored_reply(self):
+        self.assertTrue(self.cache.add_from_feedback(self.feedback))
+        self.cache._warm_state = 'warm'
+        self.assertEqual(self.cache.lookup('I have malaria symptoms', 'en')['reply'], 'Please get a malaria test.')
+
+    def test_warm_loads_the_stored_reply(self):
+        self.assertEqual(self.cache.warm(), 1)
+        self.assertEqual(self.cache.lookup('I have malaria symptoms', 'en')['reply'], 'Please get a malaria test.')
+
+    def test_feedback_endpoint_embeds_off_the_request(self):
+        with mock.patch('api.views.get_semantic_cache', return_value=self.cache), \
+                mock.patch.object(self.cache, 'add_from_feedback_in_background') as add, \
+                mock.patch.object(self.cache, 'embed') as embed:
+            response = self.client.post('/api/feedback/', {
+                'session_id': 'session-rated', 'rating': 5, 'user_query': 'I have malaria symptoms',
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        add.assert_called_once_with(response.json()['feedback_id'], shard_for(self.session.id))
+        embed.assert_not_called()
+
+
+class ConversationStateTests(TestCase):
+    """Cached message windows follow the database: appended, trimmed and invalidated on writes"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.session = ConversationSession.objects.create()
+        self.add_messages(2)
+
+    def add_messages(self, count):
+        start = self.session.messages.count()
+        return [self.session.messages.create(role='user', content=f'Message {start + i}') for i in range(count)]
+
+    def contents(self, state):
+        return [message.content for message in state.get_history(self.session)]
+
+    def test_appended_messages_are_read_without_queries(self):
+        state = ConversationStateCache(max_messages=3)
+        self.assertEqual(self.contents(state), ['Message 0', 'Message 1'])
+        for message in self.add_messages(2):
+            state.append(message)
+        with self.assertNumQueries(0):
+            # Trimmed to the most recent max_messages
+            self.assertEqual(self.contents(state), ['Message 1', 'Message 2', 'Message 3'])
+
+    def test_edits_invalidate_the_window(self):
+        state = ConversationStateCache()
+        self.contents(state)
+        Message.objects.filter(session=self.session, content='Message 0').update(content='Edited')
+        state.invalidate(self.session.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.contents(state), ['Edited', 'Message 1'])
+
+    def test_shared_windows_follow_appends_from_every_worker(self):
+        self.addCleanup(caches['default'].clear)
+        workers = [ConversationStateCache(shared_cache_alias='default') for _ in range(2)]
+        self.assertEqual(self.contents(workers[0]), ['Message 0', 'Message 1'])
+        first, second = self.add_messages(2)
+        workers[0].append(first)
+        workers[1].append(second)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contents(workers[1]), ['Message 0', 'Message 1', 'Message 2', 'Message 3'])
+            self.assertEqual(self.contents(workers[0]), ['Message 0', 'Message 1', 'Message 2', 'Message 3'])
+
+    def test_shared_append_without_the_previous_window_is_rebuilt(self):
+        self.addCleanup(caches['default'].clear)
+        workers = [ConversationStateCache(shared_cache_alias='default') for _ in range(2)]
+        self.contents(workers[0])
+        first, second = self.add_messages(2)
+        # The first append's window was not stored (e.g. that worker is still writing it)
+        with mock.patch.object(workers[0], '_set'):
+            workers[0].append(first)
+        workers[1].append(second)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.contents(workers[1]), ['Message 0', 'Message 1', 'Message 2', 'Message 3'])
+
+    def test_rolled_back_messages_are_not_appended(self):
+        state = ConversationStateCache()
+        self.contents(state)
+        with mock.patch('api.conversation_state.get_conversation_state', return_value=state), \
+                self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic(using=shard_for(self.session.pk)):
+                    self.add_messages(1)
+                    raise RuntimeError('rolled back')
+            except RuntimeError:
+                pass
+            self.add_messages(1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.contents(state), ['Message 0', 'Message 1', 'Message 2'])
+
+
+class TimedChatModel:
+    """Chat model stand-in answering after a delay, or failing"""
+
+    def __init__(self, model, delay, error=None):
+        self.model = model
+        self.delay = delay
+        self.error = error
+
+    async def ainvoke(self, messages, config=None):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return AIMessage(content=f'Answer from {self.model}')
+
+
+class HedgedLLMClientTests(SimpleTestCase):
+    """The primary answers unless it is slow or fails; nothing is awaited past the deadline"""
+
+    endpoints = itertools.count()
+
+    def make_client(self, primary, hedge, **config):
+        """A client whose primary and hedge models are (delay, error) pairs"""
+        behaviour = {'primary-model': primary, 'hedge-model': hedge}
+        endpoint_config = dict(COMMON_DEFAULTS, MODEL='primary-model', HEDGE_MODEL='hedge-model', TEMPERATURE=0,
+                               MODEL_KWARGS={}, DEADLINE_SECONDS=2.0, HEDGE_AFTER_SECONDS=0.05,
+                               MIN_HEDGE_AFTER_SECONDS=0.05)
+        endpoint_config.update(config)
+        return HedgedLLMClient(
+            f'test{next(self.endpoints)}', config=endpoint_config,
+            model_factory=lambda model, config: TimedChatModel(model, *behaviour[model]),
+        )
+
+    def count(self, client, name):
+        return metrics.get(client.metric(name))
+
+    def test_fast_primary_is_not_hedged(self):
+        client = self.make_client((0, None), (0, None))
+        response = client.invoke([])
+        self.assertEqual(response.response_metadata['llm_path'], 'primary')
+        self.assertEqual(self.count(client, 'hedged.slow'), 0)
+        self.assertEqual(metrics.sample_count(client.metric('primary')), 1)
+
+    def test_slow_primary_loses_to_hedge_and_is_recorded_censored(self):
+        client = self.make_client((1.0, None), (0, None))
+        response = client.invoke([])
+        self.assertEqual(response.response_metadata['llm_path'], 'hedge')
+        self.assertEqual(self.count(client, 'hedged.slow'), 1)
+        self.assertEqual(self.count(client, 'primary.cancelled'), 1)
+        # The cancelled primary still counts towards the p95 driving the hedge delay
+        self.assertEqual(self.count(client, 'primary.censored'), 1)
+        self.assertEqual(metrics.sample_count(client.metric('primary')), 1)
+        self.assertGreaterEqual(metrics.percentile(client.metric('primary'), 95), 0.05)
+
+    def test_failed_primary_is_hedged_at_once(self):
+        client = self.make_client((0, RuntimeError('rate limited')), (0, None), HEDGE_AFTER_SECONDS=1.0,
+                                  MIN_HEDGE_AFTER_SECONDS=1.0)
+        start = time.perf_counter()
+        response = client.invoke([])
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(response.response_metadata['llm_path'], 'hedge')
+        self.assertEqual(self.count(client, 'hedged.error'), 1)
+
+    def test_deadline_cancels_both_paths(self):
+        client = self.make_client((5.0, None), (5.0, None), DEADLINE_SECONDS=0.2)
+        with self.assertRaises(LLMDeadlineExceeded):
+            client.invoke([])
+        self.assertEqual(self.count(client, 'deadline_exceeded'), 1)
+        self.assertEqual(self.count(client, 'primary.cancelled'), 1)
+        self.assertEqual(self.count(client, 'hedge.cancelled'), 1)
+
+    def test_errors_on_both_paths_are_raised(self):
+        client = self.make_client((0, RuntimeError('primary down')), (0, RuntimeError('hedge down')))
+        with self.assertRaisesMessage(RuntimeError, 'hedge down'):
+            client.invoke([])
+
+    def test_hedge_delay_follows_primary_p95(self):
+        client = self.make_client((0, None), (0, None), HEDGE_AFTER_SECONDS=6.0, MIN_SAMPLES=20, DEADLINE_SECONDS=10.0)
+        self.assertEqual(client.hedge_delay(), 6.0)
+        for latency in range(1, 21):
+            metrics.observe(client.metric('primary'), latency / 10)
+        self.assertAlmostEqual(client.hedge_delay(), 1.9, delta=0.1)
+
+    def test_models_are_built_once_per_event_loop(self):
+        built = []
+        client = self.make_client((1.0, None), (0, None))
+        factory = client.model_factory
+        client.model_factory = lambda model, config: built.append(model) or factory(model, config)
+
+        for _ in range(3):
+            self.assertEqual(client.invoke([]).response_metadata['llm_path'], 'hedge')
+        self.assertEqual(sorted(built), ['hedge-model', 'primary-model'])
+
+        async def call_twice():
+            await client.ainvoke([])
+            await client.ainvoke([])
+        asyncio.run(call_twice())
+        self.assertEqual(len(built), 4)
+
+
+class LLMBackendTests(SimpleTestCase):
+    """settings.LLM_BACKEND selects the model factory; the local stub answers deterministically"""
+
+    config = dict(COMMON_DEFAULTS, TEMPERATURE=0, MODEL_KWARGS={}, DEADLINE_SECONDS=5.0, HEDGE_AFTER_SECONDS=5.0)
+
+    def start_stub(self, **overrides):
+        """Serve a stub with instant, seeded completions on a free port; returns its base URL"""
+        server = StubServer(get_stub_settings(PORT=0, LATENCY='fixed', LATENCY_MS=0, TOKENS_PER_SECOND=0,
+                                              SEED=7, **overrides))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+    def test_local_stub_backend_is_selected_by_settings(self):
+        with override_settings(LLM_BACKEND={'BACKEND': 'local_stub'}):
+            model = get_backend_factory()('gpt-4o', self.config)
+        self.assertEqual(model.openai_api_base, 'http://127.0.0.1:8089/v1')
+        self.assertEqual(model.model_name, 'gpt-4o')
+
+        with override_settings(LLM_BACKEND={'BACKEND': 'local_stub', 'BASE_URL': 'http://stub:9000/v1'}):
+            self.assertEqual(get_backend_factory()('gpt-4o', self.config).openai_api_base, 'http://stub:9000/v1')
+
+    def test_dotted_path_backend_is_imported(self):
+        with override_settings(LLM_BACKEND={'BACKEND': 'api.tests.TimedChatModel'}):
+            model = get_backend_factory()('custom-model', self.config)
+        self.assertIsInstance(model, TimedChatModel)
+        self.assertEqual(model.model, 'custom-model')
+
+    def test_stub_replies_are_deterministic(self):
+        base_url = self.start_stub()
+        client = HedgedLLMClient('stub-test', config=dict(self.config, MODEL='stub', HEDGE_ENABLED=False),
+                                 model_factory=get_backend_factory({'BACKEND': 'local_stub', 'BASE_URL': base_url}))
+        replies = [client.invoke([HumanMessage(content='I have a headache')]).content for _ in range(2)]
+        self.assertEqual(replies[0], replies[1])
+        self.assertTrue(replies[0].startswith('Stub reply to: I have a headache'))
+
+        fixed = StubBehaviour(get_stub_settings(REPLY='Drink water', REPLY_TOKENS=2))
+        self.assertEqual(fixed.reply_tokens([{'role': 'user', 'content': 'Hello'}]), ['Drink', ' water'])
+
+    def test_seeded_stub_draws_the_same_latencies_and_failures(self):
+        config = get_stub_settings(LATENCY='lognormal', ERROR_RATE=0.3, TIMEOUT_RATE=0.1, SEED=7)
+        first, second = StubBehaviour(config), StubBehaviour(config)
+        draws = [[(behaviour.first_token_delay(), behaviour.draw_failure()) for _ in range(20)]
+                 for behaviour in (first, second)]
+        self.assertEqual(draws[0], draws[1])
+        self.assertTrue(any(failure for _, failure in draws[0]))
+
+
+class PromptAssemblyTests(SimpleTestCase):
+    """Chat prompts start with the same bytes across turns and sessions; sections are token-counted"""
+
+    def serialize(self, messages):
+        return [(type(message).__name__, message.content.encode('utf-8')) for message in messages]
+
+    def turns(self, replies, language='en'):
+        """The prompt of every turn of a conversation with these user messages"""
+        history, prompts = [], []
+        for index, text in enumerate(replies):
+            prompts.append(build_chat_prompt(history, text, language)['messages'])
+            history = history + [Message(role='user', content=text),
+                                 Message(role='assistant', content=f'Reply {index}')]
+        return prompts
+
+    def test_prefix_is_byte_identical_across_turns_and_sessions(self):
+        first = self.turns(['I have a headache', 'Since Monday', 'No fever'])
+        second = self.turns(['My belle dey pain me', 'E don tey'], language='en-pidgin')
+        for prompt in first + second:
+            self.assertEqual(self.serialize(prompt[:1]), [('SystemMessage', BASE_SYSTEM_PROMPT.encode('utf-8'))])
+
+        # Each turn's prompt, minus the current message, starts the next turn's prompt
+        for session in (first, second):
+            for turn, next_turn in zip(session, session[1:]):
+                self.assertEqual(self.serialize(next_turn[:len(turn) - 1]), self.serialize(turn[:-1]))
+
+    def test_trimmed_history_keeps_its_start_for_several_turns(self):
+        history = list(range(30))
+        starts = {trim_history(history[:length], 12, 6)[0] for length in range(13, 18)}
+        self.assertEqual(starts, {6})
+        self.assertEqual(trim_history(history[:12], 12, 6), history[:12])
+
+    def test_token_counts(self):
+        with mock.patch('api.prompts._encoding', None):
+            self.assertEqual(count_tokens(''), 0)
+            self.assertEqual(count_tokens('ab'), 1)
+            self.assertEqual(count_tokens('a' * 40), 10)
+
+        cached = Message(role='user', content='I have a headache')
+        cached.token_count = 7
+        history = [cached, Message(role='assistant', content='How long?')]
+        user_context = UserContext(symptoms={'headache': {'severity': 3}}, symptom_durations={'headache': '3 days'})
+        tokens = build_chat_prompt(history, 'It is worse today', 'en-pidgin', user_context)['tokens']
+        self.assertEqual(tokens, {
+            'base': count_tokens(BASE_SYSTEM_PROMPT),
+            'language': count_tokens(PIDGIN_GUIDANCE),
+            'history': 7 + count_tokens('How long?'),
+            'context': count_tokens(build_context_block(user_context)),
+            'message': count_tokens('It is worse today'),
+        })
+        self.assertGreater(tokens['context'], 0)
+
+
+class UserContextMergeTests(SimpleTestCase):
+    """Entities from chat are merged into UserContext as sets: no duplicates, existing entries kept first"""
+
+    def test_entries_are_deduplicated_in_a_stable_order(self):
+        context = UserContext(
+            symptoms={'Fever': {'name': 'Fever', 'severity': 5, 'source': 'user'}},
+            treatments_tried=[{'name': 'Agbo', 'type': 'traditional', 'effective': True}],
+        )
+        changed = merge_entities(context, {
+            'SYMPTOM': ['cough', 'fever', 'headache', 'severe headache', 'pain'],
+            'MEDICATION': ['Paracetamol', 'agbo', 'paracetamol'],
+            'CONDITION': ['malaria', 'Malaria'],
+        })
+        self.assertEqual(changed, ['medical_history', 'symptoms', 'treatments_tried'])
+        self.assertEqual(list(context.symptoms), ['Fever', 'cough', 'headache', 'pain'])
+        # Entries entered by the user are never overwritten
+        self.assertEqual(context.symptoms['Fever']['severity'], 5)
+        self.assertEqual([t['name'] for t in context.treatments_tried], ['Agbo', 'Paracetamol'])
+        self.assertEqual([h['condition'] for h in context.medical_history], ['malaria'])
+
+        # Merging the same entities again changes nothing
+        before = (dict(context.symptoms), list(context.treatments_tried), list(context.medical_history))
+        self.assertEqual(merge_entities(context, {'SYMPTOM': ['Cough'], 'MEDICATION': ['PARACETAMOL'],
+                                                  'CONDITION': ['malaria']}), [])
+        self.assertEqual((context.symptoms, context.treatments_tried, context.medical_history), before)
+
+    def test_severity_and_duration_only_for_a_single_symptom(self):
+        context = UserContext()
+        merge_entities(context, {'SYMPTOM': ['headache'], 'SEVERITY': ['severe'], 'DURATION': ['for 3 days']})
+        self.assertEqual(context.symptoms['headache']['severity'], 4)
+        self.assertTrue(context.symptoms['headache']['severity_reported'])
+        self.assertEqual(context.symptom_durations, {'headache': 'for 3 days'})
+
+        # A known duration is kept; with two symptoms the duration is not attributed
+        merge_entities(context, {'SYMPTOM': ['Headache'], 'DURATION': ['for a week']})
+        merge_entities(context, {'SYMPTOM': ['cough', 'vomiting'], 'SEVERITY': ['mild'], 'DURATION': ['since monday']})
+        self.assertEqual(context.symptom_durations, {'headache': 'for 3 days'})
+        self.assertEqual(context.symptoms['cough']['severity'], 3)
+        self.assertFalse(context.symptoms['cough']['severity_reported'])
+
+
+class UserContextUpdateTests(TestCase):
+    """The update_user_context task fills the session's UserContext once per fact"""
+    databases = '__all__'
+
+    def test_repeated_updates_change_nothing(self):
+        session = ConversationSession.objects.create()
+        UserContext.objects.create(session=session, language='en-pidgin')
+        message = Message.objects.create(session=session, role='user', content='I have had a headache for 3 days')
+        update_user_context(message.id)
+        update_user_context(message.id)
+        context = UserContext.objects.using(shard_for(session.id)).get(session_id=session.id)
+        self.assertEqual(list(context.symptoms), ['headache'])
+        self.assertEqual(context.symptom_durations, {'headache': 'for 3 days'})
+        self.assertEqual(context.language, 'en-pidgin')
+
+
+class ModelRouterTests(SimpleTestCase):
+    """Each routing rule sends turns to the route it is meant to, and costs are estimated per token type"""
+
+    # (message, language, previous assistant reply, route, reason)
+    TURNS = [
+        ("Hello", 'en', None, 'simple', 'no_clinical_content'),
+        ("Thank you doctor", 'en-pidgin', "Drink plenty of water.", 'simple', 'no_clinical_content'),
+        ("I have had a headache for 3 days", 'en', None, 'clinical', 'entities'),
+        ("I dey take paracetamol", 'en-pidgin', None, 'clinical', 'entities'),
+        ("Can you tell me a little more about what you mean by that one please", 'en', None,
+         'clinical', 'length'),
+        ("Thank you", 'yo', None, 'clinical', 'language'),
+        ("Yes", 'en', "Do you feel dizzy when you stand up?", 'clinical', 'answering_question'),
+        ("Since Monday", 'en', "When did it start? ", 'clinical', 'answering_question'),
+    ]
+
+    def test_routes_and_reasons(self):
+        for message, language, previous_reply, route, reason in self.TURNS:
+            with self.subTest(message=message, language=language):
+                decision = classify_turn(message, language, previous_reply, config=ROUTING_DEFAULTS)
+                self.assertEqual((decision['route'], decision['reason']), (route, reason))
+                self.assertEqual(decision['endpoint'], ROUTING_DEFAULTS['ROUTES'][route])
+
+    def test_rule_switches(self):
+        decision = classify_turn("Hello", config={**ROUTING_DEFAULTS, 'ENABLED': False})
+        self.assertEqual((decision['route'], decision['reason']), ('clinical', 'disabled'))
+
+        config = {**ROUTING_DEFAULTS, 'CLINICAL_IF_ANSWERING_QUESTION': False}
+        decision = classify_turn("Yes", 'en', "Are you still there?", config=config)
+        self.assertEqual(decision['route'], 'simple')
+        self.assertTrue(decision['features']['answering_question'])
+
+    def test_estimate_cost(self):
+        cases = [
+            ('gpt-4o', {'prompt_tokens': 1000, 'completion_tokens': 500}, (1000 * 2.50 + 500 * 10.00) / 1e6),
+            ('gpt-4o', {'prompt_tokens': 1000, 'completion_tokens': 500,
+                        'prompt_tokens_details': {'cached_tokens': 200}},
+             (800 * 2.50 + 200 * 1.25 + 500 * 10.00) / 1e6),
+            ('gpt-4o-mini', {'prompt_tokens': 1000, 'completion_tokens': 0,
+                             'prompt_tokens_details': {'cached_tokens': None}}, 1000 * 0.15 / 1e6),
+            ('gpt-4o', {}, None),
+            ('unknown-model', {'prompt_tokens': 1000, 'completion_tokens': 500}, None),
+        ]
+        for model, token_usage, expected in cases:
+            with self.subTest(model=model, token_usage=token_usage):
+                cost = estimate_cost(model, token_usage, config=ROUTING_DEFAULTS)
+                if expected is None:
+                    self.assertIsNone(cost)
+                else:
+                    self.assertAlmostEqual(cost, expected)
+
+
+class ChatModelStub:
+    """Chat model stand-in that answers at once"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def ainvoke(self, messages, config=None):
+        return AIMessage(content="Thank you. How long have you had the headache?")
+
+
+# Reads stay on the primaries, which hold the test data (see ReadReplicaTests)
+@override_settings(SEMANTIC_CACHE={'ENABLED': False}, DATABASE_REPLICATION={'REPLICAS': {}})
+class EndpointQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Every API endpoint stays within its query budget and uses indexes on the hot
+    tables. Each endpoint is measured twice with more data the second time; the
+    count must not change, so a query per row (N+1) fails here.
+    """
+    databases = '__all__'
+
+    # Queries per request; lower these when an endpoint gets cheaper
+    BUDGETS = {
+        'tasks': 1,
+        'chat_poll': 2,
+        'chat': 9,  # The turn's two messages are saved in one transaction (a savepoint here)
+        'chat_summary': 11,
+        'chat_summary_bulk': 17,  # For two sessions
+        'feedback': 2,
+        'user_context_get': 2,
+        'user_context_post': 3,
+        'expert_review_list': 1,
+        'expert_review_for_feedback': 1,
+        'expert_review_create': 2,
+        'analytics': 1,
+        'analytics_generate': 3,
+        'analytics_dashboard': 2,
+        'data_pipeline': 1,
+        'data_pipeline_update_metrics': 9,
+        'data_pipeline_generate_training': 4,  # Including the archived-session lookup
+        'runtime_metrics': 3,
+    }
+
+    def setUp(self):
+        self.sessions = []
+        self.feedback = []
+        self.data_dir = tempfile.mkdtemp()
+        patches = [
+            mock.patch('api.llm_client.ChatOpenAI', ChatModelStub),
+            mock.patch.object(DataPipeline, '__init__', lambda pipeline: setattr(pipeline, 'data_dir', self.data_dir)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        llm_client._llm_clients.clear()
+        self.addCleanup(llm_client._llm_clients.clear)
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        models_stub = stubbed_models()
+        models_stub.__enter__()
+        self.addCleanup(models_stub.__exit__, None, None, None)
+
+    def seed(self, count):
+        """Add `count` sessions with messages, context, feedback, a review and daily metrics"""
+        today = timezone.now().date()
+        for _ in range(count):
+            index = len(self.sessions)
+            session = ConversationSession.objects.create(external_id=f'session-{index}')
+            for i in range(3):
+                Message.objects.create(session=session, role='user', content=f"I have had a headache for {i + 1} days")
+                Message.objects.create(session=session, role='assistant', content="How severe is the pain?")
+            UserContext.objects.create(session=session, language='en')
+            feedback = Feedback.objects.create(session=session, rating=4 + index % 2, comment='Clear and helpful',
+                                               user_query='headache', response_text='Rest and drink water')
+            ExpertReview.objects.create(feedback=feedback, reviewer_name='Dr. Ade', medical_accuracy=4,
+                                        cultural_relevance=5)
+            AnalyticsMetric.objects.create(metric_type='avg_rating', date=today - timedelta(days=index), value=4.0)
+            Task.objects.create(title=f'Task {index}')
+            self.sessions.append(session)
+            self.feedback.append(feedback)
+
+    def request(self, name, method, path, data=None):
+        """Make a request within the endpoint's budget, with a cold session resolver cache"""
+        get_session_resolver().clear()
+        with self.assertQueryBudget(self.BUDGETS[name], name) as captured:
+            if method == 'get':
+                response = self.client.get(path, data)
+            else:
+                response = getattr(self.client, method)(path, data, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f"{name}: {response.status_code}")
+        return len(captured)
+
+    def assertFlat(self, name, method, path, data=None):
+        """
+        The endpoint's query count does not grow with the amount of data
+
+        `path` and `data` may be callables taking the newest seeded session.
+        """
+        counts = []
+        for count in (2, 5):
+            self.seed(count)
+            session = self.sessions[-1]
+            counts.append(self.request(
+                name, method,
+                path(session) if callable(path) else path,
+                data(session) if callable(data) else data,
+            ))
+        self.assertEqual(counts[0], counts[1], f"{name} ran more queries with more data: {counts}")
+
+    def test_tasks(self):
+        self.assertFlat('tasks', 'get', '/api/tasks/')
+
+    def test_chat_poll(self):
+        self.assertFlat('chat_poll', 'get', '/api/chat/',
+                        lambda session: {'session_id': session.external_id, 'after_id': 0})
+
+    def test_chat(self):
+        self.assertFlat('chat', 'post', '/api/chat/',
+                        data=lambda session: {'message': 'It is worse in the morning', 'session_id': session.external_id})
+
+    def test_chat_summary(self):
+        self.assertFlat('chat_summary', 'post', '/api/chat/summary/',
+                        data=lambda session: {'session_id': session.external_id})
+
+    def test_chat_summary_bulk(self):
+        # The same number of sessions per request; the count grows only with that number
+        self.assertFlat('chat_summary_bulk', 'post', '/api/chat/summary/bulk/',
+                        data=lambda session: {'session_ids': [session.id - 1, session.id]})
+
+    def test_feedback(self):
+        self.assertFlat('feedback', 'post', '/api/feedback/',
+                        data=lambda session: {'session_id': session.external_id, 'rating': 5})
+
+    def test_user_context(self):
+        self.assertFlat('user_context_get', 'get', '/api/user-context/',
+                        lambda session: {'session_id': session.external_id})
+        self.assertFlat('user_context_post', 'post', '/api/user-context/',
+                        data=lambda session: {'session_id': session.external_id, 'symptoms': {'headache': 'moderate'}})
+
+    def test_expert_review(self):
+        self.assertFlat('expert_review_list', 'get', '/api/expert-review/')
+        self.assertFlat('expert_review_for_feedback', 'get', '/api/expert-review/',
+                        lambda session: {'feedback_id': self.feedback[-1].id})
+        self.assertFlat('expert_review_create', 'post', '/api/expert-review/',
+                        data=lambda session: {'feedback': self.feedback[-1].id, 'reviewer_name': 'Dr. Obi',
+                                              'medical_accuracy': 5, 'cultural_relevance': 4})
+
+    def test_analytics(self):
+        today = timezone.now().date()
+        date_range = {'from_date': (today - timedelta(days=30)).isoformat(), 'to_date': today.isoformat()}
+        self.assertFlat('analytics', 'get', '/api/analytics/', date_range)
+        self.assertFlat('analytics_generate', 'post', '/api/analytics/', date_range)
+        self.assertFlat('analytics_dashboard', 'get', '/api/analytics/dashboard/', date_range)
+
+    def test_data_pipeline(self):
+        today = timezone.now().date()
+        self.assertFlat('data_pipeline', 'get', '/api/data-pipeline/')
+        self.assertFlat('data_pipeline_update_metrics', 'post', '/api/data-pipeline/',
+                        {'operation': 'update_metrics', 'from_date': (today - timedelta(days=30)).isoformat(),
+                         'to_date': today.isoformat()})
+        self.assertFlat('data_pipeline_generate_training', 'post', '/api/data-pipeline/',
+                        {'operation': 'generate_training', 'min_rating': 1})
+
+    def test_runtime_metrics(self):
+        self.assertFlat('runtime_metrics', 'get', '/api/metrics/runtime/')
+
+
+@deferred_task('tests.fail')
+def failing_task(**payload):
+    raise RuntimeError('handler failed')
+
+
+class TaskQueueTests(TestCase):
+    """Deferred tasks are claimed by one worker, retried with backoff and dead-lettered"""
+    databases = '__all__'
+
+    def setUp(self):
+        config = {**QUEUE_DEFAULTS, 'MAX_ATTEMPTS': 3, 'RETRY_BACKOFF_SECONDS': 10, 'LEASE_SECONDS': 300}
+        self.workers = [TaskWorker(worker_id=f'worker-{i}', config=config) for i in range(2)]
+        patcher = override_settings(TASK_QUEUE={'MAX_ATTEMPTS': 3})
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def test_each_task_is_claimed_once(self):
+        tasks = [enqueue('tests.fail', n=n) for n in range(3)]
+        first, second = self.workers
+        claimed = first.claim()
+        self.assertEqual([task.id for task in claimed], [task.id for task in tasks])
+        self.assertEqual(second.claim(), [])
+        for task in claimed:
+            self.assertEqual((task.status, task.locked_by, task.attempts), ('running', 'worker-0', 1))
+
+    def test_failures_back_off_then_dead_letter(self):
+        task = enqueue('tests.fail')
+        worker = self.workers[0]
+        for attempt, delay in ((1, 10), (2, 20)):
+            DeferredTask.objects.filter(id=task.id).update(available_at=timezone.now())
+            [claimed] = worker.claim()
+            before = timezone.now()
+            self.assertFalse(worker.run_task(claimed))
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts, task.locked_by), ('pending', attempt, ''))
+            self.assertAlmostEqual((task.available_at - before).total_seconds(), delay, delta=1)
+            self.assertIn('handler failed', task.last_error)
+
+        DeferredTask.objects.filter(id=task.id).update(available_at=timezone.now())
+        worker.run_once()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('dead', 3))
+        self.assertEqual(worker.claim(), [])
+
+    def test_expired_leases_are_released_or_dead_lettered(self):
+        expired = timezone.now() - timedelta(seconds=301)
+        retried, exhausted, live = (enqueue('tests.fail') for _ in range(3))
+        DeferredTask.objects.filter(id=retried.id).update(status='running', attempts=1, locked_at=expired)
+        DeferredTask.objects.filter(id=exhausted.id).update(status='running', attempts=3, locked_at=expired)
+        DeferredTask.objects.filter(id=live.id).update(status='running', attempts=3, locked_at=timezone.now())
+
+        self.assertEqual(self.workers[0].release_expired_leases(), 1)
+        statuses = dict(DeferredTask.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[task.id] for task in (retried, exhausted, live)], ['pending', 'dead', 'running']
+        )
+
+
+class IdleSessionMixin:
+    """An idle session with messages and feedback, an active session and an archive directory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        override = override_settings(CONVERSATION_ARCHIVE={'DIRECTORY': self.directory})
+        override.enable()
+        self.addCleanup(override.disable)
+        get_session_resolver().clear()
+
+        idle_since = timezone.now() - timedelta(days=200)
+        self.session = ConversationSession.objects.create(external_id='session-idle')
+        Message.objects.create(session=self.session, role='user', content='I have had a headache for a week')
+        Message.objects.create(session=self.session, role='assistant', content='Is it worse in the morning?')
+        Feedback.objects.create(session=self.session, rating=4)
+        Message.objects.filter(session=self.session).update(timestamp=idle_since)
+        ConversationSession.objects.filter(id=self.session.id).update(created_at=idle_since)
+        Feedback.objects.filter(session=self.session).update(created_at=idle_since)
+        self.active = ConversationSession.objects.create(external_id='session-active')
+        Message.objects.create(session=self.active, role='user', content='Hello')
+
+    def snapshot(self):
+        return (
+            list(Message.objects.filter(session_id=self.session.id).order_by('id').values()),
+            list(Feedback.objects.filter(session_id=self.session.id).values()),
+        )
+
+
+class ConversationArchiveTests(IdleSessionMixin, TestCase):
+    """Idle sessions round-trip through cold storage unchanged"""
+    databases = '__all__'
+
+    def test_archive_and_rehydrate_on_resolve(self):
+        before = self.snapshot()
+        stats = archive_idle_sessions()
+        self.assertEqual(stats['sessions'], 1)
+        self.assertEqual(stats['messages'], 2)
+        self.assertFalse(ConversationSession.objects.filter(id=self.session.id).exists())
+        self.assertTrue(ConversationSession.objects.filter(id=self.active.id).exists())
+        entry = ArchivedSession.objects.get()
+        self.assertEqual((entry.session_id, entry.external_id), (self.session.id, 'session-idle'))
+        self.assertTrue(entry.has_feedback)
+
+        session = resolve_session('session-idle', create=False)
+        self.assertEqual(session.id, self.session.id)
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(ArchivedSession.objects.exists())
+
+    def test_sessions_active_again_are_not_archived(self):
+        idle_before = timezone.now() - timedelta(days=90)
+        Message.objects.create(session=self.session, role='user', content='It came back today')
+        stats = archive_sessions([self.session.id], idle_before=idle_before)
+        self.assertEqual(stats['sessions'], 0)
+        self.assertEqual(Message.objects.filter(session_id=self.session.id).count(), 3)
+        self.assertFalse(ArchivedSession.objects.exists())
+
+    def test_training_export_rehydrates_sessions_with_feedback(self):
+        archive_idle_sessions()
+        idle_day = (timezone.now() - timedelta(days=200)).date()
+        rehydrate_active_between(*created_between(idle_day, idle_day).values(), with_feedback=True)
+        self.assertTrue(ConversationSession.objects.filter(id=self.session.id).exists())
+        self.assertEqual(Message.objects.filter(session_id=self.session.id).count(), 2)
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {}})
+class BulkSummaryTests(IdleSessionMixin, TestCase):
+    """Bulk summaries stream stored summaries, errors and new summaries, and respect MAX_SESSIONS"""
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.llm_client.ChatOpenAI', ChatModelStub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        llm_client._llm_clients.clear()
+        self.addCleanup(llm_client._llm_clients.clear)
+        models_stub = stubbed_models()
+        models_stub.__enter__()
+        self.addCleanup(models_stub.__exit__, None, None, None)
+
+        self.empty = ConversationSession.objects.create(external_id='session-empty')
+        self.fresh = ConversationSession.objects.create(external_id='session-fresh')
+        Message.objects.create(session=self.fresh, role='user', content='My chest hurts when I climb stairs')
+
+    def post(self, data):
+        response = self.client.post('/api/chat/summary/bulk/', data, content_type='application/json')
+        if not response.streaming:
+            return response, None
+        return response, [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_stored_summaries_then_errors_then_new_summaries(self):
+        summarize_session(self.active.id)
+        response, lines = self.post({'session_ids': [self.fresh.id, self.empty.id, self.active.id]})
+        self.assertEqual(response.status_code, 200)
+        *results, done = lines
+        self.assertEqual([result['session_id'] for result in results], [self.active.id, self.empty.id, self.fresh.id])
+        self.assertTrue(results[0]['precomputed'])
+        self.assertEqual(results[1]['status'], 400)
+        self.assertFalse(results[2]['precomputed'])
+        self.assertEqual((done['done'], done['count']), (True, 3))
+
+        # The new summary was stored and is served as precomputed next time
+        _, lines = self.post({'session_ids': [self.fresh.id]})
+        self.assertTrue(lines[0]['precomputed'])
+
+    def test_too_many_sessions_are_rejected_before_restoring(self):
+        archive_idle_sessions()
+        date_range = {'date_from': (timezone.now() - timedelta(days=200)).date().isoformat(),
+                      'date_to': timezone.now().date().isoformat()}
+
+        with override_settings(CLINICAL_SUMMARY={'MAX_SESSIONS': 2}):
+            response, _ = self.post(date_range)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('3 requested', response.json()['error'])
+            self.assertTrue(ArchivedSession.objects.filter(session_id=self.session.id).exists())
+
+            response, _ = self.post({'session_ids': [self.fresh.id, self.empty.id, self.active.id]})
+            self.assertEqual(response.status_code, 400)
+
+        response, lines = self.post(date_range)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({line.get('session_id') for line in lines[:-1]},
+                         {self.session.id, self.active.id, self.fresh.id})
+        self.assertFalse(ArchivedSession.objects.exists())
+
+    def test_summarize_sessions_command(self):
+        output_path = f'{self.directory}/summaries.jsonl'
+        stdout, stderr = StringIO(), StringIO()
+        call_command('summarize_sessions', session_ids=[self.fresh.id, self.empty.id], output=output_path,
+                     stdout=stdout, stderr=stderr)
+        self.assertIn('Summarized 1/2 sessions', stdout.getvalue())
+        self.assertIn(f'session {self.empty.id}: No messages found', stderr.getvalue())
+        with open(output_path, encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['session_id'] for line in f], [self.empty.id, self.fresh.id])
+
+        archive_idle_sessions()
+        idle_day = (timezone.now() - timedelta(days=200)).date().isoformat()
+        stdout = StringIO()
+        call_command('summarize_sessions', date=idle_day, stdout=stdout)
+        self.assertIn('Summarized 1/1 sessions', stdout.getvalue())
+        self.assertTrue(ConversationSession.objects.filter(id=self.session.id).exists())
+
+        with self.assertRaises(CommandError):
+            call_command('summarize_sessions', date='yesterday')
+
+    def test_summarize_sessions_command_validates_and_restores_session_ids(self):
+        archive_idle_sessions()
+        stdout = StringIO()
+        call_command('summarize_sessions', session_ids=[self.session.id, self.session.id], stdout=stdout)
+        self.assertIn('Summarized 1/1 sessions', stdout.getvalue())
+        self.assertTrue(ConversationSession.objects.filter(id=self.session.id).exists())
+        self.assertFalse(ArchivedSession.objects.exists())
+
+        with self.assertRaisesMessage(CommandError, 'Sessions not found: [999999]'):
+            call_command('summarize_sessions', session_ids=[self.fresh.id, 999999])
+        with self.assertRaisesMessage(CommandError, 'shard'):
+            call_command('summarize_sessions', session_ids=[(len(get_shards()) + 1) << SHARD_ID_BITS])
+        with override_settings(CLINICAL_SUMMARY={'MAX_SESSIONS': 1}), \
+                self.assertRaisesMessage(CommandError, '2 requested'):
+            call_command('summarize_sessions', session_ids=[self.fresh.id, self.active.id])
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {}}, CLINICAL_SUMMARY={'IDLE_MINUTES': 15})
+class IdleSummaryTests(TestCase):
+    """A session is summarized once after it goes idle; checks of active sessions are pushed back"""
+    databases = '__all__'
+
+    def setUp(self):
+        patcher = mock.patch('api.llm_client.ChatOpenAI', ChatModelStub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        llm_client._llm_clients.clear()
+        self.addCleanup(llm_client._llm_clients.clear)
+        models_stub = stubbed_models()
+        models_stub.__enter__()
+        self.addCleanup(models_stub.__exit__, None, None, None)
+
+        self.session = ConversationSession.objects.create(external_id='session-summary')
+        self.turn = Message.objects.create(session=self.session, role='user', content='My knee is swollen')
+        self.reply = Message.objects.create(session=self.session, role='assistant', content='Since when?')
+
+    def idle_for(self, minutes):
+        Message.objects.filter(session=self.session).update(timestamp=timezone.now() - timedelta(minutes=minutes))
+
+    def scheduled(self):
+        return list(DeferredTask.objects.filter(name='summarize_idle_session'))
+
+    def test_active_session_is_rescheduled(self):
+        self.idle_for(5)
+        before = timezone.now()
+        summarize_idle_session(self.session.id, self.turn.id)
+
+        [task] = self.scheduled()
+        self.assertEqual(task.payload, {'session_id': self.session.id, 'after_message_id': self.turn.id})
+        self.assertAlmostEqual((task.available_at - before).total_seconds(), 10 * 60, delta=5)
+        self.assertFalse(SessionSummary.objects.filter(session_id=self.session.id).exists())
+
+    def test_check_of_an_older_turn_is_dropped(self):
+        Message.objects.create(session=self.session, role='user', content='It is getting worse')
+        summarize_idle_session(self.session.id, self.turn.id)
+        self.assertEqual(self.scheduled(), [])
+        self.assertFalse(SessionSummary.objects.filter(session_id=self.session.id).exists())
+
+    def test_idle_session_is_summarized_once(self):
+        self.idle_for(20)
+        with mock.patch('api.chat_tasks.summarize_session', wraps=summarize_session) as summarize:
+            summarize_idle_session(self.session.id, self.turn.id)
+            summarize_idle_session(self.session.id, self.turn.id)
+        self.assertEqual(summarize.call_count, 1)
+        stored = SessionSummary.objects.get(session_id=self.session.id)
+        self.assertEqual(stored.last_message_id, self.reply.id)
+        self.assertEqual(self.scheduled(), [])
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {}})
+class SessionResolverTests(TestCase):
+    """Each client id maps to one session; resolved ids are served from the LRU cache until deleted"""
+    databases = '__all__'
+
+    def setUp(self):
+        get_session_resolver().clear()
+        self.addCleanup(get_session_resolver().clear)
+
+    def test_external_id_maps_to_one_session(self):
+        session = resolve_session('session-a')
+        self.assertEqual(session.external_id, 'session-a')
+        get_session_resolver().clear()
+        self.assertEqual(resolve_session('session-a').id, session.id)
+        self.assertNotEqual(resolve_session('session-b').id, session.id)
+        self.assertEqual(ConversationSession.objects.using(shard_for(session.id)).filter(external_id='session-a').count(), 1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic(using=shard_for(session.id)):
+            ConversationSession.objects.using(shard_for(session.id)).create(external_id='session-a')
+
+    @skipUnless(len(settings.SESSION_SHARDS) > 1, 'Run with DATABASE_SHARDS=2')
+    def test_external_id_on_another_shard_is_not_duplicated(self):
+        # Sessions created before a shard was added stay where they are
+        other = next(alias for alias in get_shards() if alias != shard_for_external_id('session-a'))
+        session = ConversationSession.objects.using(other).create(external_id='session-a')
+        self.assertEqual(resolve_session('session-a').id, session.id)
+        self.assertEqual(sum(ConversationSession.objects.using(alias).filter(external_id='session-a').count()
+                             for alias in get_shards()), 1)
+
+    def test_client_ids(self):
+        session = ConversationSession.objects.create()
+        self.assertEqual(resolve_session(str(session.id)).id, session.id)
+        self.assertEqual(resolve_session(f' {session.id} ').id, session.id)
+        self.assertEqual(resolve_session('').external_id, 'default')
+        self.assertIsNone(resolve_session('session-unknown', create=False))
+        self.assertFalse(ConversationSession.objects.filter(external_id='session-unknown').exists())
+        with self.assertRaises(InvalidSessionId):
+            resolve_session('x' * 101)
+
+    def test_cache_hits_make_no_queries(self):
+        session = resolve_session('session-a')
+        with self.assertNumQueries(0, using=shard_for(session.id)):
+            cached = resolve_session('session-a')
+        self.assertEqual((cached.id, cached.external_id, cached.created_at),
+                         (session.id, session.external_id, session.created_at))
+        self.assertEqual(cached._state.db, shard_for(session.id))
+
+    def test_deleted_sessions_are_forgotten(self):
+        session = resolve_session('session-a')
+        session.delete()
+        self.assertIsNone(resolve_session('session-a', create=False))
+        self.assertNotEqual(resolve_session('session-a').id, session.id)
+
+    def test_least_recently_used_ids_are_evicted(self):
+        resolver = SessionResolver(max_entries=2)
+        first, second = resolver.resolve('session-a'), resolver.resolve('session-b')
+        resolver.resolve('session-a')
+        resolver.resolve('session-c')
+        self.assertEqual(len(resolver), 2)
+        with self.assertNumQueries(0, using=shard_for(first.id)):
+            resolver.resolve('session-a')
+        with self.assertNumQueries(1, using=shard_for(second.id)):
+            resolver.resolve('session-b')
+
+
+@override_settings(SEMANTIC_CACHE={'ENABLED': False})
+class ArchivedSessionCacheTests(IdleSessionMixin, TransactionTestCase):
+    """
+    Sessions archived by another process are rehydrated, not written to, on a resolver cache hit
+
+    Foreign keys are only checked on commit, so this runs outside a test transaction.
+    """
+    databases = '__all__'
+
+    def test_chat_rehydrates_session_archived_by_another_process(self):
+        self.assertEqual(resolve_session('session-idle').id, self.session.id)
+        # The archive command runs in its own process, with its own resolver
+        with mock.patch.object(session_resolver, '_session_resolver', session_resolver.SessionResolver()):
+            archive_idle_sessions()
+        self.assertFalse(ConversationSession.objects.filter(id=self.session.id).exists())
+
+        with mock.patch('api.llm_client.ChatOpenAI', ChatModelStub), stubbed_models():
+            llm_client._llm_clients.clear()
+            self.addCleanup(llm_client._llm_clients.clear)
+            response = self.client.post('/api/chat/', {'message': 'It is worse today', 'session_id': 'session-idle'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ArchivedSession.objects.exists())
+        self.assertEqual(Message.objects.filter(session_id=self.session.id).count(), 4)
+
+    def test_session_archived_while_the_model_answers_keeps_the_turn(self):
+        def archive_in_another_process(*args):
+            with mock.patch.object(session_resolver, '_session_resolver', session_resolver.SessionResolver()):
+                archive_sessions([self.session.id])
+
+        with mock.patch('api.llm_client.ChatOpenAI', ChatModelStub), stubbed_models(), \
+                mock.patch('api.views.record_routed_call', side_effect=archive_in_another_process):
+            llm_client._llm_clients.clear()
+            self.addCleanup(llm_client._llm_clients.clear)
+            response = self.client.post('/api/chat/', {'message': 'It is worse today', 'session_id': 'session-idle'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ArchivedSession.objects.exists())
+        self.assertEqual(list(Message.objects.filter(session_id=self.session.id).order_by('id')
+                                             .values_list('role', flat=True)),
+                         ['user', 'assistant', 'user', 'assistant'])
+
+
+class ChatTransportBenchmarkTests(TransactionTestCase):
+    """The benchmark_chat_transport command runs with the repo settings (no ALLOWED_HOSTS)"""
+
+    @override_settings(ALLOWED_HOSTS=[], DEBUG=False)
+    def test_command_runs(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        self.addCleanup(output.close)
+        call_command('benchmark_chat_transport', '--repeats', '1', '--output', output.name, stdout=StringIO())
+        results = json.load(open(output.name))
+        self.assertEqual(results['rest']['turns'], results['meta']['turns_per_conversation'])
+        self.assertEqual(results['websocket']['turns'], results['meta']['turns_per_conversation'])
+        self.assertFalse(ConversationSession.objects.exists())
+
+
+class MessageCompressionTests(TestCase):
+    """Message content round-trips through CompressedTextField"""
+    databases = '__all__'
+
+    def setUp(self):
+        reset_codec()
+        self.addCleanup(reset_codec)
+        self.session = ConversationSession.objects.create()
+
+    def stored_value(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT content FROM api_message WHERE id = %s', [message.id])
+            return bytes(cursor.fetchone()[0])
+
+    def test_round_trip(self):
+        short = Message.objects.create(session=self.session, role='user', content='Headache since Monday')
+        replies = synthetic_corpus(400)[1::2]
+        long = Message.objects.create(session=self.session, role='assistant', content=replies[0])
+        self.assertEqual(self.stored_value(short)[:1], compression.RAW)
+        self.assertEqual(self.stored_value(long)[:1], compression.ZSTD)
+        self.assertEqual(Message.objects.get(id=long.id).content, replies[0])
+        self.assertEqual(list(Message.objects.filter(id=short.id).values_list('content', flat=True)),
+                         ['Headache since Monday'])
+
+    def test_dictionary_keeps_older_values_readable(self):
+        replies = synthetic_corpus(400)[1::2]
+        before = Message.objects.create(session=self.session, role='assistant', content=replies[0])
+        train_dictionary(replies[1:], size=8 * 1024)
+        after = Message.objects.create(session=self.session, role='assistant', content=replies[0])
+        self.assertLess(len(self.stored_value(after)), len(self.stored_value(before)))
+
+        reset_codec()
+        self.assertEqual([message.content for message in Message.objects.filter(id__in=[before.id, after.id])],
+                         [replies[0], replies[0]])
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    """New connections of the sqlite profile run with the WAL tuning"""
+
+    def connect(self, **kwargs):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # ConnectionHandler fills in the settings defaults; the alias keeps it apart from the test databases
+        settings_dict = ConnectionHandler({'default': sqlite_database(f'{directory}/db.sqlite3', **kwargs)}).settings
+        connection = SQLiteDatabaseWrapper(settings_dict['default'], alias='profile')
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_set_on_new_connections(self):
+        connection = self.connect()
+        for _ in range(2):
+            self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+            self.assertEqual(self.pragma(connection, 'synchronous'), 1)  # NORMAL
+            self.assertEqual(self.pragma(connection, 'busy_timeout'), SQLITE_PRAGMAS['busy_timeout'])
+            self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+            connection.close()
+
+    def test_pragmas_can_be_disabled(self):
+        connection = self.connect(pragmas={})
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'delete')
+        self.assertEqual(self.pragma(connection, 'synchronous'), 2)  # FULL
+
+
+@override_settings(SESSION_SHARDS=['default', 'shard1'])
+class ShardMappingTests(SimpleTestCase):
+    """Ids map to their shard without a lookup"""
+
+    def test_shard_for(self):
+        self.assertEqual(shard_for(42), 'default')
+        self.assertEqual(shard_for((1 << SHARD_ID_BITS) + 42), 'shard1')
+        with self.assertRaises(ValueError):
+            shard_for(2 << SHARD_ID_BITS)
+        self.assertEqual(group_by_shard([1, (1 << SHARD_ID_BITS) + 1, 2]),
+                         {'default': [1, 2], 'shard1': [(1 << SHARD_ID_BITS) + 1]})
+
+    def test_merge_grouped_stats(self):
+        merged = merge_grouped_stats([
+            {'2026-01-02': {'count': 1, 'avg_rating': 5.0}},
+            {'2026-01-01': {'count': 2, 'avg_rating': 2.0}, '2026-01-02': {'count': 3, 'avg_rating': 1.0}},
+        ])
+        self.assertEqual(merged, {
+            '2026-01-01': {'count': 2, 'avg_rating': 2.0},
+            '2026-01-02': {'count': 4, 'avg_rating': 2.0},
+        })
+
+
+@skipUnless(len(settings.SESSION_SHARDS) > 1, 'Run with DATABASE_SHARDS=2')
+class SessionShardingTests(TestCase):
+    """
+    Conversation data stays on its session's shard and is merged across shards
+
+    Needs a second database: DATABASE_SHARDS=2 python manage.py test api.tests.SessionShardingTests
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        override = override_settings(DATABASE_REPLICATION={'REPLICAS': {}})  # Read the shards themselves
+        override.enable()
+        self.addCleanup(override.disable)
+        get_session_resolver().clear()
+        self.addCleanup(get_session_resolver().clear)
+        self.external_id = next(f'session-{i}' for i in range(100) if shard_for_external_id(f'session-{i}') == 'shard1')
+
+    def test_session_rows_live_on_their_shard(self):
+        session = resolve_session(self.external_id)
+        self.assertEqual(session._state.db, 'shard1')
+        self.assertEqual(shard_for(session.id), 'shard1')
+        message = session.messages.create(role='user', content='I have had a fever since yesterday')
+        self.assertEqual(shard_for(message.id), 'shard1')
+        self.assertFalse(Message.objects.filter(id=message.id).exists())
+
+        get_session_resolver().clear()
+        self.assertEqual(resolve_session(str(session.id)).id, session.id)
+        self.assertEqual(resolve_session(self.external_id).id, session.id)
+
+    def test_metrics_and_lists_merge_shards(self):
+        for feedback in [
+            resolve_session(self.external_id).feedback.create(rating=5, culturally_appropriate=True),
+            ConversationSession.objects.create().feedback.create(rating=2, culturally_appropriate=False),
+        ]:
+            feedback.expert_reviews.create(reviewer_name='Dr. A', medical_accuracy=3, cultural_relevance=4)
+
+        metrics = DataPipeline().extract_metrics()
+        self.assertEqual(metrics['total_feedback'], 2)
+        self.assertEqual(metrics['avg_rating'], 3.5)
+        self.assertEqual(metrics['cultural_score'], 50)
+
+        response = self.client.get('/api/analytics/dashboard/')
+        self.assertEqual(response.json()['overall']['feedback_count'], 2)
+        response = self.client.get('/api/expert-review/')
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 2)
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {}})
+class KeysetPaginationTests(TestCase):
+    """List endpoints page with cursors and project fields"""
+    databases = '__all__'
+
+    def setUp(self):
+        feedback = ConversationSession.objects.create().feedback.create(rating=3)
+        self.reviews = [
+            feedback.expert_reviews.create(reviewer_name=f'Dr. {i}', medical_accuracy=4, cultural_relevance=4)
+            for i in range(5)
+        ]
+        # Two reviews share a timestamp, so the id breaks the tie
+        ExpertReview.objects.filter(id__in=[self.reviews[1].id, self.reviews[2].id]) \
+                            .update(created_at=self.reviews[1].created_at)
+
+    def get_page(self, params):
+        response = self.client.get('/api/expert-review/', params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content)), response.headers.get('X-Next-Cursor')
+
+    def test_cursor_walks_every_row_once(self):
+        seen = []
+        params = {'limit': 2}
+        while True:
+            page, cursor = self.get_page(params)
+            self.assertLessEqual(len(page), 2)
+            seen.extend(review['id'] for review in page)
+            if cursor is None:
+                break
+            params['cursor'] = cursor
+        expected = ExpertReview.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_fields_projection(self):
+        page, _ = self.get_page({'fields': 'id,reviewer_name', 'limit': 1})
+        self.assertEqual(list(page[0]), ['id', 'reviewer_name'])
+        AnalyticsMetric.objects.create(metric_type='avg_rating', date=timezone.now().date(), value=4.0)
+        response = self.client.get('/api/analytics/', {'fields': 'metric_type_display,date'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         [{'metric_type_display': 'Average Rating', 'date': timezone.now().date().isoformat()}])
+
+    def test_invalid_parameters(self):
+        for params in ({'fields': 'password'}, {'cursor': 'not-a-cursor'}, {'limit': 0}, {'limit': 'many'}):
+            self.assertEqual(self.client.get('/api/expert-review/', params).status_code, 400, params)
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': {'default': 'replica'}, 'MAX_LAG_SECONDS': 10})
+class ReplicaRoutingTests(SimpleTestCase):
+    """Analytics reads go to the replica unless it lags or the client just wrote"""
+
+    def setUp(self):
+        replicas.reset_replica_health()
+        self.addCleanup(replicas.reset_replica_health)
+        patcher = mock.patch.object(replicas, 'replica_lag', return_value=0.0)
+        self.replica_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_use_replica_only_when_asked(self):
+        self.assertEqual(Feedback.objects.all().db, 'default')
+        with replicas.replica_reads():
+            self.assertEqual(Feedback.objects.all().db, 'replica')
+            self.assertEqual(replicas.read_db('default'), 'replica')
+            self.assertEqual(replicas.read_db('shard1'), 'shard1')
+            with replicas.primary_reads():
+                self.assertEqual(Feedback.objects.all().db, 'default')
+        with replicas.replica_reads(enabled=False):
+            self.assertEqual(Feedback.objects.all().db, 'default')
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        for lag in (60.0, None):
+            replicas.reset_replica_health()
+            self.replica_lag.return_value = lag
+            with replicas.replica_reads():
+                self.assertEqual(Feedback.objects.all().db, 'default')
+
+    def test_writes_pin_client_to_primary(self):
+        seen = []
+
+        def view(request):
+            with replicas.replica_reads():
+                seen.append(replicas.read_db())
+            return HttpResponse()
+
+        middleware = replicas.ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post('/api/feedback/'))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        middleware(factory.get('/api/analytics/dashboard/'))
+        pinned = factory.get('/api/analytics/dashboard/')
+        pinned.COOKIES[replicas.PIN_COOKIE] = '1'
+        middleware(pinned)
+        self.assertEqual(seen, ['replica', 'replica', 'default'])
+
+
+@skipUnless('replica' in settings.DATABASES, 'Run with DATABASE_READ_REPLICAS=1')
+class ReadReplicaTests(TestCase):
+    """
+    The dashboard reads a separate replica database while it is in sync and until the client writes
+
+    Needs the replica database: DATABASE_READ_REPLICAS=1 python manage.py test api.tests.ReadReplicaTests
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        replicas.reset_replica_health()
+        self.addCleanup(replicas.reset_replica_health)
+        self.feedback = ConversationSession.objects.create().feedback.create(rating=5)
+
+    def replicate(self, feedback, behind_seconds=0):
+        """Copy a feedback row to the replica, as replayed behind_seconds after it was written"""
+        ConversationSession.objects.using('replica').get_or_create(id=feedback.session_id)
+        copy = Feedback.objects.using('replica').create(session_id=feedback.session_id, rating=feedback.rating)
+        Feedback.objects.using('replica').filter(pk=copy.pk).update(
+            created_at=feedback.created_at - timedelta(seconds=behind_seconds))
+
+    def feedback_count(self):
+        return self.client.get('/api/analytics/dashboard/').json()['overall']['feedback_count']
+
+    def test_dashboard_reads_replica(self):
+        self.replicate(self.feedback)
+        # Written since the last sync, but within MAX_LAG_SECONDS
+        ConversationSession.objects.create().feedback.create(rating=4)
+        self.assertEqual(self.feedback_count(), 1)
+        self.client.post('/api/analytics/', {}, content_type='application/json')
+        self.assertEqual(self.feedback_count(), 2)
+
+    def test_unsynced_or_lagging_replica_is_not_read(self):
+        self.assertEqual(replicas.replica_lag('replica'), float('inf'))
+        self.assertEqual(self.feedback_count(), 1)
+
+        replicas.reset_replica_health()
+        ConversationSession.objects.create().feedback.create(rating=4)
+        self.replicate(self.feedback, behind_seconds=60)
+        self.assertGreaterEqual(replicas.replica_lag('replica'), 60)
+        self.assertEqual(self.feedback_count(), 2)
 
-# Create your tests here.
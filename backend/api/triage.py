@@ -0,0 +1,264 @@
+"""
+Red-flag Triage
+
+Precompiled matcher that spots emergency presentations (chest pain with
+breathlessness, seizures, stroke signs, ...) in a patient message before the
+LLM is called. English red-flag terms are drawn from the symptom and
+condition vocabularies in medical_ner.py; Nigerian Pidgin phrasings are
+listed alongside them. On a match the chat endpoint replies immediately with
+a templated urgent-care message and lets the LLM elaboration follow.
+
+Terms mentioned out of scope do not count: negated ("no chest pain", "I
+don't have shortness of breath") or history ("my father had a stroke", "had a
+seizure as a child"). A negation cue covers only the term right after it (or
+an "or" list it starts); history cues are looked for within
+SCOPE_WINDOW_TOKENS of the term in the same clause, and only spans of months
+or years count as history - "started 2 hours ago" is a current complaint.
+Self-harm terms are always flagged.
+"""
+
+import re
+import time
+
+from .medical_ner import SYMPTOM_TERMS, CONDITION_TERMS
+from .runtime_metrics import metrics
+
+
+def _vocab(*terms):
+    """Return vocabulary terms, failing loudly if medical_ner no longer knows one"""
+    known = SYMPTOM_TERMS | CONDITION_TERMS
+    missing = [term for term in terms if term not in known]
+    if missing:
+        raise ValueError(f"Red-flag terms missing from medical_ner vocabularies: {missing}")
+    return list(terms)
+
+
+# Each category lists English terms (vocabulary plus colloquial phrasings) and Pidgin phrasings
+RED_FLAG_CATEGORIES = {
+    'cardiac': {
+        'label': 'possible heart emergency',
+        'terms': _vocab('chest pain', 'chest tightness', 'heart attack') + [
+            'crushing chest', 'pain spreading to my arm',
+        ],
+        'pidgin_terms': [
+            'chest dey pain me', 'my chest dey pain', 'chest dey tight', 'pain for my chest',
+        ],
+    },
+    'breathing': {
+        'label': 'serious breathing difficulty',
+        'terms': _vocab('shortness of breath', 'difficulty breathing', 'cyanosis') + [
+            "can't breathe", 'cannot breathe', 'lips turning blue',
+        ],
+        'pidgin_terms': [
+            'no fit breathe', 'no fit breath', 'breath dey cut', 'breath no dey reach',
+        ],
+    },
+    'neurological': {
+        'label': 'possible stroke or seizure',
+        'terms': _vocab('seizure', 'stroke', 'fainting') + [
+            'convulsion', 'convulsing', 'unconscious', 'passed out', 'face drooping',
+            'slurred speech',
+        ],
+        'pidgin_terms': [
+            'e dey shake body', 'body dey shake', 'im don faint', 'e don faint', 'no dey wake',
+            'no fit talk well',
+        ],
+    },
+    'bleeding': {
+        'label': 'serious bleeding',
+        'terms': _vocab('bloody stool', 'black stool') + [
+            'vomiting blood', 'coughing blood', 'bleeding heavily',
+        ],
+        'pidgin_terms': [
+            'blood no gree stop', 'blood dey comot', 'dey vomit blood',
+        ],
+    },
+    'self_harm': {
+        'label': 'risk of self-harm',
+        'terms': [
+            'suicide', 'kill myself', 'end my life', 'want to die',
+        ],
+        'pidgin_terms': [
+            'wan kill myself', 'i wan die',
+        ],
+        # "I don't want to die" or "I've thought about suicide before" still warrants the urgent reply
+        'scoped': False,
+    },
+}
+
+# Tokens before (or after) a term that are checked for history cues
+SCOPE_WINDOW_TOKENS = 5
+
+# A term right after one of these is negated
+NEGATION_CUES = {
+    'no', 'not', 'never', 'without', 'nor', 'deny', 'denies', 'denied',
+    "don't", 'dont', "doesn't", 'doesnt', "didn't", 'didnt', "haven't", 'havent', "hasn't", 'hasnt',
+}
+
+# Words allowed between a negation cue and its term ("I don't have any chest pain")
+NEGATION_FILLERS = {
+    'have', 'has', 'had', 'any', 'a', 'an', 'feel', 'feeling', 'get', 'got', 'experience', 'experienced',
+    'suffer', 'from', 'with', 'signs', 'sign', 'of',
+}
+
+# Joins items of a negated list ("no fever or chest pain")
+LIST_CUES = {'or'}
+
+# A term after a relative plus a past-tense verb is family history ("my father had a stroke")
+FAMILY_CUES = {
+    'father', 'mother', 'dad', 'mum', 'mom', 'papa', 'mama', 'parent', 'parents', 'brother', 'sister',
+    'grandfather', 'grandmother', 'grandpa', 'grandma', 'uncle', 'aunt', 'cousin', 'family', 'relative',
+}
+PAST_VERB_CUES = {'had', 'died', 'suffered', 'passed'}
+
+# After a term, these place it in the past ("had a seizure as a child"); only long spans count
+PAST_TIME_RE = re.compile(
+    r"\b(?:(?:years?|months?) ago|as a (?:child|kid|baby|teenager)|when i was|in the past|years back|"
+    r"last (?:year|month)|in (?:19|20)\d\d)\b",
+    re.IGNORECASE,
+)
+
+# These make a term current even after history cues ("my father had a stroke 10 minutes ago")
+RECENT_TIME_RE = re.compile(
+    r"\b(?:(?:seconds?|minutes?|mins?|hours?|hrs?) ago|just now|right now|now|today|tonight|"
+    r"this (?:morning|afternoon|evening))\b",
+    re.IGNORECASE,
+)
+
+# Clauses end at punctuation and conjunctions ("no energy and chest pain", "no fever but chest pain")
+CLAUSE_BREAK_RE = re.compile(
+    r"[.;:!?,\n]|\b(?:and|but|however|although|though|so|because|then)\b", re.IGNORECASE
+)
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+URGENT_TEMPLATES = {
+    'en': (
+        "What you are describing ({concerns}) can be a medical emergency. "
+        "Please get help now: call your local emergency number or go to the nearest hospital "
+        "emergency department immediately. If someone is with you, let them know and ask them "
+        "to take you. Don't drive yourself and don't wait to see if it improves.\n\n"
+        "I'll add more information in a moment, but please seek care first."
+    ),
+    'en-pidgin': (
+        "Wetin you dey describe ({concerns}) fit be emergency. Abeg no wait: call emergency "
+        "number or go the nearest hospital emergency now now. If person dey with you, tell them "
+        "make them carry you go. No drive yourself and no wait make e beta first.\n\n"
+        "I go add more information small time, but abeg go see doctor first."
+    ),
+}
+
+
+PIDGIN_GROUP_SUFFIX = '__pidgin'
+
+
+def _build_matcher():
+    """Compile every category into one alternation with named groups per category and language"""
+    groups = []
+    for category, spec in RED_FLAG_CATEGORIES.items():
+        for group_name, terms in ((category + PIDGIN_GROUP_SUFFIX, spec['pidgin_terms']),
+                                  (category, spec['terms'])):
+            # Longest phrases first so multi-word terms win over their prefixes
+            terms = sorted(set(terms), key=len, reverse=True)
+            alternation = '|'.join(re.escape(term) for term in terms)
+            groups.append(f"(?P<{group_name}>{alternation})")
+    return re.compile(r"\b(?:" + '|'.join(groups) + r")\b", re.IGNORECASE)
+
+
+_RED_FLAG_RE = _build_matcher()
+
+
+def _tokens(text):
+    return TOKEN_RE.findall(text.lower().replace('\u2019', "'"))
+
+
+def _negated(preceding):
+    """Whether the clause tokens before a term (nearest last) end with a negation cue for it"""
+    tokens = preceding[::-1]
+    index = 0
+    while index < len(tokens) and tokens[index] in NEGATION_FILLERS:
+        index += 1
+    if index == len(tokens):
+        return False
+    if tokens[index] in NEGATION_CUES:
+        return True
+    if tokens[index] in LIST_CUES:
+        # The cue before the first item covers the whole list
+        return bool(NEGATION_CUES.intersection(tokens[index + 1:index + 1 + SCOPE_WINDOW_TOKENS]))
+    return False
+
+
+def out_of_scope(text, start, end):
+    """
+    Whether a term matched at text[start:end] is negated or history, not a current complaint
+
+    Returns:
+        str: 'negated' or 'history', or None when the term counts
+    """
+    before = CLAUSE_BREAK_RE.split(text[:start])[-1]
+    preceding_clause = _tokens(before)
+    if _negated(preceding_clause):
+        return 'negated'
+    preceding = ' '.join(preceding_clause[-SCOPE_WINDOW_TOKENS:])
+    after = CLAUSE_BREAK_RE.split(text[end:])[0]
+    following = ' '.join(_tokens(after)[:SCOPE_WINDOW_TOKENS])
+    if RECENT_TIME_RE.search(preceding) or RECENT_TIME_RE.search(following):
+        return None
+    preceding_tokens = set(preceding.split())
+    if 'history' in preceding_tokens or (FAMILY_CUES & preceding_tokens and PAST_VERB_CUES & preceding_tokens):
+        return 'history'
+    if PAST_TIME_RE.search(following):
+        return 'history'
+    return None
+
+
+def check_red_flags(text):
+    """
+    Scan a patient message for red-flag presentations
+
+    Args:
+        text (str): The patient message
+
+    Returns:
+        dict: Match details (categories, matched terms, language) or None if no red flag
+    """
+    start = time.perf_counter()
+    categories = []
+    matched_terms = []
+    has_pidgin = False
+    for match in _RED_FLAG_RE.finditer(text):
+        category = match.lastgroup
+        pidgin = category.endswith(PIDGIN_GROUP_SUFFIX)
+        if pidgin:
+            category = category[:-len(PIDGIN_GROUP_SUFFIX)]
+        if RED_FLAG_CATEGORIES[category].get('scoped', True):
+            scope = out_of_scope(text, match.start(), match.end())
+            if scope is not None:
+                metrics.incr(f'triage.suppressed.{scope}')
+                continue
+        has_pidgin = has_pidgin or pidgin
+        if category not in categories:
+            categories.append(category)
+        matched_terms.append(match.group(0).lower())
+    metrics.observe('triage.match', time.perf_counter() - start)
+    metrics.incr('triage.checked')
+
+    if not categories:
+        return None
+
+    metrics.incr('triage.hit')
+    for category in categories:
+        metrics.incr(f'triage.hit.{category}')
+
+    return {
+        'categories': categories,
+        'matched_terms': matched_terms,
+        'language': 'en-pidgin' if has_pidgin else 'en',
+    }
+
+
+def build_urgent_response(triage_result, language=None):
+    """Render the templated urgent-care reply for a red-flag match"""
+    language = language or triage_result['language']
+    template = URGENT_TEMPLATES.get(language, URGENT_TEMPLATES['en'])
+    concerns = ', '.join(RED_FLAG_CATEGORIES[c]['label'] for c in triage_result['categories'])
+    return template.format(concerns=concerns)
@@ -11,72 +11,112 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+import datetime
+import json
 import os
+import time
 from dotenv import load_dotenv
-from openai import OpenAI
 # Import LangChain components
-from langchain_community.chat_models import ChatOpenAI
 from langchain.chains.llm import LLMChain
 from langchain.chains.conversation.base import ConversationChain
 from langchain.memory import ConversationBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.prompts import PromptTemplate
 
-from .models import ConversationSession, Message, UserContext, ExpertReview, AnalyticsMetric
+from .models import ConversationSession, Message, UserContext, Feedback, ExpertReview, AnalyticsMetric
 from .medical_ner import extract_medical_entities, analyze_patient_emotion
 import logging
-from .data_pipeline import DataPipeline, process_and_update_metrics, generate_training_data
+from .data_pipeline import (
+    DataPipeline, process_and_update_metrics, generate_training_data, created_between, upsert_daily_metrics,
+    merge_grouped_stats, merge_weighted,
+)
+from .emotion_cache import get_emotion_cache
+from .runtime_metrics import metrics
+from .triage import check_red_flags, build_urgent_response
+from .language_id import detect_language, resolve_session_language
+from .semantic_cache import get_semantic_cache
+from .idempotency import get_idempotency_key, get_idempotent_executor, IdempotencyError
+from .llm_client import get_llm_client, LLMDeadlineExceeded
+from .model_router import classify_turn, record_routed_call
+from .task_queue import enqueue_many, queue_stats
+from .conversation_state import get_conversation_state
+from .session_resolver import resolve_session, with_resolved_session, with_session, InvalidSessionId
+from .sharding import shard_for, fan_out, get_shards
+from .pagination import paginate
+from .replicas import read_db, replica_reads
+from .clinical_summary import (
+    get_current_summaries, summarize_session, iter_summaries, sessions_active_between, get_summary_settings,
+    restore_requested_sessions, SessionsNotFound, TooManySessions,
+)
+from .prompts import build_chat_prompt, build_urgent_elaboration_prompt, build_summary_prompt, record_prompt_usage, prompt_cache_stats
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, models, transaction
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def get_or_create_conversation_session(session_id):
-    """Get or create a conversation session based on the provided ID"""
-    # Handle string-based session IDs (e.g., 'session-xxxx')
-    if isinstance(session_id, str) and session_id.startswith('session-'):
-        # Find an existing session or create one
-        existing_sessions = ConversationSession.objects.all()
-        if existing_sessions.exists():
-            return existing_sessions.first()
-        else:
-            return ConversationSession.objects.create()
-    
-    # Handle numeric session IDs
-    try:
-        session_id_int = int(session_id)
-        try:
-            return ConversationSession.objects.get(id=session_id_int)
-        except ConversationSession.DoesNotExist:
-            return ConversationSession.objects.create(id=session_id_int)
-        except ConversationSession.MultipleObjectsReturned:
-            return ConversationSession.objects.filter(id=session_id_int).first()
-    except (ValueError, TypeError):
-        # If conversion fails, use the first session or create one
-        return ConversationSession.objects.first() or ConversationSession.objects.create()
-
 def get_conversation_history(session):
     """Get conversation history for a session"""
     return session.messages.order_by('timestamp')
 
 def save_message(session, role, content):
     """Save a message to the database"""
-    return Message.objects.create(session=session, role=role, content=content)
+    return session.messages.create(role=role, content=content)
+
+def save_turn_messages(session, *messages):
+    """
+    Save the (role, content) messages of a chat turn in one transaction
+    
+    The session was resolved when the turn started; if it was archived while the
+    model answered, the messages are saved to the restored session instead.
+    
+    Returns:
+        list: The saved messages
+    """
+    def save(session):
+        with transaction.atomic(using=shard_for(session.pk)):
+            return [save_message(session, role, content) for role, content in messages]
+    return with_resolved_session(session, save)
 
 def is_pure_pidgin(text):
-    pidgin_keywords = [
-        "bele", "wahala", "dey", "go", "no worry", "abeg", "small-small", "pain me", "comot",
-        "gist", "how far", "na", "wetin", "palava", "waka", "chop", "fit", "no vex", "e don tey",
-        "you sabi", "make i", "e go beta", "na true", "shey", "abi", "you no go", "carry go",
-        "una", "you dey", "i dey", "weytin happen", "no be small", "as e be so", "aswear",
-        "wahala dey", "e be like say", "oya", "dey alright", "i don try", "e reach", "sharp sharp",
-        "no be me", "i no sabi", "you try", "you no try", "you no serious", "e shock me",
-        "na wa", "e no easy", "as per", "just dey", "biko", "shapaly", "dey there", "my guy",
-        "oga", "mad o", "e pain me", "no time", "na wetin", "jare", "ehn now", "no shaking"
-    ]
-    return any(word in text.lower() for word in pidgin_keywords)
+    """Check whether a message is written in Nigerian Pidgin"""
+    return detect_language(text)[0] == 'en-pidgin'
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+# Worker threads for LLM work that continues after the response has been sent
+background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat-background')
+
+def run_in_background(func, *args, **kwargs):
+    """Run a function on the background executor, releasing its DB connection afterwards"""
+    def wrapper():
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error in background task {func.__name__}: {str(e)}", exc_info=True)
+        finally:
+            connection.close()
+    return background_executor.submit(wrapper)
+
+def defer_post_turn_work(user_message, started_at):
+    """Queue the non-critical work for a finished chat turn; never fails the request"""
+    try:
+        tasks = [
+            ('annotate_message', {'message_id': user_message.id}),
+            ('update_user_context', {'message_id': user_message.id}),
+            ('record_chat_turn', {'response_time_ms': (time.perf_counter() - started_at) * 1000}),
+        ]
+        summary_config = get_summary_settings()
+        if summary_config['PRECOMPUTE_ON_IDLE']:
+            # Summarize the session once it has been idle; a later turn's check supersedes this one
+            tasks.append(('summarize_idle_session',
+                          {'session_id': user_message.session_id, 'after_message_id': user_message.id},
+                          summary_config['IDLE_MINUTES'] * 60))
+        enqueue_many(tasks)
+    except Exception as e:
+        logger.error(f"Error queueing post-turn work for message {user_message.id}: {str(e)}")
 
 class TaskViewSet(viewsets.ModelViewSet):
     queryset = Task.objects.all().order_by('-created_at')
@@ -86,7 +126,29 @@ class TaskViewSet(viewsets.ModelViewSet):
 class ChatAPIView(APIView):
     """Handle chat messages: save user message, get LangChain to generate a response using chat memory."""
     permission_classes = [AllowAny]
-    model = "gpt-4o"
+    
+    def get(self, request):
+        """Poll for messages saved after a given message id (e.g. the follow-up to an urgent reply)"""
+        session_id = request.query_params.get('session_id')
+        after_id = request.query_params.get('after_id', 0)
+        
+        if not session_id:
+            return Response({'error': 'No session_id provided.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            after_id = int(after_id)
+        except (ValueError, TypeError):
+            return Response({'error': 'after_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Polling never creates a session
+        try:
+            session = resolve_session(session_id, create=False)
+        except InvalidSessionId as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if session is None:
+            return Response({'error': 'Session not found.'}, status=status.HTTP_404_NOT_FOUND)
+        messages = session.messages.filter(id__gt=after_id).order_by('timestamp')
+        return Response({'messages': MessageSerializer(messages, many=True).data})
     
     def post(self, request):
         """Handle chat requests"""
@@ -96,93 +158,158 @@ class ChatAPIView(APIView):
         if not message:
             return Response({'error': 'No message provided'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Retried requests with the same idempotency key reuse the original reply
         try:
-            # Get or create a ConversationSession
-            session = get_or_create_conversation_session(session_id)
-            
-            # Get chat history
-            messages = get_conversation_history(session)
-            
-            # Add system prompt for Nigerian Pidgin if detected
-            pidgin_indicators = ["dey", "abeg", "belle", "na", "wetin", "wahala", "chop"]
-            has_pidgin = any(indicator in message.lower() for indicator in pidgin_indicators)
-            
-            # Set up the system prompt based on content
-            system_prompt = """You are EleraAI, a healthcare assistant specializing in providing medical information for users in African regions.
-
-When responding to health concerns:
-1. Provide accurate, clear and compassionate healthcare advice
-2. Ask follow-up questions to better understand the user's condition (always include at least one relevant follow-up question)
-3. Inquire about both modern and traditional remedies they might have tried
-4. Be sensitive to cultural contexts around health and acknowledge local healing practices
-5. Clearly state when a condition requires professional medical attention
-6. Use a conversational, warm tone without excessive formatting
-
-For symptom assessment, follow this general structure:
-- Acknowledge the user's concern
-- Offer preliminary information about possible causes
-- Ask about symptom details (duration, severity, triggers)
-- Inquire about related symptoms
-- Ask if they've tried any treatments (including traditional remedies)
-- Provide helpful advice while being clear about your limitations
-
-Remember to:
-- Format your responses in a natural, readable way
-- Use short paragraphs with appropriate spacing between ideas
-- Don't use markdown formatting like asterisks or numbered points
-- Maintain a conversation flow rather than a clinical assessment"""
-            
-            # Add Nigerian Pidgin instructions if detected
-            if has_pidgin:
-                system_prompt += """
-                The user is speaking Nigerian Pidgin. Respond in a mix of standard English and Nigerian Pidgin.
-                Use natural Pidgin phrases without making the text too formal or structured.
-                Common medical terms in Pidgin include:
-                - "Belle pain" for stomach pain
-                - "Dey purge" for diarrhea
-                - "Fever dey worry me" for having a fever
-                - "Body dey hot" for fever or high temperature
-                - "I dey feel weak" for fatigue
-                
-                Speak in a warm, friendly tone as if you're talking to a friend. 
-                Ask about local treatments like herbs or traditional medicine they might have used."""
-            
-            # Update the conversation with the user's new message
-            langchain_messages = [SystemMessage(content=system_prompt)]
-            
-            # Add chat history
-            for msg in messages:
-                if msg.role == 'user':
-                    langchain_messages.append(HumanMessage(content=msg.content))
-                else:
-                    langchain_messages.append(AIMessage(content=msg.content))
-        
-            # Add the current message
-            langchain_messages.append(HumanMessage(content=message))
+            idempotency_key = get_idempotency_key(request)
+        except IdempotencyError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        
+        executor = get_idempotent_executor()
+        if idempotency_key is None or executor is None:
+            return self.handle_chat(message, session_id)
+        
+        def handler():
+            response = self.handle_chat(message, session_id)
+            return response.status_code, response.data
+        
+        try:
+            status_code, data, replayed = executor.execute(session_id, idempotency_key, message, handler)
+        except IdempotencyError as e:
+            headers = {'Retry-After': str(e.retry_after)} if e.retry_after else None
+            return Response({'error': str(e)}, status=e.status_code, headers=headers)
+        
+        response = Response(data, status=status_code)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+    
+    def handle_chat(self, message, session_id):
+        """Generate and save the reply to a chat message"""
+        started_at = time.perf_counter()
+        try:
+            # Session and recent history come from the write-through conversation state cache
+            session, user_context = load_chat_session(session_id)
             
-            # Log API key for debugging
-            logger.info(f"API Key (first 5 chars): {os.getenv('OPENAI_API_KEY')[:5]}...")
+            turn = prepare_chat_turn(session, user_context, message, started_at)
+            if 'reply_data' in turn:
+                return Response(turn['reply_data'])
+            route = turn['route']
             
-            # Call the LLM
-            llm = ChatOpenAI(model_name=self.model, temperature=0.7)
-            response = llm.invoke(langchain_messages)
+            # Call the LLM (deadline-bound, hedged to the fallback model when slow)
+            llm_start = time.perf_counter()
+            with metrics.timer('chat.llm'):
+                response = get_llm_client(route['endpoint']).invoke(turn['messages'])
+            record_routed_call(route, response, time.perf_counter() - llm_start)
+            record_prompt_usage('chat', response)
             
             # Get the response text
             reply = response.content
             
-            # Save the interaction
-            save_message(session, 'user', message)
-            save_message(session, 'assistant', reply)
+            # Save the interaction; annotation and analytics run later on the task workers
+            finish_chat_turn(session, message, reply, started_at)
             
             logger.info(f"Received LLM response: {reply[:50]}...")
             
             return Response({'reply': reply})
+        except LLMDeadlineExceeded as e:
+            logger.error(f"LLM deadline exceeded in ChatAPIView: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
         except Exception as e:
             logger.error(f"Error in ChatAPIView: {str(e)}", exc_info=True)
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def load_chat_session(session_id):
+    """
+    Get the ConversationSession (from the session resolver cache when possible) and UserContext for a client session id
+    
+    Returns:
+        tuple: (session, user_context)
+    """
+    def load(session):
+        user_context, _ = UserContext.objects.using(shard_for(session.pk)).get_or_create(session=session)
+        return session, user_context
+    return with_session(session_id, load)
+
+def prepare_chat_turn(session, user_context, message, started_at):
+    """
+    Run the parts of a chat turn that come before the main LLM call
+    
+    Red-flag messages and semantic cache hits are answered (and saved) here.
+    Shared by ChatAPIView and the WebSocket chat channel (api/chat_socket.py).
+    
+    Returns:
+        dict: {'reply_data'} when the turn is already answered, otherwise {'messages', 'route'}
+    """
+    # Red-flag fast path: check for emergencies before waiting on the LLM
+    triage_result = check_red_flags(message)
+    
+    # Get chat history
+    conversation_state = get_conversation_state()
+    if conversation_state is not None:
+        history = conversation_state.get_history(session)
+    else:
+        history = list(get_conversation_history(session))
+    
+    # Detect the language once per session and reuse it on later turns
+    language = resolve_session_language(user_context, message)
+    has_pidgin = language == 'en-pidgin'
+    
+    # Assemble the prompt: stable base system prompt first, variable parts after it
+    prompt = build_chat_prompt(history, message, language, user_context)
+    langchain_messages = prompt['messages']
+    
+    # The assistant's last reply tells the router whether this turn answers a question
+    previous_reply = history[-1].content if history and history[-1].role == 'assistant' else None
+    
+    if triage_result:
+        # Reply with urgent-care advice right away; the LLM elaboration follows asynchronously
+        urgent_reply = build_urgent_response(triage_result, 'en-pidgin' if has_pidgin else None)
+        user_message, urgent_message = save_turn_messages(session, ('user', message), ('assistant', urgent_reply))
+        run_in_background(elaborate_urgent_reply, session, langchain_messages, urgent_reply)
+        defer_post_turn_work(user_message, started_at)
+        
+        logger.warning(f"Red-flag triage match for session {session.id}: {triage_result['categories']}")
+        
+        return {'reply_data': {
+            'reply': urgent_reply,
+            'urgent': True,
+            'triage': triage_result,
+            'elaboration_pending': True,
+            'message_id': urgent_message.id
+        }}
+    
+    # First turns can be answered from well-rated earlier replies (opt-in)
+    semantic_cache = get_semantic_cache()
+    is_first_turn = not history
+    if semantic_cache is not None and is_first_turn:
+        cached = semantic_cache.lookup(message, language)
+        if cached is not None:
+            finish_chat_turn(session, message, cached['reply'], started_at)
+            logger.info(f"Semantic cache hit (similarity {cached['similarity']:.3f}) for session {session.id}")
+            return {'reply_data': {'reply': cached['reply'], 'cached': True}}
+    
+    # Route turns without clinical content to the faster model
+    return {'messages': langchain_messages, 'route': classify_turn(message, language, previous_reply)}
+
+def finish_chat_turn(session, message, reply, started_at):
+    """Save a turn's messages and queue its post-turn work; returns the saved assistant message"""
+    user_message, assistant_message = save_turn_messages(session, ('user', message), ('assistant', reply))
+    defer_post_turn_work(user_message, started_at)
+    return assistant_message
+
+def elaborate_urgent_reply(session, langchain_messages, urgent_reply):
+    """Generate and save the LLM follow-up to a templated urgent-care reply"""
+    elaboration_messages = build_urgent_elaboration_prompt(langchain_messages, urgent_reply)
+    
+    with metrics.timer('triage.elaboration'):
+        response = get_llm_client('urgent_elaboration').invoke(elaboration_messages)
+    record_prompt_usage('chat', response)
+    
+    save_turn_messages(session, ('assistant', response.content))
+    logger.info(f"Saved urgent-care elaboration for session {session.id}")
+
 class ChatSummaryAPIView(APIView):
     """Generate a summary of a conversation session for the doctor."""
     permission_classes = [AllowAny]
@@ -191,185 +318,86 @@ class ChatSummaryAPIView(APIView):
         if not session_id:
             return Response({'error': 'No session_id provided.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Find the session object
-        session = None
-        
-        # Handle string-based session IDs (e.g., 'session-xxxx')
-        if isinstance(session_id, str) and session_id.startswith('session-'):
-            # Find an existing session
-            existing_sessions = ConversationSession.objects.all()
-            if existing_sessions.exists():
-                session = existing_sessions.first()
-                logger.info(f"Using existing session for summary with string ID {session_id}")
-            else:
-                return Response({'error': 'No sessions found.'}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            # Handle numeric session IDs
-            try:
-                session_id_int = int(session_id)
-                try:
-                    session = ConversationSession.objects.get(id=session_id_int)
-                    logger.info(f"Found session for summary with ID {session_id_int}")
-                except ConversationSession.DoesNotExist:
-                    return Response({'error': 'Session not found.'}, status=status.HTTP_404_NOT_FOUND)
-                except ConversationSession.MultipleObjectsReturned:
-                    # Handle multiple matches by using the first one
-                    session = ConversationSession.objects.filter(id=session_id_int).first()
-                    logger.info(f"Found multiple sessions with ID {session_id_int}, using first one for summary")
-            except (ValueError, TypeError):
-                # If conversion fails, use the first session
-                session = ConversationSession.objects.first()
-                if not session:
-                    return Response({'error': 'No sessions found.'}, status=status.HTTP_404_NOT_FOUND)
-                logger.info(f"Using first available session for summary with non-numeric ID {session_id}")
-        
-        # Get all messages from this session
-        messages = session.messages.order_by('timestamp')
+        try:
+            session = resolve_session(session_id, create=False)
+        except InvalidSessionId as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if session is None:
+            return Response({'error': 'Session not found.'}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Summaries precomputed when the session went idle are returned while no newer message exists
+        current = get_current_summaries([session.id]).get(session.id)
+        if current is not None:
+            metrics.incr('summary.precomputed_hit')
+            return Response(dict(current, session_id=session_id))
+        
+        # Otherwise summarize now (the clinical summarizer is configured in LLM_ENDPOINTS['summary'])
+        metrics.incr('summary.on_demand')
+        try:
+            data = summarize_session(session.id)
+        except LLMDeadlineExceeded as e:
+            return Response({'error': str(e)}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        if not messages:
+        if data is None:
             return Response({'error': 'No messages found in session.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Construct conversation text for summary
-        conversation_text = ""
-        
-        # Aggregate all medical entities across the conversation
-        all_entities = {}
-        
-        # Track patient emotions across the conversation
-        patient_emotions = []
-        
-        for msg in messages:
-            conversation_text += f"{msg.role.capitalize()}: {msg.content}\n\n"
-            
-            # Extract entities from user messages
-            if msg.role == 'user':
-                entities = extract_medical_entities(msg.content)
-                for entity_type, words in entities.items():
-                    if entity_type not in all_entities:
-                        all_entities[entity_type] = set()
-                    all_entities[entity_type].update(words)
-                
-                # Analyze emotion in each user message
-                emotion_result = analyze_patient_emotion(msg.content)
-                if emotion_result["emotion"] != "unknown":
-                    patient_emotions.append(emotion_result)
-        
-        # Create a formatted string of all detected entities
-        entity_summary = ""
-        if all_entities:
-            entity_summary = "Extracted medical entities:\n"
-            
-            # Format medications
-            if "MEDICATION" in all_entities:
-                entity_summary += f"- Medications: {', '.join(all_entities['MEDICATION'])}\n"
-            
-            # Format symptoms with attributes
-            if "SYMPTOM" in all_entities:
-                entity_summary += f"- Symptoms: {', '.join(all_entities['SYMPTOM'])}\n"
-                
-                # Add severity if available
-                if "SEVERITY" in all_entities:
-                    entity_summary += f"- Severity indicators: {', '.join(all_entities['SEVERITY'])}\n"
-                
-                # Add duration if available
-                if "DURATION" in all_entities:
-                    entity_summary += f"- Duration information: {', '.join(all_entities['DURATION'])}\n"
-            
-            # Format conditions
-            if "CONDITION" in all_entities:
-                entity_summary += f"- Medical conditions: {', '.join(all_entities['CONDITION'])}\n"
-                
-            # Format vital signs
-            if "VITALS" in all_entities:
-                entity_summary += f"- Vital signs: {', '.join(all_entities['VITALS'])}\n"
-        
-        # Create a summary of patient emotions
-        emotion_summary = ""
-        if patient_emotions:
-            emotion_counts = {}
-            for emotion_data in patient_emotions:
-                emotion = emotion_data["emotion"]
-                if emotion not in emotion_counts:
-                    emotion_counts[emotion] = 0
-                emotion_counts[emotion] += 1
-            
-            # Get the dominant emotion
-            dominant_emotion = max(emotion_counts.items(), key=lambda x: x[1])[0]
-            emotion_summary = f"Patient emotional state: Patient predominantly expressed {dominant_emotion}. "
-            
-            # Add emotional state details
-            emotion_percentages = {emotion: (count / len(patient_emotions)) * 100 
-                                for emotion, count in emotion_counts.items()}
-            emotion_list = [f"{emotion} ({percentage:.0f}%)" for emotion, percentage in emotion_percentages.items()]
-            emotion_summary += f"Emotions detected during conversation: {', '.join(emotion_list)}."
-        
-        # Create a summary using LangChain
-        # Configure a clinical summarizer with focus and clarity
-        llm = ChatOpenAI(
-            temperature=0.4,  # Very structured and safe
-            openai_api_key=os.getenv('OPENAI_API_KEY'),
-            model="gpt-4o",
-            model_kwargs={
-                "top_p": 0.85
-            }
-        )
+        return Response(dict(data, session_id=session_id, precomputed=False))
 
-        # Refined summary prompt
-        summary_template = """
-        You are a medical documentation assistant. Based on the following conversation between a patient and a virtual healthcare assistant, generate a clinical summary for a doctor.
-
-        ---
-
-        Conversation:
-        {conversation}
-
-        ---
-
-        Detected Medical Entities:
-        {entity_summary}
-
-        Patient Emotional Overview:
-        {emotion_summary}
-
-        ---
-
-        Your summary must include:
-        1. **Patient's main symptoms** (with severity and duration if mentioned)
-        2. **Relevant medical conditions or history**
-        3. **Any medications, treatments, or vital signs referenced**
-        4. **Patient's emotional state during the conversation**
-        5. **Any lifestyle or contextual clues (e.g. sleep, stress, work)**
-        6. **Questions or concerns raised by the patient**
-        7. **Suggested next steps or further assessments if applicable**
-
-        Format your output clearly. Aim for 5–8 sentences that a doctor could quickly read before consultation.
-        """
-
-        summary_prompt = PromptTemplate(
-            input_variables=["conversation", "entity_summary", "emotion_summary"],
-            template=summary_template
-        )
-
-        summary_chain = LLMChain(llm=llm, prompt=summary_prompt)
+class BulkChatSummaryAPIView(APIView):
+    """Generate summaries for many sessions (e.g. a doctor's daily queue), streamed as NDJSON as they complete."""
+    permission_classes = [AllowAny]
+    
+    def post(self, request):
+        session_ids = request.data.get('session_ids')
+        date_from = request.data.get('date_from')
+        date_to = request.data.get('date_to') or date_from
+        config = get_summary_settings()
+        
+        if session_ids:
+            if not isinstance(session_ids, list):
+                return Response({'error': 'session_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                session_ids = [int(session_id) for session_id in session_ids]
+            except (ValueError, TypeError):
+                return Response({'error': 'session_ids must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                session_ids = restore_requested_sessions(session_ids, max_sessions=config['MAX_SESSIONS'])
+            except SessionsNotFound as e:
+                return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+            except ValueError as e:
+                # TooManySessions, or an id outside every shard
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        elif date_from:
+            start, end = parse_date(str(date_from)), parse_date(str(date_to))
+            if start is None or end is None or end < start:
+                return Response({'error': 'date_from/date_to must be YYYY-MM-DD dates, date_from first'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                # Counted before archived sessions are restored
+                session_ids = sessions_active_between(start, end, max_sessions=config['MAX_SESSIONS'])
+            except TooManySessions as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            return Response({'error': 'Provide session_ids or date_from (and optionally date_to).'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            summary = summary_chain.run(
-                conversation=conversation_text, 
-                entity_summary=entity_summary,
-                emotion_summary=emotion_summary
-            )
-            
-            return Response({
-                'summary': summary,
-                'session_id': session_id,
-                'extracted_entities': {k: list(v) for k, v in all_entities.items()} if all_entities else {},
-                'emotional_analysis': {
-                    'dominant_emotion': dominant_emotion if patient_emotions else "unknown",
-                    'emotion_breakdown': emotion_percentages if patient_emotions else {}
-                }
-            })
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            concurrency = int(request.data.get('concurrency') or config['CONCURRENCY'])
+        except (ValueError, TypeError):
+            return Response({'error': 'concurrency must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        concurrency = max(1, min(concurrency, config['CONCURRENCY']))
+        
+        def stream():
+            started_at = time.perf_counter()
+            count = 0
+            for result in iter_summaries(session_ids, concurrency):
+                count += 1
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'done': True, 'count': count, 'wall_time_ms': round((time.perf_counter() - started_at) * 1000)}) + '\n'
+        
+        logger.info(f"Bulk summary of {len(session_ids)} sessions with concurrency {concurrency}")
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
 
 class FeedbackAPIView(APIView):
     """Handle feedback submissions from users"""
@@ -392,22 +420,22 @@ class FeedbackAPIView(APIView):
                            status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            # Get the conversation session
-            session = get_or_create_conversation_session(session_id)
-            
-            # Create the feedback record
-            from .models import Feedback
-            feedback = Feedback.objects.create(
-                session=session,
+            # Create the feedback record in the conversation session
+            feedback = with_session(session_id, lambda session: session.feedback.create(
                 rating=rating,
                 culturally_appropriate=culturally_appropriate,
                 comment=comment,
                 user_query=user_query,
                 response_text=response_text
-            )
+            ))
             
             logger.info(f"Feedback saved: Rating {rating}/5 for session {session_id}")
             
+            # Well-rated first turns become candidates for the semantic cache (embedded off the request)
+            semantic_cache = get_semantic_cache()
+            if semantic_cache is not None:
+                semantic_cache.add_from_feedback_in_background(feedback.id, feedback._state.db)
+            
             return Response({
                 'status': 'success',
                 'message': 'Feedback saved successfully',
@@ -428,17 +456,13 @@ class UserContextAPIView(APIView):
         if not session_id:
             return Response({'error': 'No session_id provided.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        session = get_or_create_conversation_session(session_id)
-        
-        try:
-            context = UserContext.objects.get(session=session)
-            serializer = UserContextSerializer(context)
-            return Response(serializer.data)
-        except UserContext.DoesNotExist:
-            # Create a new empty context
-            context = UserContext.objects.create(session=session)
-            serializer = UserContextSerializer(context)
-            return Response(serializer.data)
+        # Get the context, or create a new empty one
+        context, _ = with_session(
+            session_id,
+            lambda session: UserContext.objects.using(shard_for(session.pk)).get_or_create(session=session),
+        )
+        serializer = UserContextSerializer(context)
+        return Response(serializer.data)
             
     def post(self, request):
         """Create or update user context."""
@@ -446,10 +470,11 @@ class UserContextAPIView(APIView):
         if not session_id:
             return Response({'error': 'No session_id provided.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        session = get_or_create_conversation_session(session_id)
-        
         # Try to get existing context or create new one
-        context, created = UserContext.objects.get_or_create(session=session)
+        context, created = with_session(
+            session_id,
+            lambda session: UserContext.objects.using(shard_for(session.pk)).get_or_create(session=session),
+        )
         
         # Update fields based on request data
         if 'symptoms' in request.data:
@@ -488,6 +513,8 @@ class UserContextAPIView(APIView):
             
         if 'language' in request.data:
             context.language = request.data.get('language')
+            # An explicit choice always wins over detection
+            context.language_confidence = 1.0
             
         context.save()
         
@@ -504,16 +531,20 @@ class ExpertReviewAPIView(APIView):
     permission_classes = [AllowAny]
     
     def get(self, request):
-        """Get expert reviews for a specific feedback ID or list all."""
+        """Get a page of expert reviews for a specific feedback ID or of all of them."""
         feedback_id = request.query_params.get('feedback_id')
         
         if feedback_id:
-            reviews = ExpertReview.objects.filter(feedback_id=feedback_id)
-        else:
-            reviews = ExpertReview.objects.all().order_by('-created_at')[:50]  # Limit to 50 most recent
-            
-        serializer = ExpertReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+            try:
+                alias = shard_for(feedback_id)
+            except ValueError:
+                return Response({'error': 'Invalid feedback_id.'}, status=status.HTTP_400_BAD_REQUEST)
+            return paginate(request, ExpertReview.objects.using(alias).filter(feedback_id=feedback_id),
+                            ExpertReviewSerializer, ('-created_at', '-id'))
+        
+        # Most recent first, merged across shards
+        return paginate(request, ExpertReview.objects.all(), ExpertReviewSerializer, ('-created_at', '-id'),
+                        shards=get_shards())
         
     def post(self, request):
         """Create a new expert review."""
@@ -529,8 +560,9 @@ class AnalyticsAPIView(APIView):
     """API for generating and retrieving analytics data."""
     permission_classes = [AllowAny]
     
+    @replica_reads()
     def get(self, request):
-        """Get analytics metrics with optional date filtering."""
+        """Get a page of analytics metrics with optional date filtering."""
         from_date = request.query_params.get('from_date')
         to_date = request.query_params.get('to_date')
         metric_type = request.query_params.get('metric_type')
@@ -544,10 +576,9 @@ class AnalyticsAPIView(APIView):
         if metric_type:
             query_filter['metric_type'] = metric_type
             
-        # Get the metrics
-        metrics = AnalyticsMetric.objects.filter(**query_filter).order_by('date', 'metric_type')
-        serializer = AnalyticsMetricSerializer(metrics, many=True)
-        return Response(serializer.data)
+        # Get a page of the metrics
+        return paginate(request, AnalyticsMetric.objects.filter(**query_filter), AnalyticsMetricSerializer,
+                        ('date', 'metric_type'))
         
     def post(self, request):
         """Generate analytics metrics for a specific date range."""
@@ -565,6 +596,7 @@ class AnalyticsAPIView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @replica_reads()
     def generate_metrics(self, from_date, to_date):
         """Generate metrics for the specified date range."""
         from django.db.models import Avg, Count
@@ -577,95 +609,64 @@ class AnalyticsAPIView(APIView):
         if isinstance(to_date, str):
             to_date = datetime.datetime.strptime(to_date, '%Y-%m-%d').date()
         
-        # Generate average rating metrics
-        avg_ratings = Feedback.objects.filter(created_at__date__gte=from_date, 
-                                            created_at__date__lte=to_date) \
-                                     .annotate(date=TruncDate('created_at')) \
-                                     .values('date') \
-                                     .annotate(avg_rating=Avg('rating')) \
-                                     .order_by('date')
-                                     
-        for rating_data in avg_ratings:
-            # Save or update the metric
-            AnalyticsMetric.objects.update_or_create(
-                metric_type='avg_rating',
-                date=rating_data['date'],
-                defaults={'value': rating_data['avg_rating']}
-            )
-            
-        # Generate cultural appropriateness score
-        cultural_scores = Feedback.objects.filter(created_at__date__gte=from_date,
-                                                created_at__date__lte=to_date) \
-                                         .annotate(date=TruncDate('created_at')) \
-                                         .values('date') \
-                                         .annotate(
-                                             culturally_appropriate_pct=Avg(
-                                                 models.Case(
-                                                     models.When(culturally_appropriate=True, then=100),
-                                                     default=0,
-                                                     output_field=models.FloatField()
-                                                 )
+        # One grouped query per source table and shard; the daily values are saved with a single upsert
+        def daily_stats(alias):
+            alias = read_db(alias)
+            daily_feedback = Feedback.objects.using(alias) \
+                                             .filter(**created_between(from_date, to_date)) \
+                                             .annotate(date=TruncDate('created_at')) \
+                                             .values('date') \
+                                             .annotate(
+                                                 avg_rating=Avg('rating'),
+                                                 culturally_appropriate_pct=Avg(
+                                                     models.Case(
+                                                         models.When(culturally_appropriate=True, then=100),
+                                                         default=0,
+                                                         output_field=models.FloatField()
+                                                     )
+                                                 ),
+                                                 count=Count('id')
                                              )
-                                         ) \
-                                         .order_by('date')
-                                         
-        for score_data in cultural_scores:
-            AnalyticsMetric.objects.update_or_create(
-                metric_type='cultural_score',
-                date=score_data['date'],
-                defaults={'value': score_data['culturally_appropriate_pct']}
-            )
-            
-        # Generate feedback count metrics
-        feedback_counts = Feedback.objects.filter(created_at__date__gte=from_date,
-                                                created_at__date__lte=to_date) \
-                                         .annotate(date=TruncDate('created_at')) \
-                                         .values('date') \
-                                         .annotate(count=Count('id')) \
-                                         .order_by('date')
-                                         
-        for count_data in feedback_counts:
-            AnalyticsMetric.objects.update_or_create(
-                metric_type='feedback_count',
-                date=count_data['date'],
-                defaults={'value': count_data['count']}
-            )
-        
-        # Generate expert review metrics if available
-        if ExpertReview.objects.exists():
-            expert_ratings = ExpertReview.objects.filter(created_at__date__gte=from_date,
-                                                      created_at__date__lte=to_date) \
+            expert_ratings = ExpertReview.objects.using(alias) \
+                                               .filter(**created_between(from_date, to_date)) \
                                                .annotate(date=TruncDate('created_at')) \
                                                .values('date') \
                                                .annotate(
                                                    avg_accuracy=Avg('medical_accuracy'),
-                                                   avg_relevance=Avg('cultural_relevance')
-                                               ) \
-                                               .order_by('date')
-                                               
-            for expert_data in expert_ratings:
-                # Medical accuracy metric
-                AnalyticsMetric.objects.update_or_create(
-                    metric_type='medical_accuracy',
-                    date=expert_data['date'],
-                    defaults={'value': expert_data['avg_accuracy']}
-                )
-                
-                # Cultural relevance metric
-                AnalyticsMetric.objects.update_or_create(
-                    metric_type='cultural_relevance',
-                    date=expert_data['date'],
-                    defaults={'value': expert_data['avg_relevance']}
-                )
+                                                   avg_relevance=Avg('cultural_relevance'),
+                                                   count=Count('id')
+                                               )
+            return (
+                {daily.pop('date'): daily for daily in daily_feedback},
+                {expert_data.pop('date'): expert_data for expert_data in expert_ratings},
+            )
+        
+        parts = fan_out(daily_stats)
+        daily_feedback = merge_grouped_stats([feedback for feedback, _ in parts])
+        expert_ratings = merge_grouped_stats([expert for _, expert in parts])
+        
+        values = []
+        for date, daily in sorted(daily_feedback.items()):
+            values.append(('avg_rating', date, daily['avg_rating']))
+            values.append(('cultural_score', date, daily['culturally_appropriate_pct']))
+            values.append(('feedback_count', date, daily['count']))
+        
+        # Generate expert review metrics if available
+        for date, expert_data in sorted(expert_ratings.items()):
+            values.append(('medical_accuracy', date, expert_data['avg_accuracy']))
+            values.append(('cultural_relevance', date, expert_data['avg_relevance']))
+        
+        upsert_daily_metrics(values)
 
 
 class AnalyticsDashboardAPIView(APIView):
     """API for dashboard-specific analytics that provides aggregated metrics."""
     permission_classes = [AllowAny]
     
+    @replica_reads()
     def get(self, request):
         """Get dashboard metrics with various aggregations."""
-        from django.db.models import Avg, Count, Max, Min
+        from django.db.models import Avg, Count, Max, Min, Q
         from django.utils import timezone
         import datetime
         
@@ -686,24 +687,21 @@ class AnalyticsDashboardAPIView(APIView):
         # Get overall metrics
         overall_metrics = {}
         
-        # Average rating
-        avg_rating = Feedback.objects.filter(
-            created_at__date__gte=from_date,
-            created_at__date__lte=to_date
-        ).aggregate(avg=Avg('rating'))
-        overall_metrics['avg_rating'] = avg_rating['avg'] or 0
+        # Average rating, cultural appropriateness and feedback count in one query per shard
+        parts = fan_out(lambda alias: Feedback.objects.using(read_db(alias))
+                                                      .filter(**created_between(from_date, to_date))
+                                                      .aggregate(
+                                                          avg=Avg('rating'),
+                                                          cultural_appropriate_count=Count(
+                                                              'id', filter=Q(culturally_appropriate=True)),
+                                                          total_feedback_count=Count('id'),
+                                                      ))
+        parts = [part for part in parts if part['total_feedback_count']]
+        overall_metrics['avg_rating'] = merge_weighted(parts, 'avg', 'total_feedback_count') if parts else 0
         
         # Cultural appropriateness percentage
-        cultural_appropriate_count = Feedback.objects.filter(
-            created_at__date__gte=from_date,
-            created_at__date__lte=to_date,
-            culturally_appropriate=True
-        ).count()
-        
-        total_feedback_count = Feedback.objects.filter(
-            created_at__date__gte=from_date,
-            created_at__date__lte=to_date
-        ).count()
+        cultural_appropriate_count = sum(part['cultural_appropriate_count'] for part in parts)
+        total_feedback_count = sum(part['total_feedback_count'] for part in parts)
         
         if total_feedback_count > 0:
             cultural_score = (cultural_appropriate_count / total_feedback_count) * 100
@@ -836,3 +834,24 @@ class DataPipelineView(APIView):
         else:
             return Response({'error': f'Unknown operation: {operation}'}, 
                             status=status.HTTP_400_BAD_REQUEST)
+
+
+class RuntimeMetricsAPIView(APIView):
+    """
+    API exposing in-process performance counters (caches, latencies) for this worker
+    """
+    permission_classes = [AllowAny]  # Adjust as needed for production
+    
+    def get(self, request):
+        """Get a snapshot of runtime metrics"""
+        emotion_cache = get_emotion_cache()
+        semantic_cache = get_semantic_cache()
+        conversation_state = get_conversation_state()
+        return Response({
+            'metrics': metrics.snapshot(request.query_params.get('prefix')),
+            'emotion_cache': emotion_cache.stats() if emotion_cache else None,
+            'semantic_cache': semantic_cache.stats() if semantic_cache else None,
+            'prompt_cache': prompt_cache_stats(),
+            'task_queue': queue_stats(),
+            'conversation_state': conversation_state.stats() if conversation_state else None,
+        })
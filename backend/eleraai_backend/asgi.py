@@ -2,6 +2,8 @@
 ASGI config for eleraai_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections to the chat path are handled by api.chat_socket; all
+other traffic goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eleraai_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it loads models
+from api.chat_socket import websocket_router  # noqa: E402
+
+application = websocket_router(django_application)
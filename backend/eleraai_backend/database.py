@@ -0,0 +1,190 @@
+"""
+Database Profiles
+
+Builds settings.DATABASES['default'] for the selected profile:
+
+- 'sqlite': the project's file database, tuned for concurrent chat writes. WAL
+  journal mode lets readers run alongside the single writer, writers wait up to
+  busy_timeout for the lock instead of failing with "database is locked", and
+  transactions take the write lock up front (BEGIN IMMEDIATE) so two
+  read-then-write transactions cannot deadlock. Connections are kept open
+  between requests (CONN_MAX_AGE).
+- 'postgres': PostgreSQL through psycopg 3, configured with the POSTGRES_*
+  environment variables. Connections are persistent with health checks, or
+  taken from psycopg's connection pool when POSTGRES_POOL_MAX_SIZE is set
+  (recommended under ASGI, where persistent connections are not reused).
+
+The profile is chosen with the DATABASE_PROFILE environment variable.
+
+DATABASE_SHARDS=N adds N-1 conversation data shards ('shard1', ...) of the
+same profile next to 'default' (see api/sharding.py): SQLite files next to
+the default one, or PostgreSQL databases named <POSTGRES_DB>_shard<i>, on
+POSTGRES_SHARD<i>_HOST when set.
+
+DATABASE_READ_REPLICAS=1 adds a read replica of each of those databases
+('replica' for 'default', 'shard<i>_replica' for the shards; see
+api/replicas.py): for SQLite a file next to the primary's (kept in sync by
+whatever copies it), for PostgreSQL the same database on
+POSTGRES_REPLICA_HOST / POSTGRES_SHARD<i>_REPLICA_HOST. A PostgreSQL primary
+without a replica host gets no replica.
+"""
+
+import os
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # Durable at checkpoints; safe from corruption in WAL mode
+    'busy_timeout': 5000,  # ms a writer waits for the lock
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+DEFAULT_CONN_MAX_AGE = 600
+
+
+def sqlite_database(name, conn_max_age=DEFAULT_CONN_MAX_AGE, pragmas=None):
+    """
+    SQLite settings with the WAL tuning applied on every new connection
+
+    Args:
+        name: Database file
+        conn_max_age (int): Seconds a connection is kept open between requests
+        pragmas (dict): PRAGMA values (default SQLITE_PRAGMAS)
+
+    Returns:
+        dict: A DATABASES entry
+    """
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    options = {'transaction_mode': 'IMMEDIATE'}
+    if pragmas:
+        options['init_command'] = ';'.join(f'PRAGMA {key}={value}' for key, value in pragmas.items())
+    if 'busy_timeout' in pragmas:
+        # The driver's own lock timeout, in seconds
+        options['timeout'] = pragmas['busy_timeout'] / 1000
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': options,
+    }
+
+
+def postgres_database(environ=None):
+    """
+    PostgreSQL settings from the POSTGRES_* environment variables
+
+    Returns:
+        dict: A DATABASES entry
+    """
+    environ = os.environ if environ is None else environ
+    pool_max_size = int(environ.get('POSTGRES_POOL_MAX_SIZE') or 0)
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'eleraai'),
+        'USER': environ.get('POSTGRES_USER', 'eleraai'),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', '127.0.0.1'),
+        'PORT': environ.get('POSTGRES_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if pool_max_size:
+        # Pooled connections are returned to the pool after each request; Django
+        # does not allow them to be persistent as well
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(environ.get('POSTGRES_POOL_MIN_SIZE') or 2),
+            'max_size': pool_max_size,
+            'timeout': float(environ.get('POSTGRES_POOL_TIMEOUT') or 10),
+        }
+    else:
+        database['CONN_MAX_AGE'] = int(environ.get('DB_CONN_MAX_AGE') or DEFAULT_CONN_MAX_AGE)
+    return database
+
+
+def database_settings(profile, base_dir, environ=None):
+    """
+    The DATABASES['default'] entry for a profile
+
+    Args:
+        profile (str): 'sqlite' or 'postgres'
+        base_dir: Project directory, holding the SQLite file
+
+    Returns:
+        dict: A DATABASES entry
+    """
+    environ = os.environ if environ is None else environ
+    if profile == 'sqlite':
+        return sqlite_database(
+            environ.get('SQLITE_PATH') or base_dir / 'db.sqlite3',
+            conn_max_age=int(environ.get('DB_CONN_MAX_AGE') or DEFAULT_CONN_MAX_AGE),
+        )
+    if profile == 'postgres':
+        return postgres_database(environ)
+    raise ValueError(f"Unknown DATABASE_PROFILE '{profile}' (expected 'sqlite' or 'postgres')")
+
+
+def shard_aliases(count):
+    """Database aliases of `count` conversation data shards; the first is 'default'"""
+    return ['default'] + [f'shard{index}' for index in range(1, count)]
+
+
+def shard_database_settings(profile, base_dir, count, environ=None):
+    """
+    DATABASES entries of the shards after 'default'
+
+    Args:
+        profile (str): 'sqlite' or 'postgres'
+        base_dir: Project directory
+        count (int): Total number of shards, including 'default'
+
+    Returns:
+        dict: Alias -> DATABASES entry
+    """
+    environ = os.environ if environ is None else environ
+    default = database_settings(profile, base_dir, environ)
+    shards = {}
+    for index, alias in enumerate(shard_aliases(count)[1:], start=1):
+        if profile == 'sqlite':
+            name = str(default['NAME'])
+            stem, dot, suffix = name.rpartition('.')
+            database = dict(default, NAME=f'{stem}.{alias}.{suffix}' if dot else f'{name}.{alias}')
+        else:
+            database = dict(default, NAME=f"{default['NAME']}_{alias}")
+            database['HOST'] = environ.get(f'POSTGRES_SHARD{index}_HOST') or default['HOST']
+        shards[alias] = database
+    return shards
+
+
+def replica_alias(alias):
+    """Database alias of the read replica of a primary database"""
+    return 'replica' if alias == 'default' else f'{alias}_replica'
+
+
+def replica_database_settings(profile, databases, environ=None):
+    """
+    DATABASES entries of the read replicas of primary databases
+
+    Args:
+        profile (str): 'sqlite' or 'postgres'
+        databases (dict): Primary alias -> DATABASES entry ('default', 'shard1', ...)
+
+    Returns:
+        dict: Replica alias -> DATABASES entry
+    """
+    environ = os.environ if environ is None else environ
+    replicas = {}
+    for alias, primary in databases.items():
+        if profile == 'sqlite':
+            name = str(primary['NAME'])
+            stem, dot, suffix = name.rpartition('.')
+            replica = dict(primary, NAME=f'{stem}.replica.{suffix}' if dot else f'{name}.replica')
+        else:
+            host_variable = 'POSTGRES_REPLICA_HOST' if alias == 'default' else f'POSTGRES_{alias.upper()}_REPLICA_HOST'
+            if not environ.get(host_variable):
+                continue
+            replica = dict(primary, HOST=environ[host_variable])
+        replicas[replica_alias(alias)] = replica
+    return replicas
+
@@ -10,11 +10,21 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+from .database import (
+    database_settings, replica_alias, replica_database_settings, shard_aliases, shard_database_settings,
+)
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Database and service settings may come from backend/.env
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -54,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replicas.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'eleraai_backend.urls'
@@ -79,13 +90,35 @@ WSGI_APPLICATION = 'eleraai_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DATABASE_PROFILE selects 'sqlite' (WAL-tuned file database) or 'postgres' (configured with the
+# POSTGRES_* environment variables); see eleraai_backend/database.py
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+# DATABASE_SHARDS spreads conversation data over that many databases by session id (see
+# api/sharding.py). Shards can be added but never removed or reordered.
+DATABASE_SHARDS = int(os.environ.get('DATABASE_SHARDS') or 1)
+SESSION_SHARDS = shard_aliases(DATABASE_SHARDS)
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_settings(DATABASE_PROFILE, BASE_DIR),
+    **shard_database_settings(DATABASE_PROFILE, BASE_DIR, DATABASE_SHARDS),
 }
 
+# DATABASE_READ_REPLICAS=1 sends the analytics, dashboard and training export reads to a replica of
+# each database, falling back to the primary when it lags (see api/replicas.py)
+if os.environ.get('DATABASE_READ_REPLICAS', '').lower() in ('1', 'true', 'yes'):
+    DATABASES.update(replica_database_settings(DATABASE_PROFILE, dict(DATABASES)))
+
+DATABASE_REPLICATION = {
+    # Primary alias -> replica alias
+    'REPLICAS': {alias: replica_alias(alias) for alias in SESSION_SHARDS if replica_alias(alias) in DATABASES},
+    'MAX_LAG_SECONDS': float(os.environ.get('REPLICA_MAX_LAG_SECONDS') or 10),
+    'LAG_CHECK_SECONDS': 5,  # How long a replica's lag check is trusted
+    'PIN_SECONDS': 15,  # Clients read from the primary this long after a write
+}
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter', 'api.routers.SessionShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,6 +167,8 @@ CORS_ALLOW_ALL_ORIGINS = True  # For development only, restrict in production
 # CORS_ALLOWED_ORIGINS = [
 #     "http://localhost:3000",
 # ]
+# Let the frontend read the next page's cursor of paginated lists
+CORS_EXPOSE_HEADERS = ['Link', 'X-Next-Cursor']
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -175,3 +210,134 @@ LOGGING = {
         },
     },
 }
+
+# Emotion classifier result cache (see api/emotion_cache.py)
+EMOTION_CACHE = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 4096,
+    'MAX_BYTES': 2 * 1024 * 1024,
+    'TTL_SECONDS': 60 * 60,
+    'MAX_TEXT_LENGTH': 280,
+    # Set to a CACHES alias (e.g. 'default' backed by Redis/Memcached) to share results across workers
+    'SHARED_CACHE_ALIAS': None,
+}
+
+# Opt-in semantic cache of well-rated first-turn replies (see api/semantic_cache.py)
+SEMANTIC_CACHE = {
+    'ENABLED': False,
+    'SIMILARITY_THRESHOLD': 0.95,
+    'MIN_RATING': 4,
+    'MAX_ENTRIES_PER_LANGUAGE': 2000,
+    'TTL_SECONDS': 7 * 24 * 60 * 60,
+    'MAX_MESSAGE_LENGTH': 300,
+    # Loaded in the background on first use; lookups miss until then
+    'WARM_MAX_ENTRIES': 10000,
+    'WARM_RETRY_SECONDS': 60,
+}
+
+# Chat POSTs with an Idempotency-Key header are executed once (see api/idempotency.py)
+CHAT_IDEMPOTENCY = {
+    'ENABLED': True,
+    'TTL_SECONDS': 24 * 60 * 60,
+    'WAIT_TIMEOUT_SECONDS': 90,
+    'PENDING_TIMEOUT_SECONDS': 120,
+}
+
+# Per-endpoint LLM overrides ('chat', 'urgent_elaboration', 'summary'); see api/llm_client.py for keys
+LLM_ENDPOINTS = {
+    # 'chat': {'DEADLINE_SECONDS': 20.0, 'HEDGE_MODEL': 'gpt-4o-mini'},
+}
+
+# Routing of chat turns between the 'chat' and 'chat_simple' LLM endpoints (see api/model_router.py)
+LLM_ROUTING = {
+    'ENABLED': True,
+    'SIMPLE_MAX_WORDS': 12,
+}
+
+# Deferred post-turn work, run by `python manage.py run_workers` (see api/task_queue.py)
+TASK_QUEUE = {
+    'ENABLED': True,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF_SECONDS': 10,
+    'LEASE_SECONDS': 300,
+}
+
+# Client session id -> ConversationSession mapping (see api/session_resolver.py). Numeric ids
+# are primary keys; any other id (e.g. 'session-xxxx') is stored as ConversationSession.external_id.
+SESSION_RESOLVER = {
+    'MAX_ENTRIES': 10000,
+}
+
+# Message content compression (see api/compression.py). Train a dictionary from stored
+# messages with `manage.py train_compression_dictionary`; new messages use the newest one.
+MESSAGE_COMPRESSION = {
+    'ENABLED': True,
+    'LEVEL': 3,
+    'MIN_SIZE': 200,
+}
+
+# Keyset pagination of the list endpoints (see api/pagination.py): ?limit=, ?cursor=, ?fields=
+LIST_PAGINATION = {
+    'DEFAULT_LIMIT': 50,
+    'MAX_LIMIT': 500,
+    'STREAM_CHUNK_ROWS': 100,
+}
+
+# Cold storage for idle conversations (see api/archive.py and `manage.py archive_sessions`).
+# Archived sessions are restored on demand when a client, summary or export touches them.
+CONVERSATION_ARCHIVE = {
+    'DIRECTORY': os.environ.get('CONVERSATION_ARCHIVE_DIR') or BASE_DIR / 'archive',
+    'IDLE_DAYS': 90,
+    'BATCH_SIZE': 100,
+}
+
+# Chat prompt assembly (see api/prompts.py)
+CHAT_PROMPT = {
+    'HISTORY_WINDOW': 12,
+    'HISTORY_TRIM_STEP': 6,
+}
+
+# Cached history state for chat turns (see api/conversation_state.py).
+# Local memory is per process: set SHARED_CACHE_ALIAS when running several workers without sticky sessions.
+CONVERSATION_STATE = {
+    'ENABLED': True,
+    'MAX_SESSIONS': 1000,
+    'MAX_MESSAGES': 100,
+    'TTL_SECONDS': 30 * 60,
+    'SHARED_CACHE_ALIAS': None,
+}
+
+# Where chat models come from (see api/llm_client.py). Use {'BACKEND': 'local_stub'} with
+# `python manage.py run_llm_stub` to load-test or develop without calling OpenAI.
+LLM_BACKEND = {
+    'BACKEND': 'openai',
+    'BASE_URL': None,
+}
+
+# Defaults of the local LLM stub server; command-line options override them (see api/llm_stub.py)
+LLM_STUB = {
+    'PORT': 8089,
+    'LATENCY': 'lognormal',
+    'LATENCY_MS': 800,
+    'TOKENS_PER_SECOND': 60,
+    'ERROR_RATE': 0.0,
+}
+
+# WebSocket chat channel served by eleraai_backend/asgi.py (see api/chat_socket.py)
+CHAT_SOCKET = {
+    'PATH': '/ws/chat/',
+    'HEARTBEAT_SECONDS': 20,
+    'IDLE_TIMEOUT_SECONDS': 60,
+    'MAX_QUEUED_TURNS': 2,
+    'FLUSH_INTERVAL_MS': 50,
+    'SEND_TIMEOUT_SECONDS': 10,
+}
+
+# Clinical summaries (see api/clinical_summary.py): bulk generation for POST /api/chat/summary/bulk/ and
+# `manage.py summarize_sessions`, and precomputation by the task workers once a session goes idle
+CLINICAL_SUMMARY = {
+    'CONCURRENCY': 8,
+    'MAX_SESSIONS': 200,
+    'PRECOMPUTE_ON_IDLE': True,
+    'IDLE_MINUTES': 15,
+}
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_hot_path_indexes'),
+        ('voice_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voicesession',
+            index=models.Index(fields=['conversation', 'livekit_room_name', 'active'], name='voice_servi_convers_e06d40_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicesession',
+            index=models.Index(condition=models.Q(('active', True)), fields=['created_at'], name='voice_session_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicesessionparticipant',
+            index=models.Index(fields=['session', 'identity'], name='voice_servi_session_1ac6e9_idx'),
+        ),
+        migrations.AlterField(
+            model_name='voicesession',
+            name='conversation',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='voice_sessions', to='api.conversationsession'),
+        ),
+        migrations.AlterField(
+            model_name='voicesessionparticipant',
+            name='session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='voice_service.voicesession'),
+        ),
+    ]
@@ -6,13 +6,21 @@ class VoiceSession(models.Model):
     conversation = models.ForeignKey(
         ConversationSession, 
         on_delete=models.CASCADE,
-        related_name='voice_sessions'
+        related_name='voice_sessions',
+        db_index=False  # Covered by the (conversation, livekit_room_name, active) index
     )
     livekit_room_id = models.CharField(max_length=255)
     livekit_room_name = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'livekit_room_name', 'active']),
+            # Only the few live sessions are indexed for the active session list
+            models.Index(fields=['created_at'], condition=models.Q(active=True), name='voice_session_active_idx'),
+        ]
     
     def __str__(self):
         return f"Voice Session for {self.conversation.id} ({self.livekit_room_name})"
@@ -22,13 +30,19 @@ class VoiceSessionParticipant(models.Model):
     session = models.ForeignKey(
         VoiceSession,
         on_delete=models.CASCADE,
-        related_name='participants'
+        related_name='participants',
+        db_index=False  # Covered by the (session, identity) index
     )
     identity = models.CharField(max_length=255)
     name = models.CharField(max_length=255, blank=True, null=True)
     joined_at = models.DateTimeField(auto_now_add=True)
     last_active = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'identity']),
+        ]
     
     def __str__(self):
         return f"Participant {self.identity} in {self.session.livekit_room_name}"
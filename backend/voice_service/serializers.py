@@ -1,13 +1,21 @@
 from rest_framework import serializers
+from api.models import ConversationSession
+from api.serializers import ShardedCreateMixin, ShardedPrimaryKeyRelatedField
 from .models import VoiceSession, VoiceTranscript, VoiceSessionParticipant
 
-class VoiceSessionSerializer(serializers.ModelSerializer):
+class VoiceSessionSerializer(ShardedCreateMixin, serializers.ModelSerializer):
+    conversation = ShardedPrimaryKeyRelatedField(queryset=ConversationSession.objects.all())
+    shard_field = 'conversation'
+
     class Meta:
         model = VoiceSession
         fields = ['id', 'conversation', 'livekit_room_id', 'livekit_room_name', 'created_at', 'updated_at', 'active']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class VoiceSessionParticipantSerializer(serializers.ModelSerializer):
+class VoiceSessionParticipantSerializer(ShardedCreateMixin, serializers.ModelSerializer):
+    session = ShardedPrimaryKeyRelatedField(queryset=VoiceSession.objects.all())
+    shard_field = 'session'
+
     class Meta:
         model = VoiceSessionParticipant
         fields = ['id', 'session', 'identity', 'name', 'joined_at', 'last_active', 'is_active']
@@ -1,3 +1,126 @@
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 
-# Create your tests here.
+from api.models import ConversationSession
+from api.query_budget import QueryBudgetMixin
+from api.session_resolver import get_session_resolver
+
+from .models import VoiceSession, VoiceSessionParticipant, VoiceTranscript
+
+
+class FakeLiveKitService:
+    def create_or_join_room(self, room_name, identity):
+        return {'token': 'token', 'room_name': f'room-{room_name}', 'livekit_url': 'wss://livekit.test'}
+
+
+class FakeASRService:
+    def transcribe_audio_file(self, path, language=None):
+        return {'text': 'I have a headache', 'confidence': 0.9, 'language': 'en'}
+
+
+class FakeTTSService:
+    def generate_speech(self, text, language_code, voice_id=None):
+        return b'audio'
+
+
+class VoiceEndpointQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Voice endpoints stay within their query budgets and use indexes; counts must
+    not grow with the number of voice sessions (see api/tests.py)
+    """
+    databases = '__all__'
+
+    # Queries per request; lower these when an endpoint gets cheaper
+    BUDGETS = {
+        'token': 4,
+        'sessions': 1,
+        'session_detail': 1,
+        'participants': 2,
+        'participant_detail': 2,
+        'participant_create': 3,
+        'transcribe': 3,
+        'synthesize': 1,
+    }
+
+    def setUp(self):
+        self.voice_sessions = []
+        patches = [
+            mock.patch('voice_service.views.get_livekit_service', return_value=FakeLiveKitService()),
+            mock.patch('voice_service.views.get_asr_service', return_value=FakeASRService()),
+            mock.patch('voice_service.views.get_tts_service', return_value=FakeTTSService()),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def seed(self, count):
+        """Add `count` conversations with an active voice session, two participants and a transcript"""
+        for _ in range(count):
+            index = len(self.voice_sessions)
+            conversation = ConversationSession.objects.create(external_id=f'session-{index}')
+            voice_session = VoiceSession.objects.create(
+                conversation=conversation, livekit_room_id=f'room-{conversation.id}',
+                livekit_room_name=f'room-{conversation.id}',
+            )
+            for identity in ('user', 'doctor'):
+                participant = VoiceSessionParticipant.objects.create(session=voice_session, identity=identity)
+            VoiceTranscript.objects.create(session=voice_session, participant=participant, transcript='Hello')
+            self.voice_sessions.append(voice_session)
+
+    def request(self, name, method, path, data=None, multipart=False):
+        get_session_resolver().clear()
+        with self.assertQueryBudget(self.BUDGETS[name], name) as captured:
+            if method == 'get' or multipart:
+                response = getattr(self.client, method)(path, data)
+            else:
+                response = getattr(self.client, method)(path, data, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f"{name}: {response.status_code}")
+        return len(captured)
+
+    def assertFlat(self, name, method, path, data=None, multipart=False):
+        """The query count does not grow with the data; path/data may take the newest voice session"""
+        counts = []
+        for count in (2, 5):
+            self.seed(count)
+            voice_session = self.voice_sessions[-1]
+            counts.append(self.request(
+                name, method,
+                path(voice_session) if callable(path) else path,
+                data(voice_session) if callable(data) else data,
+                multipart,
+            ))
+        self.assertEqual(counts[0], counts[1], f"{name} ran more queries with more data: {counts}")
+
+    def test_token(self):
+        self.assertFlat('token', 'post', '/voice/token/',
+                        data=lambda voice_session: {'conversation_id': voice_session.conversation.external_id})
+
+    def test_sessions(self):
+        self.assertFlat('sessions', 'get', '/voice/sessions/')
+        self.assertFlat('session_detail', 'get', lambda voice_session: f'/voice/sessions/{voice_session.id}/')
+
+    def test_participants(self):
+        self.assertFlat('participants', 'get',
+                        lambda voice_session: f'/voice/sessions/{voice_session.id}/participants/')
+        self.assertFlat('participant_detail', 'get',
+                        lambda voice_session: f'/voice/sessions/{voice_session.id}/participants/'
+                                              f'{voice_session.participants.first().id}/')
+        self.assertFlat('participant_create', 'post',
+                        lambda voice_session: f'/voice/sessions/{voice_session.id}/participants/',
+                        {'identity': 'nurse'})
+
+    def test_transcribe(self):
+        self.assertFlat('transcribe', 'post', '/voice/transcribe/',
+                        lambda voice_session: {
+                            'voice_session_id': voice_session.id,
+                            'participant_id': voice_session.participants.first().id,
+                            'audio': SimpleUploadedFile('speech.webm', b'audio', content_type='audio/webm'),
+                        }, multipart=True)
+
+    def test_synthesize(self):
+        self.assertFlat('synthesize', 'post', '/voice/synthesize/',
+                        lambda voice_session: {'voice_session_id': voice_session.id, 'text': 'Drink water'})
@@ -3,12 +3,15 @@ import os
 import json
 import logging
 import tempfile
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from api.models import ConversationSession
+from api.session_resolver import with_session
+from api.pagination import paginate
+from api.sharding import shard_for, get_shards
 
 from .models import VoiceSession, VoiceTranscript, VoiceSessionParticipant
 from .serializers import VoiceSessionSerializer, VoiceTranscriptSerializer, VoiceSessionParticipantSerializer
@@ -24,6 +27,15 @@ livekit_service = None
 asr_service = None
 tts_service = None
 
+def get_voice_session_or_404(session_id):
+    """The voice session with an id, looked up on its conversation's shard"""
+    try:
+        alias = shard_for(session_id)
+    except ValueError:
+        raise Http404('No VoiceSession matches the given query.')
+    return get_object_or_404(VoiceSession.objects.using(alias), id=session_id)
+
+
 def get_livekit_service():
     """Get or initialize LiveKit service"""
     global livekit_service
@@ -62,71 +74,36 @@ class LiveKitTokenView(APIView):
             # Get LiveKit service
             livekit_service = get_livekit_service()
             
-            # Handle the conversation session retrieval
-            conversation = None
-            
-            # If the conversation_id is a string with 'session-' prefix
-            if isinstance(conversation_id, str) and conversation_id.startswith('session-'):
-                # Get the first conversation session or create a new one
-                existing_sessions = ConversationSession.objects.all()
-                if existing_sessions.exists():
-                    # Just use the first available session
-                    conversation = existing_sessions.first()
-                    logger.info(f"Using existing conversation session with ID {conversation.id}")
-                else:
-                    # Create a new session if none exist
-                    conversation = ConversationSession.objects.create()
-                    logger.info(f"Created new conversation session with ID {conversation.id}")
-            else:
-                # Try to use the ID directly
+            def join_room(conversation):
+                # Get room details and token from LiveKit service
+                room_details = livekit_service.create_or_join_room(str(conversation.id), user_identity)
+                
+                # Get or create a voice session for this conversation
                 try:
-                    conversation_id_int = int(conversation_id)
-                    # Try to get by exact ID
-                    try:
-                        conversation = ConversationSession.objects.get(id=conversation_id_int)
-                        logger.info(f"Found conversation session with ID {conversation.id}")
-                    except ConversationSession.DoesNotExist:
-                        # Create with specific ID
-                        conversation = ConversationSession.objects.create(id=conversation_id_int)
-                        logger.info(f"Created new conversation session with ID {conversation.id}")
-                    except ConversationSession.MultipleObjectsReturned:
-                        # In case of multiple objects, take the first one
-                        conversation = ConversationSession.objects.filter(id=conversation_id_int).first()
-                        logger.info(f"Found multiple session with ID {conversation_id_int}, using first one with ID {conversation.id}")
-                except (ValueError, TypeError):
-                    # If conversion fails, use the first session or create one
-                    conversation = ConversationSession.objects.first() or ConversationSession.objects.create()
-                    logger.info(f"Using/creating conversation session with ID {conversation.id}")
+                    voice_session = conversation.voice_sessions.get(
+                        livekit_room_name=room_details['room_name']
+                    )
+                    logger.info(f"Found existing voice session for conversation {conversation.id}")
+                except VoiceSession.DoesNotExist:
+                    voice_session = conversation.voice_sessions.create(
+                        livekit_room_name=room_details['room_name'],
+                        livekit_room_id=room_details['room_name'],
+                        active=True
+                    )
+                    logger.info(f"Created new voice session for conversation {conversation.id}")
+                except VoiceSession.MultipleObjectsReturned:
+                    voice_session = conversation.voice_sessions.filter(
+                        livekit_room_name=room_details['room_name']
+                    ).first()
+                    logger.info(f"Found multiple voice sessions, using first one")
+                return conversation, room_details, voice_session
             
-            # Get room details and token from LiveKit service
-            room_details = livekit_service.create_or_join_room(str(conversation.id), user_identity)
-            
-            # Get or create a voice session for this conversation
-            try:
-                voice_session = VoiceSession.objects.get(
-                    conversation=conversation,
-                    livekit_room_name=room_details['room_name']
-                )
-                logger.info(f"Found existing voice session for conversation {conversation.id}")
-            except VoiceSession.DoesNotExist:
-                voice_session = VoiceSession.objects.create(
-                    conversation=conversation,
-                    livekit_room_name=room_details['room_name'],
-                    livekit_room_id=room_details['room_name'],
-                    active=True
-                )
-                logger.info(f"Created new voice session for conversation {conversation.id}")
-            except VoiceSession.MultipleObjectsReturned:
-                voice_session = VoiceSession.objects.filter(
-                    conversation=conversation,
-                    livekit_room_name=room_details['room_name']
-                ).first()
-                logger.info(f"Found multiple voice sessions, using first one")
+            # Resolve the conversation session ('session-xxxx' ids map to their own session)
+            conversation, room_details, voice_session = with_session(conversation_id, join_room)
             
             # Create or update participant
             try:
-                participant = VoiceSessionParticipant.objects.get(
-                    session=voice_session,
+                participant = voice_session.participants.get(
                     identity=user_identity
                 )
                 # Update participant
@@ -135,16 +112,14 @@ class LiveKitTokenView(APIView):
                 participant.save()
                 logger.info(f"Updated participant {user_identity}")
             except VoiceSessionParticipant.DoesNotExist:
-                participant = VoiceSessionParticipant.objects.create(
-                    session=voice_session,
+                participant = voice_session.participants.create(
                     identity=user_identity,
                     name=user_name,
                     is_active=True
                 )
                 logger.info(f"Created new participant {user_identity}")
             except VoiceSessionParticipant.MultipleObjectsReturned:
-                participant = VoiceSessionParticipant.objects.filter(
-                    session=voice_session,
+                participant = voice_session.participants.filter(
                     identity=user_identity
                 ).first()
                 participant.name = user_name
@@ -187,12 +162,12 @@ class TranscribeAudioView(APIView):
             asr_service = get_asr_service()
             
             # Get the voice session
-            voice_session = get_object_or_404(VoiceSession, id=voice_session_id)
+            voice_session = get_voice_session_or_404(voice_session_id)
             
             # Get the participant if provided
             participant = None
             if participant_id:
-                participant = get_object_or_404(VoiceSessionParticipant, id=participant_id, session=voice_session)
+                participant = get_object_or_404(voice_session.participants, id=participant_id)
             
             # Save audio to temporary file
             with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_file:
@@ -204,8 +179,7 @@ class TranscribeAudioView(APIView):
             transcription_result = asr_service.transcribe_audio_file(temp_file_path, language)
             
             # Save transcription to database
-            transcript = VoiceTranscript.objects.create(
-                session=voice_session,
+            transcript = voice_session.transcripts.create(
                 participant=participant,
                 transcript=transcription_result['text'],
                 confidence=transcription_result.get('confidence', 0.0),
@@ -253,7 +227,7 @@ class TextToSpeechView(APIView):
             tts_service = get_tts_service()
             
             # Get the voice session
-            voice_session = get_object_or_404(VoiceSession, id=voice_session_id)
+            voice_session = get_voice_session_or_404(voice_session_id)
             
             # Clean up markdown formatting from text
             import re
@@ -294,14 +268,13 @@ class VoiceSessionView(APIView):
         """Get voice session details"""
         if session_id:
             # Get a specific voice session
-            voice_session = get_object_or_404(VoiceSession, id=session_id)
+            voice_session = get_voice_session_or_404(session_id)
             serializer = VoiceSessionSerializer(voice_session)
             return Response(serializer.data)
         else:
-            # List all active voice sessions
-            voice_sessions = VoiceSession.objects.filter(active=True)
-            serializer = VoiceSessionSerializer(voice_sessions, many=True)
-            return Response(serializer.data)
+            # A page of the active voice sessions, newest first, across shards
+            return paginate(request, VoiceSession.objects.filter(active=True), VoiceSessionSerializer,
+                            ('-created_at', '-id'), shards=get_shards())
     
     def post(self, request):
         """Create a new voice session"""
@@ -313,7 +286,7 @@ class VoiceSessionView(APIView):
     
     def put(self, request, session_id):
         """Update a voice session"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
+        voice_session = get_voice_session_or_404(session_id)
         serializer = VoiceSessionSerializer(voice_session, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -322,7 +295,7 @@ class VoiceSessionView(APIView):
     
     def delete(self, request, session_id):
         """Delete (deactivate) a voice session"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
+        voice_session = get_voice_session_or_404(session_id)
         voice_session.active = False
         voice_session.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -334,22 +307,20 @@ class ParticipantView(APIView):
     
     def get(self, request, session_id, participant_id=None):
         """Get participant details"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
+        voice_session = get_voice_session_or_404(session_id)
         
         if participant_id:
             # Get a specific participant
-            participant = get_object_or_404(VoiceSessionParticipant, id=participant_id, session=voice_session)
+            participant = get_object_or_404(voice_session.participants, id=participant_id)
             serializer = VoiceSessionParticipantSerializer(participant)
             return Response(serializer.data)
         else:
-            # List all participants in the session
-            participants = VoiceSessionParticipant.objects.filter(session=voice_session)
-            serializer = VoiceSessionParticipantSerializer(participants, many=True)
-            return Response(serializer.data)
+            # A page of the participants in the session
+            return paginate(request, voice_session.participants.all(), VoiceSessionParticipantSerializer, ('id',))
     
     def post(self, request, session_id):
         """Add a participant to a session"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
+        voice_session = get_voice_session_or_404(session_id)
         
         # Add session to request data
         data = request.data.copy()
@@ -363,8 +334,8 @@ class ParticipantView(APIView):
     
     def put(self, request, session_id, participant_id):
         """Update a participant"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
-        participant = get_object_or_404(VoiceSessionParticipant, id=participant_id, session=voice_session)
+        voice_session = get_voice_session_or_404(session_id)
+        participant = get_object_or_404(voice_session.participants, id=participant_id)
         
         serializer = VoiceSessionParticipantSerializer(participant, data=request.data, partial=True)
         if serializer.is_valid():
@@ -374,8 +345,8 @@ class ParticipantView(APIView):
     
     def delete(self, request, session_id, participant_id):
         """Mark a participant as inactive"""
-        voice_session = get_object_or_404(VoiceSession, id=session_id)
-        participant = get_object_or_404(VoiceSessionParticipant, id=participant_id, session=voice_session)
+        voice_session = get_voice_session_or_404(session_id)
+        participant = get_object_or_404(voice_session.participants, id=participant_id)
         
         participant.is_active = False
         participant.save()